@@ -86,7 +86,7 @@ export async function getOrderById(orderId: string): Promise<ShopifyOrder | null
 // Consulta estado de orden directamente desde processed_orders.json (fuente de verdad)
 export interface CorreosStatusResponse {
     exists: boolean;
-    status: "GUIDE_CREATED" | "PROCESSING";
+    status: "GUIDE_CREATED" | "PROCESSING" | "UNCERTAIN";
     tracking_number: string | null;
     processed_at: string | null;
 }
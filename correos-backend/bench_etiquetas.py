@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark de las etiquetas locales (ZPL y PDF compacto) contra el PDF de Correos.
+
+Renderiza N etiquetas con datos de ejemplo (o los guardados de una guía) y
+muestra tiempo por etiqueta (primera y en caliente) y tamaño. Para comparar
+con la etiqueta oficial se indica el PDF devuelto por ccrRegistroEnvio:
+con --guia (del almacén local) o con --pdf-correos. El tiempo de Correos en
+generarlo es el de `soap_llamada_duracion_segundos{operacion="ccrRegistroEnvio"}`
+en /metrics.
+
+Uso:
+    python bench_etiquetas.py [--n 500] [--guia PY064089266CR] [--pdf-correos etiqueta.pdf]
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import datetime
+
+from src.models.envio import DatosEtiqueta
+from src.services import etiquetas
+from src.services.almacen_pdf import almacen_pdf
+
+
+def _datos_ejemplo(i: int) -> DatosEtiqueta:
+    return DatosEtiqueta(
+        numero_envio=f"PY{64089266 + i:09d}CR",
+        fecha_envio=datetime(2026, 1, 20, 10, 30),
+        remitente={
+            "nombre": "Tribu Mates",
+            "direccion": "San José, Costa Rica",
+            "telefono": "22221234",
+            "codigo_postal": "10101",
+        },
+        destinatario={
+            "nombre": "María González Pérez",
+            "direccion": "Del Pali 200 metros sur, casa amarilla con portón negro, Cartago",
+            "telefono": "8888-8888",
+            "codigo_postal": "30101",
+        },
+        peso=500.0,
+        observaciones="Paquete frágil",
+    )
+
+
+def _medir(formato: str, datos: list) -> dict:
+    inicio = time.perf_counter()
+    contenido, _ = etiquetas.renderizar(datos[0], formato)
+    primera = time.perf_counter() - inicio
+
+    tiempos = []
+    tamanos = []
+    for d in datos:
+        inicio = time.perf_counter()
+        contenido, _ = etiquetas.renderizar(d, formato)
+        tiempos.append(time.perf_counter() - inicio)
+        tamanos.append(len(contenido))
+    tiempos.sort()
+    return {
+        "primera_ms": primera * 1000,
+        "media_ms": statistics.mean(tiempos) * 1000,
+        "p95_ms": tiempos[int(len(tiempos) * 0.95) - 1] * 1000,
+        "bytes": statistics.mean(tamanos),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--n", type=int, default=500, help="Etiquetas por formato")
+    parser.add_argument("--guia", help="Número de envío guardado en el almacén local")
+    parser.add_argument("--pdf-correos", help="PDF de etiqueta devuelto por Correos")
+    args = parser.parse_args()
+
+    pdf_correos = None
+    if args.guia:
+        datos_json = almacen_pdf.datos(args.guia)
+        objeto = almacen_pdf.buscar(args.guia)
+        if datos_json is None or objeto is None:
+            parser.error(f"La guía {args.guia} no tiene datos o PDF en {almacen_pdf.directorio}")
+        datos = [DatosEtiqueta.model_validate_json(datos_json)] * args.n
+        pdf_correos = objeto.ruta
+    else:
+        datos = [_datos_ejemplo(i) for i in range(args.n)]
+    if args.pdf_correos:
+        pdf_correos = args.pdf_correos
+
+    print(f"{args.n} etiquetas por formato")
+    print(f"{'formato':<14} {'1ra ms':>8} {'media ms':>9} {'p95 ms':>8} {'bytes':>10}")
+    resultados = {}
+    for formato in etiquetas.FORMATOS:
+        r = resultados[formato] = _medir(formato, datos)
+        print(f"{formato:<14} {r['primera_ms']:>8.2f} {r['media_ms']:>9.3f} {r['p95_ms']:>8.3f} {r['bytes']:>10.0f}")
+
+    if pdf_correos:
+        tamano = os.path.getsize(pdf_correos)
+        print(f"{'pdf correos':<14} {'':>8} {'':>9} {'':>8} {tamano:>10}")
+        for formato, r in resultados.items():
+            print(f"  {formato}: {tamano / r['bytes']:.0f}x más chico que el PDF de Correos")
+    else:
+        print("(sin PDF de Correos para comparar: usar --guia o --pdf-correos)")
+
+
+if __name__ == "__main__":
+    main()
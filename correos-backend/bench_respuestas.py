@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark de serialización de RespuestaGuia con un PDF grande.
+
+Compara, a través del stack ASGI completo de FastAPI (sin red ni SOAP):
+- antes: el endpoint devuelve RespuestaGuia validada y FastAPI aplica
+  response_model + jsonable_encoder + json.dumps
+- después: model_construct + RespuestaJSONRapida (orjson si está instalado)
+
+Mide CPU por request (time.process_time) y pico de memoria asignada durante
+una request (tracemalloc).
+
+Uso:
+    python bench_respuestas.py [--kb 600] [--requests 200]
+"""
+import argparse
+import asyncio
+import base64
+import os
+import time
+import tracemalloc
+
+from fastapi import FastAPI
+
+from src.api.respuestas import RespuestaJSONRapida, orjson
+from src.models.envio import RespuestaGuia
+
+
+def _crear_app(pdf_base64: str) -> FastAPI:
+    app = FastAPI()
+    datos = {
+        "exito": True,
+        "numero_envio": "WW123456789CR",
+        "codigo_respuesta": "00",
+        "mensaje_respuesta": "OK",
+        "pdf_base64": pdf_base64,
+    }
+
+    @app.post("/antes", response_model=RespuestaGuia)
+    async def antes() -> RespuestaGuia:
+        return RespuestaGuia(**datos)
+
+    @app.post("/despues", response_model=RespuestaGuia)
+    async def despues():
+        return RespuestaJSONRapida(RespuestaGuia.model_construct(**datos))
+
+    return app
+
+
+async def _request(app: FastAPI, ruta: str) -> int:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": ruta,
+        "raw_path": ruta.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1),
+        "server": ("bench", 80),
+    }
+    tamano = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(mensaje):
+        nonlocal tamano
+        if mensaje["type"] == "http.response.body":
+            tamano += len(mensaje.get("body", b""))
+
+    await app(scope, receive, send)
+    return tamano
+
+
+async def _medir(app: FastAPI, ruta: str, cantidad: int) -> dict:
+    for _ in range(5):
+        tamano = await _request(app, ruta)
+
+    inicio_cpu = time.process_time()
+    inicio = time.perf_counter()
+    for _ in range(cantidad):
+        await _request(app, ruta)
+    cpu = (time.process_time() - inicio_cpu) / cantidad
+    pared = (time.perf_counter() - inicio) / cantidad
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    await _request(app, ruta)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"cpu_ms": cpu * 1000, "pared_ms": pared * 1000, "pico_kb": pico / 1024, "bytes": tamano}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--kb", type=int, default=600, help="Tamaño del PDF en KB (antes de base64)")
+    parser.add_argument("--requests", type=int, default=200, help="Requests por variante")
+    args = parser.parse_args()
+
+    pdf_base64 = base64.b64encode(os.urandom(args.kb * 1024)).decode("ascii")
+    app = _crear_app(pdf_base64)
+
+    print(f"PDF de {args.kb} KB ({len(pdf_base64) / 1024:.0f} KB en base64), "
+          f"{args.requests} requests, serializador: {'orjson' if orjson else 'json (stdlib)'}")
+    print(f"{'variante':<10} {'CPU ms/req':>11} {'pared ms/req':>13} {'pico KB':>10} {'bytes':>10}")
+    resultados = {}
+    for ruta in ("/antes", "/despues"):
+        r = resultados[ruta] = asyncio.run(_medir(app, ruta, args.requests))
+        print(f"{ruta[1:]:<10} {r['cpu_ms']:>11.3f} {r['pared_ms']:>13.3f} {r['pico_kb']:>10.0f} {r['bytes']:>10}")
+
+    antes, despues = resultados["/antes"], resultados["/despues"]
+    print(f"CPU x{antes['cpu_ms'] / despues['cpu_ms']:.1f} menos, "
+          f"pico de memoria x{antes['pico_kb'] / despues['pico_kb']:.1f} menor")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Compila src/data/catalogo_geografico.json a un snapshot binario
+(src/data/catalogo_geografico.bin) que los workers abren con mmap.
+
+El snapshot guarda el sha256 del JSON de origen: si el JSON cambia y no se
+vuelve a compilar, el backend lo detecta y usa el JSON directamente.
+
+Uso:
+    python build_catalog_snapshot.py              # compilar
+    python build_catalog_snapshot.py --benchmark  # compilar y comparar contra JSON
+
+Ejecutar en el build/deploy, después de actualizar el JSON.
+"""
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from src.services.catalogo_service import catalogo_service, validar_catalogo
+from src.services.catalogo_snapshot import (
+    SnapshotCatalogo,
+    SnapshotInvalidoError,
+    compilar_snapshot,
+    escribir_atomico,
+)
+
+# Cada medición corre en un proceso nuevo para que el RSS sea comparable
+_SCRIPT_MEDICION = r"""
+import sys, time, tracemalloc
+sys.path.insert(0, {raiz!r})
+
+def _rss_anon_kb():
+    # Memoria anónima (privada del proceso); las páginas del mmap cuentan en RssFile
+    with open("/proc/self/status") as f:
+        for linea in f:
+            if linea.startswith("RssAnon:"):
+                return int(linea.split()[1])
+    return 0
+
+from src.services.catalogo_service import CatalogoService
+from pathlib import Path
+
+servicio = CatalogoService()
+if {modo!r} == "json":
+    servicio.snapshot_path = Path("/nonexistent/catalogo.bin")
+
+rss_antes = _rss_anon_kb()
+t0 = time.perf_counter()
+servicio.cargar_catalogo()
+# Una consulta para tocar las páginas que se usan en runtime
+servicio.get_distritos("1", "01")
+t1 = time.perf_counter()
+rss_despues = _rss_anon_kb()
+
+# Heap de Python retenido por el catálogo (segunda carga, medida aislada)
+servicio._indice = None
+tracemalloc.start()
+servicio.cargar_catalogo()
+heap, _ = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+
+assert servicio.indice.origen == {modo!r}, servicio.indice.origen
+print(f"{{(t1 - t0) * 1000:.3f}} {{rss_despues - rss_antes}} {{heap}}")
+"""
+
+
+def compilar(json_path: Path, bin_path: Path) -> None:
+    raw = json_path.read_bytes()
+    catalogo = json.loads(raw.decode("utf-8"))
+
+    errores = validar_catalogo(catalogo)
+    if errores:
+        print("❌ VALIDACIÓN FALLIDA - NO SE GENERARÁ EL SNAPSHOT")
+        for error in errores:
+            print(f"   • {error}")
+        sys.exit(1)
+
+    try:
+        contenido = compilar_snapshot(catalogo, hashlib.sha256(raw).hexdigest())
+    except SnapshotInvalidoError as e:
+        print(f"❌ No se pudo compilar el snapshot: {e}")
+        sys.exit(1)
+
+    # Verificar ida y vuelta antes de publicar el archivo
+    with tempfile.NamedTemporaryFile(suffix=".bin") as tmp:
+        tmp.write(contenido)
+        tmp.flush()
+        if SnapshotCatalogo(Path(tmp.name)).a_dict() != catalogo:
+            print("❌ El snapshot no reproduce el JSON original. No se guardará.")
+            sys.exit(1)
+
+    escribir_atomico(bin_path, contenido)
+
+    print(f"   ✅ JSON:     {len(raw):,} bytes ({len(raw)/1024:.1f} KB)")
+    print(f"   ✅ Snapshot: {len(contenido):,} bytes ({len(contenido)/1024:.1f} KB)")
+    print(f"   ✅ Archivo:  {bin_path.absolute()}")
+
+
+def medir(modo: str, repeticiones: int):
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    script = _SCRIPT_MEDICION.format(raiz=raiz, modo=modo)
+    tiempos, rss, heaps = [], [], []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip().splitlines()[-1]
+        ms, kb, heap = salida.split()
+        tiempos.append(float(ms))
+        rss.append(int(kb))
+        heaps.append(int(heap))
+    return statistics.median(tiempos), statistics.median(rss), statistics.median(heaps)
+
+
+def benchmark(repeticiones: int) -> None:
+    print(f"\n📊 Carga del catálogo por worker (mediana de {repeticiones} procesos nuevos)")
+    print(f"   {'origen':<10} {'tiempo':>10} {'RssAnon':>12} {'heap Python':>14}")
+    resultados = {}
+    for modo in ("json", "snapshot"):
+        ms, kb, heap = medir(modo, repeticiones)
+        resultados[modo] = (ms, kb, heap)
+        print(f"   {modo:<10} {ms:>8.3f}ms {kb:>9,} KB {heap / 1024:>11,.1f} KB")
+
+    json_ms, _, json_heap = resultados["json"]
+    snap_ms, _, snap_heap = resultados["snapshot"]
+    if snap_ms > 0:
+        print(f"\n   Arranque {json_ms / snap_ms:.1f}x más rápido con snapshot")
+    print(f"   Memoria privada por worker: {(json_heap - snap_heap) / 1024:,.1f} KB menos con snapshot")
+    print("   (las páginas del mmap son compartidas entre workers y no se duplican)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--benchmark", action="store_true", help="Comparar arranque y RSS contra el JSON")
+    parser.add_argument("--repeticiones", type=int, default=15, help="Procesos por medición (default: 15)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("COMPILANDO SNAPSHOT BINARIO DEL CATÁLOGO")
+    print("=" * 60)
+
+    compilar(catalogo_service.data_path, catalogo_service.snapshot_path)
+
+    if args.benchmark:
+        benchmark(args.repeticiones)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,42 +2,165 @@
 """
 Script para descargar el catálogo geográfico completo de Costa Rica
 desde la API pública https://api-geo-cr.vercel.app
+
+Las respuestas se guardan en un cache HTTP en disco y se revalidan con
+requests condicionales (ETag / Last-Modified), las descargas corren en
+paralelo, y el JSON solo se reescribe si su contenido cambió: una corrida
+sin cambios no toca el archivo y no invalida los caches de los clientes.
+
+Uso:
+    python download_catalog.py            # descargar, comparar y guardar si cambió
+    python download_catalog.py --dry-run  # solo mostrar el reporte de diferencias
 """
+import argparse
+import hashlib
 import json
+import os
+import sys
 import urllib.request
 import urllib.error
-import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from src.services.catalogo_service import validar_catalogo
+from src.services.catalogo_snapshot import escribir_atomico
 
 BASE_URL = "https://api-geo-cr.vercel.app"
+BASE_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_PATH = BASE_DIR / "src" / "data" / "catalogo_geografico.json"
+CACHE_DIR = BASE_DIR / ".cache_api_geo"
+MAX_WORKERS = 8
+
+
+class CacheHTTP:
+    """Cache en disco de respuestas GET, revalidado con ETag/Last-Modified."""
+
+    def __init__(self, directorio: Path):
+        self.directorio = directorio
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.descargas = 0
+
+    def _path(self, url: str) -> Path:
+        return self.directorio / f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def _leer(self, url: str):
+        try:
+            with open(self._path(url), 'r', encoding='utf-8') as f:
+                entrada = json.load(f)
+            return entrada if entrada.get("url") == url else None
+        except (OSError, ValueError):
+            return None
+
+    def get(self, url: str):
+        entrada = self._leer(url)
+        request = urllib.request.Request(url)
+        if entrada:
+            if entrada.get("etag"):
+                request.add_header("If-None-Match", entrada["etag"])
+            if entrada.get("last_modified"):
+                request.add_header("If-Modified-Since", entrada["last_modified"])
+
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                body = response.read().decode('utf-8')
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and entrada:
+                self.hits += 1
+                return json.loads(entrada["body"])
+            raise
+
+        self.descargas += 1
+        if etag or last_modified:
+            escribir_atomico(
+                self._path(url),
+                json.dumps({
+                    "url": url,
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "body": body,
+                }, ensure_ascii=False).encode("utf-8"),
+            )
+        return json.loads(body)
+
 
-def fetch_json(url):
+def fetch_json(cache, url):
     """Fetch JSON from URL"""
     try:
-        with urllib.request.urlopen(url, timeout=30) as response:
-            return json.loads(response.read().decode('utf-8'))
+        return cache.get(url)
     except Exception as e:
         print(f"Error fetching {url}: {e}")
         return None
 
-def main():
-    print("=" * 60)
-    print("DESCARGANDO CATÁLOGO GEOGRÁFICO COMPLETO DE COSTA RICA")
-    print("Fuente: api-geo-cr.vercel.app")
-    print("=" * 60)
-    
+
+def serializar(catalogo) -> bytes:
+    """Serialización canónica: el hash del archivo depende solo del contenido."""
+    return json.dumps(catalogo, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def _por_codigo(items):
+    return {item["codigo"]: item for item in items}
+
+
+def diff_catalogo(anterior, nuevo):
+    """
+    Compara dos catálogos por nivel y código.
+
+    Returns:
+        Lista de líneas legibles ("+" agregado, "-" eliminado, "~" modificado)
+    """
+    lineas = []
+
+    def _comparar(nivel, contexto, items_antes, items_despues):
+        antes, despues = _por_codigo(items_antes), _por_codigo(items_despues)
+        for codigo in sorted(despues.keys() - antes.keys()):
+            lineas.append(f"+ {nivel} {contexto}{codigo} {despues[codigo]['nombre']}")
+        for codigo in sorted(antes.keys() - despues.keys()):
+            lineas.append(f"- {nivel} {contexto}{codigo} {antes[codigo]['nombre']}")
+        for codigo in sorted(antes.keys() & despues.keys()):
+            if antes[codigo] != despues[codigo]:
+                cambios = ", ".join(
+                    f"{campo}: {antes[codigo].get(campo)!r} → {despues[codigo].get(campo)!r}"
+                    for campo in sorted(antes[codigo].keys() | despues[codigo].keys())
+                    if antes[codigo].get(campo) != despues[codigo].get(campo)
+                )
+                lineas.append(f"~ {nivel} {contexto}{codigo} ({cambios})")
+
+    _comparar("provincia", "", anterior.get("provincias", []), nuevo.get("provincias", []))
+    for prov in sorted(anterior.get("cantones", {}).keys() | nuevo.get("cantones", {}).keys()):
+        _comparar(
+            "cantón", f"{prov}-",
+            anterior.get("cantones", {}).get(prov, []),
+            nuevo.get("cantones", {}).get(prov, []),
+        )
+    for key in sorted(anterior.get("distritos", {}).keys() | nuevo.get("distritos", {}).keys()):
+        _comparar(
+            "distrito", f"{key}-",
+            anterior.get("distritos", {}).get(key, []),
+            nuevo.get("distritos", {}).get(key, []),
+        )
+    return lineas
+
+
+def descargar(cache):
     catalogo = {
         "provincias": [],
         "cantones": {},
         "distritos": {}
     }
-    
+
     # 1. Fetch provincias
     print("\n[1/3] Descargando provincias...")
-    resp = fetch_json(f"{BASE_URL}/provincias")
+    resp = fetch_json(cache, f"{BASE_URL}/provincias")
     if not resp or resp.get("status") != "success":
         print("ERROR: No se pudieron obtener las provincias")
         sys.exit(1)
-    
+
     provincias_raw = resp.get("data", [])
     for p in provincias_raw:
         catalogo["provincias"].append({
@@ -45,68 +168,127 @@ def main():
             "nombre": p["descripcion"]
         })
     print(f"   ✅ {len(catalogo['provincias'])} provincias")
-    
-    # 2. Fetch cantones por provincia
-    print("\n[2/3] Descargando cantones por provincia...")
-    total_cantones = 0
-    for prov in catalogo["provincias"]:
-        prov_id = prov["codigo"]
-        resp = fetch_json(f"{BASE_URL}/provincias/{prov_id}/cantones")
-        if not resp or resp.get("status") != "success":
-            print(f"   ⚠️  No se pudieron obtener cantones para provincia {prov_id}")
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        # 2. Fetch cantones por provincia (en paralelo, se arma en orden)
+        print("\n[2/3] Descargando cantones por provincia...")
+        prov_ids = [prov["codigo"] for prov in catalogo["provincias"]]
+        respuestas = pool.map(
+            lambda prov_id: fetch_json(cache, f"{BASE_URL}/provincias/{prov_id}/cantones"),
+            prov_ids,
+        )
+        total_cantones = 0
+        for prov_id, resp in zip(prov_ids, respuestas):
+            if not resp or resp.get("status") != "success":
+                print(f"   ⚠️  No se pudieron obtener cantones para provincia {prov_id}")
+                catalogo["cantones"][prov_id] = []
+                continue
+
+            cantones_raw = resp.get("data", [])
             catalogo["cantones"][prov_id] = []
-            continue
-        
-        cantones_raw = resp.get("data", [])
-        catalogo["cantones"][prov_id] = []
-        for c in cantones_raw:
-            catalogo["cantones"][prov_id].append({
-                "codigo": str(c["idCanton"]).zfill(2),
-                "nombre": c["descripcion"]
-            })
-        total_cantones += len(catalogo["cantones"][prov_id])
-        print(f"   Provincia {prov_id}: {len(catalogo['cantones'][prov_id])} cantones")
-    print(f"   ✅ {total_cantones} cantones en total")
-    
-    # 3. Fetch distritos por cantón
-    print("\n[3/3] Descargando distritos por cantón...")
-    total_distritos = 0
-    for prov_id, cantones in catalogo["cantones"].items():
-        for canton in cantones:
-            canton_id = canton["codigo"]
-            # API usa el ID numérico, no con ceros
-            canton_id_num = str(int(canton_id))
-            
-            resp = fetch_json(f"{BASE_URL}/cantones/{canton_id_num}/distritos")
+            for c in cantones_raw:
+                catalogo["cantones"][prov_id].append({
+                    "codigo": str(c["idCanton"]).zfill(2),
+                    "nombre": c["descripcion"]
+                })
+            total_cantones += len(catalogo["cantones"][prov_id])
+            print(f"   Provincia {prov_id}: {len(catalogo['cantones'][prov_id])} cantones")
+        print(f"   ✅ {total_cantones} cantones en total")
+
+        # 3. Fetch distritos por cantón
+        print("\n[3/3] Descargando distritos por cantón...")
+        pares = [
+            (prov_id, canton["codigo"])
+            for prov_id, cantones in catalogo["cantones"].items()
+            for canton in cantones
+        ]
+        # API usa el ID numérico, no con ceros
+        respuestas = pool.map(
+            lambda par: fetch_json(cache, f"{BASE_URL}/cantones/{int(par[1])}/distritos"),
+            pares,
+        )
+        total_distritos = 0
+        for (prov_id, canton_id), resp in zip(pares, respuestas):
+            key = f"{prov_id}-{canton_id}"
             if not resp or resp.get("status") != "success":
-                print(f"   ⚠️  No se pudieron obtener distritos para {prov_id}-{canton_id}")
-                key = f"{prov_id}-{canton_id}"
+                print(f"   ⚠️  No se pudieron obtener distritos para {key}")
                 catalogo["distritos"][key] = []
                 continue
-            
+
             distritos_raw = resp.get("data", [])
-            key = f"{prov_id}-{canton_id}"
             catalogo["distritos"][key] = []
             for d in distritos_raw:
                 # Generar código postal: PCCDD
                 distrito_num = str(d.get("idDistrito", 1)).zfill(2)
                 codigo_postal = f"{prov_id}{canton_id}{distrito_num}"
-                
+
                 catalogo["distritos"][key].append({
                     "codigo": distrito_num,
                     "nombre": d["descripcion"],
                     "codigoPostal": codigo_postal
                 })
             total_distritos += len(catalogo["distritos"][key])
-    
+
     print(f"   ✅ {total_distritos} distritos en total")
-    
-    # 4. Guardar JSON
-    output_path = "src/data/catalogo_geografico.json"
-    print(f"\n[4/4] Guardando en {output_path}...")
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(catalogo, f, ensure_ascii=False, indent=2)
-    
+    return catalogo, total_cantones, total_distritos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Descarga el catálogo desde api-geo-cr.vercel.app")
+    parser.add_argument("--dry-run", action="store_true", help="Solo mostrar diferencias, no guardar")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("DESCARGANDO CATÁLOGO GEOGRÁFICO COMPLETO DE COSTA RICA")
+    print("Fuente: api-geo-cr.vercel.app")
+    print("=" * 60)
+
+    cache = CacheHTTP(CACHE_DIR)
+    catalogo, total_cantones, total_distritos = descargar(cache)
+    print(f"\n   🌐 {cache.descargas} descargas, {cache.hits} respuestas 304 (cache)")
+
+    # 4. Comparar con el archivo actual
+    output_path = OUTPUT_PATH
+    contenido = serializar(catalogo)
+    anterior = None
+    if output_path.exists():
+        raw_anterior = output_path.read_bytes()
+        if hashlib.sha256(raw_anterior).digest() == hashlib.sha256(contenido).digest():
+            print("\n✅ Sin cambios: el catálogo es idéntico al actual. No se reescribe el archivo.")
+            return
+        try:
+            anterior = json.loads(raw_anterior.decode("utf-8"))
+        except ValueError:
+            print("   ⚠️  El archivo actual no es JSON válido; se reemplazará completo")
+
+    print(f"\n[4/4] Diferencias contra {output_path}...")
+    if anterior is not None:
+        lineas = diff_catalogo(anterior, catalogo)
+        for linea in lineas:
+            print(f"   {linea}")
+        if not lineas:
+            print("   (solo cambió el formato/orden)")
+        print(
+            f"   Resumen: {sum(l.startswith('+') for l in lineas)} agregados, "
+            f"{sum(l.startswith('-') for l in lineas)} eliminados, "
+            f"{sum(l.startswith('~') for l in lineas)} modificados"
+        )
+
+    errores = validar_catalogo(catalogo)
+    if errores:
+        print("\n❌ VALIDACIÓN FALLIDA - NO SE GUARDARÁ EL ARCHIVO")
+        for error in errores:
+            print(f"   • {error}")
+        sys.exit(1)
+
+    if args.dry_run:
+        print("\n(dry-run) No se guardó el archivo.")
+        return
+
+    # 5. Guardar JSON
+    print(f"\nGuardando en {output_path}...")
+    escribir_atomico(output_path, contenido)
+
     print("\n" + "=" * 60)
     print("CATÁLOGO COMPLETO DESCARGADO")
     print("=" * 60)
@@ -7,229 +7,335 @@ Estructura de respuesta SOAP:
 - ccrCodProvincia → Provincias.ccrItemGeografico[].Codigo/Descripcion
 - ccrCodCanton → Cantones.ccrItemGeografico[].Codigo/Descripcion
 - ccrCodDistrito → Distritos.ccrItemGeografico[].Codigo/Descripcion
+- ccrCodBarrio → Barrios.ccrBarrio[].CodBarrio/CodSucursal/Nombre (modo --barrios)
+
+Las consultas de cantones y distritos corren en un pool de hilos acotado,
+limitadas por un token bucket para no superar el ritmo que tolera Correos.
+Cada provincia/cantón descargado se guarda en un checkpoint: si el script
+se interrumpe, al ejecutarlo de nuevo continúa donde quedó.
 
 Uso:
     python generate_catalog_from_soap.py
+    python generate_catalog_from_soap.py --workers 4 --tasa 3
+    python generate_catalog_from_soap.py --reiniciar   # ignorar checkpoint
+    python generate_catalog_from_soap.py --barrios     # barrios por distrito
+
+En modo --barrios se recorren los distritos del JSON ya generado y se escribe
+un archivo por distrito en src/data/barrios/ (el backend los carga bajo
+demanda). Los distritos que ya tienen archivo se saltan, salvo --reiniciar.
 
 Requisitos:
     - Variables de entorno configuradas (.env o export)
     - Credenciales válidas de Correos
     - Conexión a internet
 """
+import argparse
 import json
+import random
 import sys
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 # Add project root to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from src.services.soap_client import soap_client
+from src.services.catalogo_service import validar_catalogo
+from src.services.catalogo_snapshot import escribir_atomico
+from src.services.rate_limiter import TokenBucket
+from src.services.planificador import CARRIL_FONDO, usar_carril
 from zeep.helpers import serialize_object
 
+BASE_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
+OUTPUT_PATH = BASE_DIR / "src" / "data" / "catalogo_geografico.json"
+CHECKPOINT_PATH = BASE_DIR / "src" / "data" / ".catalogo_soap_checkpoint.json"
+BARRIOS_DIR = BASE_DIR / "src" / "data" / "barrios"
+
+# Ritmo equivalente a las pausas fijas de 0.3 s que se usaban antes,
+# pero repartido entre varios hilos en lugar de serializado.
+DEFAULT_WORKERS = 4
+DEFAULT_TASA = 3.0
+DEFAULT_REINTENTOS = 4
+BACKOFF_BASE_SEGUNDOS = 1.0
+
+
+class ErrorSoapCatalogo(Exception):
+    """Correos respondió con un CodRespuesta distinto de 00."""
+
+
+class Checkpoint:
+    """Progreso de la descarga persistido en disco (escritura atómica)."""
+
+    def __init__(self, path: Path, reiniciar: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self.datos = {"provincias": None, "cantones": {}, "distritos": {}}
+
+        if reiniciar and path.exists():
+            path.unlink()
+        elif path.exists():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.datos.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"   ⚠️ Checkpoint ilegible, se descarta: {e}")
+
+    def guardar(self, seccion: str, key: str, valor) -> None:
+        with self._lock:
+            if seccion == "provincias":
+                self.datos["provincias"] = valor
+            else:
+                self.datos[seccion][key] = valor
+            escribir_atomico(
+                self.path,
+                json.dumps(self.datos, ensure_ascii=False).encode("utf-8"),
+            )
+
+    def eliminar(self) -> None:
+        if self.path.exists():
+            self.path.unlink()
+
+
+def _items(data, contenedor: str):
+    """Extrae ccrItemGeografico normalizando lista u objeto único."""
+    items = (data.get(contenedor) or {}).get('ccrItemGeografico', [])
+    if not isinstance(items, list):
+        items = [items] if items else []
+    return items
+
+
+def _llamar(limitador: TokenBucket, reintentos: int, metodo: str, *args):
+    """
+    Llama un método SOAP respetando el rate limit, con reintentos y
+    backoff exponencial (con jitter) ante errores de red o CodRespuesta != 00.
+    """
+    for intento in range(reintentos + 1):
+        limitador.adquirir()
+        try:
+            # La cosecha nunca compite de igual a igual con la UI
+            with usar_carril(CARRIL_FONDO):
+                data = serialize_object(soap_client.call_method(metodo, *args))
+            cod_respuesta = data.get('CodRespuesta')
+            if cod_respuesta != '00':
+                mensaje = data.get('MensajeRespuesta', 'Error desconocido')
+                raise ErrorSoapCatalogo(f"Error SOAP {cod_respuesta} - {mensaje}")
+            return data
+        except Exception as e:
+            if intento == reintentos:
+                raise
+            espera = BACKOFF_BASE_SEGUNDOS * (2 ** intento) * (0.5 + random.random())
+            print(f"   ↻ {metodo}{args}: {e}. Reintento {intento + 1}/{reintentos} en {espera:.1f}s")
+            time.sleep(espera)
+
+
+def obtener_provincias(limitador, reintentos):
+    data = _llamar(limitador, reintentos, "ccrCodProvincia")
+    provincias = []
+    for item in _items(data, 'Provincias'):
+        codigo = str(item.get('Codigo', '')).strip()
+        nombre = str(item.get('Descripcion', '')).strip().upper()
+        if codigo and nombre:
+            provincias.append({"codigo": codigo, "nombre": nombre})
+    return provincias
+
+
+def obtener_cantones(limitador, reintentos, prov_id):
+    data = _llamar(limitador, reintentos, "ccrCodCanton", prov_id)
+    cantones = []
+    for item in _items(data, 'Cantones'):
+        codigo = str(item.get('Codigo', '')).strip()
+        nombre = str(item.get('Descripcion', '')).strip().upper()
+        if codigo and nombre:
+            # Asegurar padding de 2 dígitos
+            cantones.append({"codigo": codigo.zfill(2), "nombre": nombre})
+    return cantones
+
+
+def obtener_distritos(limitador, reintentos, prov_id, canton_id):
+    # Provincia sin padding (1,2..), cantón CON padding (01,02..)
+    data = _llamar(limitador, reintentos, "ccrCodDistrito", prov_id, canton_id)
+    distritos = []
+    for item in _items(data, 'Distritos'):
+        codigo = str(item.get('Codigo', '')).strip()
+        nombre = str(item.get('Descripcion', '')).strip().upper()
+        if codigo and nombre:
+            # Asegurar padding de 2 dígitos
+            distritos.append({"codigo": codigo.zfill(2), "nombre": nombre})
+    return distritos
+
+
+def obtener_barrios(limitador, reintentos, prov_id, canton_id, distrito_id):
+    data = _llamar(limitador, reintentos, "ccrCodBarrio", prov_id, canton_id, distrito_id)
+    contenedor = data.get('Barrios') or {}
+    # El nombre del elemento repetido varía según el despliegue del WS
+    items = contenedor.get('ccrBarrio') or contenedor.get('ccrItemGeografico') or []
+    if not isinstance(items, list):
+        items = [items] if items else []
+
+    barrios = []
+    for item in items:
+        codigo = str(item.get('CodBarrio') or item.get('Codigo') or '').strip()
+        sucursal = str(item.get('CodSucursal') or item.get('Sucursal') or '').strip()
+        nombre = str(item.get('Nombre') or item.get('Descripcion') or '').strip().upper()
+        if codigo and nombre:
+            barrios.append({
+                "codigo_barrio": codigo.zfill(2),
+                "codigo_sucursal": sucursal,
+                "nombre": nombre,
+            })
+    return barrios
+
+
+def cosechar(tareas, workers, hechas, guardar, descripcion):
+    """
+    Ejecuta las tareas pendientes en el pool y guarda cada resultado
+    apenas llega.
+
+    Args:
+        tareas: Dict key -> callable sin argumentos
+        hechas: Keys ya descargadas en una corrida anterior
+        guardar: Callable (key, resultado) que persiste el progreso
+
+    Returns:
+        Dict key -> error de las tareas que fallaron tras los reintentos
+    """
+    pendientes = {k: fn for k, fn in tareas.items() if k not in hechas}
+    ya_hechas = len(tareas) - len(pendientes)
+    if ya_hechas:
+        print(f"   ⏩ {ya_hechas}/{len(tareas)} {descripcion} recuperados del checkpoint")
+
+    fallidas = {}
+    completadas = ya_hechas
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futuros = {pool.submit(fn): key for key, fn in pendientes.items()}
+        for futuro in as_completed(futuros):
+            key = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                fallidas[key] = str(e)
+                print(f"   ⚠️ {key}: {e}")
+                continue
+            guardar(key, resultado)
+            completadas += 1
+            # Mostrar progreso cada 10 o al final
+            if completadas % 10 == 0 or completadas == len(tareas):
+                print(f"   [{completadas}/{len(tareas)}] {key}: {len(resultado)} {descripcion}")
+    return fallidas
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Descarga el catálogo geográfico de Correos via SOAP")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"Hilos concurrentes (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--tasa", type=float, default=DEFAULT_TASA, help=f"Llamadas SOAP por segundo (default: {DEFAULT_TASA})")
+    parser.add_argument("--reintentos", type=int, default=DEFAULT_REINTENTOS, help=f"Reintentos por consulta (default: {DEFAULT_REINTENTOS})")
+    parser.add_argument("--reiniciar", action="store_true", help="Ignorar el checkpoint y descargar todo de nuevo")
+    parser.add_argument("--barrios", action="store_true", help="Descargar barrios por distrito (requiere el JSON generado)")
+    args = parser.parse_args()
+
+    if args.barrios:
+        main_barrios(args)
+        return
+
     print("=" * 60)
     print("DESCARGANDO CATÁLOGO GEOGRÁFICO DE CORREOS VIA SOAP")
     print("Esto se ejecuta UNA SOLA VEZ para generar el JSON")
     print("=" * 60)
-    
-    catalogo = {
-        "provincias": [],
-        "cantones": {},
-        "distritos": {}
-    }
-    
-    # Verificar que el archivo de salida existe o puede crearse
-    output_path = Path("src/data/catalogo_geografico.json")
+
+    output_path = OUTPUT_PATH
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    
+
     print(f"\n📁 Archivo de salida: {output_path.absolute()}")
+    print(f"💾 Checkpoint: {CHECKPOINT_PATH}")
+    print(f"⚙️  {args.workers} hilos, {args.tasa} llamadas/s, {args.reintentos} reintentos")
     print(f"🔐 Usando credenciales de Correos configuradas en .env\n")
-    
+
+    checkpoint = Checkpoint(CHECKPOINT_PATH, reiniciar=args.reiniciar)
+    limitador = TokenBucket(tasa=args.tasa, capacidad=args.workers)
+    inicio = time.monotonic()
+
     # 1. Obtener provincias
     print("\n[1/3] Obteniendo provincias (ccrCodProvincia)...")
-    try:
-        result = soap_client.call_method("ccrCodProvincia")
-        data = serialize_object(result)
-        
-        # Verificar respuesta SOAP
-        cod_respuesta = data.get('CodRespuesta')
-        if cod_respuesta != '00':
-            mensaje = data.get('MensajeRespuesta', 'Error desconocido')
-            print(f"   ❌ Error SOAP: Código {cod_respuesta} - {mensaje}")
+    provincias = checkpoint.datos["provincias"]
+    if provincias:
+        print("   ⏩ Recuperadas del checkpoint")
+    else:
+        try:
+            provincias = obtener_provincias(limitador, args.reintentos)
+        except Exception as e:
+            print(f"   ❌ Error obteniendo provincias: {e}")
             sys.exit(1)
-        
-        # Extraer provincias
-        provincias_data = data.get('Provincias', {})
-        items = provincias_data.get('ccrItemGeografico', [])
-        
-        # Normalizar: puede venir como lista o objeto único
-        if not isinstance(items, list):
-            items = [items] if items else []
-        
-        # Procesar cada provincia
-        for item in items:
-            codigo = str(item.get('Codigo', '')).strip()
-            nombre = str(item.get('Descripcion', '')).strip().upper()
-            
-            if codigo and nombre:
-                catalogo["provincias"].append({
-                    "codigo": codigo,
-                    "nombre": nombre
-                })
-        
-        if not catalogo["provincias"]:
+        if not provincias:
             print("   ❌ No se obtuvieron provincias. Abortando.")
             sys.exit(1)
-        
-        print(f"   ✅ {len(catalogo['provincias'])} provincias obtenidas")
-        for p in catalogo["provincias"]:
-            print(f"      {p['codigo']}: {p['nombre']}")
-            
-    except Exception as e:
-        print(f"   ❌ Error obteniendo provincias: {e}")
-        import traceback
-        traceback.print_exc()
-        sys.exit(1)
-    
+        checkpoint.guardar("provincias", None, provincias)
+
+    print(f"   ✅ {len(provincias)} provincias obtenidas")
+    for p in provincias:
+        print(f"      {p['codigo']}: {p['nombre']}")
+
     # 2. Obtener cantones por provincia
     print("\n[2/3] Obteniendo cantones (ccrCodCanton)...")
-    total_cantones = 0
-    for idx, prov in enumerate(catalogo["provincias"], 1):
-        prov_id = prov["codigo"]
-        prov_nombre = prov["nombre"]
-        
-        try:
-            # Pequeño delay para evitar rate limiting
-            if idx > 1:
-                time.sleep(0.5)
-            
-            result = soap_client.call_method("ccrCodCanton", prov_id)
-            data = serialize_object(result)
-            
-            catalogo["cantones"][prov_id] = []
-            
-            cod_respuesta = data.get('CodRespuesta')
-            if cod_respuesta == '00':
-                cantones_data = data.get('Cantones', {})
-                items = cantones_data.get('ccrItemGeografico', [])
-                
-                # Normalizar: puede venir como lista o objeto único
-                if not isinstance(items, list):
-                    items = [items] if items else []
-                
-                # Procesar cada cantón
-                for item in items:
-                    codigo = str(item.get('Codigo', '')).strip()
-                    nombre = str(item.get('Descripcion', '')).strip().upper()
-                    
-                    if codigo and nombre:
-                        # Asegurar padding de 2 dígitos
-                        codigo_padded = codigo.zfill(2)
-                        catalogo["cantones"][prov_id].append({
-                            "codigo": codigo_padded,
-                            "nombre": nombre
-                        })
-            else:
-                mensaje = data.get('MensajeRespuesta', 'Error desconocido')
-                print(f"   ⚠️ Provincia {prov_id}: Error SOAP {cod_respuesta} - {mensaje}")
-            
-            total_cantones += len(catalogo["cantones"][prov_id])
-            print(f"   [{idx}/{len(catalogo['provincias'])}] {prov_nombre}: {len(catalogo['cantones'][prov_id])} cantones")
-            
-        except Exception as e:
-            print(f"   ⚠️ Error en provincia {prov_id} ({prov_nombre}): {e}")
-            catalogo["cantones"][prov_id] = []
-    
+    fallidas_cantones = cosechar(
+        {
+            p["codigo"]: (lambda prov_id=p["codigo"]: obtener_cantones(limitador, args.reintentos, prov_id))
+            for p in provincias
+        },
+        args.workers,
+        checkpoint.datos["cantones"],
+        lambda key, resultado: checkpoint.guardar("cantones", key, resultado),
+        "cantones",
+    )
+    cantones = {p["codigo"]: checkpoint.datos["cantones"].get(p["codigo"], []) for p in provincias}
+    total_cantones = sum(len(v) for v in cantones.values())
     print(f"\n   ✅ {total_cantones} cantones en total")
-    
+
     # 3. Obtener distritos por cantón
     print("\n[3/3] Obteniendo distritos (ccrCodDistrito)...")
-    total_distritos = 0
-    total_combinations = sum(len(cantones) for cantones in catalogo["cantones"].values())
-    current = 0
-    
-    for prov_id, cantones in catalogo["cantones"].items():
-        prov_nombre = next((p["nombre"] for p in catalogo["provincias"] if p["codigo"] == prov_id), prov_id)
-        
-        for canton in cantones:
-            canton_id = canton["codigo"]
-            canton_nombre = canton["nombre"]
-            key = f"{prov_id}-{canton_id}"
-            current += 1
-            
-            try:
-                # Pequeño delay para evitar rate limiting
-                if current > 1:
-                    time.sleep(0.3)
-                
-                # Provincia sin padding (1,2..), cantón CON padding (01,02..)
-                result = soap_client.call_method("ccrCodDistrito", prov_id, canton_id)
-                data = serialize_object(result)
-                
-                catalogo["distritos"][key] = []
-                
-                cod_respuesta = data.get('CodRespuesta')
-                if cod_respuesta == '00':
-                    distritos_data = data.get('Distritos', {})
-                    items = distritos_data.get('ccrItemGeografico', [])
-                    
-                    # Normalizar: puede venir como lista o objeto único
-                    if not isinstance(items, list):
-                        items = [items] if items else []
-                    
-                    # Procesar cada distrito
-                    for item in items:
-                        codigo = str(item.get('Codigo', '')).strip()
-                        nombre = str(item.get('Descripcion', '')).strip().upper()
-                        
-                        if codigo and nombre:
-                            # Asegurar padding de 2 dígitos
-                            distrito_codigo = codigo.zfill(2)
-                            
-                            catalogo["distritos"][key].append({
-                                "codigo": distrito_codigo,
-                                "nombre": nombre
-                            })
-                else:
-                    mensaje = data.get('MensajeRespuesta', 'Error desconocido')
-                    print(f"   ⚠️ {key}: Error SOAP {cod_respuesta} - {mensaje}")
-                
-                num_distritos = len(catalogo["distritos"][key])
-                total_distritos += num_distritos
-                
-                # Mostrar progreso cada 10 combinaciones o al final
-                if current % 10 == 0 or current == total_combinations:
-                    print(f"   [{current}/{total_combinations}] {prov_nombre} > {canton_nombre}: {num_distritos} distritos")
-                    
-            except Exception as e:
-                print(f"   ⚠️ Error en {key} ({prov_nombre} > {canton_nombre}): {e}")
-                catalogo["distritos"][key] = []
-    
+    tareas_distritos = {}
+    for prov_id, lista in cantones.items():
+        for canton in lista:
+            key = f"{prov_id}-{canton['codigo']}"
+            tareas_distritos[key] = (
+                lambda prov_id=prov_id, canton_id=canton["codigo"]:
+                    obtener_distritos(limitador, args.reintentos, prov_id, canton_id)
+            )
+    fallidas_distritos = cosechar(
+        tareas_distritos,
+        args.workers,
+        checkpoint.datos["distritos"],
+        lambda key, resultado: checkpoint.guardar("distritos", key, resultado),
+        "distritos",
+    )
+    distritos = {key: checkpoint.datos["distritos"].get(key, []) for key in tareas_distritos}
+    total_distritos = sum(len(v) for v in distritos.values())
     print(f"\n   ✅ {total_distritos} distritos en total")
-    
+
+    catalogo = {
+        "provincias": provincias,
+        "cantones": cantones,
+        "distritos": distritos,
+    }
+
+    fallidas = {**fallidas_cantones, **fallidas_distritos}
+    if fallidas:
+        print(f"\n   ⚠️ {len(fallidas)} consultas fallaron tras {args.reintentos} reintentos:")
+        for key, error in fallidas.items():
+            print(f"      • {key}: {error}")
+        print("   ⚠️ Ejecute el script de nuevo para reintentar solo las pendientes.")
+
     # 4. Validar y guardar JSON
     print(f"\n[4/4] Validando datos antes de guardar...")
-    
+
     # Validaciones estrictas - si no se cumplen, ERROR y no guardar
-    errores_validacion = []
-    
-    if len(catalogo['provincias']) != 7:
-        error_msg = f"ERROR: Se esperaban 7 provincias, se obtuvieron {len(catalogo['provincias'])}"
-        print(f"   ❌ {error_msg}")
-        errores_validacion.append(error_msg)
-    
-    if total_cantones < 80:
-        error_msg = f"ERROR: Se esperaban al menos 80 cantones, se obtuvieron {total_cantones}"
+    # (las mismas que aplica CatalogoService al recargar en caliente)
+    errores_validacion = validar_catalogo(catalogo)
+    for error_msg in errores_validacion:
         print(f"   ❌ {error_msg}")
-        errores_validacion.append(error_msg)
-    
-    if total_distritos < 480:
-        error_msg = f"ERROR: Se esperaban al menos 480 distritos, se obtuvieron {total_distritos}"
-        print(f"   ❌ {error_msg}")
-        errores_validacion.append(error_msg)
-    
+
     # Si hay errores de validación, NO guardar y salir
     if errores_validacion:
         print("\n" + "=" * 60)
@@ -238,36 +344,98 @@ def main():
         for error in errores_validacion:
             print(f"   • {error}")
         print("=" * 60)
-        print("\n⚠️  Corrija los errores y ejecute el script nuevamente.")
+        print("\n⚠️  Corrija los errores y ejecute el script nuevamente (se reanuda desde el checkpoint).")
         sys.exit(1)
-    
-    # Si pasa las validaciones, guardar JSON
+
+    # Si pasa las validaciones, guardar JSON (atómico: el backend puede estar vigilando el archivo)
     print(f"\n[5/5] Guardando en {output_path}...")
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(catalogo, f, ensure_ascii=False, indent=2)
-        
+        escribir_atomico(
+            output_path,
+            json.dumps(catalogo, ensure_ascii=False, indent=2).encode("utf-8"),
+        )
+
         # Verificar tamaño del archivo
         file_size = output_path.stat().st_size
         print(f"   ✅ Archivo guardado: {file_size:,} bytes ({file_size/1024:.1f} KB)")
-        
+
     except Exception as e:
         print(f"   ❌ Error guardando archivo: {e}")
         sys.exit(1)
-    
+
+    # El checkpoint se conserva mientras queden consultas fallidas
+    if not fallidas:
+        checkpoint.eliminar()
+
     # Resumen final
     print("\n" + "=" * 60)
     print("✅ CATÁLOGO OFICIAL DE CORREOS DESCARGADO EXITOSAMENTE")
     print("=" * 60)
     print(f"📊 Estadísticas:")
-    print(f"   • Provincias: {len(catalogo['provincias'])}")
+    print(f"   • Provincias: {len(provincias)}")
     print(f"   • Cantones:   {total_cantones}")
     print(f"   • Distritos:  {total_distritos}")
+    print(f"   • Duración:   {time.monotonic() - inicio:.1f}s")
     print(f"   • Archivo:    {output_path.absolute()}")
     print("=" * 60)
     print("\n✅ El catálogo está listo para producción.")
     print("✅ Puede hacer deploy. El JSON no cambiará hasta ejecutar este script nuevamente.")
     print("\n💡 Para regenerar el catálogo, ejecute este script nuevamente.")
 
+def main_barrios(args):
+    print("=" * 60)
+    print("DESCARGANDO BARRIOS DE CORREOS VIA SOAP (ccrCodBarrio)")
+    print("=" * 60)
+
+    if not OUTPUT_PATH.exists():
+        print(f"   ❌ No existe {OUTPUT_PATH}. Genere primero el catálogo (sin --barrios).")
+        sys.exit(1)
+
+    with open(OUTPUT_PATH, 'r', encoding='utf-8') as f:
+        catalogo = json.load(f)
+
+    BARRIOS_DIR.mkdir(parents=True, exist_ok=True)
+    print(f"\n📁 Directorio de salida: {BARRIOS_DIR.absolute()}")
+    print(f"⚙️  {args.workers} hilos, {args.tasa} llamadas/s, {args.reintentos} reintentos")
+
+    limitador = TokenBucket(tasa=args.tasa, capacidad=args.workers)
+    inicio = time.monotonic()
+
+    tareas = {}
+    for key_canton, distritos in catalogo.get("distritos", {}).items():
+        prov_id, canton_id = key_canton.split("-", 1)
+        for distrito in distritos:
+            key = f"{key_canton}-{distrito['codigo']}"
+            tareas[key] = (
+                lambda prov_id=prov_id, canton_id=canton_id, distrito_id=distrito["codigo"]:
+                    obtener_barrios(limitador, args.reintentos, prov_id, canton_id, distrito_id)
+            )
+
+    # Cada archivo de distrito es su propio checkpoint
+    hechas = set() if args.reiniciar else {p.stem for p in BARRIOS_DIR.glob("*.json")}
+
+    def _guardar(key, barrios):
+        escribir_atomico(
+            BARRIOS_DIR / f"{key}.json",
+            json.dumps(barrios, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        )
+
+    fallidas = cosechar(tareas, args.workers, hechas, _guardar, "barrios")
+
+    total_archivos = len(list(BARRIOS_DIR.glob("*.json")))
+    print("\n" + "=" * 60)
+    if fallidas:
+        print(f"⚠️ {len(fallidas)} distritos fallaron. Ejecute de nuevo para reintentar solo esos.")
+    else:
+        print("✅ BARRIOS DESCARGADOS EXITOSAMENTE")
+    print("=" * 60)
+    print(f"   • Distritos con archivo: {total_archivos}/{len(tareas)}")
+    print(f"   • Duración:              {time.monotonic() - inicio:.1f}s")
+    print("=" * 60)
+
+    if fallidas:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main()
@@ -1,14 +1,171 @@
 #!/usr/bin/env python3
 """
 Script para ejecutar el servidor de la API.
+
+Modos (SERVIDOR_MODO o --modo):
+- produccion (por defecto): un worker por CPU, uvloop/httptools si están
+  instalados, sin reload. Con gunicorn instalado el catálogo (y opcionalmente
+  el WSDL) se carga una vez en el proceso maestro antes de crear los workers,
+  que lo comparten copy-on-write, y cada worker se recicla tras
+  SERVIDOR_MAX_REQUESTS requests. Sin gunicorn se usa uvicorn --workers.
+- desarrollo (--modo desarrollo o --reload): un proceso con reload.
+
+Uso:
+    python run.py
+    python run.py --workers 4
+    python run.py --reload
 """
+import argparse
+import gc
+import logging
+import os
+import tempfile
+
 import uvicorn
 
-if __name__ == "__main__":
+from src.config import config
+
+APP = "src.api.endpoints:app"
+
+logger = logging.getLogger("run")
+
+
+def _cpus_disponibles() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _precargar(wsdl: bool) -> None:
+    """
+    Trabajo que conviene hacer una sola vez en el maestro antes del fork:
+    los workers heredan el catálogo (y el WSDL parseado) sin copiarlo.
+    """
+    from src.services.catalogo_service import catalogo_service
+
+    try:
+        catalogo_service.cargar_catalogo()
+    except Exception as e:
+        logger.error("❌ No se pudo precargar el catálogo (cada worker lo reintentará): %s", e)
+
+    if wsdl:
+        from src.services.soap_client import soap_client
+
+        try:
+            cliente = soap_client._get_client()
+            # Las conexiones abiertas para bajar el WSDL no se comparten entre procesos
+            cliente.transport.session.close()
+        except Exception as e:
+            logger.error("❌ No se pudo precargar el WSDL (cada worker lo cargará): %s", e)
+
+    # Lo cargado hasta aquí queda fuera del GC: las recolecciones de los
+    # workers no tocan esas páginas y siguen compartidas
+    gc.collect()
+    gc.freeze()
+
+
+def _asegurar_metricas_multiproceso(workers: int, puerto: int) -> None:
+    """Con varios workers /metrics debe sumar los de todos (ver metricas.py)."""
+    if workers > 1 and not config.METRICAS_MULTIPROCESO_DIR:
+        directorio = os.path.join(tempfile.gettempdir(), f"correos_metricas_{puerto}")
+        os.environ["METRICAS_MULTIPROCESO_DIR"] = directorio
+        config.METRICAS_MULTIPROCESO_DIR = directorio
+
+
+def _servir_gunicorn(args, workers: int) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    class _Aplicacion(BaseApplication):
+        def load_config(self):
+            opciones = {
+                "bind": f"{args.host}:{args.port}",
+                "workers": workers,
+                "worker_class": "uvicorn.workers.UvicornWorker",
+                "preload_app": True,
+                "max_requests": config.SERVIDOR_MAX_REQUESTS,
+                "max_requests_jitter": config.SERVIDOR_MAX_REQUESTS_JITTER,
+                "keepalive": config.SERVIDOR_KEEPALIVE_SEGUNDOS,
+                "backlog": config.SERVIDOR_BACKLOG,
+                "graceful_timeout": config.SERVIDOR_APAGADO_SEGUNDOS,
+                # Una request puede durar hasta el plazo máximo
+                "timeout": int(config.PLAZO_REQUEST_MAXIMO_SEGUNDOS) + config.SERVIDOR_APAGADO_SEGUNDOS,
+            }
+            for clave, valor in opciones.items():
+                self.cfg.set(clave, valor)
+
+        def load(self):
+            # Con preload_app corre en el maestro, antes de crear los workers
+            from src.api.endpoints import app
+
+            _precargar(wsdl=args.precargar_wsdl)
+            return app
+
+    _Aplicacion().run()
+
+
+def _servir_uvicorn(args, workers: int) -> None:
+    if workers > 1:
+        logger.warning(
+            "⚠️  Sin gunicorn: %d workers de uvicorn sin precarga compartida "
+            "ni reciclado (pip install gunicorn)", workers
+        )
     uvicorn.run(
-        "src.api.endpoints:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        log_level="info"
+        APP,
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop="auto",
+        http="auto",
+        backlog=config.SERVIDOR_BACKLOG,
+        timeout_keep_alive=config.SERVIDOR_KEEPALIVE_SEGUNDOS,
+        timeout_graceful_shutdown=config.SERVIDOR_APAGADO_SEGUNDOS,
+        # Logs por el logging de la app (JSON, no bloqueante); el acceso
+        # ya queda en /metrics
+        log_config=None,
+        access_log=False,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de la API de Correos")
+    parser.add_argument("--modo", choices=["produccion", "desarrollo"], default=config.SERVIDOR_MODO)
+    parser.add_argument("--reload", action="store_true", help="Equivale a --modo desarrollo")
+    parser.add_argument("--host", default=config.SERVIDOR_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVIDOR_PUERTO)
+    parser.add_argument("--workers", type=int, default=config.SERVIDOR_WORKERS, help="0 = uno por CPU")
+    parser.add_argument(
+        "--precargar-wsdl", action="store_true", default=config.SERVIDOR_PRECARGAR_WSDL,
+        help="Parsear el WSDL en el maestro antes de crear los workers (gunicorn)"
     )
+    parser.add_argument("--sin-gunicorn", action="store_true", help="Usar uvicorn --workers aunque haya gunicorn")
+    args = parser.parse_args()
+
+    if args.reload or args.modo == "desarrollo":
+        uvicorn.run(APP, host=args.host, port=args.port, reload=True, log_level="info")
+        return
+
+    from src.services.logs import configurar_logging
+    configurar_logging()
+
+    workers = args.workers if args.workers > 0 else _cpus_disponibles()
+    _asegurar_metricas_multiproceso(workers, args.port)
+
+    try:
+        import gunicorn  # noqa: F401
+        hay_gunicorn = not args.sin_gunicorn
+    except ImportError:
+        hay_gunicorn = False
+
+    logger.info(
+        "🚀 Modo producción: %d workers en %s:%d (%s)",
+        workers, args.host, args.port, "gunicorn + uvicorn" if hay_gunicorn else "uvicorn"
+    )
+    if hay_gunicorn:
+        _servir_gunicorn(args, workers)
+    else:
+        _servir_uvicorn(args, workers)
+
+
+if __name__ == "__main__":
+    main()
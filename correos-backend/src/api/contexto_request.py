@@ -0,0 +1,37 @@
+"""
+Middleware ASGI que asigna un request id a cada request HTTP.
+
+Se toma del header X-Request-ID si el cliente lo envía (para correlacionar
+con sus logs) o se genera uno. Queda en el contexto durante toda la request,
+incluidos los hilos del ejecutor SOAP, y se devuelve en la respuesta.
+"""
+from src.services.logs import nuevo_request_id, usar_request_id
+
+_HEADER = b"x-request-id"
+
+
+class ContextoRequest:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for nombre, valor in scope["headers"]:
+            if nombre == _HEADER:
+                # Acotado: el valor termina en cada línea de log
+                request_id = valor.decode("latin-1")[:64] or None
+                break
+        request_id = request_id or nuevo_request_id()
+
+        async def _send(mensaje):
+            if mensaje["type"] == "http.response.start":
+                mensaje.setdefault("headers", [])
+                mensaje["headers"] = list(mensaje["headers"]) + [(_HEADER, request_id.encode("latin-1"))]
+            await send(mensaje)
+
+        with usar_request_id(request_id):
+            await self.app(scope, receive, _send)
@@ -0,0 +1,125 @@
+"""
+Descarga de archivos binarios con ETag y rangos (RFC 9110).
+
+El FileResponse de Starlette 0.27 no atiende `Range`; aquí se resuelve:
+- `If-None-Match` con el ETag vigente -> 304 sin cuerpo
+- `Range: bytes=a-b` (un solo rango) -> 206 con `Content-Range`
+- rango fuera del archivo -> 416
+- varios rangos o `If-Range` que no coincide -> archivo completo (200)
+
+El archivo se lee por bloques en un hilo, sin cargarlo entero en memoria.
+"""
+import os
+import re
+from typing import Iterator, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+BLOQUE = 64 * 1024
+
+_RANGO = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _leer(ruta: str, inicio: int, largo: int) -> Iterator[bytes]:
+    with open(ruta, "rb") as f:
+        f.seek(inicio)
+        while largo > 0:
+            bloque = f.read(min(BLOQUE, largo))
+            if not bloque:
+                break
+            largo -= len(bloque)
+            yield bloque
+
+
+def etag_coincide(valor: Optional[str], etag: str) -> bool:
+    """True si el header If-None-Match `valor` incluye `etag`."""
+    if not valor:
+        return False
+    candidatos = [v.strip() for v in valor.split(",")]
+    # Comparación débil: W/"x" equivale a "x"
+    return "*" in candidatos or any(c.removeprefix("W/") == etag for c in candidatos)
+
+
+def _parse_rango(valor: str, tamano: int) -> Optional[Tuple[int, int]]:
+    """
+    Returns:
+        (inicio, fin inclusivo), o None si el header no es un rango simple
+
+    Raises:
+        ValueError: Si el rango no se puede satisfacer (416)
+    """
+    m = _RANGO.match(valor.strip())
+    if not m:
+        return None
+    desde, hasta = m.groups()
+    if not desde and not hasta:
+        return None
+    if not desde:
+        # bytes=-N: los últimos N bytes
+        sufijo = int(hasta)
+        if sufijo == 0:
+            raise ValueError("rango vacío")
+        return max(0, tamano - sufijo), tamano - 1
+    inicio = int(desde)
+    fin = int(hasta) if hasta else tamano - 1
+    if inicio >= tamano or fin < inicio:
+        raise ValueError("rango fuera del archivo")
+    return inicio, min(fin, tamano - 1)
+
+
+def respuesta_archivo(
+    request: Request,
+    ruta: str,
+    etag: str,
+    media_type: str,
+    nombre: Optional[str] = None,
+    cache_control: str = "private, max-age=86400",
+) -> Response:
+    """
+    Responde `ruta` atendiendo If-None-Match, Range e If-Range.
+
+    Args:
+        request: Request entrante (para los headers condicionales)
+        ruta: Archivo a enviar
+        etag: Valor del ETag con comillas (p.ej. '"<sha256>"')
+        media_type: Content-Type
+        nombre: Nombre sugerido (Content-Disposition inline)
+        cache_control: Header Cache-Control
+    """
+    tamano = os.stat(ruta).st_size
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": cache_control,
+    }
+    if nombre:
+        headers["Content-Disposition"] = f'inline; filename="{nombre}"'
+
+    if etag_coincide(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    rango = None
+    valor_rango = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if valor_rango and (if_range is None or if_range.strip() == etag):
+        try:
+            rango = _parse_rango(valor_rango, tamano)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{tamano}"
+            return Response(status_code=416, headers=headers)
+
+    if rango is None:
+        inicio, largo, estado = 0, tamano, 200
+    else:
+        inicio, fin = rango
+        largo, estado = fin - inicio + 1, 206
+        headers["Content-Range"] = f"bytes {inicio}-{fin}/{tamano}"
+    headers["Content-Length"] = str(largo)
+
+    if request.method == "HEAD":
+        return Response(status_code=estado, headers=headers, media_type=media_type)
+    # Iterador síncrono: Starlette lo consume en el threadpool
+    return StreamingResponse(
+        _leer(ruta, inicio, largo), status_code=estado, headers=headers, media_type=media_type
+    )
@@ -1,24 +1,60 @@
 """
 Endpoints FastAPI para la integración con Correos de Costa Rica.
 """
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
 import logging
-from fastapi import FastAPI, HTTPException
+from datetime import datetime, timezone
+from fastapi import FastAPI, HTTPException, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional
-from src.models.envio import SolicitudGuia, RespuestaGuia
+from src.models.envio import (
+    SolicitudGuia, RespuestaGuia, SolicitudLotePDF, DatosEtiqueta, AjustesGuiaOrden, SolicitudCotizacion
+)
 from src.services.guia_service import guia_service
-from src.services.envio_service import envio_service
-from src.services.catalogo_service import catalogo_service
-
-# Configurar logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from src.services.envio_service import envio_service, RegistroInciertoError
+from src.config import config
+from src.services.catalogo_service import catalogo_service, CatalogoInvalidoError
+from src.services.ejecutor_soap import ejecutor_soap, EjecutorSaturadoError
+from src.services.metricas import registro
+from src.api.metricas_http import MetricasHTTP
+from src.api.contexto_request import ContextoRequest
+from src.api.perfilado import PerfiladoRequests
+from src.api.respuestas import RespuestaJSONRapida
+from src.api.descargas import etag_coincide, respuesta_archivo
+from src.services.almacen_pdf import almacen_pdf
+from src.services.lotes_pdf import generador_lotes, GuiasMultipaginaError, GuiasSinPDFError
+from src.services import etiquetas
+from src.services.ordenes_procesadas import (
+    registro_ordenes, guia_creada_o_en_curso, describir_ocupada, OrdenOcupadaError,
+    ESTADO_GUIA_CREADA, ESTADO_INCIERTO
 )
+from src.services.ordenes import repositorio_ordenes
+from src.services.orden_guia import construir_solicitud, OrdenNoEnviableError
+from src.services.validacion_envio import verificar_solicitud, EnvioInvalidoError
+from src.services.cola_guias import cola_guias
+from src.services.cotizador import cotizador
+from src.services.calentamiento import calentamiento
+from src.services.perfilador import Perfilador
+from src.services.logs import configurar_logging
+from src.services.rate_limiter import LimiteExcedidoError
+from src.services.soap_client import ConexionSoapError
+from src.services.plazo import PlazoVencidoError, usar_plazo
+from src.services.planificador import planificador, usar_carril, CARRILES, CARRIL_INTERACTIVO
+
+# Configurar logging (cola + hilo de escritura, niveles desde LOG_LEVEL)
+configurar_logging()
 logger = logging.getLogger(__name__)
 
+_consultas_catalogo = registro.contador(
+    "catalogo_consultas_total", "Consultas al catálogo geográfico por tipo", ["tipo"]
+)
+
 # Crear aplicación FastAPI
 app = FastAPI(
     title="Integración Correos de Costa Rica",
@@ -47,35 +83,130 @@ app.add_middleware(
 # ============================================================================
 # EVENTO DE STARTUP - CARGAR CATÁLOGO EN MEMORIA
 # ============================================================================
+# Latencia y conteo de requests por ruta (/metrics)
+app.add_middleware(MetricasHTTP)
+# Perfilado opt-in de requests individuales (sin instalar si está apagado)
+if config.PERFIL_DIR:
+    app.add_middleware(
+        PerfiladoRequests,
+        perfilador=Perfilador(
+            config.PERFIL_DIR,
+            intervalo=config.PERFIL_INTERVALO_MS / 1000.0,
+            max_perfiles=config.PERFIL_MAX_ARCHIVOS
+        ),
+        rutas=config.PERFIL_RUTAS,
+        tasa=config.PERFIL_MUESTREO_TASA,
+        admin_secret=config.ADMIN_SECRET
+    )
+# Request id en los logs y en el header X-Request-ID (el más externo)
+app.add_middleware(ContextoRequest)
+
+
 @app.on_event("startup")
 async def startup_event():
     """
-    Carga el catálogo geográfico completo al iniciar el servidor.
+    Carga el catálogo geográfico completo al iniciar el servidor y calienta
+    el worker (cliente SOAP, token, conexiones) en segundo plano: GET /ready
+    responde 200 cuando termina.
     Esto se ejecuta UNA SOLA VEZ al arrancar.
     """
-    logger.info("=" * 60)
-    logger.info("CARGANDO CATÁLOGO DESDE JSON (NO SOAP)")
-    logger.info("=" * 60)
+    if not config.ARRANQUE_CALENTAR:
+        for paso in ("cliente_soap", "token", "conexiones"):
+            calentamiento.omitir(paso)
     
-    try:
-        catalogo_service.cargar_catalogo()
-        logger.info("=" * 60)
-        logger.info("CATÁLOGO CARGADO EXITOSAMENTE")
-        logger.info("=" * 60)
-    except Exception as e:
-        logger.error("=" * 60)
-        logger.error(f"ERROR CRÍTICO AL CARGAR CATÁLOGO: {e}")
-        logger.error("El servidor continuará pero el catálogo no estará disponible")
-        logger.error("=" * 60)
+    # El catálogo (JSON, no SOAP) se carga ya: la cola de guías lo necesita.
+    # Si falla el servidor continúa y se reintenta en segundo plano.
+    calentamiento.iniciar(antes=("catalogo",))
+    
+    # Recarga en caliente si el JSON cambia en disco (opcional)
+    catalogo_service.iniciar_vigilancia()
+    
+    # Copia local de las órdenes de Shopify (ya y cada ORDENES_SYNC_SEGUNDOS)
+    repositorio_ordenes.iniciar_sincronizacion()
+    
+    # Pre-generación de guías de las órdenes pagadas (webhook)
+    cola_guias.iniciar(_procesar_guia)
+    
+    # Con varios workers, /metrics suma los valores de todos
+    if config.METRICAS_MULTIPROCESO_DIR:
+        registro.configurar_multiproceso(
+            config.METRICAS_MULTIPROCESO_DIR,
+            config.METRICAS_VOLCADO_SEGUNDOS
+        )
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Detiene los hilos de fondo."""
+    calentamiento.detener()
+    catalogo_service.detener_vigilancia()
+    repositorio_ordenes.detener_sincronizacion()
+    cola_guias.detener()
+    ejecutor_soap.cerrar()
+    registro_ordenes.cerrar()
+    registro.detener_multiproceso()
+
+
+def _verificar_admin(secret: Optional[str]) -> None:
+    """Valida el header X-Admin-Secret contra Config.ADMIN_SECRET."""
+    if not config.ADMIN_SECRET:
+        raise HTTPException(status_code=403, detail="Endpoints de administración deshabilitados")
+    if not secret or not hmac.compare_digest(secret, config.ADMIN_SECRET):
+        raise HTTPException(status_code=403, detail="Credenciales de administración inválidas")
 
 
 # ============================================================================
 # MODELOS PYDANTIC PARA EL ENDPOINT DE CATÁLOGO
 # ============================================================================
 class CatalogoRequest(BaseModel):
-    tipo: str  # "provincias", "cantones", "distritos"
+    tipo: str  # "provincias", "cantones", "distritos", "barrios"
     provincia_codigo: Optional[str] = None
     canton_codigo: Optional[str] = None
+    distrito_codigo: Optional[str] = None
+
+
+def _respuesta_catalogo(
+    data,
+    tipo: str,
+    if_none_match: Optional[str],
+    sha256_archivo: Optional[str] = None
+) -> Response:
+    """
+    Arma la respuesta del catálogo con la versión y el ETag vigentes, o 304
+    si el cliente ya tiene ese ETag (If-None-Match).
+    Los datos salen del índice propio: se serializan sin pasar por jsonable_encoder.
+    Con `sha256_archivo` (barrios) el ETag cubre también ese archivo.
+    """
+    _consultas_catalogo.inc(tipo=tipo)
+    indice = catalogo_service.indice
+    etag = indice.etag
+    if sha256_archivo:
+        etag = f'{etag[:-1]}-{sha256_archivo[:16]}"'
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    return RespuestaJSONRapida(
+        {
+            "success": True,
+            "data": data,
+            "fuente": "CACHE",
+            "version": indice.version
+        },
+        headers={"ETag": etag}
+    )
+
+
+async def _buscar_barrios(provincia_codigo: str, canton_codigo: str, distrito_codigo: str):
+    """Barrios del distrito (lectura de disco en un hilo); 404 si no existe."""
+    barrios = await asyncio.to_thread(
+        catalogo_service.buscar_barrios, provincia_codigo, canton_codigo, distrito_codigo
+    )
+    if barrios is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Distrito no encontrado: {provincia_codigo}-{canton_codigo}-{distrito_codigo}"
+        )
+    return barrios
 
 
 # ============================================================================
@@ -93,37 +224,80 @@ async def root():
 
 @app.get("/health")
 async def health():
-    """Endpoint de salud detallado"""
+    """
+    Endpoint de salud detallado: el proceso responde (siempre 200) y el
+    estado y la duración de cada paso del calentamiento.
+    """
+    arranque = calentamiento.estado()
     return {
-        "status": "healthy",
-        "service": "Integración Correos de Costa Rica"
+        "status": "healthy" if arranque["listo"] else "starting",
+        "service": "Integración Correos de Costa Rica",
+        "segundos_hasta_listo": arranque["segundos_hasta_listo"],
+        "componentes": arranque["componentes"],
+        "ejecutor_soap": ejecutor_soap.estado(),
+        "planificador_soap": planificador.estado()
     }
 
 
+@app.get("/ready")
+async def ready():
+    """
+    Readiness para el balanceador: 200 solo cuando el worker terminó el
+    calentamiento (catálogo y, con ARRANQUE_ESPERAR_CORREOS, cliente SOAP,
+    token y conexiones); 503 mientras tanto.
+    """
+    arranque = calentamiento.estado()
+    return JSONResponse(
+        status_code=200 if arranque["listo"] else 503,
+        content={"ready": arranque["listo"], "componentes": arranque["componentes"]}
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Métricas en formato de texto de Prometheus: HTTP por ruta, llamadas SOAP
+    por operación y CodRespuesta, renovaciones de token, consultas al
+    catálogo, tamaño de PDFs, ejecutor, carriles y rate limit.
+    Con METRICAS_MULTIPROCESO_DIR suma los valores de todos los workers.
+    """
+    return PlainTextResponse(
+        await asyncio.to_thread(registro.render),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.post("/catalogo_geografico")
-async def catalogo_geografico(request: CatalogoRequest):
+async def catalogo_geografico(
+    request: CatalogoRequest,
+    if_none_match: Optional[str] = Header(None)
+):
     """
     Endpoint para consultar el catálogo geográfico.
     Lee SOLO del cache en memoria, NUNCA llama al SOAP.
     
     Parámetros:
-    - tipo: "provincias", "cantones", "distritos"
-    - provincia_codigo: requerido para cantones y distritos
-    - canton_codigo: requerido para distritos
+    - tipo: "provincias", "cantones", "distritos", "barrios"
+    - provincia_codigo: requerido para cantones, distritos y barrios
+    - canton_codigo: requerido para distritos y barrios
+    - distrito_codigo: requerido para barrios
     
     Returns:
     {
         "success": true,
         "data": [...],
-        "fuente": "CACHE"
+        "fuente": "CACHE",
+        "version": 1
     }
+    
+    El header ETag cambia cada vez que se publica un catálogo distinto; con
+    If-None-Match igual al vigente se responde 304 sin cuerpo.
     """
+    sha256_archivo = None
     try:
-        logger.info(f"📦 Consulta catálogo: tipo={request.tipo}, prov={request.provincia_codigo}, cant={request.canton_codigo}")
-        
         if request.tipo == "provincias":
             data = catalogo_service.get_provincias()
-            logger.info(f"✅ Devolviendo {len(data)} provincias desde CACHE")
+            logger.debug("✅ Devolviendo %d provincias desde CACHE", len(data))
             
         elif request.tipo == "cantones":
             if not request.provincia_codigo:
@@ -132,7 +306,7 @@ async def catalogo_geografico(request: CatalogoRequest):
                     detail="provincia_codigo es requerido para tipo=cantones"
                 )
             data = catalogo_service.get_cantones(request.provincia_codigo)
-            logger.info(f"✅ Devolviendo {len(data)} cantones (prov={request.provincia_codigo}) desde CACHE")
+            logger.debug("✅ Devolviendo %d cantones (prov=%s) desde CACHE", len(data), request.provincia_codigo)
             
         elif request.tipo == "distritos":
             if not request.provincia_codigo or not request.canton_codigo:
@@ -144,24 +318,40 @@ async def catalogo_geografico(request: CatalogoRequest):
                 request.provincia_codigo,
                 request.canton_codigo
             )
-            logger.info(f"✅ Devolviendo {len(data)} distritos (prov={request.provincia_codigo}, cant={request.canton_codigo}) desde CACHE")
+            logger.debug(
+                "✅ Devolviendo %d distritos (prov=%s, cant=%s) desde CACHE",
+                len(data), request.provincia_codigo, request.canton_codigo
+            )
+            
+        elif request.tipo == "barrios":
+            if not request.provincia_codigo or not request.canton_codigo or not request.distrito_codigo:
+                raise HTTPException(
+                    status_code=400,
+                    detail="provincia_codigo, canton_codigo y distrito_codigo son requeridos para tipo=barrios"
+                )
+            barrios = await _buscar_barrios(
+                request.provincia_codigo,
+                request.canton_codigo,
+                request.distrito_codigo
+            )
+            data, sha256_archivo = barrios.datos, barrios.sha256
+            logger.debug(
+                "✅ Devolviendo %d barrios (prov=%s, cant=%s, dist=%s)",
+                len(data), request.provincia_codigo, request.canton_codigo, request.distrito_codigo
+            )
             
         else:
             raise HTTPException(
                 status_code=400,
-                detail=f"Tipo inválido: {request.tipo}. Debe ser: provincias, cantones, distritos"
+                detail=f"Tipo inválido: {request.tipo}. Debe ser: provincias, cantones, distritos, barrios"
             )
         
-        return {
-            "success": True,
-            "data": data,
-            "fuente": "CACHE"
-        }
+        return _respuesta_catalogo(data, request.tipo, if_none_match, sha256_archivo)
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Error en catalogo_geografico: {e}", exc_info=True)
+        logger.error("❌ Error en catalogo_geografico: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail={
@@ -172,63 +362,377 @@ async def catalogo_geografico(request: CatalogoRequest):
         )
 
 
+@app.get("/catalogo_geografico/barrios/{provincia_codigo}/{canton_codigo}/{distrito_codigo}")
+async def catalogo_barrios(
+    provincia_codigo: str,
+    canton_codigo: str,
+    distrito_codigo: str,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Barrios de un distrito (equivalente a tipo="barrios" en POST /catalogo_geografico).
+    Los barrios se cargan de disco en la primera consulta de cada distrito
+    (y cuando cambia su archivo); 404 si el distrito no está en el catálogo.
+    """
+    try:
+        barrios = await _buscar_barrios(
+            provincia_codigo,
+            canton_codigo,
+            distrito_codigo
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("❌ Error en catalogo_barrios: %s", e, exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "error": str(e),
+                "fuente": "CACHE"
+            }
+        )
+    
+    return _respuesta_catalogo(barrios.datos, "barrios", if_none_match, barrios.sha256)
+
+
+@app.post("/admin/catalogo/recargar")
+async def recargar_catalogo(
+    forzar: bool = False,
+    x_admin_secret: Optional[str] = Header(None)
+):
+    """
+    Recarga el catálogo geográfico desde disco sin reiniciar el worker.
+    
+    El parseo y la validación corren en un hilo aparte; el índice vigente
+    solo se reemplaza si el archivo nuevo es válido.
+    Requiere el header X-Admin-Secret.
+    
+    Solo recarga el worker que atiende la request. Los demás se enteran por
+    su watcher (CATALOGO_WATCH_INTERVAL_SECONDS > 0): si se publicó una
+    versión nueva, el archivo se toca para que lo relean. `alcance` indica
+    si el resto de los workers la va a tomar.
+    """
+    _verificar_admin(x_admin_secret)
+    
+    try:
+        resultado = await asyncio.to_thread(catalogo_service.recargar_catalogo, forzar)
+    except CatalogoInvalidoError as e:
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "success": False,
+                "errores": e.errores,
+                "version_vigente": catalogo_service.version
+            }
+        )
+    except Exception as e:
+        logger.error("❌ Error recargando catálogo: %s", e, exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "error": str(e),
+                "version_vigente": catalogo_service.version
+            }
+        )
+    
+    vigilancia = config.CATALOGO_WATCH_INTERVAL_SECONDS > 0
+    if resultado["recargado"] and vigilancia:
+        await asyncio.to_thread(catalogo_service.notificar_workers)
+    
+    return {
+        "success": True,
+        "catalogo": resultado,
+        "alcance": "todos los workers" if vigilancia else "este worker"
+    }
+
+
+def _url_pdf(numero_envio: str) -> str:
+    return f"/guias/{numero_envio}/pdf"
+
+
+def _liberar_orden(orden_id, anterior) -> None:
+    """Devuelve una orden reclamada a su estado anterior (la guía no salió)."""
+    if anterior is None:
+        registro_ordenes.borrar(orden_id)
+    else:
+        registro_ordenes.guardar(anterior)
+
+
+def _procesar_guia(
+    solicitud: SolicitudGuia,
+    incluir_base64: bool = False,
+    regenerar: bool = True,
+    incierta: bool = False
+) -> RespuestaGuia:
+    """
+    Pipeline bloqueante de generación de guía (corre en un hilo del ejecutor).
+    
+    El PDF queda en el almacén local y la respuesta lleva su URL; en base64
+    solo si se pide (o si no se pudo guardar, para no perder la etiqueta).
+    
+    Con `orden_id`, antes de llamar a Correos la orden se reclama de forma
+    atómica en el registro de órdenes procesadas (GET /correos/status):
+    PROCESSING mientras se genera, GUIDE_CREATED al terminar, y su estado
+    anterior si falla antes de registrar el envío. Si ccrRegistroEnvio queda
+    sin respuesta (timeout, plazo, conexión) la orden pasa a UNCERTAIN con el
+    número de envío y no se vuelve a reclamar sin `incierta`; un rechazo de
+    Correos sí la libera. Sin `regenerar` tampoco se reclama una orden que ya
+    tiene guía.
+    
+    Raises:
+        EnvioInvalidoError: Si la solicitud no pasa la validación local
+            (antes de pedir un número de guía)
+        OrdenOcupadaError: Si la orden ya se está generando (o ya tiene guía
+            y no se pidió regenerar, o quedó UNCERTAIN)
+        RegistroInciertoError: Si ccrRegistroEnvio quedó sin respuesta con el
+            número de guía ya consumido (el envío pudo quedar registrado)
+    """
+    verificar_solicitud(solicitud)
+    
+    anterior = None
+    if solicitud.orden_id:
+        anterior = registro_ordenes.reclamar(
+            solicitud.orden_id, config.PLAZO_REQUEST_MAXIMO_SEGUNDOS,
+            regenerar=regenerar, incierta=incierta
+        )
+    
+    try:
+        # Paso 1: Generar número de guía
+        logger.debug("Paso 1: Generando número de guía...")
+        resultado_guia = guia_service.generar_numero_guia()
+        numero_envio = resultado_guia['numero_envio']
+    except BaseException:
+        if solicitud.orden_id:
+            _liberar_orden(solicitud.orden_id, anterior)
+        raise
+    
+    # Paso 2: Registrar envío con los datos completos
+    logger.debug("Paso 2: Registrando envío %s...", numero_envio)
+    try:
+        resultado_envio = envio_service.registrar_envio(
+            numero_guia=numero_envio,
+            solicitud=solicitud
+        )
+    except (PlazoVencidoError, ConexionSoapError) as e:
+        # Sin respuesta: el envío pudo quedar registrado, la orden no se libera
+        if solicitud.orden_id:
+            registro_ordenes.registrar(solicitud.orden_id, ESTADO_INCIERTO, numero_envio=numero_envio)
+        raise RegistroInciertoError(numero_envio, e) from e
+    except BaseException:
+        # Correos rechazó el envío (o falló antes de enviarlo)
+        if solicitud.orden_id:
+            _liberar_orden(solicitud.orden_id, anterior)
+        raise
+    
+    if solicitud.orden_id:
+        tarifa = resultado_envio.get('tarifa')
+        registro_ordenes.registrar(
+            solicitud.orden_id,
+            ESTADO_GUIA_CREADA,
+            numero_envio=numero_envio,
+            tarifa=tarifa['monto_total'] if tarifa else None,
+            pdf_sha256=resultado_envio['pdf_sha256']
+        )
+    
+    pdf = resultado_envio['pdf']
+    guardado = resultado_envio['pdf_sha256'] is not None
+    pdf_base64 = None
+    if pdf is not None and (incluir_base64 or not guardado):
+        pdf_base64 = base64.b64encode(pdf).decode("ascii")
+    
+    # Construir respuesta exitosa (datos propios: sin re-validar el PDF)
+    respuesta = RespuestaGuia.model_construct(
+        exito=True,
+        numero_envio=numero_envio,
+        codigo_respuesta=resultado_envio['codigo_respuesta'],
+        mensaje_respuesta=resultado_envio['mensaje_respuesta'],
+        pdf_base64=pdf_base64,
+        pdf_url=_url_pdf(numero_envio) if guardado else None,
+        error=None
+    )
+    
+    logger.info("Guía generada exitosamente: %s", numero_envio)
+    
+    return respuesta
+
+
 @app.post("/generar_guia", response_model=RespuestaGuia)
-async def generar_guia(solicitud: SolicitudGuia) -> RespuestaGuia:
+async def generar_guia(
+    solicitud: SolicitudGuia,
+    x_prioridad: Optional[str] = Header(None),
+    x_plazo_ms: Optional[int] = Header(None),
+    pdf_base64: Optional[bool] = None
+) -> RespuestaJSONRapida:
     """
     Genera una guía de envío completa.
     
     Este endpoint:
     1. Genera el número de guía (CCRGENERARGUIA)
     2. Registra el envío (CCRREGISTROENVIO)
-    3. Retorna el PDF de la guía en Base64
+    3. Guarda el PDF en el almacén local y retorna su URL
+       (GET /guias/{numero}/pdf); con ?pdf_base64=true (o
+       PDF_INLINE_BASE64) también el PDF en Base64
+    
+    Las llamadas a Correos de esta request van por el carril indicado en
+    X-Prioridad (interactivo por defecto; los jobs masivos envían "masivo").
+    
+    Toda la request (cola, token, llamadas SOAP) tiene un plazo total de
+    PLAZO_REQUEST_SEGUNDOS, o el que pida el cliente en X-Plazo-Ms (con tope
+    PLAZO_REQUEST_MAXIMO_SEGUNDOS). Vencido el plazo se abandona el trabajo
+    y se responde 504.
     
     Args:
         solicitud: Datos del envío (remitente, destinatario, peso, etc.)
+        x_prioridad: Carril de prioridad (interactivo, masivo, fondo)
+        x_plazo_ms: Plazo total pedido por el cliente, en milisegundos
+        pdf_base64: Incluir el PDF en Base64 (por defecto PDF_INLINE_BASE64)
         
     Returns:
-        RespuestaGuia con el número de envío y PDF en Base64
+        RespuestaGuia con el número de envío y la URL del PDF. Se devuelve
+        como RespuestaJSONRapida: el PDF se serializa una sola vez, sin
+        validación de response_model ni jsonable_encoder.
         
     Raises:
         HTTPException: Si hay error en el proceso
+        EjecutorSaturadoError: Si el ejecutor SOAP está lleno (503 + Retry-After)
+        LimiteExcedidoError: Si se agotó la cuota hacia Correos (503 + Retry-After)
+        PlazoVencidoError: Si se agotó el plazo de la request (504)
+    """
+    carril = _carril(x_prioridad)
+    segundos = _plazo_segundos(x_plazo_ms)
+    return RespuestaJSONRapida(await _ejecutar_guia(solicitud, carril, segundos, pdf_base64))
+
+
+def _carril(x_prioridad: Optional[str]) -> str:
+    carril = (x_prioridad or CARRIL_INTERACTIVO).strip().lower()
+    if carril not in CARRILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"X-Prioridad inválida. Debe ser: {', '.join(CARRILES)}"
+        )
+    return carril
+
+
+def _plazo_segundos(x_plazo_ms: Optional[int]) -> float:
+    segundos = config.PLAZO_REQUEST_SEGUNDOS
+    if x_plazo_ms is not None:
+        if x_plazo_ms <= 0:
+            raise HTTPException(status_code=400, detail="X-Plazo-Ms debe ser mayor a 0")
+        segundos = min(x_plazo_ms / 1000.0, config.PLAZO_REQUEST_MAXIMO_SEGUNDOS)
+    return segundos
+
+
+def _conflicto_orden(fila) -> HTTPException:
+    """409 para una orden que ya tiene guía (o una incierta) o se está generando."""
+    return HTTPException(
+        status_code=409,
+        detail={
+            "exito": False,
+            "error": describir_ocupada(fila),
+            "status": fila.estado,
+            "numero_envio": fila.numero_envio
+        }
+    )
+
+
+def _resultado_incierto(solicitud: SolicitudGuia, numero_envio: Optional[str]) -> HTTPException:
+    """
+    504 cuando venció el plazo pero la guía pudo crearse igual: el hilo del
+    ejecutor sigue con la llamada en curso, o Correos pudo haber registrado
+    el envío antes del timeout.
+    """
+    if numero_envio:
+        consulta = f"El envío {numero_envio} pudo quedar registrado en Correos; verifíquelo antes de reintentar"
+    elif solicitud.orden_id:
+        consulta = (
+            f"La guía puede terminar de generarse; consulte GET /correos/status/{solicitud.orden_id} "
+            "antes de reintentar"
+        )
+    else:
+        consulta = "La guía puede terminar de generarse; verifíquelo en Correos antes de reintentar"
+    return HTTPException(
+        status_code=504,
+        detail={
+            "exito": False,
+            "error": "No se pudo completar dentro del plazo (generar guía)",
+            "resultado": "desconocido",
+            "consulta": consulta,
+            "numero_envio": numero_envio,
+            "pdf_base64": None
+        }
+    )
+
+
+async def _ejecutar_guia(
+    solicitud: SolicitudGuia,
+    carril: str,
+    segundos: float,
+    pdf_base64: Optional[bool],
+    regenerar: bool = True,
+    incierta: bool = False
+) -> RespuestaGuia:
+    """
+    Corre _procesar_guia en el ejecutor SOAP con carril y plazo, y traduce
+    los errores a HTTPException (los de capacidad y plazo pasan tal cual).
+    
+    Si vence el plazo con la guía ya en camino (el hilo sigue, o el registro
+    ya se había enviado) el 504 lo dice en `resultado: "desconocido"`, con el
+    número de envío si se conoce.
     """
     try:
-        logger.info("Iniciando proceso de generación de guía")
-        
-        # Paso 1: Generar número de guía
-        logger.info("Paso 1: Generando número de guía...")
-        resultado_guia = guia_service.generar_numero_guia()
-        numero_envio = resultado_guia['numero_envio']
-        
-        logger.info(f"Número de guía generado: {numero_envio}")
+        # El pipeline SOAP es bloqueante: corre en el ejecutor acotado.
+        # El carril y el plazo viajan en el contexto hasta SoapClient.
+        with usar_carril(carril), usar_plazo(segundos):
+            try:
+                return await asyncio.wait_for(
+                    ejecutor_soap.ejecutar(
+                        _procesar_guia,
+                        solicitud,
+                        config.PDF_INLINE_BASE64 if pdf_base64 is None else pdf_base64,
+                        regenerar,
+                        incierta
+                    ),
+                    timeout=segundos
+                )
+            except asyncio.TimeoutError:
+                # El hilo abandona el trabajo en la siguiente etapa, pero la
+                # llamada en curso puede terminar creando la guía
+                raise _resultado_incierto(solicitud, None)
         
-        # Paso 2: Registrar envío con los datos completos
-        logger.info("Paso 2: Registrando envío...")
-        resultado_envio = envio_service.registrar_envio(
-            numero_guia=numero_envio,
-            solicitud=solicitud
+    except (EjecutorSaturadoError, LimiteExcedidoError, PlazoVencidoError, HTTPException):
+        raise
+    except OrdenOcupadaError as e:
+        raise _conflicto_orden(e.fila)
+    except RegistroInciertoError as e:
+        if isinstance(e.causa, PlazoVencidoError):
+            raise _resultado_incierto(solicitud, e.numero_envio)
+        logger.error("Error al registrar la guía %s: %s", e.numero_envio, e.causa, exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "exito": False,
+                "error": str(e.causa),
+                "resultado": "desconocido",
+                "numero_envio": e.numero_envio,
+                "pdf_base64": None
+            }
         )
-        
-        # Construir respuesta exitosa
-        respuesta = RespuestaGuia(
-            exito=True,
-            numero_envio=numero_envio,
-            codigo_respuesta=resultado_envio['codigo_respuesta'],
-            mensaje_respuesta=resultado_envio['mensaje_respuesta'],
-            pdf_base64=resultado_envio['pdf_base64']
+    except EnvioInvalidoError as e:
+        # No se llamó a Correos: no hay número de guía consumido
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "exito": False,
+                "error": str(e),
+                "errores": e.errores,
+                "numero_envio": None,
+                "pdf_base64": None
+            }
         )
-        
-        logger.info(f"Guía generada exitosamente: {numero_envio}")
-        
-        return respuesta
-        
     except Exception as e:
-        logger.error(f"Error al generar guía: {e}", exc_info=True)
-        
-        # Construir respuesta de error
-        respuesta = RespuestaGuia(
-            exito=False,
-            error=str(e)
-        )
+        logger.error("Error al generar guía: %s", e, exc_info=True)
         
         # Retornar con código 500 si es error del servidor
         # o 400 si es error de validación
@@ -247,10 +751,165 @@ async def generar_guia(solicitud: SolicitudGuia) -> RespuestaGuia:
         )
 
 
+@app.api_route("/guias/{numero_envio}/pdf", methods=["GET", "HEAD"])
+async def descargar_pdf_guia(numero_envio: str, request: Request):
+    """
+    PDF de la guía guardado al generarla, en binario.
+    
+    Soporta `If-None-Match` (ETag = SHA-256 del PDF, 304) y `Range` (206),
+    para reanudar descargas y para visores que piden por partes.
+    """
+    objeto = await asyncio.to_thread(almacen_pdf.buscar, numero_envio)
+    if objeto is None:
+        raise HTTPException(status_code=404, detail="No hay PDF guardado para esa guía")
+    
+    return respuesta_archivo(
+        request,
+        objeto.ruta,
+        etag=f'"{objeto.sha256}"',
+        media_type="application/pdf",
+        nombre=f"{numero_envio}.pdf",
+        # Un número de envío no cambia de PDF
+        cache_control="private, max-age=31536000, immutable"
+    )
+
+
+def _renderizar_etiqueta(numero_envio: str, formato: str):
+    datos = almacen_pdf.datos(numero_envio)
+    if datos is None:
+        return None
+    return etiquetas.renderizar(DatosEtiqueta.model_validate_json(datos), formato)
+
+
+@app.get("/guias/{numero_envio}/etiqueta")
+async def etiqueta_guia(numero_envio: str, formato: str = "zpl"):
+    """
+    Etiqueta renderizada localmente para impresoras térmicas, con los mismos
+    datos enviados a Correos en ccrRegistroEnvio.
+    
+    - formato=zpl: ZPL II 4x6" a 203 dpi (Zebra y compatibles)
+    - formato=pdf: PDF vectorial mínimo de 4x6" (1-2 KB)
+    
+    La etiqueta oficial sigue disponible en GET /guias/{numero}/pdf.
+    """
+    if formato not in etiquetas.FORMATOS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato inválido: {formato}. Debe ser: {', '.join(etiquetas.FORMATOS)}"
+        )
+    
+    resultado = await asyncio.to_thread(_renderizar_etiqueta, numero_envio, formato)
+    if resultado is None:
+        raise HTTPException(status_code=404, detail="No hay datos de etiqueta para esa guía")
+    
+    contenido, media_type = resultado
+    return Response(
+        content=contenido,
+        media_type=media_type,
+        headers={"Content-Disposition": f'inline; filename="{numero_envio}.{formato}"'}
+    )
+
+
+@app.post("/guias/lote/pdf")
+async def pdf_lote_guias(solicitud: SolicitudLotePDF, request: Request):
+    """
+    Un solo PDF para imprimir varias guías: una etiqueta por página
+    (por_hoja=1) o varias por hoja A4/carta (2, 4, 6 u 8).
+    
+    Se arma copiando las páginas guardadas (sin re-renderizar) y queda
+    cacheado por conjunto de guías: pedir el mismo lote otra vez lo sirve
+    de disco (header X-Cache: HIT). Acepta Range e If-None-Match como
+    GET /guias/{numero}/pdf.
+    """
+    if len(solicitud.numeros) > config.PDF_LOTE_MAXIMO:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo {config.PDF_LOTE_MAXIMO} guías por lote"
+        )
+    
+    try:
+        resultado = await asyncio.to_thread(
+            generador_lotes.generar,
+            solicitud.numeros,
+            solicitud.por_hoja,
+            solicitud.hoja
+        )
+    except GuiasSinPDFError as e:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "Hay guías sin PDF guardado",
+                "numeros": e.numeros
+            }
+        )
+    except GuiasMultipaginaError as e:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Hay guías de más de una página: use por_hoja=1",
+                "numeros": e.numeros
+            }
+        )
+    
+    respuesta = respuesta_archivo(
+        request,
+        resultado.ruta,
+        etag=f'"{resultado.clave}"',
+        media_type="application/pdf",
+        nombre=f"guias-{resultado.clave[:12]}.pdf"
+    )
+    respuesta.headers["X-Cache"] = "HIT" if resultado.desde_cache else "MISS"
+    respuesta.headers["X-Paginas"] = str(resultado.paginas)
+    return respuesta
+
+
+@app.exception_handler(EjecutorSaturadoError)
+async def ejecutor_saturado_handler(request, exc: EjecutorSaturadoError):
+    """Backpressure: rechazo rápido cuando el ejecutor SOAP está lleno."""
+    logger.warning("Ejecutor SOAP saturado, rechazando %s", request.url.path)
+    return JSONResponse(
+        status_code=503,
+        content={
+            "exito": False,
+            "error": "Servicio saturado, intente nuevamente",
+            "retry_after": exc.retry_after
+        },
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.exception_handler(PlazoVencidoError)
+async def plazo_vencido_handler(request, exc: PlazoVencidoError):
+    """La request no pudo terminar dentro de su plazo."""
+    logger.warning("Plazo agotado en %s: %s", request.url.path, exc.etapa)
+    return JSONResponse(
+        status_code=504,
+        content={
+            "exito": False,
+            "error": f"No se pudo completar dentro del plazo ({exc.etapa})"
+        }
+    )
+
+
+@app.exception_handler(LimiteExcedidoError)
+async def limite_excedido_handler(request, exc: LimiteExcedidoError):
+    """Cuota hacia Correos agotada: se rechaza en vez de hacernos bloquear upstream."""
+    logger.warning("Rate limit hacia Correos (%s), rechazando %s", exc.operacion, request.url.path)
+    return JSONResponse(
+        status_code=503,
+        content={
+            "exito": False,
+            "error": "Límite de llamadas a Correos alcanzado, intente nuevamente",
+            "retry_after": exc.retry_after
+        },
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """Manejador global de excepciones"""
-    logger.error(f"Excepción no manejada: {exc}", exc_info=True)
+    logger.error("Excepción no manejada: %s", exc, exc_info=True)
     return JSONResponse(
         status_code=500,
         content={
@@ -262,98 +921,270 @@ async def global_exception_handler(request, exc):
 
 
 # ============================================================================
-# ENDPOINTS MOCK PARA ÓRDENES DE SHOPIFY (PARA DESARROLLO/PRUEBAS)
+# ÓRDENES DE SHOPIFY
 # ============================================================================
 
-MOCK_ORDERS = [
-    {
-        "id": 1024,
-        "name": "#1024",
-        "created_at": "2026-01-20T10:30:00Z",
-        "financial_status": "paid",
-        "customer": {
-            "first_name": "Juan",
-            "last_name": "Pérez",
-            "email": "juan.perez@example.com",
-            "phone": "8888-8888"
-        },
-        "shipping_address": {
-            "address1": "Del Pali 200 metros sur",
-            "city": "Cartago",
-            "province": "Cartago",
-            "zip": "30101",
-            "phone": "8888-8888",
-            "country": "CR"
-        }
-    },
-    {
-        "id": 1025,
-        "name": "#1025",
-        "created_at": "2026-01-21T14:15:00Z",
-        "financial_status": "paid",
-        "customer": {
-            "first_name": "María",
-            "last_name": "González",
-            "email": "maria.gonzalez@example.com",
-            "phone": "7777-7777"
-        },
-        "shipping_address": {
-            "address1": "Avenida Central, casa 123",
-            "city": "San José",
-            "province": "San José",
-            "zip": "10101",
-            "phone": "7777-7777",
-            "country": "CR"
-        }
+@app.get("/ordenes")
+async def get_ordenes(
+    limite: int = 50,
+    cursor: Optional[str] = None,
+    financial_status: Optional[str] = None,
+    sin_guia: bool = False
+) -> RespuestaJSONRapida:
+    """
+    Órdenes de Shopify (copia local sincronizada), de la más nueva a la más
+    vieja, con su estado en Correos (`correos_status`, `correos_tracking`).
+    
+    Paginado por cursor: pasar `siguiente_cursor` de la respuesta anterior.
+    
+    Args:
+        limite: Órdenes por página (máximo 250)
+        cursor: Cursor de la página siguiente
+        financial_status: Solo órdenes con ese estado de pago (p.ej. paid)
+        sin_guia: Solo órdenes sin guía creada
+    """
+    try:
+        ordenes, siguiente = await asyncio.to_thread(
+            repositorio_ordenes.listar, limite, cursor, financial_status, sin_guia
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    
+    return RespuestaJSONRapida({
+        "success": True,
+        "orders": ordenes,
+        "siguiente_cursor": siguiente
+    })
+
+
+@app.get("/ordenes/{order_id}")
+async def get_orden(order_id: str) -> RespuestaJSONRapida:
+    """
+    Una orden por id (1024, TM-1024, GID de Shopify) o por nombre (#1024).
+    """
+    orden = await asyncio.to_thread(repositorio_ordenes.buscar, order_id)
+    if orden is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    return RespuestaJSONRapida({
+        "success": True,
+        "order": orden
+    })
+
+
+@app.post("/ordenes/{order_id}/guia", response_model=RespuestaGuia)
+async def generar_guia_orden(
+    order_id: str,
+    ajustes: Optional[AjustesGuiaOrden] = None,
+    regenerar: bool = False,
+    incierta: bool = False,
+    x_prioridad: Optional[str] = Header(None),
+    x_plazo_ms: Optional[int] = Header(None),
+    pdf_base64: Optional[bool] = None
+) -> RespuestaJSONRapida:
+    """
+    Genera la guía de una orden en una sola request.
+    
+    Carga la orden, resuelve el código postal de destino en el catálogo,
+    completa el remitente desde la configuración y corre el mismo pipeline
+    que /generar_guia (carril, plazo, PDF en el almacén). La orden queda
+    registrada para /correos/status.
+    
+    Args:
+        order_id: Id, TM-<id>, GID o #nombre de la orden
+        ajustes: Correcciones opcionales (código postal, señas, teléfono, peso)
+        regenerar: Generar otra guía aunque la orden ya tenga una
+        incierta: Generar otra guía para una orden UNCERTAIN, ya verificado
+            en Correos que su envío no quedó registrado
+        x_prioridad: Carril de prioridad (los jobs masivos envían "masivo")
+        x_plazo_ms: Plazo total pedido por el cliente, en milisegundos
+        pdf_base64: Incluir el PDF en Base64 (por defecto PDF_INLINE_BASE64)
+    
+    Raises:
+        HTTPException: 404 si la orden no existe, 409 si ya tiene guía (o se
+            está generando, o su registro quedó incierto), 422 con todos los
+            datos faltantes de la orden
+    """
+    carril = _carril(x_prioridad)
+    segundos = _plazo_segundos(x_plazo_ms)
+    
+    orden = await asyncio.to_thread(repositorio_ordenes.buscar, order_id)
+    if orden is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    # Atajo sin ocupar el ejecutor; el reclamo atómico lo hace _procesar_guia
+    procesada = await asyncio.to_thread(registro_ordenes.buscar, orden["id"])
+    if procesada is not None and procesada.estado == ESTADO_INCIERTO:
+        if not incierta:
+            raise _conflicto_orden(procesada)
+    elif not regenerar and guia_creada_o_en_curso(procesada, config.PLAZO_REQUEST_MAXIMO_SEGUNDOS):
+        raise _conflicto_orden(procesada)
+    
+    try:
+        solicitud = construir_solicitud(orden, ajustes)
+    except OrdenNoEnviableError as e:
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "exito": False,
+                "errores": e.errores
+            }
+        )
+    
+    return RespuestaJSONRapida(
+        await _ejecutar_guia(solicitud, carril, segundos, pdf_base64, regenerar=regenerar, incierta=incierta)
+    )
+
+
+@app.post("/admin/ordenes/sincronizar")
+async def sincronizar_ordenes(x_admin_secret: Optional[str] = Header(None)):
+    """
+    Sincroniza ya las órdenes desde la fuente (sin esperar ORDENES_SYNC_SEGUNDOS).
+    Requiere el header X-Admin-Secret.
+    """
+    _verificar_admin(x_admin_secret)
+    
+    sincronizadas = await asyncio.to_thread(repositorio_ordenes.sincronizar)
+    return {
+        "success": True,
+        "sincronizadas": sincronizadas
     }
-]
 
 
-@app.get("/ordenes")
-async def get_ordenes():
+@app.post("/webhooks/shopify/orders-paid")
+async def webhook_orden_pagada(
+    request: Request,
+    x_shopify_hmac_sha256: Optional[str] = Header(None),
+    x_shopify_webhook_id: Optional[str] = Header(None)
+):
     """
-    Endpoint mock para obtener órdenes de Shopify.
-    En producción, esto debería conectarse a la API real de Shopify.
+    Webhook orders/paid de Shopify.
+    
+    Verifica la firma HMAC-SHA256 del cuerpo con SHOPIFY_WEBHOOK_SECRET,
+    encola la orden en la cola durable de guías y responde enseguida: la guía
+    se genera en segundo plano (ver cola_guias.py). Un reintento de Shopify
+    con el mismo X-Shopify-Webhook-Id no se encola de nuevo.
     """
-    logger.info("📦 Obteniendo órdenes mock")
+    if not config.SHOPIFY_WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Webhook de Shopify deshabilitado")
+    
+    cuerpo = await request.body()
+    firma = base64.b64encode(
+        hmac.new(config.SHOPIFY_WEBHOOK_SECRET.encode("utf-8"), cuerpo, hashlib.sha256).digest()
+    ).decode("ascii")
+    if not x_shopify_hmac_sha256 or not hmac.compare_digest(firma, x_shopify_hmac_sha256):
+        raise HTTPException(status_code=401, detail="Firma HMAC inválida")
+    
+    try:
+        orden = json.loads(cuerpo)
+        int(orden["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Cuerpo del webhook inválido")
+    
+    encolada = await asyncio.to_thread(cola_guias.encolar, orden, x_shopify_webhook_id)
+    logger.info("📬 Webhook orders/paid de %s (%s)", orden.get("name"), "encolada" if encolada else "duplicada")
     return {
         "success": True,
-        "orders": MOCK_ORDERS
+        "encolada": encolada
     }
 
 
-@app.get("/ordenes/{order_id}")
-async def get_orden(order_id: str):
+@app.get("/admin/cola/guias")
+async def estado_cola_guias(x_admin_secret: Optional[str] = Header(None)):
     """
-    Endpoint mock para obtener una orden específica.
-    En producción, esto debería conectarse a la API real de Shopify.
+    Trabajos de la cola de pre-generación por estado.
+    Requiere el header X-Admin-Secret.
     """
-    logger.info(f"📦 Obteniendo orden mock: {order_id}")
+    _verificar_admin(x_admin_secret)
+    
+    return {
+        "success": True,
+        "estados": await asyncio.to_thread(cola_guias.resumen)
+    }
 
-    # Buscar por ID numérico o nombre
-    for order in MOCK_ORDERS:
-        if str(order["id"]) == order_id or order["name"] == f"#{order_id}":
-            return {
-                "success": True,
-                "order": order
-            }
 
-    # Si no se encuentra, retornar 404
-    raise HTTPException(status_code=404, detail="Order not found")
+@app.post("/cotizar")
+async def cotizar(solicitud: SolicitudCotizacion):
+    """
+    Tarifas de Correos para varios envíos (checkout de Shopify).
+    
+    Los ítems con el mismo destino y tramo de peso comparten una consulta;
+    las tarifas salen del cache (memoria / SQLite) y solo las que faltan se
+    piden a ccrTarifa, en paralelo. Cada ítem trae su tarifa o `error`; al
+    vencer COTIZAR_PLAZO_SEGUNDOS se responde con lo que haya.
+    """
+    if len(solicitud.items) > config.COTIZAR_MAXIMO_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Máximo {config.COTIZAR_MAXIMO_ITEMS} envíos por cotización"
+        )
+    
+    origen = solicitud.codigo_postal_origen or config.REMITENTE_CODIGO_POSTAL
+    with usar_plazo(config.COTIZAR_PLAZO_SEGUNDOS):
+        try:
+            cotizaciones = await cotizador.cotizar(
+                [(item.codigo_postal, item.peso) for item in solicitud.items],
+                origen
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    return RespuestaJSONRapida({
+        "success": True,
+        "origen": origen,
+        "cotizaciones": cotizaciones
+    })
+
+
+@app.post("/admin/tarifas/precalcular")
+async def precalcular_tarifas(
+    origen: Optional[str] = None,
+    x_admin_secret: Optional[str] = Header(None)
+):
+    """
+    Consulta en segundo plano las tarifas de todos los distritos y tramos
+    que no estén en cache, por el carril de fondo.
+    Requiere el header X-Admin-Secret.
+    """
+    _verificar_admin(x_admin_secret)
+    
+    try:
+        iniciado = cotizador.iniciar_precalculo(origen or config.REMITENTE_CODIGO_POSTAL)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "success": True,
+        "iniciado": iniciado
+    }
 
 
 @app.get("/correos/status/{order_key}")
 async def get_correos_status(order_key: str):
     """
-    Endpoint mock para obtener el estado de una orden en Correos.
-    En producción, esto debería consultar processed_orders.json o base de datos.
+    Estado de una orden en Correos, desde el registro de órdenes procesadas.
+    
+    Acepta TM-<id>, el id numérico o el GID de Shopify. La búsqueda es por
+    clave primaria, pero puede esperar el lock del escritor por lotes o el
+    busy_timeout de SQLite: corre en un hilo, fuera del event loop.
     """
-    logger.info(f"📦 Consultando estado de Correos para: {order_key}")
-
-    # Por ahora, retornar que no existe
+    logger.debug("📦 Consultando estado de Correos para: %s", order_key)
+    
+    orden = await asyncio.to_thread(registro_ordenes.buscar, order_key)
+    if orden is None:
+        return {
+            "exists": False,
+            "status": None,
+            "tracking_number": None,
+            "processed_at": None
+        }
+    
     return {
-        "exists": False,
-        "status": None,
-        "tracking_number": None,
-        "processed_at": None
+        "exists": True,
+        "status": orden.estado,
+        "tracking_number": orden.numero_envio,
+        "processed_at": datetime.fromtimestamp(orden.procesada_en, timezone.utc)
+            .isoformat(timespec="seconds").replace("+00:00", "Z"),
+        "tarifa": orden.tarifa,
+        "pdf_url": _url_pdf(orden.numero_envio) if orden.pdf_sha256 else None
     }
@@ -0,0 +1,71 @@
+"""
+Middleware ASGI que mide latencia y cantidad de requests HTTP por ruta.
+"""
+import time
+from typing import Dict
+
+from src.services.metricas import registro
+
+_duracion = registro.histograma(
+    "http_request_duracion_segundos", "Latencia de las requests HTTP", ["metodo", "ruta"]
+)
+_requests = registro.contador(
+    "http_requests_total", "Requests HTTP por ruta y código de estado", ["metodo", "ruta", "estado"]
+)
+_en_curso = registro.medidor(
+    "http_requests_en_curso", "Requests HTTP en curso"
+)
+
+# Requests que no matchean ninguna ruta (evita una serie por URL arbitraria)
+RUTA_DESCONOCIDA = "<sin_ruta>"
+
+
+class MetricasHTTP:
+    """
+    Middleware ASGI puro (sin BaseHTTPMiddleware, que agrega una tarea y
+    copias de body por request). La ruta se reporta como plantilla
+    ("/ordenes/{order_id}"), no como URL, para acotar la cardinalidad.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._rutas: Dict[object, str] = {}
+
+    def _ruta(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return RUTA_DESCONOCIDA
+        ruta = self._rutas.get(endpoint)
+        if ruta is None:
+            for route in getattr(scope.get("app"), "routes", ()):
+                if getattr(route, "endpoint", None) is endpoint:
+                    ruta = route.path
+                    break
+            else:
+                ruta = RUTA_DESCONOCIDA
+            self._rutas[endpoint] = ruta
+        return ruta
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        estado = 500
+
+        async def _send(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        _en_curso.inc()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _en_curso.dec()
+            metodo = scope["method"]
+            ruta = self._ruta(scope)
+            _duracion.observe(time.perf_counter() - inicio, metodo=metodo, ruta=ruta)
+            _requests.inc(metodo=metodo, ruta=ruta, estado=str(estado))
@@ -0,0 +1,68 @@
+"""
+Middleware ASGI que perfila requests individuales (ver services/perfilador.py).
+
+Se perfila una request a una de las rutas habilitadas si:
+- trae el header `X-Perfilar` junto con un `X-Admin-Secret` válido, o
+- sale sorteada según PERFIL_MUESTREO_TASA.
+
+La respuesta lleva el header `X-Perfil` con el nombre del perfil.
+Solo se instala si PERFIL_DIR está configurado.
+"""
+import asyncio
+import hmac
+import random
+from typing import Iterable
+
+from src.services.logs import request_id_actual
+from src.services.perfilador import Perfilador, nuevo_id_perfil
+
+_HEADER_PERFILAR = b"x-perfilar"
+_HEADER_SECRET = b"x-admin-secret"
+
+
+class PerfiladoRequests:
+    def __init__(self, app, perfilador: Perfilador, rutas: Iterable[str], tasa: float, admin_secret: str):
+        self.app = app
+        self.perfilador = perfilador
+        self.rutas = frozenset(rutas)
+        self.tasa = tasa
+        self.admin_secret = admin_secret
+
+    def _motivo(self, scope):
+        if self.admin_secret:
+            headers = dict(scope["headers"])
+            if _HEADER_PERFILAR in headers:
+                secret = headers.get(_HEADER_SECRET, b"").decode("latin-1")
+                if hmac.compare_digest(secret, self.admin_secret):
+                    return "admin"
+        if self.tasa > 0 and random.random() < self.tasa:
+            return "muestreo"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.rutas:
+            await self.app(scope, receive, send)
+            return
+        motivo = self._motivo(scope)
+        if motivo is None:
+            await self.app(scope, receive, send)
+            return
+
+        perfil = self.perfilador.iniciar(
+            nuevo_id_perfil(scope["path"], request_id_actual()), scope["path"], motivo
+        )
+
+        async def _send(mensaje):
+            if mensaje["type"] == "http.response.start":
+                mensaje["headers"] = list(mensaje.get("headers", [])) + [
+                    (b"x-perfil", perfil.id.encode("latin-1"))
+                ]
+            await send(mensaje)
+
+        try:
+            # El hilo del event loop también atiende otras requests: sus
+            # muestras pueden incluir trabajo ajeno (el del ejecutor SOAP no)
+            with self.perfilador.perfilar(perfil):
+                await self.app(scope, receive, _send)
+        finally:
+            await asyncio.to_thread(self.perfilador.finalizar, perfil)
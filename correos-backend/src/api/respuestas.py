@@ -0,0 +1,56 @@
+"""
+Respuesta JSON rápida para endpoints con payloads grandes o muy consultados.
+
+El camino por defecto de FastAPI para un endpoint que devuelve un modelo es:
+validar contra `response_model`, `jsonable_encoder` (copia recursiva a
+tipos básicos) y `json.dumps`. Para `/generar_guia` eso copia varias veces
+un `pdf_base64` de cientos de KB.
+
+`RespuestaJSONRapida` se devuelve directamente desde el endpoint, así
+FastAPI no valida ni re-codifica: el contenido (dict/list de tipos básicos o
+un modelo Pydantic construido por nosotros) se serializa una sola vez, con
+orjson si está instalado (`pip install orjson`) o con `json` de la stdlib.
+Solo para objetos armados por el propio backend; la entrada del cliente se
+sigue validando con los modelos de siempre.
+"""
+import json
+from typing import Any
+
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+_OPCIONES_ORJSON = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def _a_basico(contenido: Any) -> Any:
+    """Un modelo Pydantic de primer nivel se pasa a dict sin validar ni copiar valores."""
+    if isinstance(contenido, BaseModel):
+        return {campo: getattr(contenido, campo) for campo in type(contenido).model_fields}
+    return contenido
+
+
+def serializar_json(contenido: Any) -> bytes:
+    """Serializa a JSON compacto en UTF-8."""
+    contenido = _a_basico(contenido)
+    if orjson is not None:
+        return orjson.dumps(contenido, option=_OPCIONES_ORJSON)
+    # ensure_ascii=True: el encoder en C es bastante más rápido para el
+    # base64 del PDF (ASCII puro) que la variante que conserva no-ASCII
+    return json.dumps(
+        contenido,
+        ensure_ascii=True,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("ascii")
+
+
+class RespuestaJSONRapida(JSONResponse):
+    """JSONResponse sin validación ni jsonable_encoder, serializada con orjson si existe."""
+
+    def render(self, content: Any) -> bytes:
+        return serializar_json(content)
@@ -3,13 +3,24 @@ Configuración de la aplicación.
 Carga variables de entorno y define constantes.
 """
 import os
+import tempfile
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Dict, List, Optional
 
 # Cargar variables de entorno
 load_dotenv()
 
 
+def _parse_mapa(valor: str) -> Dict[str, float]:
+    """Convierte "a=1,b=2.5" en {"a": 1.0, "b": 2.5}."""
+    resultado = {}
+    for parte in valor.split(","):
+        if "=" in parte:
+            clave, numero = parte.split("=", 1)
+            resultado[clave.strip()] = float(numero)
+    return resultado
+
+
 class Config:
     """Configuración de Correos de Costa Rica"""
     
@@ -32,13 +43,193 @@ class Config:
     )
     
     # Configuración de aplicación
+    # Nivel raíz y por logger: "INFO,zeep=WARNING,src.services.soap_client=DEBUG"
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    # Formato de salida: json (una línea por record) o texto
+    LOG_FORMATO: str = os.getenv("LOG_FORMATO", "json")
+    # Fracción de líneas INFO/DEBUG a conservar por logger ("src.api.endpoints=0.1")
+    LOG_MUESTREO: Dict[str, float] = _parse_mapa(os.getenv("LOG_MUESTREO", ""))
+    # Records en espera de escritura; con la cola llena se descartan
+    LOG_COLA: int = int(os.getenv("LOG_COLA", "10000"))
     TOKEN_REFRESH_BUFFER_SECONDS: int = int(
         os.getenv("TOKEN_REFRESH_BUFFER_SECONDS", "60")
     )
     
+    # Plazo total por request (segundos) y tope para el que pida el cliente
+    # en el header X-Plazo-Ms. Cada etapa usa solo lo que queda del plazo.
+    PLAZO_REQUEST_SEGUNDOS: float = float(os.getenv("PLAZO_REQUEST_SEGUNDOS", "30"))
+    PLAZO_REQUEST_MAXIMO_SEGUNDOS: float = float(os.getenv("PLAZO_REQUEST_MAXIMO_SEGUNDOS", "120"))
+    # Timeouts por llamada cuando no hay plazo (o si es menor que lo que queda)
+    AUTH_TIMEOUT_SEGUNDOS: float = float(os.getenv("AUTH_TIMEOUT_SEGUNDOS", "10"))
+    SOAP_TIMEOUT_SEGUNDOS: float = float(os.getenv("SOAP_TIMEOUT_SEGUNDOS", "30"))
+    
     # Tiempo de expiración del token (5 minutos en segundos)
     TOKEN_EXPIRATION_SECONDS: int = 300
+    
+    # Administración (endpoints /admin/*). Vacío = deshabilitados
+    ADMIN_SECRET: str = os.getenv("ADMIN_SECRET", "")
+    
+    # Catálogo geográfico: cada cuántos segundos revisar el mtime del JSON
+    # para recargarlo en caliente (0 = sin vigilancia)
+    CATALOGO_WATCH_INTERVAL_SECONDS: float = float(
+        os.getenv("CATALOGO_WATCH_INTERVAL_SECONDS", "0")
+    )
+    
+    # Ejecutor de llamadas bloqueantes a Correos (SOAP + token):
+    # hilos simultáneos y requests adicionales que pueden esperar en cola.
+    # Con el pool y la cola llenos se responde 503 con Retry-After.
+    SOAP_EXECUTOR_WORKERS: int = int(os.getenv("SOAP_EXECUTOR_WORKERS", "8"))
+    SOAP_EXECUTOR_COLA: int = int(os.getenv("SOAP_EXECUTOR_COLA", "32"))
+    # Lugares del ejecutor que las requests masivas/de fondo no pueden ocupar
+    SOAP_RESERVA_INTERACTIVA: int = int(os.getenv("SOAP_RESERVA_INTERACTIVA", "2"))
+    
+    # Llamadas simultáneas hacia Correos (todas las fuentes) y su reparto
+    # ponderado entre carriles cuando hay espera
+    SOAP_CONCURRENCIA_MAXIMA: int = int(os.getenv("SOAP_CONCURRENCIA_MAXIMA", "6"))
+    SOAP_PESOS_CARRILES: Dict[str, float] = _parse_mapa(
+        os.getenv("SOAP_PESOS_CARRILES", "interactivo=8,masivo=3,fondo=1")
+    )
+    
+    # Rate limit hacia Correos compartido entre workers (token bucket por
+    # operación). Backend: sqlite (procesos del host), redis (varios hosts),
+    # memoria (solo este proceso) o vacío para desactivar.
+    SOAP_RATE_LIMIT_BACKEND: str = os.getenv("SOAP_RATE_LIMIT_BACKEND", "sqlite")
+    SOAP_RATE_LIMIT_SQLITE_PATH: str = os.getenv(
+        "SOAP_RATE_LIMIT_SQLITE_PATH",
+        os.path.join(tempfile.gettempdir(), "correos_rate_limit.sqlite3")
+    )
+    SOAP_RATE_LIMIT_REDIS_URL: str = os.getenv("SOAP_RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+    # Llamadas por segundo por operación, y tasas específicas ("ccrTarifa=2,...")
+    SOAP_RATE_LIMIT_TASA: float = float(os.getenv("SOAP_RATE_LIMIT_TASA", "5"))
+    SOAP_RATE_LIMIT_TASAS: Dict[str, float] = _parse_mapa(os.getenv("SOAP_RATE_LIMIT_TASAS", ""))
+    SOAP_RATE_LIMIT_RAFAGA_SEGUNDOS: float = float(os.getenv("SOAP_RATE_LIMIT_RAFAGA_SEGUNDOS", "2"))
+    # Espera máxima por un token antes de fallar (0 = fail-fast)
+    SOAP_RATE_LIMIT_ESPERA_SEGUNDOS: float = float(os.getenv("SOAP_RATE_LIMIT_ESPERA_SEGUNDOS", "2"))
+    
+    # Hedging (segundo intento si el primero tarda más que el percentil de
+    # latencia) solo para operaciones idempotentes. Vacío = deshabilitado.
+    SOAP_HEDGING_OPERACIONES: List[str] = [
+        op.strip() for op in os.getenv("SOAP_HEDGING_OPERACIONES", "").split(",") if op.strip()
+    ]
+    SOAP_HEDGING_PERCENTIL: float = float(os.getenv("SOAP_HEDGING_PERCENTIL", "95"))
+    SOAP_HEDGING_RETARDO_INICIAL_SEGUNDOS: float = float(
+        os.getenv("SOAP_HEDGING_RETARDO_INICIAL_SEGUNDOS", "1")
+    )
+    SOAP_HEDGING_RETARDO_MINIMO_SEGUNDOS: float = float(
+        os.getenv("SOAP_HEDGING_RETARDO_MINIMO_SEGUNDOS", "0.05")
+    )
+    # Fracción máxima de llamadas que pueden llevar un segundo intento
+    SOAP_HEDGING_TASA_MAXIMA: float = float(os.getenv("SOAP_HEDGING_TASA_MAXIMA", "0.1"))
+    
+    # Directorio compartido por los workers para agregar /metrics entre
+    # procesos (vacío = solo el proceso que atiende la request)
+    METRICAS_MULTIPROCESO_DIR: str = os.getenv("METRICAS_MULTIPROCESO_DIR", "")
+    METRICAS_VOLCADO_SEGUNDOS: float = float(os.getenv("METRICAS_VOLCADO_SEGUNDOS", "5"))
+    
+    # Perfilado de requests individuales (vacío = deshabilitado, sin costo).
+    # Se activa con X-Perfilar + X-Admin-Secret o por muestreo.
+    PERFIL_DIR: str = os.getenv("PERFIL_DIR", "")
+    PERFIL_MUESTREO_TASA: float = float(os.getenv("PERFIL_MUESTREO_TASA", "0"))
+    PERFIL_MAX_ARCHIVOS: int = int(os.getenv("PERFIL_MAX_ARCHIVOS", "50"))
+    PERFIL_INTERVALO_MS: float = float(os.getenv("PERFIL_INTERVALO_MS", "5"))
+    PERFIL_RUTAS: List[str] = [
+        r.strip() for r in os.getenv("PERFIL_RUTAS", "/generar_guia,/catalogo_geografico").split(",") if r.strip()
+    ]
+    
+    # Almacén local de PDFs de guías (por contenido, ver almacen_pdf.py)
+    PDF_ALMACEN_DIR: str = os.getenv(
+        "PDF_ALMACEN_DIR",
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "var", "pdf")
+    )
+    # Incluir además el PDF en base64 en la respuesta de /generar_guia por
+    # defecto (se puede pedir por request con ?pdf_base64=true)
+    PDF_INLINE_BASE64: bool = os.getenv("PDF_INLINE_BASE64", "false").lower() in ("1", "true", "si", "sí")
+    
+    # Hojas de impresión (POST /guias/lote/pdf): máximo de guías por pedido
+    # y hojas generadas a conservar en cache
+    PDF_LOTE_MAXIMO: int = int(os.getenv("PDF_LOTE_MAXIMO", "500"))
+    PDF_LOTES_CACHE_MAX: int = int(os.getenv("PDF_LOTES_CACHE_MAX", "200"))
+    
+    # Registro de órdenes procesadas (SQLite, ver ordenes_procesadas.py):
+    # las escrituras se agrupan hasta N filas o N milisegundos
+    ORDENES_DB_PATH: str = os.getenv(
+        "ORDENES_DB_PATH",
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "var", "ordenes.sqlite3")
+    )
+    ORDENES_LOTE_MAXIMO: int = int(os.getenv("ORDENES_LOTE_MAXIMO", "500"))
+    ORDENES_LOTE_ESPERA_MS: float = float(os.getenv("ORDENES_LOTE_ESPERA_MS", "50"))
+    # Órdenes de Shopify (ver ordenes.py): fuente local con el formato de
+    # /orders.json y cada cuántos segundos se sincroniza (0 = solo al iniciar)
+    ORDENES_FUENTE_PATH: str = os.getenv(
+        "ORDENES_FUENTE_PATH",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ordenes_shopify.json")
+    )
+    ORDENES_SYNC_SEGUNDOS: float = float(os.getenv("ORDENES_SYNC_SEGUNDOS", "30"))
+    
+    # Remitente de las guías generadas desde una orden (POST /ordenes/{id}/guia)
+    REMITENTE_NOMBRE: str = os.getenv("REMITENTE_NOMBRE", "Tribu Mates")
+    REMITENTE_DIRECCION: str = os.getenv(
+        "REMITENTE_DIRECCION", "Alajuela, Grecia, 800 este de la Universidad Latina"
+    )
+    REMITENTE_TELEFONO: str = os.getenv("REMITENTE_TELEFONO", "")
+    REMITENTE_CODIGO_POSTAL: str = os.getenv("REMITENTE_CODIGO_POSTAL", "20301")
+    # Peso (gramos) cuando la orden no trae total_weight
+    ORDENES_PESO_GRAMOS: float = float(os.getenv("ORDENES_PESO_GRAMOS", "500"))
+    
+    # Webhook orders/paid de Shopify (vacío = deshabilitado) y cola que
+    # pre-genera las guías: guías a la vez, segundos mínimos entre guías,
+    # intentos ante errores de Correos y espera base entre intentos
+    SHOPIFY_WEBHOOK_SECRET: str = os.getenv("SHOPIFY_WEBHOOK_SECRET", "")
+    COLA_GUIAS_CONCURRENCIA: int = int(os.getenv("COLA_GUIAS_CONCURRENCIA", "2"))
+    COLA_GUIAS_INTERVALO_SEGUNDOS: float = float(os.getenv("COLA_GUIAS_INTERVALO_SEGUNDOS", "5"))
+    COLA_GUIAS_MAX_INTENTOS: int = int(os.getenv("COLA_GUIAS_MAX_INTENTOS", "5"))
+    COLA_GUIAS_REINTENTO_SEGUNDOS: float = float(os.getenv("COLA_GUIAS_REINTENTO_SEGUNDOS", "30"))
+    
+    # Cotizaciones (POST /cotizar, ver cotizador.py): el peso se redondea al
+    # tramo de gramos siguiente y cada ruta + tramo se consulta a Correos una
+    # vez por vigencia. Ítems por pedido, ccrTarifa simultáneas por pedido y
+    # plazo total (en el checkout no se puede esperar PLAZO_REQUEST_SEGUNDOS)
+    COTIZAR_TRAMOS_GRAMOS: List[int] = sorted(
+        int(t) for t in os.getenv("COTIZAR_TRAMOS_GRAMOS", "250,500,1000,2000,3000,4000,5000").split(",")
+        if t.strip()
+    )
+    COTIZAR_VIGENCIA_SEGUNDOS: float = float(os.getenv("COTIZAR_VIGENCIA_SEGUNDOS", "86400"))
+    COTIZAR_CACHE_MEMORIA: int = int(os.getenv("COTIZAR_CACHE_MEMORIA", "20000"))
+    COTIZAR_MAXIMO_ITEMS: int = int(os.getenv("COTIZAR_MAXIMO_ITEMS", "100"))
+    COTIZAR_CONCURRENCIA: int = int(os.getenv("COTIZAR_CONCURRENCIA", "4"))
+    COTIZAR_PLAZO_SEGUNDOS: float = float(os.getenv("COTIZAR_PLAZO_SEGUNDOS", "3"))
+    
+    # Servidor (run.py). Modo produccion (workers, sin reload) o desarrollo
+    # (un proceso con reload); desarrollo solo si se pide explícitamente.
+    SERVIDOR_MODO: str = os.getenv("SERVIDOR_MODO", "produccion")
+    SERVIDOR_HOST: str = os.getenv("SERVIDOR_HOST", "0.0.0.0")
+    SERVIDOR_PUERTO: int = int(os.getenv("SERVIDOR_PUERTO", "8000"))
+    # Procesos worker (0 = uno por CPU disponible)
+    SERVIDOR_WORKERS: int = int(os.getenv("SERVIDOR_WORKERS", "0"))
+    # Reciclar cada worker tras N requests (+ jitter aleatorio) para acotar
+    # el crecimiento de memoria; 0 = nunca. Requiere gunicorn.
+    SERVIDOR_MAX_REQUESTS: int = int(os.getenv("SERVIDOR_MAX_REQUESTS", "10000"))
+    SERVIDOR_MAX_REQUESTS_JITTER: int = int(os.getenv("SERVIDOR_MAX_REQUESTS_JITTER", "1000"))
+    # Keep-alive mayor que el idle timeout del balanceador (60s en la mayoría)
+    SERVIDOR_KEEPALIVE_SEGUNDOS: int = int(os.getenv("SERVIDOR_KEEPALIVE_SEGUNDOS", "75"))
+    SERVIDOR_BACKLOG: int = int(os.getenv("SERVIDOR_BACKLOG", "2048"))
+    # Tiempo para terminar las requests en curso al reciclar o apagar
+    SERVIDOR_APAGADO_SEGUNDOS: int = int(os.getenv("SERVIDOR_APAGADO_SEGUNDOS", "30"))
+    # Parsear también el WSDL antes de crear los workers (con gunicorn)
+    SERVIDOR_PRECARGAR_WSDL: bool = os.getenv("SERVIDOR_PRECARGAR_WSDL", "false").lower() in ("1", "true", "si", "sí")
+    
+    # Calentamiento de cada worker al iniciar (ver calentamiento.py): cliente
+    # SOAP, token y conexiones a Correos antes de que /ready responda 200.
+    # Sin ARRANQUE_ESPERAR_CORREOS /ready solo espera el catálogo y los pasos
+    # hacia Correos siguen en segundo plano. Espera base entre reintentos.
+    ARRANQUE_CALENTAR: bool = os.getenv("ARRANQUE_CALENTAR", "true").lower() in ("1", "true", "si", "sí")
+    ARRANQUE_ESPERAR_CORREOS: bool = os.getenv("ARRANQUE_ESPERAR_CORREOS", "true").lower() in ("1", "true", "si", "sí")
+    ARRANQUE_REINTENTO_SEGUNDOS: float = float(os.getenv("ARRANQUE_REINTENTO_SEGUNDOS", "5"))
+    
+    # Cantidad máxima de distritos con barrios cargados en memoria por worker
+    CATALOGO_BARRIOS_CACHE_SIZE: int = int(
+        os.getenv("CATALOGO_BARRIOS_CACHE_SIZE", "256")
+    )
 
 
 # Instancia global de configuración
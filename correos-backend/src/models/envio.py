@@ -2,7 +2,7 @@
 Modelos de datos para envíos usando Pydantic.
 """
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, Field, field_validator
 
 
@@ -31,6 +31,7 @@ class SolicitudGuia(BaseModel):
     monto_flete: float = Field(..., ge=0, description="Monto del flete en colones")
     observaciones: Optional[str] = Field(None, max_length=200, description="Descripción del contenido")
     fecha_envio: Optional[datetime] = Field(default_factory=datetime.now, description="Fecha de envío")
+    orden_id: Optional[str] = Field(None, max_length=100, description="Orden de Shopify (id, TM-<id> o GID) para /correos/status")
     
     @field_validator('peso')
     @classmethod
@@ -49,6 +50,16 @@ class SolicitudGuia(BaseModel):
         return v
 
 
+class DatosEtiqueta(BaseModel):
+    """Datos impresos en la etiqueta (los mismos enviados en ccrRegistroEnvio)"""
+    numero_envio: str
+    fecha_envio: Optional[datetime] = None
+    remitente: DatosRemitente
+    destinatario: DatosDestinatario
+    peso: float
+    observaciones: Optional[str] = None
+
+
 class RespuestaGuia(BaseModel):
     """Respuesta de generación de guía"""
     exito: bool
@@ -56,4 +67,50 @@ class RespuestaGuia(BaseModel):
     codigo_respuesta: Optional[str] = None
     mensaje_respuesta: Optional[str] = None
     pdf_base64: Optional[str] = None
+    pdf_url: Optional[str] = None
     error: Optional[str] = None
+
+
+class SolicitudLotePDF(BaseModel):
+    """Guías a imprimir juntas en un solo PDF"""
+    numeros: List[str] = Field(..., min_length=1, description="Números de envío, en orden de impresión")
+    por_hoja: int = Field(1, description="Etiquetas por hoja: 1 (una por página), 2, 4, 6 u 8")
+    hoja: str = Field("A4", description="Tamaño de hoja cuando por_hoja > 1: A4 o carta")
+    
+    @field_validator('por_hoja')
+    @classmethod
+    def validate_por_hoja(cls, v):
+        """Validar que la grilla sea una de las soportadas"""
+        if v not in (1, 2, 4, 6, 8):
+            raise ValueError('por_hoja debe ser 1, 2, 4, 6 u 8')
+        return v
+    
+    @field_validator('hoja')
+    @classmethod
+    def validate_hoja(cls, v):
+        """Validar el tamaño de hoja"""
+        if v not in ('A4', 'carta'):
+            raise ValueError('hoja debe ser A4 o carta')
+        return v
+
+
+class AjustesGuiaOrden(BaseModel):
+    """Correcciones opcionales al generar la guía de una orden (POST /ordenes/{id}/guia)"""
+    codigo_postal: Optional[str] = Field(None, pattern=r"^\d{5}$", description="Código postal de destino (reemplaza al zip de la orden)")
+    direccion: Optional[str] = Field(None, max_length=500, description="Señas de entrega (reemplaza a address1/address2)")
+    telefono: Optional[str] = Field(None, max_length=15, description="Teléfono del destinatario")
+    peso: Optional[float] = Field(None, gt=0, description="Peso del envío en gramos")
+    monto_flete: float = Field(0.0, ge=0, description="Monto del flete en colones")
+    observaciones: Optional[str] = Field(None, max_length=200, description="Descripción del contenido")
+
+
+class ItemCotizacion(BaseModel):
+    """Un envío a cotizar: destino y peso"""
+    codigo_postal: str = Field(..., max_length=8, description="Código postal de destino (PCCDD)")
+    peso: float = Field(..., gt=0, description="Peso del envío en gramos")
+
+
+class SolicitudCotizacion(BaseModel):
+    """Envíos a cotizar juntos (POST /cotizar)"""
+    items: List[ItemCotizacion] = Field(..., min_length=1, description="Envíos, en el orden de la respuesta")
+    codigo_postal_origen: Optional[str] = Field(None, max_length=8, description="Origen (por defecto REMITENTE_CODIGO_POSTAL)")
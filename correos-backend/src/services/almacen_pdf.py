@@ -0,0 +1,154 @@
+"""
+Almacén local de PDFs de guías, direccionado por contenido.
+
+Cada PDF se guarda una sola vez con el nombre de su SHA-256, repartido en
+subdirectorios para no acumular cientos de miles de archivos en uno:
+
+    PDF_ALMACEN_DIR/objetos/ab/cd/abcd…ef.pdf
+    PDF_ALMACEN_DIR/guias/3f/PY064089266CR      (contiene el SHA-256)
+    PDF_ALMACEN_DIR/datos/3f/PY064089266CR.json (datos de la etiqueta)
+
+La referencia por número de envío permite descargar la etiqueta en cualquier
+momento (GET /guias/{numero}/pdf) aunque el cliente haya perdido la
+respuesta de /generar_guia. Los archivos se escriben con rename atómico: un
+lector nunca ve un PDF a medio escribir, y si el mismo contenido ya existe no
+se vuelve a escribir.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from typing import NamedTuple, Optional
+
+from src.config import config
+from src.services.metricas import registro
+
+logger = logging.getLogger(__name__)
+
+# Números de envío de Correos (p.ej. PY064089266CR); evita rutas arbitrarias
+_NUMERO_VALIDO = re.compile(r"^[A-Za-z0-9_-]{1,40}$")
+_SHA256_VALIDO = re.compile(r"^[0-9a-f]{64}$")
+
+_escrituras = registro.contador(
+    "pdf_almacen_escrituras_total", "PDFs guardados en el almacén local", ["resultado"]
+)
+
+
+class ObjetoPDF(NamedTuple):
+    ruta: str
+    sha256: str
+    tamano: int
+
+
+def numero_valido(numero_envio: str) -> bool:
+    return bool(numero_envio) and _NUMERO_VALIDO.match(numero_envio) is not None
+
+
+def _escribir_atomico(ruta: str, contenido: bytes) -> None:
+    directorio = os.path.dirname(ruta)
+    os.makedirs(directorio, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directorio, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(contenido)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, ruta)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class AlmacenPDF:
+    """
+    Args:
+        directorio: Raíz del almacén (Config.PDF_ALMACEN_DIR)
+    """
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+
+    def ruta_objeto(self, sha256: str) -> str:
+        return os.path.join(self.directorio, "objetos", sha256[:2], sha256[2:4], f"{sha256}.pdf")
+
+    def _ruta_por_numero(self, carpeta: str, numero_envio: str, sufijo: str = "") -> str:
+        fragmento = hashlib.sha1(numero_envio.encode("utf-8")).hexdigest()[:2]
+        return os.path.join(self.directorio, carpeta, fragmento, numero_envio + sufijo)
+
+    def _ruta_referencia(self, numero_envio: str) -> str:
+        return self._ruta_por_numero("guias", numero_envio)
+
+    def guardar(self, numero_envio: str, contenido: bytes) -> str:
+        """
+        Guarda el PDF y lo asocia al número de envío.
+
+        Returns:
+            SHA-256 (hex) del PDF
+
+        Raises:
+            ValueError: Si el número de envío no es válido
+            OSError: Si no se pudo escribir
+        """
+        if not numero_valido(numero_envio):
+            raise ValueError(f"Número de envío inválido: {numero_envio!r}")
+        sha256 = hashlib.sha256(contenido).hexdigest()
+        ruta = self.ruta_objeto(sha256)
+        if os.path.exists(ruta):
+            _escrituras.inc(resultado="existente")
+        else:
+            _escribir_atomico(ruta, contenido)
+            _escrituras.inc(resultado="nuevo")
+        _escribir_atomico(self._ruta_referencia(numero_envio), sha256.encode("ascii"))
+        logger.debug("PDF de %s guardado (%d bytes, %s)", numero_envio, len(contenido), sha256[:12])
+        return sha256
+
+    def objeto(self, sha256: str) -> Optional[ObjetoPDF]:
+        """PDF por su SHA-256, o None si no está."""
+        if not _SHA256_VALIDO.match(sha256 or ""):
+            return None
+        ruta = self.ruta_objeto(sha256)
+        try:
+            tamano = os.stat(ruta).st_size
+        except FileNotFoundError:
+            return None
+        return ObjetoPDF(ruta, sha256, tamano)
+
+    def buscar(self, numero_envio: str) -> Optional[ObjetoPDF]:
+        """PDF asociado a un número de envío, o None si no hay."""
+        if not numero_valido(numero_envio):
+            return None
+        try:
+            with open(self._ruta_referencia(numero_envio), "rb") as f:
+                sha256 = f.read().decode("ascii").strip()
+        except FileNotFoundError:
+            return None
+        return self.objeto(sha256)
+
+    def guardar_datos(self, numero_envio: str, datos_json: bytes) -> None:
+        """
+        Guarda los datos de la etiqueta (JSON) para poder renderizarla
+        localmente después (ver etiquetas.py).
+
+        Raises:
+            ValueError: Si el número de envío no es válido
+            OSError: Si no se pudo escribir
+        """
+        if not numero_valido(numero_envio):
+            raise ValueError(f"Número de envío inválido: {numero_envio!r}")
+        _escribir_atomico(self._ruta_por_numero("datos", numero_envio, ".json"), datos_json)
+
+    def datos(self, numero_envio: str) -> Optional[bytes]:
+        """JSON con los datos de la etiqueta, o None si no hay."""
+        if not numero_valido(numero_envio):
+            return None
+        try:
+            with open(self._ruta_por_numero("datos", numero_envio, ".json"), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+# Instancia global del almacén
+almacen_pdf = AlmacenPDF(config.PDF_ALMACEN_DIR)
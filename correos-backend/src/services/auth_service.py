@@ -2,17 +2,28 @@
 Servicio de autenticación con Correos de Costa Rica.
 Maneja la obtención y renovación automática de tokens.
 """
-import time
 import logging
+import threading
+import time
 import requests
 import json
 import base64
 from typing import Optional
 from datetime import datetime, timedelta
 from src.config import config
+from src.services.metricas import registro
+from src.services import plazo
+from src.services.plazo import PlazoVencidoError
 
 logger = logging.getLogger(__name__)
 
+_renovaciones = registro.contador(
+    "auth_renovaciones_total", "Renovaciones del token de Correos", ["resultado"]
+)
+_duracion_renovacion = registro.histograma(
+    "auth_renovacion_duracion_segundos", "Duración de la renovación del token"
+)
+
 
 class AuthService:
     """
@@ -23,7 +34,7 @@ class AuthService:
     def __init__(self):
         self._token: Optional[str] = None
         self._token_expires_at: Optional[datetime] = None
-        self._lock = False  # Simple lock para evitar requests concurrentes
+        self._lock = threading.Lock()  # Una sola renovación a la vez entre hilos
     
     def get_token(self, force_refresh: bool = False) -> str:
         """
@@ -43,7 +54,7 @@ class AuthService:
             return self._token
         
         # Renovar token
-        return self._refresh_token()
+        return self._refresh_token(forzar=force_refresh)
 
     @staticmethod
     def _normalize_token(token: str) -> str:
@@ -93,29 +104,39 @@ class AuthService:
         
         return datetime.now() < expires_with_buffer
     
-    def _refresh_token(self) -> str:
+    def _refresh_token(self, forzar: bool = False) -> str:
         """
         Renueva el token desde el servicio de autenticación.
         
+        Si otro hilo lo renovó mientras se esperaba el lock, se reutiliza
+        ese token en lugar de pedir uno nuevo.
+        
+        Args:
+            forzar: Si True, el token vigente al entrar se considera rechazado
+        
         Returns:
             Nuevo token
             
         Raises:
+            PlazoVencidoError: Si el plazo de la request vence esperando
             Exception: Si falla la autenticación
         """
-        # Evitar múltiples requests simultáneos
-        if self._lock:
-            # Esperar un poco y reintentar
-            time.sleep(0.5)
-            if self._token and self._is_token_valid():
-                return self._token
+        token_previo = self._token
         
-        self._lock = True
+        # Evitar múltiples requests simultáneos (sin esperar más que el plazo)
+        espera = plazo.timeout_para("espera de renovación de token", None)
+        if not self._lock.acquire(timeout=-1 if espera is None else espera):
+            raise PlazoVencidoError("espera de renovación de token")
         
+        inicio = None
+        resultado = "error"
         try:
+            if self._is_token_valid() and (not forzar or self._token != token_previo):
+                return self._token
+            
             logger.info("Renovando token de autenticación...")
-            logger.info(f"URL: {config.TOKEN_URL}")
-            logger.info(f"Username: {config.USERNAME}")
+            inicio = time.perf_counter()
+            logger.debug("Token URL: %s, usuario: %s", config.TOKEN_URL, config.USERNAME)
             
             payload = {
                 "Username": config.USERNAME,
@@ -128,32 +149,26 @@ class AuthService:
                 "Accept": "application/json"
             }
             
-            logger.debug(f"Payload enviado (sin password): {{'Username': '{config.USERNAME}', 'Sistema': '{config.SISTEMA}'}}")
-            
             response = requests.post(
                 config.TOKEN_URL,
                 json=payload,
                 headers=headers,
-                timeout=10,
+                timeout=plazo.timeout_para("token", config.AUTH_TIMEOUT_SEGUNDOS),
                 verify=True  # Cambiar a False temporalmente si hay problemas SSL
             )
             
-            logger.info(f"Status code: {response.status_code}")
-            logger.info(f"Response headers: {dict(response.headers)}")
-            logger.info(f"Response text (primeros 500 chars): {response.text[:500]}")
+            logger.debug("Status code token: %s", response.status_code)
             
             response.raise_for_status()
             
             # Intentar parsear como JSON
             try:
                 data = response.json()
-                logger.info(f"Response JSON parseado: {data}")
             except (ValueError, json.JSONDecodeError) as e:
                 # Si no es JSON, puede ser texto plano (el token directamente)
-                logger.warning(f"La respuesta no es JSON válido: {e}")
-                logger.info("Intentando interpretar respuesta como texto plano (token directo)")
+                logger.warning("La respuesta no es JSON válido: %s", e)
+                logger.info("Interpretando respuesta como texto plano (token directo)")
                 data = response.text.strip()
-                logger.info(f"Response como texto: {data}")
             
             # El formato de respuesta puede variar, ajustar según la respuesta real
             token = None
@@ -175,7 +190,7 @@ class AuthService:
                     # Si solo hay un campo, usar su valor
                     token = list(data.values())[0]
                 else:
-                    logger.warning(f"Formato de respuesta JSON no reconocido: {data}")
+                    logger.warning("Formato de respuesta JSON no reconocido (campos: %s)", sorted(data.keys()))
                     # Intentar convertir todo el dict a string si no hay campos conocidos
                     token = str(data)
             elif isinstance(data, str):
@@ -183,7 +198,7 @@ class AuthService:
                 token = data.strip().strip('"').strip("'")  # Remover comillas si las hay
             
             if not token or token == "null" or token == "None":
-                logger.error(f"No se pudo extraer el token de la respuesta: {data}")
+                logger.error("No se pudo extraer el token de la respuesta")
                 raise ValueError(f"Token vacío o inválido en la respuesta. Respuesta completa: {response.text}")
             
             # Normalizar: Correos NO acepta 'Bearer <jwt>' en pToken
@@ -203,35 +218,40 @@ class AuthService:
             logger.info(
                 f"Token renovado exitosamente. Expira en: {self._token_expires_at}"
             )
-            logger.debug(f"Token (primeros 20 chars): {self._token[:20]}...")
-            
+            resultado = "ok"
             return self._token
             
         except requests.exceptions.SSLError as e:
-            logger.error(f"Error SSL al renovar token: {e}")
+            logger.error("Error SSL al renovar token: %s", e)
             raise Exception(f"Error SSL al obtener token: {str(e)}. Verifica certificados o configura verify=False temporalmente.")
         except requests.exceptions.ConnectionError as e:
-            logger.error(f"Error de conexión al renovar token: {e}")
+            logger.error("Error de conexión al renovar token: %s", e)
             raise Exception(f"Error de conexión al obtener token: {str(e)}. Verifica la URL '{config.TOKEN_URL}' y conectividad.")
         except requests.exceptions.HTTPError as e:
-            logger.error(f"Error HTTP al renovar token: {e}")
-            logger.error(f"Response status: {response.status_code}")
-            logger.error(f"Response text: {response.text}")
+            logger.error("Error HTTP al renovar token: %s", e)
+            logger.error("Response status: %s", response.status_code)
             raise Exception(f"Error HTTP {response.status_code} al obtener token: {response.text}")
+        except PlazoVencidoError:
+            raise
         except requests.exceptions.Timeout as e:
-            logger.error(f"Timeout al renovar token: {e}")
+            logger.error("Timeout al renovar token: %s", e)
+            if plazo.vencido():
+                raise PlazoVencidoError("token")
             raise Exception(f"Timeout al obtener token: {str(e)}. La conexión excedió el tiempo de espera.")
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error de request al renovar token: {e}")
+            logger.error("Error de request al renovar token: %s", e)
             raise Exception(f"Error de conexión al obtener token: {str(e)}")
         except ValueError as e:
-            logger.error(f"Error de valor al procesar token: {e}")
+            logger.error("Error de valor al procesar token: %s", e)
             raise
         except Exception as e:
-            logger.error(f"Error inesperado al renovar token: {e}", exc_info=True)
+            logger.error("Error inesperado al renovar token: %s", e, exc_info=True)
             raise Exception(f"Error al obtener token: {str(e)}")
         finally:
-            self._lock = False
+            if inicio is not None:
+                _duracion_renovacion.observe(time.perf_counter() - inicio)
+                _renovaciones.inc(resultado=resultado)
+            self._lock.release()
     
     def invalidate_token(self):
         """Invalida el token actual (útil para forzar renovación)"""
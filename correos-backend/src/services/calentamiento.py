@@ -0,0 +1,171 @@
+"""
+Calentamiento de cada worker al iniciar (GET /ready, GET /health).
+
+Sin esto el worker se declara sano apenas levanta, y la primera request real
+paga el WSDL, el token y los handshakes TLS. Aquí cada paso se ejecuta una
+vez al iniciar, se mide y queda su estado:
+
+- catalogo: el catálogo geográfico (en el startup, antes que la cola de guías)
+- cliente_soap: parsear el WSDL (ya hecho si el maestro lo precargó)
+- token: autenticación contra el servicio de tokens
+- conexiones: conexiones TLS abiertas en el pool del transporte SOAP
+
+Los pasos hacia Correos corren en un hilo y, si fallan, se reintentan con
+espera exponencial (ARRANQUE_REINTENTO_SEGUNDOS, hasta un minuto). /ready
+responde 200 cuando terminaron los pasos requeridos: los de Correos solo si
+ARRANQUE_ESPERAR_CORREOS.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence
+
+from src.config import config
+from src.services.auth_service import auth_service
+from src.services.catalogo_service import catalogo_service
+from src.services.metricas import registro
+from src.services.soap_client import soap_client
+
+logger = logging.getLogger(__name__)
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+LISTO = "listo"
+ERROR = "error"
+OMITIDO = "omitido"
+
+# Conexiones que guarda por host el pool de requests (HTTPAdapter)
+_POOL_REQUESTS = 10
+
+_duracion = registro.medidor(
+    "arranque_paso_duracion_segundos", "Duración del último intento de cada paso del calentamiento", ["paso"]
+)
+_listo = registro.medidor("arranque_listo", "Workers con el calentamiento terminado (/ready)")
+
+
+class _Paso:
+    def __init__(self, nombre: str, fn: Callable[[], None], requerido: bool):
+        self.nombre = nombre
+        self.fn = fn
+        self.requerido = requerido
+        self.estado = PENDIENTE
+        self.intentos = 0
+        self.duracion_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def resumen(self) -> dict:
+        return {
+            "estado": self.estado,
+            "requerido": self.requerido,
+            "intentos": self.intentos,
+            "duracion_ms": self.duracion_ms,
+            "error": self.error,
+        }
+
+
+class Calentamiento:
+    """Pasos de arranque medidos, con reintentos y estado para /ready y /health."""
+
+    def __init__(self, reintento: float):
+        self.reintento = max(0.1, reintento)
+        self._pasos: Dict[str, _Paso] = {}
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._inicio = time.monotonic()
+        self._listo_en: Optional[float] = None
+
+    def agregar(self, nombre: str, fn: Callable[[], None], requerido: bool = True) -> None:
+        self._pasos[nombre] = _Paso(nombre, fn, requerido)
+
+    def omitir(self, nombre: str) -> None:
+        """El paso no corre ni se espera (p.ej. ARRANQUE_CALENTAR=false)."""
+        paso = self._pasos[nombre]
+        paso.estado = OMITIDO
+        paso.requerido = False
+        self._verificar_listo()
+
+    def ejecutar(self, nombre: str) -> bool:
+        """Ejecuta un paso y registra estado y duración; True si terminó bien."""
+        paso = self._pasos[nombre]
+        paso.estado = EN_CURSO
+        paso.intentos += 1
+        inicio = time.perf_counter()
+        try:
+            paso.fn()
+        except Exception as e:
+            paso.estado = ERROR
+            paso.error = str(e)
+            logger.error("❌ Calentamiento: %s falló (intento %d): %s", nombre, paso.intentos, e)
+        else:
+            paso.estado = LISTO
+            paso.error = None
+        duracion = time.perf_counter() - inicio
+        paso.duracion_ms = round(duracion * 1000, 1)
+        _duracion.set(duracion, paso=nombre)
+        if paso.estado == LISTO:
+            logger.info("🔥 Calentamiento: %s listo en %.0f ms", nombre, paso.duracion_ms)
+        self._verificar_listo()
+        return paso.estado == LISTO
+
+    def _verificar_listo(self) -> None:
+        with self._lock:
+            if self._listo_en is None and self.listo:
+                self._listo_en = time.monotonic()
+                _listo.set(1)
+                logger.info("✅ Worker listo en %.2fs", self._listo_en - self._inicio)
+
+    @property
+    def listo(self) -> bool:
+        return all(p.estado == LISTO for p in self._pasos.values() if p.requerido)
+
+    def iniciar(self, antes: Sequence[str] = ()) -> None:
+        """
+        Ejecuta ya los pasos `antes` (los que el resto del startup necesita) y
+        los pendientes en un hilo, en orden, reintentando los que fallan.
+        """
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        # En gunicorn la instancia se crea en el maestro: se mide desde el worker
+        self._inicio = time.monotonic()
+        for nombre in antes:
+            self.ejecutar(nombre)
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="calentamiento", daemon=True)
+        self._hilo.start()
+
+    def detener(self) -> None:
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+
+    def _bucle(self) -> None:
+        for paso in self._pasos.values():
+            espera = self.reintento
+            while paso.estado in (PENDIENTE, ERROR) and not self._detener.is_set():
+                if self.ejecutar(paso.nombre):
+                    break
+                # Los pasos siguientes dependen de este
+                if self._detener.wait(espera):
+                    return
+                espera = min(espera * 2, 60.0)
+
+    def estado(self) -> dict:
+        listo_en = self._listo_en
+        return {
+            "listo": self.listo,
+            "segundos_hasta_listo": round(listo_en - self._inicio, 3) if listo_en is not None else None,
+            "componentes": {nombre: paso.resumen() for nombre, paso in self._pasos.items()},
+        }
+
+
+def _conexiones() -> None:
+    soap_client.abrir_conexiones(min(config.SOAP_CONCURRENCIA_MAXIMA, _POOL_REQUESTS))
+
+
+# Instancia global del calentamiento del worker
+calentamiento = Calentamiento(reintento=config.ARRANQUE_REINTENTO_SEGUNDOS)
+calentamiento.agregar("catalogo", catalogo_service.cargar_catalogo)
+calentamiento.agregar("cliente_soap", soap_client._get_client, requerido=config.ARRANQUE_ESPERAR_CORREOS)
+calentamiento.agregar("token", auth_service.get_token, requerido=config.ARRANQUE_ESPERAR_CORREOS)
+calentamiento.agregar("conexiones", _conexiones, requerido=config.ARRANQUE_ESPERAR_CORREOS)
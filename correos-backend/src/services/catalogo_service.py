@@ -1,112 +1,503 @@
 """
 Servicio para catálogo geográfico.
 Carga 100% desde JSON estático (NO SOAP).
+
+El catálogo vive en un índice inmutable (`IndiceCatalogo`). Las recargas
+construyen y validan un índice nuevo fuera del path de requests y luego
+reemplazan la referencia de una sola vez, así los lectores nunca ven un
+catálogo a medio construir.
+
+Si existe un snapshot binario compilado a partir del mismo JSON
+(build_catalog_snapshot.py), se usa vía mmap en lugar de parsear el JSON.
+
+Los barrios (cuarto nivel) están particionados en un archivo por distrito
+(data/barrios/{provincia}-{canton}-{distrito}.json) y se cargan recién en
+la primera consulta, en un LRU acotado. Cada entrada guarda el mtime del
+archivo: si se vuelve a cosechar un distrito se relee sin recargar el
+catálogo, y el hash del archivo entra en el ETag de la respuesta.
 """
+import hashlib
 import json
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, NamedTuple, Optional, Any
+
+from src.config import config
+from src.services.catalogo_snapshot import SnapshotCatalogo, SnapshotInvalidoError
 
 logger = logging.getLogger(__name__)
 
-# Cache global - se carga una sola vez al startup
-CATALOGO_CACHE: Dict = {}
+# Mínimos esperados del catálogo oficial de Correos (ver generate_catalog_from_soap.py)
+PROVINCIAS_ESPERADAS = 7
+MIN_CANTONES = 80
+MIN_DISTRITOS = 480
+
+
+class CatalogoInvalidoError(Exception):
+    """El catálogo no pasó las validaciones; el índice vigente no se toca."""
+
+    def __init__(self, errores: List[str]):
+        self.errores = errores
+        super().__init__("; ".join(errores))
+
+
+def validar_catalogo(catalogo: Dict[str, Any]) -> List[str]:
+    """
+    Valida la estructura y los totales mínimos del catálogo.
+
+    Args:
+        catalogo: Dict con "provincias", "cantones" y "distritos"
+
+    Returns:
+        Lista de errores (vacía si el catálogo es válido)
+    """
+    errores = []
+
+    if not isinstance(catalogo, dict):
+        return ["ERROR: El catálogo debe ser un objeto JSON"]
+
+    provincias = catalogo.get("provincias")
+    cantones = catalogo.get("cantones")
+    distritos = catalogo.get("distritos")
+
+    if not isinstance(provincias, list):
+        errores.append("ERROR: 'provincias' debe ser una lista")
+        provincias = []
+    if not isinstance(cantones, dict):
+        errores.append("ERROR: 'cantones' debe ser un objeto")
+        cantones = {}
+    if not isinstance(distritos, dict):
+        errores.append("ERROR: 'distritos' debe ser un objeto")
+        distritos = {}
+
+    errores.extend(validar_totales(
+        len(provincias),
+        sum(len(v) for v in cantones.values()),
+        sum(len(v) for v in distritos.values()),
+    ))
+    return errores
+
+
+def validar_totales(total_provincias: int, total_cantones: int, total_distritos: int) -> List[str]:
+    """Valida los totales mínimos del catálogo oficial."""
+    errores = []
+
+    if total_provincias != PROVINCIAS_ESPERADAS:
+        errores.append(
+            f"ERROR: Se esperaban {PROVINCIAS_ESPERADAS} provincias, se obtuvieron {total_provincias}"
+        )
+
+    if total_cantones < MIN_CANTONES:
+        errores.append(
+            f"ERROR: Se esperaban al menos {MIN_CANTONES} cantones, se obtuvieron {total_cantones}"
+        )
+
+    if total_distritos < MIN_DISTRITOS:
+        errores.append(
+            f"ERROR: Se esperaban al menos {MIN_DISTRITOS} distritos, se obtuvieron {total_distritos}"
+        )
+
+    return errores
+
+
+class _FuenteJson:
+    """Catálogo parseado del JSON, con la misma interfaz que SnapshotCatalogo."""
+
+    def __init__(self, datos: Dict[str, Any]):
+        self._datos = datos
+        self.num_provincias = len(datos.get("provincias", []))
+        self.num_cantones = sum(len(v) for v in datos.get("cantones", {}).values())
+        self.num_distritos = sum(len(v) for v in datos.get("distritos", {}).values())
+
+    def get_provincias(self) -> List[Dict[str, str]]:
+        return self._datos.get("provincias", [])
+
+    def get_cantones(self, codigo_provincia: str) -> List[Dict[str, str]]:
+        return self._datos.get("cantones", {}).get(codigo_provincia, [])
+
+    def get_distritos(self, codigo_provincia: str, codigo_canton: str) -> List[Dict[str, str]]:
+        return self._datos.get("distritos", {}).get(f"{codigo_provincia}-{codigo_canton}", [])
+
+
+class IndiceCatalogo:
+    """
+    Snapshot inmutable del catálogo ya validado.
+    No se modifica después de construido; una recarga crea uno nuevo.
+    """
+
+    def __init__(self, fuente, version: int, sha256: str, mtime_ns: int, origen: str = "json"):
+        self.fuente = fuente
+        self.version = version
+        self.sha256 = sha256
+        self.mtime_ns = mtime_ns
+        self.origen = origen
+        self.cargado_en = time.time()
+
+        self.num_provincias = fuente.num_provincias
+        self.num_cantones = fuente.num_cantones
+        self.num_distritos = fuente.num_distritos
+
+    @property
+    def etag(self) -> str:
+        """Validador de cache: depende solo del contenido (igual en todos los workers)."""
+        return f'"cat-{self.sha256[:16]}"'
+
+    def resumen(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "etag": self.etag,
+            "origen": self.origen,
+            "provincias": self.num_provincias,
+            "cantones": self.num_cantones,
+            "distritos": self.num_distritos,
+            "cargado_en": self.cargado_en,
+        }
+
+
+class BarriosDistrito(NamedTuple):
+    """Barrios de un distrito tal como se leyeron de su archivo."""
+    datos: List[Dict[str, str]]
+    sha256: str
+    mtime_ns: Optional[int]
+
+
+class _LRU:
+    """Cache LRU acotado y thread-safe."""
+
+    def __init__(self, capacidad: int):
+        self.capacidad = max(1, capacidad)
+        self._items: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, valor: Any) -> None:
+        with self._lock:
+            self._items[key] = valor
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacidad:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
 
 
 class CatalogoService:
     """Servicio de catálogo geográfico basado en JSON estático."""
-    
+
     def __init__(self):
         """Inicializa el servicio con la ruta al archivo JSON."""
         self.data_path = Path(__file__).parent.parent / "data" / "catalogo_geografico.json"
-    
+        self.snapshot_path = self.data_path.with_suffix(".bin")
+        self.barrios_dir = self.data_path.parent / "barrios"
+        self._barrios = _LRU(config.CATALOGO_BARRIOS_CACHE_SIZE)
+        self._indice: Optional[IndiceCatalogo] = None
+        # Serializa recargas (admin + watcher); los lectores no toman este lock
+        self._recarga_lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._watcher_stop = threading.Event()
+        # Último mtime del archivo ya procesado (por el watcher): vive aquí y
+        # no en el índice, que es inmutable
+        self._mtime_visto: Optional[int] = None
+
+    @property
+    def version(self) -> int:
+        """Versión del índice vigente (0 si no hay catálogo cargado)."""
+        indice = self._indice
+        return indice.version if indice else 0
+
+    @property
+    def indice(self) -> Optional[IndiceCatalogo]:
+        return self._indice
+
+    def _construir_indice(self, version: int) -> IndiceCatalogo:
+        """
+        Lee y valida el catálogo (snapshot binario si está al día, si no el
+        JSON). No toca el índice vigente.
+        """
+        if not self.data_path.exists():
+            raise FileNotFoundError(f"No se encontró el archivo: {self.data_path}")
+
+        mtime_ns = self.data_path.stat().st_mtime_ns
+        raw = self.data_path.read_bytes()
+        sha256 = hashlib.sha256(raw).hexdigest()
+
+        snapshot = self._abrir_snapshot(sha256)
+        if snapshot is not None:
+            errores = validar_totales(snapshot.num_provincias, snapshot.num_cantones, snapshot.num_distritos)
+            if errores:
+                raise CatalogoInvalidoError(errores)
+            return IndiceCatalogo(snapshot, version, sha256, mtime_ns, origen="snapshot")
+
+        datos = json.loads(raw.decode("utf-8"))
+
+        errores = validar_catalogo(datos)
+        if errores:
+            raise CatalogoInvalidoError(errores)
+
+        return IndiceCatalogo(_FuenteJson(datos), version, sha256, mtime_ns, origen="json")
+
+    def _abrir_snapshot(self, sha256: str) -> Optional[SnapshotCatalogo]:
+        """Abre el snapshot binario solo si fue compilado desde este mismo JSON."""
+        if not self.snapshot_path.exists():
+            return None
+        try:
+            snapshot = SnapshotCatalogo(self.snapshot_path)
+        except (SnapshotInvalidoError, OSError) as e:
+            logger.warning(f"⚠️ Snapshot ignorado ({self.snapshot_path}): {e}")
+            return None
+        if snapshot.sha256_origen != sha256:
+            logger.warning(
+                "⚠️ Snapshot desactualizado respecto al JSON; usando JSON. "
+                "Ejecute build_catalog_snapshot.py para regenerarlo."
+            )
+            return None
+        return snapshot
+
     def cargar_catalogo(self) -> None:
         """
         Carga el catálogo desde JSON una sola vez al iniciar.
         NO llama SOAP - lee archivo estático.
         """
-        global CATALOGO_CACHE
-        
-        if CATALOGO_CACHE:
+        if self._indice is not None:
             logger.info("✅ Catálogo ya cargado en memoria")
             return
-        
+
         try:
             logger.info(f"📦 Cargando catálogo desde {self.data_path}")
-            
-            if not self.data_path.exists():
-                raise FileNotFoundError(f"No se encontró el archivo: {self.data_path}")
-            
-            with open(self.data_path, 'r', encoding='utf-8') as f:
-                CATALOGO_CACHE = json.load(f)
-            
-            # Contar items para logging
-            num_prov = len(CATALOGO_CACHE.get("provincias", []))
-            num_cant = sum(len(v) for v in CATALOGO_CACHE.get("cantones", {}).values())
-            num_dist = sum(
-                len(dists)
-                for dists in CATALOGO_CACHE.get("distritos", {}).values()
-            )
-            
-            logger.info(f"✅ Catálogo cargado exitosamente:")
-            logger.info(f"   - {num_prov} provincias")
-            logger.info(f"   - {num_cant} cantones")
-            logger.info(f"   - {num_dist} distritos")
-            
+            self.recargar_catalogo()
+
         except FileNotFoundError as e:
             logger.error(f"❌ Archivo de catálogo no encontrado: {e}")
             raise
         except json.JSONDecodeError as e:
             logger.error(f"❌ Error parseando JSON: {e}")
             raise
+        except CatalogoInvalidoError as e:
+            logger.error(f"❌ Catálogo inválido: {e}")
+            raise
         except Exception as e:
             logger.error(f"❌ Error cargando catálogo: {e}", exc_info=True)
             raise
-    
+
+    def recargar_catalogo(self, forzar: bool = False) -> Dict[str, Any]:
+        """
+        Construye un índice nuevo desde disco y lo publica atómicamente.
+        Si el archivo no cambió (mismo hash) no se publica una versión nueva,
+        salvo que se indique forzar=True.
+
+        Pensado para ejecutarse fuera del event loop (admin o watcher).
+
+        Returns:
+            Resumen del índice vigente tras la recarga, con "recargado": bool
+
+        Raises:
+            CatalogoInvalidoError: Si el archivo nuevo no pasa las validaciones
+        """
+        with self._recarga_lock:
+            actual = self._indice
+            nuevo = self._construir_indice(version=(actual.version if actual else 0) + 1)
+            self._mtime_visto = nuevo.mtime_ns
+
+            if actual is not None and not forzar and nuevo.sha256 == actual.sha256:
+                logger.info("Catálogo sin cambios (mismo hash); se mantiene la versión %s", actual.version)
+                return {**actual.resumen(), "recargado": False}
+
+            # Swap atómico: una sola asignación de referencia
+            self._indice = nuevo
+            # Los barrios se releen de disco bajo la versión nueva
+            self._barrios.clear()
+
+        logger.info(f"✅ Catálogo cargado exitosamente (versión {nuevo.version}, desde {nuevo.origen}):")
+        logger.info(f"   - {nuevo.num_provincias} provincias")
+        logger.info(f"   - {nuevo.num_cantones} cantones")
+        logger.info(f"   - {nuevo.num_distritos} distritos")
+
+        return {**nuevo.resumen(), "recargado": True}
+
+    def notificar_workers(self) -> None:
+        """
+        Toca el archivo del catálogo para que el watcher de los demás workers
+        lo relea (aunque se haya copiado conservando el mtime). Sin vigilancia
+        (CATALOGO_WATCH_INTERVAL_SECONDS=0) los otros workers no se enteran.
+        """
+        with self._recarga_lock:
+            try:
+                os.utime(self.data_path)
+                self._mtime_visto = self.data_path.stat().st_mtime_ns
+            except OSError as e:
+                logger.warning("⚠️ No se pudo tocar %s para avisar a los workers: %s", self.data_path, e)
+
+    def iniciar_vigilancia(self, intervalo: Optional[float] = None) -> None:
+        """
+        Inicia un hilo que recarga el catálogo cuando cambia el mtime del archivo.
+        Con intervalo <= 0 la vigilancia queda deshabilitada.
+        """
+        if intervalo is None:
+            intervalo = config.CATALOGO_WATCH_INTERVAL_SECONDS
+        if intervalo <= 0 or self._watcher is not None:
+            return
+
+        self._watcher_stop.clear()
+        self._watcher = threading.Thread(
+            target=self._vigilar,
+            args=(intervalo,),
+            name="catalogo-watcher",
+            daemon=True,
+        )
+        self._watcher.start()
+        logger.info(f"👀 Vigilando cambios en {self.data_path} cada {intervalo}s")
+
+    def detener_vigilancia(self) -> None:
+        """Detiene el hilo de vigilancia (si está activo)."""
+        if self._watcher is None:
+            return
+        self._watcher_stop.set()
+        self._watcher.join(timeout=5)
+        self._watcher = None
+
+    def _vigilar(self, intervalo: float) -> None:
+        while not self._watcher_stop.wait(intervalo):
+            try:
+                mtime_ns = self.data_path.stat().st_mtime_ns
+            except OSError:
+                continue
+
+            if mtime_ns == self._mtime_visto:
+                continue
+
+            try:
+                self.recargar_catalogo()
+            except CatalogoInvalidoError as e:
+                logger.error(f"❌ Catálogo nuevo rechazado, se mantiene la versión vigente: {e}")
+                # No reintentar el mismo archivo inválido en cada vuelta
+                self._mtime_visto = mtime_ns
+            except Exception as e:
+                logger.error(f"❌ Error recargando catálogo: {e}", exc_info=True)
+
+    def _get_indice(self) -> IndiceCatalogo:
+        indice = self._indice
+        if indice is None:
+            raise Exception("Catálogo no cargado. El servidor debe iniciarse correctamente.")
+        return indice
+
     def get_provincias(self) -> List[Dict[str, str]]:
         """
         Obtiene todas las provincias desde el cache.
-        
+
         Returns:
             Lista de provincias: [{"codigo": "1", "nombre": "San José"}, ...]
         """
-        if not CATALOGO_CACHE:
-            raise Exception("Catálogo no cargado. El servidor debe iniciarse correctamente.")
-        
-        return CATALOGO_CACHE.get("provincias", [])
-    
+        return self._get_indice().fuente.get_provincias()
+
     def get_cantones(self, codigo_provincia: str) -> List[Dict[str, str]]:
         """
         Obtiene cantones de una provincia desde el cache.
-        
+
         Args:
             codigo_provincia: Código de la provincia (ej: "1")
-            
+
         Returns:
             Lista de cantones: [{"codigo": "01", "nombre": "San José"}, ...]
         """
-        if not CATALOGO_CACHE:
-            raise Exception("Catálogo no cargado. El servidor debe iniciarse correctamente.")
-        
-        return CATALOGO_CACHE.get("cantones", {}).get(codigo_provincia, [])
-    
+        return self._get_indice().fuente.get_cantones(codigo_provincia)
+
     def get_distritos(self, codigo_provincia: str, codigo_canton: str) -> List[Dict[str, str]]:
         """
         Obtiene distritos de un cantón desde el cache.
-        
+
         Args:
             codigo_provincia: Código de la provincia (ej: "1")
             codigo_canton: Código del cantón (ej: "01")
-            
+
         Returns:
             Lista de distritos: [{"codigo": "01", "nombre": "Carmen", "codigoPostal": "10101"}, ...]
         """
-        if not CATALOGO_CACHE:
-            raise Exception("Catálogo no cargado. El servidor debe iniciarse correctamente.")
-        
-        # Usar key compuesta "provincia-canton"
-        key = f"{codigo_provincia}-{codigo_canton}"
-        return CATALOGO_CACHE.get("distritos", {}).get(key, [])
+        return self._get_indice().fuente.get_distritos(codigo_provincia, codigo_canton)
+
+    def buscar_barrios(
+        self,
+        codigo_provincia: str,
+        codigo_canton: str,
+        codigo_distrito: str
+    ) -> Optional[BarriosDistrito]:
+        """
+        Barrios de un distrito con el hash de su archivo (para el ETag).
+        Lee de disco (bloqueante): desde el event loop, usar asyncio.to_thread.
+
+        Returns:
+            None si el distrito no está en el catálogo
+        """
+        self._get_indice()
+
+        # Solo se aceptan distritos del catálogo (evita leer rutas arbitrarias)
+        distritos = self.get_distritos(codigo_provincia, codigo_canton)
+        if not any(d.get("codigo") == codigo_distrito for d in distritos):
+            return None
+
+        key = f"{codigo_provincia}-{codigo_canton}-{codigo_distrito}"
+        path = self.barrios_dir / f"{key}.json"
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+
+        barrios = self._barrios.get(key)
+        if barrios is not None and barrios.mtime_ns == mtime_ns:
+            return barrios
+
+        try:
+            raw = path.read_bytes()
+        except FileNotFoundError:
+            raw, mtime_ns = b"", None
+        barrios = BarriosDistrito(
+            json.loads(raw.decode("utf-8")) if raw else [],
+            hashlib.sha256(raw).hexdigest(),
+            mtime_ns,
+        )
+        # También se cachean distritos sin barrios para no volver a tocar disco
+        self._barrios.put(key, barrios)
+        return barrios
+
+    def get_barrios(
+        self,
+        codigo_provincia: str,
+        codigo_canton: str,
+        codigo_distrito: str
+    ) -> Optional[List[Dict[str, str]]]:
+        """
+        Obtiene barrios de un distrito. El archivo del distrito se lee de
+        disco en la primera consulta (y cuando cambia su mtime) y queda en un
+        LRU acotado.
+
+        Args:
+            codigo_provincia: Código de la provincia (ej: "1")
+            codigo_canton: Código del cantón (ej: "01")
+            codigo_distrito: Código del distrito (ej: "01")
+
+        Returns:
+            Lista de barrios: [{"codigo_barrio": "01", "codigo_sucursal": "CART", "nombre": "..."}, ...],
+            o None si el distrito no está en el catálogo
+        """
+        barrios = self.buscar_barrios(codigo_provincia, codigo_canton, codigo_distrito)
+        return barrios.datos if barrios is not None else None
 
 
 # Instancia global del servicio
@@ -0,0 +1,283 @@
+"""
+Snapshot binario compacto del catálogo geográfico.
+
+El JSON del catálogo se compila (build_catalog_snapshot.py) a un archivo con
+registros de ancho fijo más una tabla de strings. Los workers lo abren con
+mmap de solo lectura: arrancar no requiere parsear JSON y todos los procesos
+comparten las mismas páginas físicas del archivo.
+
+Formato (little-endian):
+
+    Cabecera    MAGIC, versión de formato, sha256 del JSON origen,
+                cantidades y offsets de cada sección
+    Provincias  [codigo, nombre, primer_canton, num_cantones]
+    Cantones    [codigo, nombre, primer_distrito, num_distritos]
+    Distritos   [codigo, nombre, codigo_postal]
+    Índices     [clave, registro] ordenados por clave (búsqueda binaria):
+                provincias por "1", cantones por "1-01"
+    Strings     UTF-8 deduplicados; cada referencia es (offset, largo)
+"""
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+MAGIC = b"CCRCAT\x00\x01"
+FORMATO_VERSION = 1
+
+# magic, formato, sha256 origen, n_prov, n_cant, n_dist,
+# off_prov, off_cant, off_dist, off_idx_prov, off_idx_cant, off_strings, len_strings
+_CABECERA = struct.Struct("<8sI32sIIIIIIIIII")
+# (offset, largo) en la tabla de strings
+_REF = "IH"
+# Provincia / cantón: codigo, nombre, primer hijo, cantidad de hijos
+_NODO = struct.Struct("<" + _REF + _REF + "IH")
+# Distrito: codigo, nombre, codigo_postal (largo 0 = sin código postal)
+_DISTRITO = struct.Struct("<" + _REF + _REF + _REF)
+# Índice: clave, número de registro
+_ENTRADA_INDICE = struct.Struct("<" + _REF + "I")
+
+
+class SnapshotInvalidoError(Exception):
+    """El archivo no es un snapshot válido o no corresponde al JSON vigente."""
+
+
+class _TablaStrings:
+    """Acumula strings UTF-8 deduplicados durante la compilación."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._refs: Dict[str, Tuple[int, int]] = {}
+
+    def ref(self, texto: Optional[str]) -> Tuple[int, int]:
+        if texto is None:
+            return (0, 0)
+        if texto not in self._refs:
+            data = texto.encode("utf-8")
+            if len(data) > 0xFFFF:
+                raise ValueError(f"String demasiado largo para el snapshot: {texto[:40]}...")
+            self._refs[texto] = (len(self._buffer), len(data))
+            self._buffer.extend(data)
+        return self._refs[texto]
+
+    def bytes(self) -> bytes:
+        return bytes(self._buffer)
+
+
+def compilar_snapshot(catalogo: Dict[str, Any], sha256_origen: str) -> bytes:
+    """
+    Compila el catálogo (ya validado) a su representación binaria.
+
+    Args:
+        catalogo: Dict con "provincias", "cantones" y "distritos"
+        sha256_origen: Hash hexadecimal del JSON de origen
+
+    Returns:
+        Contenido del snapshot
+
+    Raises:
+        SnapshotInvalidoError: Si el catálogo trae campos que el formato no
+            representa (el snapshot no sería equivalente al JSON)
+    """
+    strings = _TablaStrings()
+    provincias, cantones, distritos = [], [], []
+    idx_prov, idx_cant = [], []
+
+    for prov in catalogo.get("provincias", []):
+        _verificar_campos(prov, ("codigo", "nombre"))
+        prov_codigo = prov["codigo"]
+        lista_cantones = catalogo.get("cantones", {}).get(prov_codigo, [])
+        idx_prov.append((prov_codigo, len(provincias)))
+        provincias.append((strings.ref(prov_codigo), strings.ref(prov["nombre"]), len(cantones), len(lista_cantones)))
+
+        for canton in lista_cantones:
+            _verificar_campos(canton, ("codigo", "nombre"))
+            key = f"{prov_codigo}-{canton['codigo']}"
+            lista_distritos = catalogo.get("distritos", {}).get(key, [])
+            idx_cant.append((key, len(cantones)))
+            cantones.append((strings.ref(canton["codigo"]), strings.ref(canton["nombre"]), len(distritos), len(lista_distritos)))
+
+            for distrito in lista_distritos:
+                _verificar_campos(distrito, ("codigo", "nombre", "codigoPostal"))
+                distritos.append((
+                    strings.ref(distrito["codigo"]),
+                    strings.ref(distrito["nombre"]),
+                    strings.ref(distrito.get("codigoPostal")),
+                ))
+
+    # Claves huérfanas no serían alcanzables desde el snapshot
+    if len(idx_cant) != sum(len(v) for v in catalogo.get("cantones", {}).values()):
+        raise SnapshotInvalidoError("Hay cantones de provincias que no existen en 'provincias'")
+    if len(distritos) != sum(len(v) for v in catalogo.get("distritos", {}).values()):
+        raise SnapshotInvalidoError("Hay distritos de cantones que no existen en 'cantones'")
+
+    cuerpo = bytearray()
+    offsets = {}
+
+    def _seccion(nombre, registros, empaquetar):
+        offsets[nombre] = _CABECERA.size + len(cuerpo)
+        for registro in registros:
+            cuerpo.extend(empaquetar(registro))
+
+    _seccion("prov", provincias, lambda r: _NODO.pack(*r[0], *r[1], r[2], r[3]))
+    _seccion("cant", cantones, lambda r: _NODO.pack(*r[0], *r[1], r[2], r[3]))
+    _seccion("dist", distritos, lambda r: _DISTRITO.pack(*r[0], *r[1], *r[2]))
+    # Las claves se ordenan por bytes UTF-8, igual que la búsqueda binaria
+    _seccion("idx_prov", sorted(idx_prov, key=lambda e: e[0].encode("utf-8")),
+             lambda e: _ENTRADA_INDICE.pack(*strings.ref(e[0]), e[1]))
+    _seccion("idx_cant", sorted(idx_cant, key=lambda e: e[0].encode("utf-8")),
+             lambda e: _ENTRADA_INDICE.pack(*strings.ref(e[0]), e[1]))
+
+    tabla = strings.bytes()
+    offsets["strings"] = _CABECERA.size + len(cuerpo)
+
+    cabecera = _CABECERA.pack(
+        MAGIC,
+        FORMATO_VERSION,
+        bytes.fromhex(sha256_origen),
+        len(provincias),
+        len(cantones),
+        len(distritos),
+        offsets["prov"],
+        offsets["cant"],
+        offsets["dist"],
+        offsets["idx_prov"],
+        offsets["idx_cant"],
+        offsets["strings"],
+        len(tabla),
+    )
+    return cabecera + bytes(cuerpo) + tabla
+
+
+def _verificar_campos(item: Dict[str, Any], permitidos: Tuple[str, ...]) -> None:
+    extra = set(item) - set(permitidos)
+    if extra:
+        raise SnapshotInvalidoError(f"Campos no soportados por el snapshot: {sorted(extra)}")
+
+
+def escribir_atomico(path: Path, contenido: bytes) -> None:
+    """
+    Escribe un archivo de forma atómica (temporal + rename): los workers
+    nunca leen un snapshot o catálogo a medio escribir.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(contenido)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class SnapshotCatalogo:
+    """
+    Lector del snapshot sobre un mmap de solo lectura.
+    Expone la misma interfaz de consulta que el catálogo en JSON.
+    """
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            try:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                raise SnapshotInvalidoError(f"Snapshot vacío: {path}") from e
+
+        if len(self._mm) < _CABECERA.size:
+            raise SnapshotInvalidoError(f"Snapshot truncado: {path}")
+
+        (
+            magic, formato, sha_raw,
+            self.num_provincias, self.num_cantones, self.num_distritos,
+            self._off_prov, self._off_cant, self._off_dist,
+            self._off_idx_prov, self._off_idx_cant,
+            self._off_strings, len_strings,
+        ) = _CABECERA.unpack_from(self._mm, 0)
+
+        if magic != MAGIC or formato != FORMATO_VERSION:
+            raise SnapshotInvalidoError(f"Formato de snapshot no soportado: {path}")
+        if self._off_strings + len_strings != len(self._mm):
+            raise SnapshotInvalidoError(f"Snapshot truncado: {path}")
+
+        self.sha256_origen = sha_raw.hex()
+
+    def _str(self, offset: int, largo: int) -> str:
+        inicio = self._off_strings + offset
+        return self._mm[inicio:inicio + largo].decode("utf-8")
+
+    def _buscar(self, off_indice: int, cantidad: int, clave: str) -> Optional[int]:
+        """Búsqueda binaria sobre un índice ordenado por clave."""
+        objetivo = clave.encode("utf-8")
+        lo, hi = 0, cantidad
+        while lo < hi:
+            mid = (lo + hi) // 2
+            s_off, s_len, registro = _ENTRADA_INDICE.unpack_from(
+                self._mm, off_indice + mid * _ENTRADA_INDICE.size
+            )
+            inicio = self._off_strings + s_off
+            actual = self._mm[inicio:inicio + s_len]
+            if actual == objetivo:
+                return registro
+            if actual < objetivo:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def _nodo(self, off_seccion: int, registro: int) -> Tuple[str, str, int, int]:
+        c_off, c_len, n_off, n_len, primero, cantidad = _NODO.unpack_from(
+            self._mm, off_seccion + registro * _NODO.size
+        )
+        return self._str(c_off, c_len), self._str(n_off, n_len), primero, cantidad
+
+    def get_provincias(self) -> List[Dict[str, str]]:
+        resultado = []
+        for registro in range(self.num_provincias):
+            codigo, nombre, _, _ = self._nodo(self._off_prov, registro)
+            resultado.append({"codigo": codigo, "nombre": nombre})
+        return resultado
+
+    def get_cantones(self, codigo_provincia: str) -> List[Dict[str, str]]:
+        registro = self._buscar(self._off_idx_prov, self.num_provincias, codigo_provincia)
+        if registro is None:
+            return []
+        _, _, primero, cantidad = self._nodo(self._off_prov, registro)
+        resultado = []
+        for i in range(primero, primero + cantidad):
+            codigo, nombre, _, _ = self._nodo(self._off_cant, i)
+            resultado.append({"codigo": codigo, "nombre": nombre})
+        return resultado
+
+    def get_distritos(self, codigo_provincia: str, codigo_canton: str) -> List[Dict[str, str]]:
+        key = f"{codigo_provincia}-{codigo_canton}"
+        registro = self._buscar(self._off_idx_cant, self.num_cantones, key)
+        if registro is None:
+            return []
+        _, _, primero, cantidad = self._nodo(self._off_cant, registro)
+        resultado = []
+        for i in range(primero, primero + cantidad):
+            c_off, c_len, n_off, n_len, p_off, p_len = _DISTRITO.unpack_from(
+                self._mm, self._off_dist + i * _DISTRITO.size
+            )
+            distrito = {"codigo": self._str(c_off, c_len), "nombre": self._str(n_off, n_len)}
+            if p_len:
+                distrito["codigoPostal"] = self._str(p_off, p_len)
+            resultado.append(distrito)
+        return resultado
+
+    def a_dict(self) -> Dict[str, Any]:
+        """Reconstruye el catálogo completo (para verificar la compilación)."""
+        provincias = self.get_provincias()
+        cantones = {p["codigo"]: self.get_cantones(p["codigo"]) for p in provincias}
+        distritos = {
+            f"{p}-{c['codigo']}": self.get_distritos(p, c["codigo"])
+            for p, lista in cantones.items()
+            for c in lista
+        }
+        return {"provincias": provincias, "cantones": cantones, "distritos": distritos}
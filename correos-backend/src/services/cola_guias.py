@@ -0,0 +1,349 @@
+"""
+Cola durable de guías a pre-generar (webhook orders/paid de Shopify).
+
+El webhook solo encola y responde; las guías se generan en segundo plano,
+repartidas en el tiempo en lugar de acumularse hasta que alguien las pide:
+
+- La cola es una tabla SQLite en la base de órdenes (Config.ORDENES_DB_PATH):
+  sobrevive a reinicios y la comparten todos los workers. Un mismo webhook
+  (X-Shopify-Webhook-Id) o una orden ya en cola no se encolan dos veces.
+- Un solo consumidor por host: el worker que toma el lock de archivo
+  (flock) procesa la cola; si se cae, otro lo toma en unos segundos.
+- Ritmo acotado: COLA_GUIAS_CONCURRENCIA guías a la vez y como mucho una
+  cada COLA_GUIAS_INTERVALO_SEGUNDOS, por el carril "fondo" del planificador
+  (las requests interactivas pasan primero).
+- Antes de generar se salta la orden si el registro de órdenes procesadas ya
+  tiene su guía (o la está generando), y se valida la dirección contra el
+  catálogo: una orden con datos faltantes queda "rechazada" para revisión
+  manual, sin reintentos. Los errores de Correos antes de registrar el envío
+  se reintentan con espera exponencial hasta COLA_GUIAS_MAX_INTENTOS, igual
+  que un rechazo de ccrRegistroEnvio; si ccrRegistroEnvio queda sin respuesta
+  con el número de guía ya consumido, Correos pudo haber registrado el envío y
+  la orden queda en "revision" (con ese número, y UNCERTAIN en el registro de
+  órdenes), sin reintentos que lo dupliquen.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin elección entre procesos (un solo worker)
+    fcntl = None
+
+from src.config import config
+from src.models.envio import RespuestaGuia
+from src.services.envio_service import RegistroInciertoError
+from src.services.logs import usar_request_id
+from src.services.metricas import registro
+from src.services.orden_guia import OrdenNoEnviableError, construir_solicitud
+from src.services.ordenes import repositorio_ordenes
+from src.services.ordenes_procesadas import (
+    ESTADO_INCIERTO, OrdenOcupadaError, abrir_base, describir_ocupada, guia_creada_o_en_curso,
+    registro_ordenes
+)
+from src.services.planificador import CARRIL_FONDO, usar_carril
+from src.services.plazo import usar_plazo
+from src.services.rate_limiter import TokenBucket
+from src.services.validacion_envio import EnvioInvalidoError
+
+logger = logging.getLogger(__name__)
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+HECHA = "hecha"
+OMITIDA = "omitida"
+RECHAZADA = "rechazada"
+REVISION = "revision"
+FALLIDA = "fallida"
+
+_trabajos = registro.contador(
+    "cola_guias_trabajos_total", "Órdenes procesadas por la cola de guías", ["resultado"]
+)
+_encoladas = registro.contador(
+    "cola_guias_encoladas_total", "Órdenes recibidas por webhook", ["resultado"]
+)
+
+_ESQUEMA = (
+    "CREATE TABLE IF NOT EXISTS cola_guias ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, orden_id INTEGER NOT NULL, webhook_id TEXT UNIQUE, "
+    "estado TEXT NOT NULL, intentos INTEGER NOT NULL DEFAULT 0, disponible_en REAL NOT NULL, "
+    "creada_en REAL NOT NULL, actualizada_en REAL NOT NULL, numero_envio TEXT, error TEXT)",
+    "CREATE INDEX IF NOT EXISTS ix_cola_guias_estado ON cola_guias (estado, disponible_en)",
+    # Una orden no puede estar dos veces en cola a la vez
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_cola_guias_orden_activa ON cola_guias (orden_id) "
+    "WHERE estado IN ('pendiente', 'en_curso')",
+)
+
+# Segundos entre intentos del consumidor por tomar el lock / buscar trabajo
+_ESPERA_LIDER = 5.0
+_ESPERA_COLA = 2.0
+
+
+class ColaGuias:
+    """
+    Args:
+        path: Archivo SQLite (la base de órdenes)
+        concurrencia: Guías generándose a la vez (0 = no consumir)
+        intervalo: Segundos mínimos entre el inicio de dos guías
+        max_intentos: Intentos por orden ante errores de Correos
+        reintento: Espera base (segundos) entre intentos; se duplica en cada uno
+    """
+
+    def __init__(
+        self,
+        path: str,
+        concurrencia: int = 2,
+        intervalo: float = 5.0,
+        max_intentos: int = 5,
+        reintento: float = 30.0,
+    ):
+        self.path = path
+        self.concurrencia = max(0, concurrencia)
+        self.intervalo = max(0.0, intervalo)
+        self.max_intentos = max(1, max_intentos)
+        self.reintento = reintento
+        self._local = threading.local()
+        self._hay_trabajo = threading.Event()
+        self._stop = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._procesar: Optional[Callable[..., RespuestaGuia]] = None
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = abrir_base(self.path, _ESQUEMA)
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return conexion
+
+    # ------------------------------------------------------------------
+    # Productor (webhook)
+    # ------------------------------------------------------------------
+
+    def encolar(self, orden: dict, webhook_id: Optional[str] = None) -> bool:
+        """
+        Guarda la orden en el repositorio y la encola.
+
+        Returns:
+            False si el webhook ya se había recibido o la orden ya está en cola
+        """
+        repositorio_ordenes.guardar(orden)
+        ahora = time.time()
+        cursor = self._conexion().execute(
+            "INSERT OR IGNORE INTO cola_guias "
+            "(orden_id, webhook_id, estado, disponible_en, creada_en, actualizada_en) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (int(orden["id"]), webhook_id, PENDIENTE, ahora, ahora, ahora),
+        )
+        encolada = cursor.rowcount == 1
+        _encoladas.inc(resultado="nueva" if encolada else "duplicada")
+        if encolada:
+            self._hay_trabajo.set()
+        return encolada
+
+    def resumen(self) -> Dict[str, int]:
+        """Trabajos por estado."""
+        filas = self._conexion().execute(
+            "SELECT estado, COUNT(*) FROM cola_guias GROUP BY estado"
+        ).fetchall()
+        return dict(filas)
+
+    # ------------------------------------------------------------------
+    # Consumidor
+    # ------------------------------------------------------------------
+
+    def iniciar(self, procesar: Callable[..., RespuestaGuia]) -> None:
+        """
+        Inicia el consumidor.
+
+        Args:
+            procesar: Pipeline bloqueante de generación de guía (el mismo de
+                /generar_guia); recibe la SolicitudGuia de la orden y `regenerar`
+        """
+        if self.concurrencia == 0 or self._hilo is not None:
+            return
+        self._procesar = procesar
+        self._stop.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="cola-guias", daemon=True)
+        self._hilo.start()
+
+    def detener(self) -> None:
+        """Deja de tomar trabajos y espera a los que están en curso."""
+        if self._hilo is None:
+            return
+        self._stop.set()
+        self._hay_trabajo.set()
+        self._hilo.join(timeout=config.SERVIDOR_APAGADO_SEGUNDOS)
+        self._hilo = None
+
+    def _tomar_lock(self):
+        ruta = self.path + ".cola.lock"
+        archivo = open(ruta, "a")
+        if fcntl is None:
+            return archivo
+        while not self._stop.is_set():
+            try:
+                fcntl.flock(archivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return archivo
+            except BlockingIOError:
+                self._stop.wait(_ESPERA_LIDER)
+        archivo.close()
+        return None
+
+    def _bucle(self) -> None:
+        # Crea la base (y su directorio, donde va el lock) si no existe
+        self._conexion()
+        lock = self._tomar_lock()
+        if lock is None:
+            return
+        logger.info("📬 Consumidor de la cola de guías activo (pid %d)", os.getpid())
+        try:
+            # Con el lock nadie más está procesando: lo que quedó en curso es
+            # de un consumidor caído
+            while not self._stop.is_set():
+                try:
+                    self._conexion().execute(
+                        "UPDATE cola_guias SET estado = ? WHERE estado = ?", (PENDIENTE, EN_CURSO)
+                    )
+                    break
+                except sqlite3.Error as e:
+                    logger.error("❌ No se pudo recuperar la cola de guías: %s", e)
+                    self._stop.wait(_ESPERA_COLA)
+            ritmo = TokenBucket(1.0 / self.intervalo, capacidad=1) if self.intervalo else None
+            libres = threading.BoundedSemaphore(self.concurrencia)
+            with ThreadPoolExecutor(self.concurrencia, thread_name_prefix="cola-guias") as pool:
+                while not self._stop.is_set():
+                    libres.acquire()
+                    try:
+                        trabajo = self._tomar()
+                    except sqlite3.Error as e:
+                        # p.ej. "database is locked": el hilo sigue y reintenta
+                        logger.error("❌ No se pudo leer la cola de guías: %s", e)
+                        trabajo = None
+                    if trabajo is None:
+                        libres.release()
+                        self._hay_trabajo.wait(_ESPERA_COLA)
+                        self._hay_trabajo.clear()
+                        continue
+                    if ritmo is not None:
+                        ritmo.adquirir()
+                    pool.submit(self._ejecutar, *trabajo).add_done_callback(lambda _: libres.release())
+        finally:
+            lock.close()
+
+    def _tomar(self):
+        fila = self._conexion().execute(
+            "UPDATE cola_guias SET estado = ?, actualizada_en = ? "
+            "WHERE id = (SELECT id FROM cola_guias WHERE estado = ? AND disponible_en <= ? "
+            "ORDER BY disponible_en, id LIMIT 1) RETURNING id, orden_id, intentos",
+            (EN_CURSO, time.time(), PENDIENTE, time.time()),
+        ).fetchone()
+        return fila
+
+    def _terminar(self, trabajo_id: int, estado: str, numero_envio: Optional[str] = None,
+                  error: Optional[str] = None) -> None:
+        self._conexion().execute(
+            "UPDATE cola_guias SET estado = ?, numero_envio = ?, error = ?, actualizada_en = ? WHERE id = ?",
+            (estado, numero_envio, error, time.time(), trabajo_id),
+        )
+        _trabajos.inc(resultado=estado)
+
+    def _ejecutar(self, trabajo_id: int, orden_id: int, intentos: int) -> None:
+        with usar_request_id(f"cola-{trabajo_id}"):
+            try:
+                self._generar(trabajo_id, orden_id, intentos)
+            except Exception as e:
+                logger.error("❌ Error inesperado en la cola de guías: %s", e, exc_info=True)
+                self._terminar(trabajo_id, FALLIDA, error=str(e))
+
+    def _revisar_incierta(self, trabajo_id: int, orden: dict, procesada) -> None:
+        # Una guía anterior de la orden quedó UNCERTAIN: otra podría duplicar el envío
+        logger.warning(
+            "⚠️ Orden %s con registro incierto de la guía %s; queda para revisión",
+            orden.get("name"), procesada.numero_envio
+        )
+        self._terminar(trabajo_id, REVISION, numero_envio=procesada.numero_envio,
+                       error=describir_ocupada(procesada))
+
+    def _generar(self, trabajo_id: int, orden_id: int, intentos: int) -> None:
+        orden = repositorio_ordenes.buscar(orden_id)
+        if orden is None:
+            self._terminar(trabajo_id, RECHAZADA, error="Orden no encontrada")
+            return
+
+        procesada = registro_ordenes.buscar(orden_id)
+        if procesada is not None and procesada.estado == ESTADO_INCIERTO:
+            self._revisar_incierta(trabajo_id, orden, procesada)
+            return
+        if guia_creada_o_en_curso(procesada, config.PLAZO_REQUEST_MAXIMO_SEGUNDOS):
+            logger.info("⏭️ Orden %s ya tiene guía; se omite", orden.get("name"))
+            self._terminar(trabajo_id, OMITIDA, numero_envio=procesada.numero_envio)
+            return
+
+        try:
+            solicitud = construir_solicitud(orden)
+        except OrdenNoEnviableError as e:
+            logger.warning("⚠️ Orden %s requiere revisión: %s", orden.get("name"), e)
+            self._terminar(trabajo_id, RECHAZADA, error=str(e))
+            return
+
+        try:
+            with usar_carril(CARRIL_FONDO), usar_plazo(config.PLAZO_REQUEST_MAXIMO_SEGUNDOS):
+                respuesta = self._procesar(solicitud, regenerar=False)
+        except OrdenOcupadaError as e:
+            if e.fila.estado == ESTADO_INCIERTO:
+                self._revisar_incierta(trabajo_id, orden, e.fila)
+                return
+            # Otro (la UI u otra request) la reclamó entre la lectura y ahora
+            logger.info("⏭️ Orden %s ya tiene guía o se está generando; se omite", orden.get("name"))
+            self._terminar(trabajo_id, OMITIDA, numero_envio=e.fila.numero_envio)
+            return
+        except EnvioInvalidoError as e:
+            # Reintentar no cambia el resultado: queda para revisión
+            logger.warning("⚠️ Orden %s requiere revisión: %s", orden.get("name"), e)
+            self._terminar(trabajo_id, RECHAZADA, error=str(e))
+            return
+        except RegistroInciertoError as e:
+            # Reintentar podría registrar la orden dos veces
+            logger.error(
+                "❌ Orden %s: registro de la guía %s incierto, queda para revisión: %s",
+                orden.get("name"), e.numero_envio, e.causa
+            )
+            self._terminar(trabajo_id, REVISION, numero_envio=e.numero_envio, error=str(e))
+            return
+        except Exception as e:
+            intentos += 1
+            if intentos >= self.max_intentos:
+                logger.error("❌ Orden %s sin guía tras %d intentos: %s", orden.get("name"), intentos, e)
+                self._terminar(trabajo_id, FALLIDA, error=str(e))
+                return
+            espera = self.reintento * 2 ** (intentos - 1)
+            logger.warning(
+                "⚠️ Guía de la orden %s falló (intento %d), reintento en %.0fs: %s",
+                orden.get("name"), intentos, espera, e
+            )
+            self._conexion().execute(
+                "UPDATE cola_guias SET estado = ?, intentos = ?, disponible_en = ?, error = ?, "
+                "actualizada_en = ? WHERE id = ?",
+                (PENDIENTE, intentos, time.time() + espera, str(e), time.time(), trabajo_id),
+            )
+            _trabajos.inc(resultado="reintento")
+            return
+
+        logger.info("✅ Guía %s pre-generada para la orden %s", respuesta.numero_envio, orden.get("name"))
+        self._terminar(trabajo_id, HECHA, numero_envio=respuesta.numero_envio)
+
+
+# Instancia global de la cola
+cola_guias = ColaGuias(
+    config.ORDENES_DB_PATH,
+    concurrencia=config.COLA_GUIAS_CONCURRENCIA,
+    intervalo=config.COLA_GUIAS_INTERVALO_SEGUNDOS,
+    max_intentos=config.COLA_GUIAS_MAX_INTENTOS,
+    reintento=config.COLA_GUIAS_REINTENTO_SEGUNDOS,
+)
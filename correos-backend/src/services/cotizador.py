@@ -0,0 +1,364 @@
+"""
+Cotización de envíos para el checkout (POST /cotizar).
+
+ccrTarifa depende solo de origen, destino y peso, así que se cachea:
+
+- El peso se redondea al tramo siguiente (COTIZAR_TRAMOS_GRAMOS; sobre el
+  último, al kilo siguiente) y cada (origen, destino, tramo) se consulta una
+  vez por COTIZAR_VIGENCIA_SEGUNDOS. Un carrito con muchas líneas al mismo
+  distrito y tramo cuesta una sola consulta.
+- Las tarifas viven en memoria (LRU) y en una tabla SQLite de la base de
+  órdenes, compartida entre workers y reinicios. `precalcular` la llena en
+  segundo plano para todos los distritos del catálogo.
+- Las que faltan se consultan en paralelo por el ejecutor SOAP (con el rate
+  limit de ccrTarifa), como mucho COTIZAR_CONCURRENCIA por pedido; dos
+  pedidos que necesitan la misma tarifa a la vez esperan la misma consulta.
+- Al vencer el plazo se responde con lo que haya: las consultas pendientes
+  siguen con su propio timeout (SOAP_TIMEOUT_SEGUNDOS, no el plazo del
+  pedido) y quedan en cache para el siguiente pedido.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from src.config import config
+from src.services import plazo
+from src.services.catalogo_service import catalogo_service
+from src.services.ejecutor_soap import ejecutor_soap
+from src.services.envio_service import envio_service
+from src.services.metricas import registro
+from src.services.ordenes_procesadas import abrir_base
+from src.services.planificador import CARRIL_FONDO, usar_carril
+from src.services.rate_limiter import LimiteExcedidoError
+from src.services.validacion_envio import resolver_codigo_postal
+
+logger = logging.getLogger(__name__)
+
+# Una ruta sin tarifa (Correos no respondió 00) se recuerda solo en memoria
+# y por poco tiempo: puede ser un error pasajero
+_VIGENCIA_SIN_TARIFA = 300.0
+
+_ESQUEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS tarifas (
+        origen TEXT NOT NULL,
+        destino TEXT NOT NULL,
+        tramo INTEGER NOT NULL,
+        monto_tarifa REAL NOT NULL,
+        impuesto REAL NOT NULL,
+        descuento REAL NOT NULL,
+        monto_total REAL NOT NULL,
+        consultada_en REAL NOT NULL,
+        PRIMARY KEY (origen, destino, tramo)
+    ) WITHOUT ROWID
+    """,
+)
+
+_tarifas = registro.contador(
+    "cotizar_tarifas_total", "Tarifas de /cotizar por origen de la respuesta", ["fuente"]
+)
+
+
+class Ruta(NamedTuple):
+    origen: str
+    destino: str
+    tramo: int
+
+
+class Tarifa(NamedTuple):
+    monto_tarifa: Optional[float]
+    impuesto: Optional[float]
+    descuento: Optional[float]
+    monto_total: Optional[float]
+    consultada_en: float
+
+
+def _sin_tarifa() -> Tarifa:
+    return Tarifa(None, None, None, None, time.time())
+
+
+class Cotizador:
+    """Tarifas de ccrTarifa por ruta y tramo de peso, con cache en memoria y SQLite."""
+
+    def __init__(
+        self,
+        path: str,
+        tramos: List[int],
+        vigencia: float,
+        capacidad: int,
+        concurrencia: int,
+        timeout: float,
+    ):
+        self.path = path
+        self.tramos = tramos
+        self.vigencia = vigencia
+        self.capacidad = max(1, capacidad)
+        self.concurrencia = max(1, concurrencia)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._memoria: "OrderedDict[Ruta, Tarifa]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Consultas en curso por ruta (event loop del worker)
+        self._en_vuelo: Dict[Ruta, asyncio.Future] = {}
+        self._precalculo: Optional[threading.Thread] = None
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = abrir_base(self.path, _ESQUEMA)
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return conexion
+
+    def tramo(self, peso: float) -> int:
+        """Gramos del tramo que cubre `peso`."""
+        for tramo in self.tramos:
+            if peso <= tramo:
+                return tramo
+        return int(math.ceil(peso / 1000.0)) * 1000
+
+    # ------------------------------------------------------------------
+    # Cache
+    # ------------------------------------------------------------------
+
+    def _vigente(self, tarifa: Tarifa) -> bool:
+        vigencia = self.vigencia if tarifa.monto_total is not None else min(self.vigencia, _VIGENCIA_SIN_TARIFA)
+        return time.time() - tarifa.consultada_en < vigencia
+
+    def _en_memoria(self, ruta: Ruta) -> Optional[Tarifa]:
+        with self._lock:
+            tarifa = self._memoria.get(ruta)
+            if tarifa is None:
+                return None
+            if not self._vigente(tarifa):
+                del self._memoria[ruta]
+                return None
+            self._memoria.move_to_end(ruta)
+            return tarifa
+
+    def _recordar(self, ruta: Ruta, tarifa: Tarifa) -> None:
+        with self._lock:
+            self._memoria[ruta] = tarifa
+            self._memoria.move_to_end(ruta)
+            while len(self._memoria) > self.capacidad:
+                self._memoria.popitem(last=False)
+
+    def _en_base(self, rutas: List[Ruta]) -> Dict[Ruta, Tarifa]:
+        """Tarifas vigentes guardadas (por otro worker, antes del reinicio o por precalcular)."""
+        encontradas = {}
+        desde = time.time() - self.vigencia
+        conexion = self._conexion()
+        for ruta in rutas:
+            fila = conexion.execute(
+                "SELECT monto_tarifa, impuesto, descuento, monto_total, consultada_en FROM tarifas "
+                "WHERE origen = ? AND destino = ? AND tramo = ? AND consultada_en > ?",
+                (*ruta, desde),
+            ).fetchone()
+            if fila is not None:
+                tarifa = Tarifa(*fila)
+                self._recordar(ruta, tarifa)
+                encontradas[ruta] = tarifa
+        return encontradas
+
+    def consultar(self, ruta: Ruta) -> Optional[Tarifa]:
+        """
+        Consulta ccrTarifa (bloqueante) y guarda el resultado.
+        None si Correos no tiene tarifa para la ruta.
+        """
+        respuesta = envio_service.consultar_tarifa(ruta.origen, ruta.destino, ruta.tramo)
+        if respuesta is None:
+            self._recordar(ruta, _sin_tarifa())
+            return None
+        tarifa = Tarifa(
+            float(respuesta["monto_tarifa"]),
+            float(respuesta["impuesto"]),
+            float(respuesta["descuento"]),
+            float(respuesta["monto_total"]),
+            time.time(),
+        )
+        self._recordar(ruta, tarifa)
+        self._conexion().execute(
+            "INSERT OR REPLACE INTO tarifas "
+            "(origen, destino, tramo, monto_tarifa, impuesto, descuento, monto_total, consultada_en) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (*ruta, *tarifa),
+        )
+        return tarifa
+
+    # ------------------------------------------------------------------
+    # Cotización
+    # ------------------------------------------------------------------
+
+    async def _consultar_limitado(self, ruta: Ruta, limite: asyncio.Semaphore) -> Optional[Tarifa]:
+        # La tarea la comparten varios pedidos y debe poder terminar después
+        # del plazo del que la lanzó: corre con su propio timeout
+        with plazo.usar_plazo_propio(self.timeout):
+            async with limite:
+                return await ejecutor_soap.ejecutar(self.consultar, ruta)
+
+    def _consulta(self, ruta: Ruta, limite: asyncio.Semaphore) -> asyncio.Future:
+        tarea = self._en_vuelo.get(ruta)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._consultar_limitado(ruta, limite))
+            self._en_vuelo[ruta] = tarea
+            tarea.add_done_callback(lambda _t: self._en_vuelo.pop(ruta, None))
+        return tarea
+
+    async def cotizar(self, items: List[Tuple[str, float]], origen: str) -> List[dict]:
+        """
+        Cotiza `items` (código postal de destino, gramos) desde `origen`.
+
+        Devuelve un resultado por ítem, en el mismo orden, con la tarifa o
+        `error`. Espera a Correos como mucho lo que queda del plazo.
+
+        Raises:
+            ValueError: Si el origen no es un distrito del catálogo
+        """
+        ubicacion = resolver_codigo_postal(origen)
+        if ubicacion is None:
+            raise ValueError(f"El código postal de origen {origen!r} no corresponde a un distrito del catálogo")
+
+        rutas: List[Optional[Ruta]] = []
+        for codigo, peso in items:
+            destino = resolver_codigo_postal(codigo)
+            rutas.append(Ruta(ubicacion.codigo_postal, destino.codigo_postal, self.tramo(peso)) if destino else None)
+
+        tarifas: Dict[Ruta, Tarifa] = {}
+        fuentes: Dict[Ruta, str] = {}
+        faltan = []
+        for ruta in dict.fromkeys(r for r in rutas if r):
+            tarifa = self._en_memoria(ruta)
+            if tarifa is None:
+                faltan.append(ruta)
+            elif tarifa.monto_total is None:
+                fuentes[ruta] = "sin_tarifa"
+            else:
+                tarifas[ruta], fuentes[ruta] = tarifa, "memoria"
+
+        if faltan:
+            guardadas = await asyncio.to_thread(self._en_base, faltan)
+            for ruta, tarifa in guardadas.items():
+                tarifas[ruta], fuentes[ruta] = tarifa, "base"
+            faltan = [r for r in faltan if r not in guardadas]
+
+        if faltan:
+            limite = asyncio.Semaphore(self.concurrencia)
+            consultas = {ruta: self._consulta(ruta, limite) for ruta in faltan}
+            # asyncio.wait no cancela: lo que no llegue a tiempo queda en cache
+            await asyncio.wait(consultas.values(), timeout=plazo.restante())
+            for ruta, tarea in consultas.items():
+                if not tarea.done():
+                    fuentes[ruta] = "plazo"
+                elif tarea.exception() is not None:
+                    logger.warning("No se pudo cotizar %s: %s", ruta, tarea.exception())
+                    fuentes[ruta] = "error"
+                elif tarea.result() is None:
+                    fuentes[ruta] = "sin_tarifa"
+                else:
+                    tarifas[ruta], fuentes[ruta] = tarea.result(), "correos"
+
+        resultados = []
+        for (codigo, peso), ruta in zip(items, rutas):
+            resultado = {"codigo_postal": codigo, "peso": peso}
+            if ruta is None:
+                _tarifas.inc(fuente="catalogo")
+                resultado["error"] = "El código postal no corresponde a un distrito del catálogo"
+            elif ruta in tarifas:
+                _tarifas.inc(fuente=fuentes[ruta])
+                tarifa = tarifas[ruta]
+                resultado.update(
+                    tramo=ruta.tramo,
+                    monto_tarifa=tarifa.monto_tarifa,
+                    impuesto=tarifa.impuesto,
+                    descuento=tarifa.descuento,
+                    monto_total=tarifa.monto_total,
+                    fuente=fuentes[ruta],
+                )
+            else:
+                _tarifas.inc(fuente=fuentes[ruta])
+                resultado["tramo"] = ruta.tramo
+                resultado["error"] = (
+                    "Correos no tiene tarifa para este destino" if fuentes[ruta] == "sin_tarifa"
+                    else "Tarifa no disponible, intente nuevamente"
+                )
+            resultados.append(resultado)
+        return resultados
+
+    # ------------------------------------------------------------------
+    # Precálculo
+    # ------------------------------------------------------------------
+
+    def _distritos(self) -> List[str]:
+        codigos = []
+        for provincia in catalogo_service.get_provincias():
+            p = provincia["codigo"]
+            for canton in catalogo_service.get_cantones(p):
+                for distrito in catalogo_service.get_distritos(p, canton["codigo"]):
+                    codigos.append(f"{p}{canton['codigo']}{distrito['codigo']}")
+        return codigos
+
+    def precalcular(self, origen: str) -> Dict[str, int]:
+        """
+        Consulta (carril de fondo, bloqueante) las tarifas de todos los
+        distritos del catálogo y tramos que no estén vigentes en la base.
+        """
+        rutas = [Ruta(origen, destino, tramo) for destino in self._distritos() for tramo in self.tramos]
+        vigentes = self._en_base(rutas)
+        resumen = {"vigentes": len(vigentes), "consultadas": 0, "sin_tarifa": 0, "errores": 0}
+        with usar_carril(CARRIL_FONDO):
+            for ruta in rutas:
+                if ruta in vigentes:
+                    continue
+                try:
+                    try:
+                        tarifa = self.consultar(ruta)
+                    except LimiteExcedidoError:
+                        # La cuota de ccrTarifa es compartida con el checkout: ceder y reintentar
+                        time.sleep(1)
+                        tarifa = self.consultar(ruta)
+                    if tarifa is None:
+                        resumen["sin_tarifa"] += 1
+                    else:
+                        resumen["consultadas"] += 1
+                except Exception as e:
+                    resumen["errores"] += 1
+                    logger.debug("No se pudo precalcular %s: %s", ruta, e)
+        logger.info("💰 Tarifas precalculadas desde %s: %s", origen, resumen)
+        return resumen
+
+    def iniciar_precalculo(self, origen: str) -> bool:
+        """
+        Lanza `precalcular` en un hilo; False si ya hay uno corriendo.
+
+        Raises:
+            ValueError: Si el origen no es un distrito del catálogo
+        """
+        ubicacion = resolver_codigo_postal(origen)
+        if ubicacion is None:
+            raise ValueError(f"El código postal de origen {origen!r} no corresponde a un distrito del catálogo")
+        # Mismas claves que cotizar: el código normalizado del distrito
+        origen = ubicacion.codigo_postal
+        with self._lock:
+            if self._precalculo is not None and self._precalculo.is_alive():
+                return False
+            self._precalculo = threading.Thread(
+                target=self.precalcular, args=(origen,), name="precalculo-tarifas", daemon=True
+            )
+            self._precalculo.start()
+            return True
+
+
+# Instancia global del cotizador
+cotizador = Cotizador(
+    config.ORDENES_DB_PATH,
+    tramos=config.COTIZAR_TRAMOS_GRAMOS,
+    vigencia=config.COTIZAR_VIGENCIA_SEGUNDOS,
+    capacidad=config.COTIZAR_CACHE_MEMORIA,
+    concurrencia=config.COTIZAR_CONCURRENCIA,
+    timeout=config.SOAP_TIMEOUT_SEGUNDOS,
+)
@@ -0,0 +1,180 @@
+"""
+Ejecutor acotado para el trabajo bloqueante contra Correos (SOAP + token).
+
+Los endpoints son `async def`, pero zeep y requests bloquean. Ejecutar ese
+trabajo directamente en el event loop frena todas las requests del worker
+(incluido /health). Este ejecutor lo corre en un pool de hilos de tamaño fijo
+con una cola de admisión acotada: cuando está lleno, rechaza enseguida con
+EjecutorSaturadoError en lugar de acumular requests sin límite.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from src.config import config
+from src.services import plazo
+from src.services.metricas import registro
+from src.services.perfilador import registrar_hilo
+from src.services.planificador import CARRIL_INTERACTIVO, carril_actual
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_en_curso = registro.medidor(
+    "soap_executor_en_curso", "Tareas SOAP ejecutándose en el pool"
+)
+_en_cola = registro.medidor(
+    "soap_executor_en_cola", "Tareas SOAP admitidas esperando un hilo libre"
+)
+_capacidad = registro.medidor(
+    "soap_executor_capacidad", "Capacidad del ejecutor SOAP", ["tipo"]
+)
+_rechazos = registro.contador(
+    "soap_executor_rechazos_total", "Tareas rechazadas por ejecutor saturado"
+)
+_espera_cola = registro.histograma(
+    "soap_executor_espera_cola_segundos", "Tiempo en cola antes de obtener un hilo"
+)
+_duracion = registro.histograma(
+    "soap_executor_duracion_segundos", "Duración de las tareas SOAP en el pool"
+)
+
+
+class EjecutorSaturadoError(Exception):
+    """El ejecutor está lleno (hilos ocupados y cola completa)."""
+
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        super().__init__(f"Servicio saturado. Reintente en {retry_after}s")
+
+
+def _dentro_de_plazo(fn: Callable[..., T], *args, **kwargs) -> T:
+    plazo.verificar("cola del ejecutor")
+    with registrar_hilo():
+        return fn(*args, **kwargs)
+
+
+class EjecutorSoap:
+    """
+    Pool de hilos de tamaño fijo con admisión acotada.
+
+    Admite como máximo `max_workers + max_cola` tareas a la vez; la siguiente
+    se rechaza sin esperar. Las tareas que no son del carril interactivo
+    pueden ocupar como máximo `max_workers - reserva_interactiva` lugares,
+    así un lote masivo nunca deja a la UI sin hilos.
+    """
+
+    def __init__(self, max_workers: int, max_cola: int, reserva_interactiva: int = 0):
+        self.max_workers = max_workers
+        self.max_cola = max_cola
+        self.limite_no_interactivo = max(1, max_workers - reserva_interactiva)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="soap")
+        self._lock = threading.Lock()
+        self._admitidas = 0
+        self._admitidas_no_interactivas = 0
+        self._ejecutando = 0
+        # Duración media móvil, para estimar Retry-After
+        self._duracion_media = 1.0
+
+        _capacidad.set(max_workers, tipo="workers")
+        _capacidad.set(max_cola, tipo="cola")
+
+    def _admitir(self, interactiva: bool) -> None:
+        with self._lock:
+            lleno = self._admitidas >= self.max_workers + self.max_cola
+            if not interactiva:
+                lleno = lleno or self._admitidas_no_interactivas >= self.limite_no_interactivo
+            if lleno:
+                _rechazos.inc()
+                raise EjecutorSaturadoError(self._estimar_retry_after())
+            self._admitidas += 1
+            if not interactiva:
+                self._admitidas_no_interactivas += 1
+            _en_cola.set(self._admitidas - self._ejecutando)
+
+    def _liberar(self, interactiva: bool) -> None:
+        with self._lock:
+            self._admitidas -= 1
+            if not interactiva:
+                self._admitidas_no_interactivas -= 1
+            _en_cola.set(self._admitidas - self._ejecutando)
+
+    def _estimar_retry_after(self) -> int:
+        # Tiempo aproximado para vaciar la cola actual
+        return max(1, round(self._duracion_media * (self._admitidas / self.max_workers)))
+
+    def _correr(self, encolada_en: float, fn: Callable[..., T]) -> T:
+        inicio = time.monotonic()
+        _espera_cola.observe(inicio - encolada_en)
+        with self._lock:
+            self._ejecutando += 1
+            _en_curso.set(self._ejecutando)
+            _en_cola.set(self._admitidas - self._ejecutando)
+        try:
+            return fn()
+        finally:
+            duracion = time.monotonic() - inicio
+            _duracion.observe(duracion)
+            with self._lock:
+                self._ejecutando -= 1
+                self._duracion_media = 0.9 * self._duracion_media + 0.1 * duracion
+                _en_curso.set(self._ejecutando)
+
+    def enviar(self, fn: Callable[..., T], *args, **kwargs) -> Future:
+        """
+        Encola fn(*args, **kwargs) en el pool y devuelve el Future.
+        El contexto (contextvars) del llamador se propaga al hilo; si el plazo
+        de la request vence mientras espera en cola, la tarea no se ejecuta.
+
+        Raises:
+            EjecutorSaturadoError: Si no hay lugar en el pool ni en la cola
+        """
+        interactiva = carril_actual() == CARRIL_INTERACTIVO
+        self._admitir(interactiva)
+        try:
+            ctx = contextvars.copy_context()
+            llamada = functools.partial(ctx.run, _dentro_de_plazo, fn, *args, **kwargs)
+            futuro = self._pool.submit(self._correr, time.monotonic(), llamada)
+        except BaseException:
+            self._liberar(interactiva)
+            raise
+        # El lugar se libera cuando el hilo termina, aunque el llamador
+        # haya dejado de esperar (p.ej. cliente desconectado)
+        futuro.add_done_callback(lambda _f: self._liberar(interactiva))
+        return futuro
+
+    async def ejecutar(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Ejecuta fn(*args, **kwargs) en el pool sin bloquear el event loop.
+
+        Raises:
+            EjecutorSaturadoError: Si no hay lugar en el pool ni en la cola
+        """
+        return await asyncio.wrap_future(self.enviar(fn, *args, **kwargs))
+
+    def estado(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "cola_maxima": self.max_cola,
+                "en_curso": self._ejecutando,
+                "en_cola": self._admitidas - self._ejecutando,
+                "admitidas_no_interactivas": self._admitidas_no_interactivas,
+            }
+
+    def cerrar(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Instancia global del ejecutor
+ejecutor_soap = EjecutorSoap(
+    max_workers=config.SOAP_EXECUTOR_WORKERS,
+    max_cola=config.SOAP_EXECUTOR_COLA,
+    reserva_interactiva=config.SOAP_RESERVA_INTERACTIVA,
+)
@@ -3,15 +3,36 @@ Servicio para registrar envío usando CCRREGISTROENVIO.
 """
 import logging
 import base64
+import binascii
 from datetime import datetime
 from decimal import Decimal
 from typing import Dict, Any, Optional, Tuple
 from src.config import config
+from src.services import plazo
+from src.services.almacen_pdf import almacen_pdf
+from src.services.metricas import BUCKETS_BYTES, registro
 from src.services.soap_client import soap_client
-from src.models.envio import SolicitudGuia
+from src.models.envio import DatosEtiqueta, SolicitudGuia
 
 logger = logging.getLogger(__name__)
 
+_tamano_pdf = registro.histograma(
+    "envio_pdf_bytes", "Tamaño del PDF de guía devuelto por ccrRegistroEnvio", buckets=BUCKETS_BYTES
+)
+
+
+class RegistroInciertoError(Exception):
+    """
+    ccrRegistroEnvio falló con un número de guía ya consumido: Correos pudo
+    haber registrado el envío (p.ej. un timeout con la solicitud enviada), así
+    que reintentar puede duplicarlo.
+    """
+
+    def __init__(self, numero_envio: str, causa: Exception):
+        self.numero_envio = numero_envio
+        self.causa = causa
+        super().__init__(f"No se sabe si el envío {numero_envio} quedó registrado: {causa}")
+
 
 class EnvioService:
     """Servicio para registrar envíos"""
@@ -35,21 +56,49 @@ class EnvioService:
         digits = digits[:5]
         return digits[0], digits[1:3], digits[3:5]
 
+    @staticmethod
+    def _pdf_a_bytes(pdf: Any) -> Optional[bytes]:
+        """
+        El PDF llega como bytes (xsd:base64Binary, ya decodificado por zeep)
+        o como texto base64. Se decodifica una sola vez aquí.
+        """
+        if not pdf:
+            return None
+        if isinstance(pdf, (bytes, bytearray)):
+            return bytes(pdf)
+        try:
+            return base64.b64decode(pdf)
+        except (binascii.Error, ValueError) as e:
+            logger.error("PDF de ccrRegistroEnvio no es base64 válido: %s", e)
+            return None
+
     @staticmethod
     def _consultar_tarifa(solicitud: SolicitudGuia) -> Optional[Dict[str, Any]]:
+        """Tarifa oficial de un envío ya armado (ver consultar_tarifa)."""
+        return EnvioService.consultar_tarifa(
+            solicitud.remitente.codigo_postal,
+            solicitud.destinatario.codigo_postal_zip or solicitud.destinatario.codigo_postal,
+            solicitud.peso
+        )
+
+    @staticmethod
+    def consultar_tarifa(origen: str, destino: str, peso: float) -> Optional[Dict[str, Any]]:
         """
         Consulta la tarifa oficial con el método ccrTarifa.
         Devuelve None si no se puede calcular (p.ej. código postal inválido).
+
+        Args:
+            origen: Código postal de origen (PCCDD)
+            destino: Código postal de destino (PCCDD)
+            peso: Peso en gramos
         """
-        origen = EnvioService._parse_codigo_postal_cr(solicitud.remitente.codigo_postal)
-        destino = EnvioService._parse_codigo_postal_cr(
-            solicitud.destinatario.codigo_postal_zip or solicitud.destinatario.codigo_postal
-        )
-        if not origen or not destino:
+        partes_origen = EnvioService._parse_codigo_postal_cr(origen)
+        partes_destino = EnvioService._parse_codigo_postal_cr(destino)
+        if not partes_origen or not partes_destino:
             return None
 
-        prov_o, canton_o, dist_o = origen
-        prov_d, canton_d, dist_d = destino
+        prov_o, canton_o, dist_o = partes_origen
+        prov_d, canton_d, dist_d = partes_destino
 
         req_tarifa = {
             "ProvinciaOrigen": prov_o,
@@ -58,7 +107,7 @@ class EnvioService:
             "ProvinciaDestino": prov_d,
             "CantonDestino": canton_d,
             "DistritoDestino": dist_d,
-            "Peso": Decimal(str(solicitud.peso)),
+            "Peso": Decimal(str(peso)),
             "Servicio": str(config.SERVICIO_ID),
         }
 
@@ -81,7 +130,7 @@ class EnvioService:
             return None
 
         if codigo != "00":
-            logger.warning(f"ccrTarifa no retornó 00. Código: {codigo}, Mensaje: {mensaje}")
+            logger.warning("ccrTarifa no retornó 00. Código: %s, Mensaje: %s", codigo, mensaje)
             return None
 
         # Normalizar a Decimal (Zeep normalmente ya entrega Decimal)
@@ -122,13 +171,17 @@ class EnvioService:
             Diccionario con:
                 - codigo_respuesta: Código de respuesta
                 - mensaje_respuesta: Mensaje de respuesta
-                - pdf_base64: PDF de la guía en Base64
+                - pdf: PDF de la guía (bytes) o None
+                - pdf_sha256: Referencia en el almacén local (None si no se guardó)
+                - tarifa: Tarifa oficial (si disponible)
                 
         Raises:
+            PlazoVencidoError: Si se agota el plazo de la request
             Exception: Si falla el registro
         """
         try:
-            logger.info(f"Registrando envío con número de guía: {numero_guia}")
+            plazo.verificar("registrar envío")
+            logger.debug("Registrando envío con número de guía: %s", numero_guia)
             
             # FECHA_ENVIO según WSDL: xsd:dateTime
             # Zeep espera un datetime (no timestamp int).
@@ -193,15 +246,15 @@ class EnvioService:
             if hasattr(result, 'CodRespuesta'):
                 codigo = result.CodRespuesta
                 mensaje = getattr(result, 'MensajeRespuesta', '')
-                pdf_base64 = getattr(result, 'PDF', None)
+                pdf_respuesta = getattr(result, 'PDF', None)
             elif isinstance(result, dict):
                 codigo = result.get('CodRespuesta')
                 mensaje = result.get('MensajeRespuesta', '')
-                pdf_base64 = result.get('PDF')
+                pdf_respuesta = result.get('PDF')
             else:
                 codigo = '00'
                 mensaje = 'Consulta exitosa'
-                pdf_base64 = getattr(result, 'PDF', None) if hasattr(result, 'PDF') else None
+                pdf_respuesta = getattr(result, 'PDF', None) if hasattr(result, 'PDF') else None
             
             # Validar código de respuesta
             if codigo != '00':
@@ -217,28 +270,58 @@ class EnvioService:
                 else:
                     raise Exception(f"Error desconocido: {mensaje}")
             
-            if not pdf_base64:
+            # Decodificar una vez y guardar: la etiqueta queda disponible
+            # aunque el cliente pierda esta respuesta
+            pdf = EnvioService._pdf_a_bytes(pdf_respuesta)
+            pdf_sha256 = None
+            if pdf is None:
                 logger.warning("No se recibió PDF en la respuesta")
+            else:
+                _tamano_pdf.observe(len(pdf))
+                try:
+                    pdf_sha256 = almacen_pdf.guardar(numero_guia, pdf)
+                except (OSError, ValueError) as e:
+                    logger.error("❌ No se pudo guardar el PDF de %s: %s", numero_guia, e)
+            
+            # Datos para renderizar la etiqueta localmente (ZPL / PDF compacto)
+            try:
+                datos_etiqueta = DatosEtiqueta(
+                    numero_envio=numero_guia,
+                    fecha_envio=fecha_envio_dt,
+                    remitente=solicitud.remitente,
+                    destinatario=solicitud.destinatario,
+                    peso=solicitud.peso,
+                    observaciones=solicitud.observaciones
+                )
+                almacen_pdf.guardar_datos(numero_guia, datos_etiqueta.model_dump_json().encode("utf-8"))
+            except (OSError, ValueError) as e:
+                logger.warning("No se pudieron guardar los datos de etiqueta de %s: %s", numero_guia, e)
             
-            logger.info("Envío registrado exitosamente")
+            logger.debug("Envío registrado exitosamente")
 
             # Consultar tarifa oficial (si posible) para saber el monto cobrado por Correos
+            # La guía ya está registrada: si no queda plazo se omite la tarifa
+            # en lugar de hacer fallar la request
             tarifa = None
-            try:
-                tarifa = EnvioService._consultar_tarifa(solicitud)
-            except Exception as e:
-                logger.warning(f"No se pudo consultar tarifa (ccrTarifa): {e}")
+            if plazo.vencido():
+                logger.warning("Sin plazo para consultar tarifa (ccrTarifa); se omite")
+            else:
+                try:
+                    tarifa = EnvioService._consultar_tarifa(solicitud)
+                except Exception as e:
+                    logger.warning("No se pudo consultar tarifa (ccrTarifa): %s", e)
             
             return {
                 'codigo_respuesta': codigo,
                 'mensaje_respuesta': mensaje,
-                'pdf_base64': pdf_base64,
+                'pdf': pdf,
+                'pdf_sha256': pdf_sha256,
                 # Tarifa oficial reportada por Correos (si disponible)
                 'tarifa': tarifa,
             }
             
         except Exception as e:
-            logger.error(f"Error al registrar envío: {e}")
+            logger.error("Error al registrar envío: %s", e)
             raise
 
 
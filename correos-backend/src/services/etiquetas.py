@@ -0,0 +1,267 @@
+"""
+Etiquetas renderizadas localmente para impresoras térmicas.
+
+El PDF que devuelve ccrRegistroEnvio es pesado y las térmicas tardan en
+rasterizarlo. Con los mismos datos que se envían a Correos (ENVIO_ID,
+DEST_*, SEND_*, PESO, OBSERVACIONES) aquí se arma:
+
+- ZPL II (Zebra y compatibles): la impresora dibuja texto y código de barras
+  sin rasterizar nada en el host.
+- Un PDF mínimo con fpdf2 (fuente Helvetica del visor, sin embeber, y
+  barras Code 128 como rectángulos vectoriales), de 1-2 KB.
+
+Ambas etiquetas son de 4x6 pulgadas. Lo que no cambia entre etiquetas (la
+plantilla ZPL, la tabla de Code 128 y las barras de cada número) se arma una
+sola vez y queda cacheado; renderizar cuesta milisegundos.
+"""
+import textwrap
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Tuple
+
+from fpdf import FPDF
+
+from src.models.envio import DatosEtiqueta
+from src.services.metricas import registro
+
+# Tamaño de la etiqueta: 4x6 pulgadas
+ANCHO_PT, ALTO_PT = 288, 432
+DPI_ZPL = 203
+ANCHO_ZPL, ALTO_ZPL = 4 * DPI_ZPL, 6 * DPI_ZPL
+
+FORMATOS = ("zpl", "pdf")
+
+_renderizadas = registro.contador(
+    "etiquetas_locales_total", "Etiquetas renderizadas localmente por formato", ["formato"]
+)
+
+# Code 128: anchos (barra, espacio, barra...) de cada símbolo, en módulos
+_CODE128 = (
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213", "122312", "132212", "221213",
+    "221312", "231212", "112232", "122132", "122231", "113222", "123122", "123221", "223211", "221132",
+    "221231", "213212", "223112", "312131", "311222", "321122", "321221", "312212", "322112", "322211",
+    "212123", "212321", "232121", "111323", "131123", "131321", "112313", "132113", "132311", "211313",
+    "231113", "231311", "112133", "112331", "132131", "113123", "113321", "133121", "313121", "211331",
+    "231131", "213113", "213311", "213131", "311123", "311321", "331121", "312113", "312311", "332111",
+    "314111", "221411", "431111", "111224", "111422", "121124", "121421", "141122", "141221", "112214",
+    "112412", "122114", "122411", "142112", "142211", "241211", "221114", "413111", "241112", "134111",
+    "111242", "121142", "121241", "114212", "124112", "124211", "411212", "421112", "421211", "212141",
+    "214121", "412121", "111143", "111341", "131141", "114113", "114311", "411113", "411311", "113141",
+    "114131", "311141", "411131", "211412", "211214", "211232", "2331112",
+)
+_INICIO_B = 104
+_FIN = 106
+
+
+@lru_cache(maxsize=1024)
+def barras_code128(valor: str) -> Tuple[Tuple[int, int], ...]:
+    """
+    Barras de `valor` en Code 128 (juego B): tuplas (inicio, ancho) en
+    módulos, sin zonas de silencio.
+
+    Raises:
+        ValueError: Si hay caracteres fuera de ASCII imprimible
+    """
+    codigos = [_INICIO_B]
+    for caracter in valor:
+        codigo = ord(caracter) - 32
+        if not 0 <= codigo <= 95:
+            raise ValueError(f"Carácter no soportado en Code 128: {caracter!r}")
+        codigos.append(codigo)
+    control = (codigos[0] + sum(i * c for i, c in enumerate(codigos[1:], start=1))) % 103
+    codigos.extend([control, _FIN])
+
+    barras: List[Tuple[int, int]] = []
+    x = 0
+    for codigo in codigos:
+        for i, ancho in enumerate(_CODE128[codigo]):
+            ancho = int(ancho)
+            if i % 2 == 0:
+                barras.append((x, ancho))
+            x += ancho
+    return tuple(barras)
+
+
+def _modulos_code128(valor: str) -> int:
+    # 11 módulos por símbolo (inicio, datos, control) + 13 del fin
+    return 11 * (len(valor) + 2) + 13
+
+
+def _fecha(datos: DatosEtiqueta) -> str:
+    return (datos.fecha_envio or datetime.now()).strftime("%d/%m/%Y")
+
+
+# ---------------------------------------------------------------------------
+# ZPL
+# ---------------------------------------------------------------------------
+
+def _campo_zpl(texto: str) -> str:
+    """Escapa para ^FH (indicador _): _, ^, ~ y \\ en hex; sin saltos de línea."""
+    texto = " ".join(str(texto or "").split())
+    return (
+        texto.replace("_", "_5F").replace("^", "_5E").replace("~", "_7E").replace("\\", "_5C")
+    )
+
+
+# Plantilla fija (se arma una vez); ^CI28 = UTF-8, ^FH = escapes en hex
+_PLANTILLA_ZPL = "\n".join([
+    "^XA",
+    "^CI28",
+    f"^PW{ANCHO_ZPL}",
+    f"^LL{ALTO_ZPL}",
+    "^LH0,0",
+    "^FO40,30^A0N,42,42^FDCorreos de Costa Rica^FS",
+    "^FO560,38^A0N,28,28^FH^FD{fecha}^FS",
+    "^FO40,90^GB732,3,3^FS",
+    "^FO{x_barras},115^BY3,3,170^BCN,170,N,N,N^FH^FD{numero}^FS",
+    "^FO40,300^A0N,40,40^FB732,1,0,C^FH^FD{numero}^FS",
+    "^FO40,360^GB732,3,3^FS",
+    "^FO40,380^A0N,26,26^FDDESTINATARIO^FS",
+    "^FO40,415^A0N,44,44^FB732,2,0,L^FH^FD{dest_nombre}^FS",
+    "^FO40,510^A0N,32,32^FB732,4,4,L^FH^FD{dest_direccion}^FS",
+    "^FO40,665^A0N,32,32^FH^FDTel: {dest_telefono}^FS",
+    "^FO420,665^A0N,32,32^FH^FDCP: {dest_cp}^FS",
+    "^FO40,720^GB732,3,3^FS",
+    "^FO40,740^A0N,26,26^FDREMITENTE^FS",
+    "^FO40,775^A0N,30,30^FB732,1,0,L^FH^FD{send_nombre}^FS",
+    "^FO40,815^A0N,26,26^FB732,3,2,L^FH^FD{send_direccion}^FS",
+    "^FO40,905^A0N,26,26^FH^FDTel: {send_telefono}   CP: {send_cp}^FS",
+    "^FO40,955^GB732,3,3^FS",
+    "^FO40,975^A0N,30,30^FH^FDPeso: {peso} g^FS",
+    "^FO40,1020^A0N,26,26^FB732,4,2,L^FH^FDObs: {observaciones}^FS",
+    "^XZ",
+    "",
+])
+
+
+def renderizar_zpl(datos: DatosEtiqueta) -> bytes:
+    """Etiqueta 4x6" a 203 dpi en ZPL II (UTF-8)."""
+    numero = _campo_zpl(datos.numero_envio)
+    # Centrar el código de barras (módulo de 3 puntos)
+    ancho_barras = 3 * _modulos_code128(datos.numero_envio)
+    zpl = _PLANTILLA_ZPL.format(
+        fecha=_campo_zpl(_fecha(datos)),
+        numero=numero,
+        x_barras=max(20, (ANCHO_ZPL - ancho_barras) // 2),
+        dest_nombre=_campo_zpl(datos.destinatario.nombre),
+        dest_direccion=_campo_zpl(datos.destinatario.direccion),
+        dest_telefono=_campo_zpl(datos.destinatario.telefono),
+        dest_cp=_campo_zpl(datos.destinatario.codigo_postal_zip or datos.destinatario.codigo_postal),
+        send_nombre=_campo_zpl(datos.remitente.nombre),
+        send_direccion=_campo_zpl(datos.remitente.direccion),
+        send_telefono=_campo_zpl(datos.remitente.telefono),
+        send_cp=_campo_zpl(datos.remitente.codigo_postal),
+        peso=f"{datos.peso:g}",
+        observaciones=_campo_zpl(datos.observaciones or "-"),
+    )
+    _renderizadas.inc(formato="zpl")
+    return zpl.encode("utf-8")
+
+
+# ---------------------------------------------------------------------------
+# PDF
+# ---------------------------------------------------------------------------
+
+def _latin1(texto: str) -> str:
+    """Helvetica (fuente estándar, sin embeber) solo cubre latin-1."""
+    return " ".join(str(texto or "").split()).encode("latin-1", "replace").decode("latin-1")
+
+
+def _lineas(texto: str, caracteres: int, maximo: int) -> List[str]:
+    lineas = textwrap.wrap(_latin1(texto), caracteres) or [""]
+    if len(lineas) > maximo:
+        lineas = lineas[:maximo]
+        lineas[-1] = lineas[-1][:max(0, caracteres - 3)] + "..."
+    return lineas
+
+
+class _EtiquetaPDF(FPDF):
+    """FPDF sin metadatos variables ni márgenes, para etiquetas de 4x6"."""
+
+    def __init__(self):
+        super().__init__(unit="pt", format=(ANCHO_PT, ALTO_PT))
+        self.set_auto_page_break(False)
+        self.set_margin(0)
+        self.set_creation_date(datetime(2000, 1, 1))
+        self.set_creator("correos-backend")
+        self.set_producer("correos-backend")
+
+
+def renderizar_pdf(datos: DatosEtiqueta) -> bytes:
+    """Etiqueta 4x6" en PDF vectorial mínimo (fpdf2)."""
+    pdf = _EtiquetaPDF()
+    pdf.add_page()
+    izquierda, ancho = 14.0, ANCHO_PT - 28.0
+
+    pdf.set_font("helvetica", "B", 13)
+    pdf.text(izquierda, 24, "Correos de Costa Rica")
+    pdf.set_font("helvetica", "", 9)
+    pdf.text(ANCHO_PT - 14 - pdf.get_string_width(_fecha(datos)), 24, _fecha(datos))
+    pdf.line(izquierda, 32, izquierda + ancho, 32)
+
+    # Código de barras centrado
+    modulos = _modulos_code128(datos.numero_envio)
+    modulo = min(1.2, ancho / modulos)
+    x0 = (ANCHO_PT - modulos * modulo) / 2
+    for inicio, ancho_barra in barras_code128(datos.numero_envio):
+        pdf.rect(x0 + inicio * modulo, 40, ancho_barra * modulo, 56, style="F")
+    pdf.set_font("helvetica", "B", 14)
+    numero = _latin1(datos.numero_envio)
+    pdf.text((ANCHO_PT - pdf.get_string_width(numero)) / 2, 112, numero)
+    pdf.line(izquierda, 122, izquierda + ancho, 122)
+
+    y = 136.0
+    pdf.set_font("helvetica", "B", 8)
+    pdf.text(izquierda, y, "DESTINATARIO")
+    pdf.set_font("helvetica", "B", 14)
+    for linea in _lineas(datos.destinatario.nombre, 34, 2):
+        y += 16
+        pdf.text(izquierda, y, linea)
+    pdf.set_font("helvetica", "", 10)
+    for linea in _lineas(datos.destinatario.direccion, 52, 4):
+        y += 12
+        pdf.text(izquierda, y, linea)
+    y += 14
+    destino_cp = datos.destinatario.codigo_postal_zip or datos.destinatario.codigo_postal
+    pdf.text(izquierda, y, _latin1(f"Tel: {datos.destinatario.telefono}    CP: {destino_cp}"))
+    y += 10
+    pdf.line(izquierda, y, izquierda + ancho, y)
+
+    y += 14
+    pdf.set_font("helvetica", "B", 8)
+    pdf.text(izquierda, y, "REMITENTE")
+    pdf.set_font("helvetica", "", 9)
+    for linea in _lineas(datos.remitente.nombre, 58, 1) + _lineas(datos.remitente.direccion, 58, 3):
+        y += 11
+        pdf.text(izquierda, y, linea)
+    y += 11
+    pdf.text(izquierda, y, _latin1(f"Tel: {datos.remitente.telefono}    CP: {datos.remitente.codigo_postal}"))
+    y += 9
+    pdf.line(izquierda, y, izquierda + ancho, y)
+
+    y += 14
+    pdf.set_font("helvetica", "B", 10)
+    pdf.text(izquierda, y, f"Peso: {datos.peso:g} g")
+    if datos.observaciones:
+        pdf.set_font("helvetica", "", 9)
+        for linea in _lineas(f"Obs: {datos.observaciones}", 58, 4):
+            y += 11
+            pdf.text(izquierda, y, linea)
+
+    _renderizadas.inc(formato="pdf")
+    return bytes(pdf.output())
+
+
+def renderizar(datos: DatosEtiqueta, formato: str) -> Tuple[bytes, str]:
+    """
+    Returns:
+        (contenido, media type)
+
+    Raises:
+        ValueError: Si el formato no es zpl ni pdf
+    """
+    if formato == "zpl":
+        return renderizar_zpl(datos), "application/x-zpl; charset=utf-8"
+    if formato == "pdf":
+        return renderizar_pdf(datos), "application/pdf"
+    raise ValueError(f"Formato inválido: {formato}. Debe ser: {', '.join(FORMATOS)}")
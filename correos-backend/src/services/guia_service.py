@@ -3,6 +3,7 @@ Servicio para generar número de guía usando CCRGENERARGUIA.
 """
 import logging
 from typing import Dict, Any
+from src.services import plazo
 from src.services.soap_client import soap_client
 
 logger = logging.getLogger(__name__)
@@ -23,10 +24,12 @@ class GuiaService:
                 - mensaje_respuesta: Mensaje de respuesta
                 
         Raises:
+            PlazoVencidoError: Si se agota el plazo de la request
             Exception: Si falla la generación
         """
         try:
-            logger.info("Generando número de guía con CCRGENERARGUIA...")
+            plazo.verificar("generar número de guía")
+            logger.debug("Generando número de guía con CCRGENERARGUIA...")
             
             # Llamar al método SOAP
             # Nota: Según la documentación, este método puede no requerir parámetros
@@ -68,7 +71,7 @@ class GuiaService:
             if not numero_envio:
                 raise Exception("No se recibió número de envío en la respuesta")
             
-            logger.info(f"Número de guía generado exitosamente: {numero_envio}")
+            logger.info("Número de guía generado exitosamente: %s", numero_envio)
             
             return {
                 'numero_envio': numero_envio,
@@ -77,7 +80,7 @@ class GuiaService:
             }
             
         except Exception as e:
-            logger.error(f"Error al generar número de guía: {e}")
+            logger.error("Error al generar número de guía: %s", e)
             raise
 
 
@@ -0,0 +1,223 @@
+"""
+Hedged requests para operaciones idempotentes de Correos.
+
+Si el primer intento no respondió después de un retardo (percentil de la
+latencia reciente de la operación), se lanza un segundo intento y se usa el
+que responda primero. Un presupuesto limita la fracción de llamadas que
+pueden duplicarse, así el p99 baja sin duplicar la carga hacia Correos.
+
+Solo para operaciones sin efectos (tarifas, catálogo): ccrGenerarGuia y
+ccrRegistroEnvio se ignoran aunque estén en SOAP_HEDGING_OPERACIONES (un
+segundo intento consumiría o registraría otra guía).
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, Iterable, Optional, TypeVar
+
+from src.services import plazo
+from src.services.metricas import registro
+from src.services.perfilador import registrar_hilo
+from src.services.plazo import PlazoVencidoError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Un segundo intento de estas duplica guías: nunca llevan hedge
+OPERACIONES_NO_IDEMPOTENTES = frozenset({"ccrGenerarGuia", "ccrRegistroEnvio"})
+
+_hedges = registro.contador(
+    "soap_hedging_total", "Segundos intentos lanzados (hedges)", ["operacion"]
+)
+_ganados = registro.contador(
+    "soap_hedging_ganados_total", "Hedges que respondieron antes que el primer intento", ["operacion"]
+)
+_omitidos = registro.contador(
+    "soap_hedging_omitidos_total", "Hedges no lanzados por presupuesto agotado", ["operacion"]
+)
+
+
+class _VentanaLatencias:
+    """Últimas N latencias exitosas de una operación, con percentil cacheado."""
+
+    RECALCULAR_CADA = 16
+
+    def __init__(self, tamano: int):
+        self._muestras: Deque[float] = deque(maxlen=tamano)
+        self._desde_calculo = 0
+        self._percentil: Optional[float] = None
+
+    def agregar(self, segundos: float) -> None:
+        self._muestras.append(segundos)
+        self._desde_calculo += 1
+
+    def percentil(self, p: float, minimo_muestras: int) -> Optional[float]:
+        if len(self._muestras) < minimo_muestras:
+            return None
+        if self._percentil is None or self._desde_calculo >= self.RECALCULAR_CADA:
+            ordenadas = sorted(self._muestras)
+            indice = min(len(ordenadas) - 1, int(len(ordenadas) * p / 100.0))
+            self._percentil = ordenadas[indice]
+            self._desde_calculo = 0
+        return self._percentil
+
+
+class Hedger:
+    """
+    Ejecuta intentos con hedging para las operaciones habilitadas.
+
+    Args:
+        operaciones: Operaciones idempotentes habilitadas (las de
+            OPERACIONES_NO_IDEMPOTENTES se ignoran con un warning)
+        percentil: Percentil de latencia usado como retardo del hedge
+        retardo_inicial: Retardo mientras no hay suficientes muestras
+        retardo_minimo: Retardo mínimo (evita duplicar llamadas rápidas)
+        tasa_maxima: Fracción máxima de llamadas que pueden llevar hedge
+        max_workers: Hilos para los intentos
+    """
+
+    MINIMO_MUESTRAS = 20
+
+    def __init__(
+        self,
+        operaciones: Iterable[str],
+        percentil: float = 95.0,
+        retardo_inicial: float = 1.0,
+        retardo_minimo: float = 0.05,
+        tasa_maxima: float = 0.1,
+        max_workers: int = 8,
+        tamano_ventana: int = 256,
+    ):
+        operaciones = frozenset(op for op in operaciones if op)
+        ignoradas = operaciones & OPERACIONES_NO_IDEMPOTENTES
+        if ignoradas:
+            logger.warning(
+                "⚠️ Hedging ignorado para operaciones no idempotentes: %s", ", ".join(sorted(ignoradas))
+            )
+        self.operaciones = operaciones - OPERACIONES_NO_IDEMPOTENTES
+        self.percentil = percentil
+        self.retardo_inicial = retardo_inicial
+        self.retardo_minimo = retardo_minimo
+        self.tasa_maxima = tasa_maxima
+        self._tamano_ventana = tamano_ventana
+        self._ventanas: Dict[str, _VentanaLatencias] = {}
+        self._max_workers = max_workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Presupuesto: cada llamada suma tasa_maxima, cada hedge cuesta 1;
+        # se acumula hasta el equivalente a 100 llamadas (absorbe ráfagas)
+        self._credito = 1.0
+        self._credito_maximo = max(1.0, 100 * tasa_maxima)
+
+    def habilitado(self, operacion: str) -> bool:
+        return operacion in self.operaciones
+
+    def _pool_intentos(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self._max_workers, thread_name_prefix="soap-hedge"
+                    )
+        return self._pool
+
+    def retardo(self, operacion: str) -> float:
+        with self._lock:
+            ventana = self._ventanas.get(operacion)
+            valor = ventana.percentil(self.percentil, self.MINIMO_MUESTRAS) if ventana else None
+        if valor is None:
+            return self.retardo_inicial
+        return max(self.retardo_minimo, valor)
+
+    def _registrar_latencia(self, operacion: str, segundos: float) -> None:
+        with self._lock:
+            ventana = self._ventanas.get(operacion)
+            if ventana is None:
+                ventana = self._ventanas[operacion] = _VentanaLatencias(self._tamano_ventana)
+            ventana.agregar(segundos)
+
+    def _acumular_credito(self) -> None:
+        with self._lock:
+            self._credito = min(self._credito_maximo, self._credito + self.tasa_maxima)
+
+    def _gastar_credito(self) -> bool:
+        with self._lock:
+            if self._credito >= 1.0:
+                self._credito -= 1.0
+                return True
+            return False
+
+    def _lanzar(self, operacion: str, intento: Callable[[bool], T], es_hedge: bool) -> Future:
+        def _medido():
+            inicio = time.monotonic()
+            with registrar_hilo():
+                resultado = intento(es_hedge)
+            self._registrar_latencia(operacion, time.monotonic() - inicio)
+            return resultado
+
+        ctx = contextvars.copy_context()
+        return self._pool_intentos().submit(ctx.run, _medido)
+
+    def ejecutar(self, operacion: str, intento: Callable[[bool], T]) -> T:
+        """
+        Ejecuta `intento(es_hedge)` con hedging.
+
+        Args:
+            operacion: Nombre de la operación (para latencias y métricas)
+            intento: Función que hace una llamada completa; recibe True si es el hedge
+
+        Returns:
+            El resultado del primer intento que termine bien
+        """
+        self._acumular_credito()
+        retardo = self.retardo(operacion)
+        primero = self._lanzar(operacion, intento, es_hedge=False)
+
+        # Sin esperar el retardo entero si el plazo vence antes
+        restante = plazo.restante()
+        espera = retardo if restante is None else max(0.0, min(retardo, restante))
+        done, _ = wait([primero], timeout=espera)
+        if done:
+            return primero.result()
+
+        pendientes = {primero}
+        segundo = None
+        if plazo.vencido():
+            pass
+        elif self._gastar_credito():
+            _hedges.inc(operacion=operacion)
+            logger.info("Hedge de %s: sin respuesta en %.0fms", operacion, retardo * 1000)
+            segundo = self._lanzar(operacion, intento, es_hedge=True)
+            pendientes.add(segundo)
+        else:
+            _omitidos.inc(operacion=operacion)
+
+        error = None
+        while pendientes:
+            done, pendientes = wait(pendientes, timeout=plazo.restante(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise PlazoVencidoError(f"{operacion} (hedging)")
+            # Preferir el que terminó bien; el otro sigue y su resultado se descarta
+            for futuro in done:
+                if futuro.exception() is None:
+                    if futuro is segundo:
+                        _ganados.inc(operacion=operacion)
+                    return futuro.result()
+                if error is None or futuro is primero:
+                    error = futuro.exception()
+        raise error
+
+    def estado(self) -> dict:
+        return {
+            "operaciones": sorted(self.operaciones),
+            "retardos_ms": {op: round(self.retardo(op) * 1000, 1) for op in sorted(self.operaciones)},
+            "credito": round(self._credito, 2),
+        }
+
+    def cerrar(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,237 @@
+"""
+Logging estructurado y no bloqueante.
+
+Los handlers de `logging` escriben al stream en el hilo que loguea: en un
+endpoint async eso es I/O síncrona en el event loop. Aquí el root logger solo
+tiene un QueueHandler que encola el record (sin formatearlo) y un hilo
+QueueListener lo formatea (JSON o texto) y lo escribe.
+
+- Formato lazy: usar `logger.info("guía %s", numero)`; el mensaje se arma en
+  el hilo de escritura y solo si el nivel lo deja pasar.
+- Cada record lleva el request id y el carril de la request en curso.
+- Niveles por logger desde Config.LOG_LEVEL: "INFO,zeep=WARNING,src.services.soap_client=DEBUG".
+- Muestreo: `LOG_MUESTREO` ("src.api.endpoints=0.1") o `extra={"muestreo": 0.01}`
+  en líneas de alto volumen. WARNING y superiores nunca se descartan.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional, Tuple
+
+from src.config import config
+from src.services.metricas import registro
+from src.services.planificador import carril_actual
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_descartados = registro.contador(
+    "logs_descartados_total", "Líneas de log descartadas", ["motivo"]
+)
+
+# Atributos propios de LogRecord (el resto viene de extra=...)
+_ATRIBUTOS_RECORD = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message", "asctime", "request_id", "carril", "muestreo",
+    # uvicorn agrega el mensaje con colores ANSI
+    "color_message",
+}
+
+
+def nuevo_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def request_id_actual() -> Optional[str]:
+    return _request_id.get()
+
+
+@contextmanager
+def usar_request_id(request_id: str) -> Iterator[None]:
+    """Asocia `request_id` a los logs del bloque (y de los hilos que lo hereden)."""
+    token = _request_id.set(request_id)
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+
+def _parse_niveles(valor: str) -> Tuple[str, Dict[str, str]]:
+    """"INFO,zeep=WARNING" -> ("INFO", {"zeep": "WARNING"})."""
+    raiz = "INFO"
+    niveles = {}
+    for parte in (valor or "").split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        if "=" in parte:
+            nombre, nivel = parte.split("=", 1)
+            niveles[nombre.strip()] = nivel.strip().upper()
+        else:
+            raiz = parte.upper()
+    return raiz, niveles
+
+
+class FiltroContexto(logging.Filter):
+    """
+    Agrega request_id y carril al record y aplica el muestreo.
+    Corre en el hilo que loguea (el ContextVar no existe en el hilo de escritura).
+    """
+
+    def __init__(self, muestreo_por_logger: Dict[str, float]):
+        super().__init__()
+        self.muestreo_por_logger = muestreo_por_logger
+
+    def _tasa(self, record: logging.LogRecord) -> float:
+        tasa = getattr(record, "muestreo", None)
+        if tasa is not None:
+            return tasa
+        nombre = record.name
+        while nombre:
+            if nombre in self.muestreo_por_logger:
+                return self.muestreo_por_logger[nombre]
+            nombre = nombre.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            tasa = self._tasa(record)
+            if tasa < 1.0 and random.random() >= tasa:
+                _descartados.inc(motivo="muestreo")
+                return False
+        record.request_id = _request_id.get()
+        record.carril = carril_actual()
+        return True
+
+
+class ColaNoBloqueante(logging.handlers.QueueHandler):
+    """QueueHandler que no formatea en el hilo que loguea y descarta si la cola está llena."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El formateo (getMessage, traceback) lo hace el hilo de escritura
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _descartados.inc(motivo="cola_llena")
+
+
+class FormateadorJSON(logging.Formatter):
+    """Una línea JSON por record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        datos = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            datos["request_id"] = request_id
+            datos["carril"] = getattr(record, "carril", None)
+        for clave, valor in record.__dict__.items():
+            if clave not in _ATRIBUTOS_RECORD and not clave.startswith("_"):
+                datos[clave] = valor
+        if record.exc_info:
+            datos["exc"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class FormateadorTexto(logging.Formatter):
+    """Formato legible para desarrollo, con el request id."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = "-"
+        return super().format(record)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[ColaNoBloqueante] = None
+_lock = threading.Lock()
+
+
+def configurar_logging(
+    niveles: Optional[str] = None,
+    formato: Optional[str] = None,
+    muestreo: Optional[Dict[str, float]] = None,
+    tamano_cola: Optional[int] = None,
+) -> None:
+    """
+    Instala el QueueHandler en el root logger y arranca el hilo de escritura.
+    Idempotente: llamadas siguientes solo ajustan los niveles.
+
+    Args:
+        niveles: Ver Config.LOG_LEVEL
+        formato: "json" o "texto" (Config.LOG_FORMATO)
+        muestreo: Fracción a conservar por logger (Config.LOG_MUESTREO)
+        tamano_cola: Records en espera antes de descartar (Config.LOG_COLA)
+    """
+    global _listener, _handler
+    raiz, por_logger = _parse_niveles(niveles if niveles is not None else config.LOG_LEVEL)
+    root = logging.getLogger()
+    root.setLevel(raiz)
+    for nombre, nivel in por_logger.items():
+        logging.getLogger(nombre).setLevel(nivel)
+
+    with _lock:
+        if _listener is not None:
+            return
+
+        formato = (formato or config.LOG_FORMATO).lower()
+        salida = logging.StreamHandler(sys.stderr)
+        salida.setFormatter(FormateadorJSON() if formato == "json" else FormateadorTexto())
+
+        cola = queue.Queue(maxsize=tamano_cola or config.LOG_COLA)
+        handler = ColaNoBloqueante(cola)
+        handler.addFilter(FiltroContexto(muestreo if muestreo is not None else config.LOG_MUESTREO))
+
+        for existente in list(root.handlers):
+            root.removeHandler(existente)
+        root.addHandler(handler)
+        _handler = handler
+
+        _listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=True)
+        _listener.start()
+        atexit.register(detener_logging)
+
+
+def detener_logging() -> None:
+    """Vacía la cola y detiene el hilo de escritura."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def _reiniciar_en_hijo() -> None:
+    """
+    Tras un fork (gunicorn con preload) el hilo de escritura no existe en el
+    hijo y la cola pudo quedar con su lock tomado: cola e hilo nuevos.
+    """
+    global _listener, _lock
+    _lock = threading.Lock()
+    if _listener is None or _handler is None:
+        return
+    cola = queue.Queue(maxsize=_handler.queue.maxsize)
+    _handler.queue = cola
+    _listener = logging.handlers.QueueListener(cola, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+os.register_at_fork(after_in_child=_reiniciar_en_hijo)
@@ -0,0 +1,424 @@
+"""
+Hojas de impresión con muchas guías en un solo PDF.
+
+A partir de los PDFs del almacén local (almacen_pdf.py) arma:
+- un PDF con todas las páginas de cada guía, una tras otra (`por_hoja=1`), o
+- hojas A4/carta con 2, 4, 6 u 8 etiquetas cada una (N-up); aquí cada guía
+  debe ser de una sola página.
+
+Las páginas se copian tal cual (contenido, fuentes e imágenes ya
+comprimidos), sin volver a renderizar. La salida se escribe de forma
+incremental: cada etiqueta se lee, sus objetos se escriben al archivo y se
+descartan antes de pasar a la siguiente, así la memoria no crece con la
+cantidad de guías. El resultado queda cacheado por el hash del conjunto
+(números, contenido de cada PDF y formato).
+
+Requiere el paquete `pypdf` (solo para leer los PDFs de origen).
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import tempfile
+import time
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from src.config import config
+from src.services.almacen_pdf import AlmacenPDF, almacen_pdf
+from src.services.metricas import registro
+
+logger = logging.getLogger(__name__)
+
+# Tamaños de hoja en puntos (1/72")
+HOJAS = {
+    "A4": (595.28, 841.89),
+    "carta": (612.0, 792.0),
+}
+# Etiquetas por hoja -> columnas (las filas salen de la cantidad)
+GRILLAS = {1: 1, 2: 1, 4: 2, 6: 2, 8: 2}
+MARGEN = 18.0
+
+_lotes = registro.contador(
+    "pdf_lotes_total", "Hojas de impresión de guías servidas", ["resultado"]
+)
+_duracion = registro.histograma(
+    "pdf_lote_duracion_segundos", "Tiempo de armado de hojas de impresión", ["formato"]
+)
+
+
+class GuiasSinPDFError(Exception):
+    """Alguna de las guías pedidas no tiene PDF en el almacén."""
+
+    def __init__(self, numeros: List[str]):
+        self.numeros = numeros
+        super().__init__(f"Guías sin PDF guardado: {', '.join(numeros)}")
+
+
+class GuiasMultipaginaError(Exception):
+    """Alguna de las guías tiene más de una página: no entra en una celda N-up."""
+
+    def __init__(self, numeros: List[str]):
+        self.numeros = numeros
+        super().__init__(f"Guías de más de una página: {', '.join(numeros)}")
+
+
+class ResultadoLote(NamedTuple):
+    ruta: str
+    clave: str
+    paginas: int
+    desde_cache: bool
+
+
+def _importar_pypdf():
+    try:
+        import pypdf
+        from pypdf import generic
+    except ImportError:
+        raise RuntimeError(
+            "Las hojas de impresión requieren el paquete pypdf. Instálelo con: pip install pypdf"
+        )
+    return pypdf, generic
+
+
+class _EscritorPDF:
+    """
+    Escribe un PDF objeto por objeto, sin mantener los ya escritos en memoria.
+    Solo se guardan los offsets para la tabla xref del final.
+    """
+
+    def __init__(self, archivo: BinaryIO, generic):
+        self._f = archivo
+        self._g = generic
+        self._offsets: List[Optional[int]] = []
+        self._f.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def reservar(self) -> int:
+        self._offsets.append(None)
+        return len(self._offsets)
+
+    def escribir(self, numero: int, objeto) -> None:
+        self._offsets[numero - 1] = self._f.tell()
+        self._f.write(f"{numero} 0 obj\n".encode("ascii"))
+        objeto.write_to_stream(self._f)
+        self._f.write(b"\nendobj\n")
+
+    def referencia(self, numero: int):
+        return self._g.IndirectObject(numero, 0, None)
+
+    def copiar_objetos(self, raiz, pagina_destino: Optional[int] = None) -> object:
+        """
+        Copia `raiz` y todo lo que referencia desde el PDF de origen,
+        renumerando los objetos. Devuelve la copia de `raiz` (sin escribir).
+
+        Args:
+            raiz: Objeto del PDF de origen (ya resuelto)
+            pagina_destino: Número del árbol de páginas al que se cuelga la página
+        """
+        g = self._g
+        mapa: Dict[Tuple[int, int], int] = {}
+        pendientes: List[Tuple[int, object]] = []
+
+        def copiar(obj):
+            if isinstance(obj, g.IndirectObject):
+                clave = (obj.idnum, obj.generation)
+                nuevo = mapa.get(clave)
+                if nuevo is None:
+                    destino = obj.get_object()
+                    # Otras páginas o el árbol del origen (links, /Parent) no se copian
+                    if isinstance(destino, g.DictionaryObject) and destino.get("/Type") in ("/Page", "/Pages"):
+                        return g.NullObject()
+                    nuevo = mapa[clave] = self.reservar()
+                    pendientes.append((nuevo, destino))
+                return self.referencia(nuevo)
+            if isinstance(obj, g.StreamObject):
+                copia = g.EncodedStreamObject() if isinstance(obj, g.EncodedStreamObject) else g.DecodedStreamObject()
+                # Datos tal cual (ya comprimidos): sin decodificar ni recodificar
+                copia._data = obj._data
+                for clave, valor in obj.items():
+                    copia[clave] = copiar(valor)
+                return copia
+            if isinstance(obj, g.DictionaryObject):
+                copia = g.DictionaryObject()
+                for clave, valor in obj.items():
+                    copia[clave] = copiar(valor)
+                return copia
+            if isinstance(obj, g.ArrayObject):
+                return g.ArrayObject(copiar(v) for v in obj)
+            return obj
+
+        if pagina_destino is not None:
+            resultado = g.DictionaryObject()
+            for clave, valor in raiz.items():
+                if clave != "/Parent":
+                    resultado[g.NameObject(clave)] = copiar(valor)
+            resultado[g.NameObject("/Parent")] = self.referencia(pagina_destino)
+        else:
+            resultado = copiar(raiz)
+
+        while pendientes:
+            numero, objeto = pendientes.pop()
+            self.escribir(numero, copiar(objeto))
+        return resultado
+
+    def cerrar(self, catalogo: int) -> None:
+        inicio_xref = self._f.tell()
+        total = len(self._offsets) + 1
+        self._f.write(f"xref\n0 {total}\n0000000000 65535 f \n".encode("ascii"))
+        for offset in self._offsets:
+            if offset is None:
+                self._f.write(b"0000000000 65535 f \n")
+            else:
+                self._f.write(f"{offset:010d} 00000 n \n".encode("ascii"))
+        self._f.write(
+            f"trailer\n<< /Size {total} /Root {catalogo} 0 R >>\nstartxref\n{inicio_xref}\n%%EOF\n".encode("ascii")
+        )
+
+
+def _contenido_pagina(pagina) -> bytes:
+    contenido = pagina.get_contents()
+    return contenido.get_data() if contenido is not None else b""
+
+
+def _celdas(por_hoja: int, ancho: float, alto: float) -> List[Tuple[float, float, float, float]]:
+    """(x, y, ancho, alto) de cada lugar de la hoja, de arriba a la izquierda."""
+    columnas = GRILLAS[por_hoja]
+    filas = math.ceil(por_hoja / columnas)
+    ancho_celda = (ancho - 2 * MARGEN) / columnas
+    alto_celda = (alto - 2 * MARGEN) / filas
+    celdas = []
+    for i in range(por_hoja):
+        fila, columna = divmod(i, columnas)
+        x = MARGEN + columna * ancho_celda
+        y = alto - MARGEN - (fila + 1) * alto_celda
+        celdas.append((x, y, ancho_celda, alto_celda))
+    return celdas
+
+
+class GeneradorLotes:
+    """
+    Args:
+        almacen: Almacén de PDFs por guía
+        directorio: Dónde cachear las hojas generadas
+        max_archivos: Hojas cacheadas a conservar (las menos usadas se borran)
+    """
+
+    def __init__(self, almacen: AlmacenPDF, directorio: str, max_archivos: int = 200):
+        self.almacen = almacen
+        self.directorio = directorio
+        self.max_archivos = max_archivos
+
+    def _ruta_cache(self, clave: str) -> str:
+        return os.path.join(self.directorio, clave[:2], f"{clave}.pdf")
+
+    def generar(self, numeros: Sequence[str], por_hoja: int = 1, hoja: str = "A4") -> ResultadoLote:
+        """
+        Arma (o toma del cache) el PDF de impresión de `numeros`, en ese orden.
+
+        Raises:
+            GuiasSinPDFError: Si alguna guía no tiene PDF guardado
+            GuiasMultipaginaError: Si por_hoja > 1 y alguna guía tiene más de una página
+            ValueError: Si por_hoja u hoja no son válidos
+            RuntimeError: Si falta pypdf
+        """
+        if por_hoja not in GRILLAS:
+            raise ValueError(f"por_hoja debe ser uno de {sorted(GRILLAS)}")
+        if hoja not in HOJAS:
+            raise ValueError(f"hoja debe ser una de {sorted(HOJAS)}")
+
+        objetos = []
+        faltantes = []
+        for numero in numeros:
+            objeto = self.almacen.buscar(numero)
+            if objeto is None:
+                faltantes.append(numero)
+            else:
+                objetos.append(objeto)
+        if faltantes:
+            raise GuiasSinPDFError(faltantes)
+
+        clave = hashlib.sha256(json.dumps({
+            "guias": [[n, o.sha256] for n, o in zip(numeros, objetos)],
+            "por_hoja": por_hoja,
+            "hoja": hoja if por_hoja > 1 else None,
+        }, sort_keys=True).encode("utf-8")).hexdigest()
+
+        ruta = self._ruta_cache(clave)
+        if os.path.exists(ruta):
+            try:
+                os.utime(ruta)
+            except OSError:
+                pass
+            pypdf, _ = _importar_pypdf()
+            try:
+                # /Count del árbol de páginas del PDF cacheado
+                paginas = len(pypdf.PdfReader(ruta).pages)
+            except (OSError, pypdf.errors.PyPdfError):
+                # Ilegible o borrado por _podar entretanto: se vuelve a armar
+                paginas = None
+            if paginas is not None:
+                _lotes.inc(resultado="cache")
+                return ResultadoLote(ruta, clave, paginas, True)
+
+        inicio = time.monotonic()
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(ruta), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if por_hoja == 1:
+                    paginas = self._unir(f, [o.ruta for o in objetos])
+                else:
+                    paginas = self._hojas(f, numeros, [o.ruta for o in objetos], por_hoja, HOJAS[hoja])
+            os.replace(tmp, ruta)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+        duracion = time.monotonic() - inicio
+        _duracion.observe(duracion, formato="unido" if por_hoja == 1 else f"{por_hoja}_por_hoja")
+        _lotes.inc(resultado="generado")
+        logger.info(
+            "🖨️  Hoja de %d guías (%d por hoja) en %.0fms: %s",
+            len(objetos), por_hoja, duracion * 1000, clave[:12]
+        )
+        self._podar()
+        return ResultadoLote(ruta, clave, paginas, False)
+
+    def _unir(self, f: BinaryIO, rutas: List[str]) -> int:
+        """Todas las páginas de cada PDF, una tras otra. Devuelve las páginas escritas."""
+        pypdf, g = _importar_pypdf()
+        escritor = _EscritorPDF(f, g)
+        arbol = escritor.reservar()
+        catalogo = escritor.reservar()
+        hijos = []
+        for ruta in rutas:
+            lector = pypdf.PdfReader(ruta)
+            for pagina in lector.pages:
+                numero = escritor.reservar()
+                escritor.escribir(numero, escritor.copiar_objetos(pagina, pagina_destino=arbol))
+                hijos.append(numero)
+            del lector
+        self._cerrar(escritor, g, arbol, catalogo, hijos)
+        return len(hijos)
+
+    def _hojas(
+        self,
+        f: BinaryIO,
+        numeros: Sequence[str],
+        rutas: List[str],
+        por_hoja: int,
+        tamano: Tuple[float, float],
+    ) -> int:
+        """
+        Cada etiqueta (la única página de cada PDF) pasa a ser un Form XObject
+        y se dibuja escalada en su lugar de la hoja. Devuelve las hojas escritas.
+
+        Raises:
+            GuiasMultipaginaError: Antes de escribir nada, si algún PDF tiene
+                más de una página (se perdería el resto en la celda)
+        """
+        pypdf, g = _importar_pypdf()
+        multipagina = [n for n, ruta in zip(numeros, rutas) if len(pypdf.PdfReader(ruta).pages) != 1]
+        if multipagina:
+            raise GuiasMultipaginaError(multipagina)
+        ancho, alto = tamano
+        celdas = _celdas(por_hoja, ancho, alto)
+        escritor = _EscritorPDF(f, g)
+        arbol = escritor.reservar()
+        catalogo = escritor.reservar()
+        hijos = []
+
+        for desde in range(0, len(rutas), por_hoja):
+            xobjects = g.DictionaryObject()
+            operaciones = []
+            for i, ruta in enumerate(rutas[desde:desde + por_hoja]):
+                pagina = pypdf.PdfReader(ruta).pages[0]
+                caja = pagina.mediabox
+                x0, y0 = float(caja.left), float(caja.bottom)
+                w, h = float(caja.width), float(caja.height)
+
+                forma = g.DecodedStreamObject()
+                forma.set_data(_contenido_pagina(pagina))
+                forma = forma.flate_encode()
+                forma[g.NameObject("/Type")] = g.NameObject("/XObject")
+                forma[g.NameObject("/Subtype")] = g.NameObject("/Form")
+                forma[g.NameObject("/BBox")] = g.ArrayObject(
+                    g.FloatObject(v) for v in (x0, y0, x0 + w, y0 + h)
+                )
+                recursos = pagina.get("/Resources")
+                if recursos is not None:
+                    forma[g.NameObject("/Resources")] = escritor.copiar_objetos(recursos.get_object())
+                numero = escritor.reservar()
+                escritor.escribir(numero, forma)
+                del pagina, forma
+
+                nombre = f"/E{i}"
+                xobjects[g.NameObject(nombre)] = escritor.referencia(numero)
+                cx, cy, cw, ch = celdas[i]
+                escala = min(cw / w, ch / h)
+                tx = cx + (cw - w * escala) / 2 - x0 * escala
+                ty = cy + (ch - h * escala) / 2 - y0 * escala
+                operaciones.append(f"q {escala:.5f} 0 0 {escala:.5f} {tx:.3f} {ty:.3f} cm {nombre} Do Q")
+
+            contenido = g.DecodedStreamObject()
+            contenido.set_data("\n".join(operaciones).encode("ascii"))
+            numero_contenido = escritor.reservar()
+            escritor.escribir(numero_contenido, contenido.flate_encode())
+
+            hoja = g.DictionaryObject({
+                g.NameObject("/Type"): g.NameObject("/Page"),
+                g.NameObject("/Parent"): escritor.referencia(arbol),
+                g.NameObject("/MediaBox"): g.ArrayObject(
+                    g.FloatObject(v) for v in (0, 0, ancho, alto)
+                ),
+                g.NameObject("/Resources"): g.DictionaryObject({
+                    g.NameObject("/XObject"): xobjects
+                }),
+                g.NameObject("/Contents"): escritor.referencia(numero_contenido),
+            })
+            numero = escritor.reservar()
+            escritor.escribir(numero, hoja)
+            hijos.append(numero)
+
+        self._cerrar(escritor, g, arbol, catalogo, hijos)
+        return len(hijos)
+
+    @staticmethod
+    def _cerrar(escritor: _EscritorPDF, g, arbol: int, catalogo: int, hijos: List[int]) -> None:
+        escritor.escribir(arbol, g.DictionaryObject({
+            g.NameObject("/Type"): g.NameObject("/Pages"),
+            g.NameObject("/Kids"): g.ArrayObject(escritor.referencia(n) for n in hijos),
+            g.NameObject("/Count"): g.NumberObject(len(hijos)),
+        }))
+        escritor.escribir(catalogo, g.DictionaryObject({
+            g.NameObject("/Type"): g.NameObject("/Catalog"),
+            g.NameObject("/Pages"): escritor.referencia(arbol),
+        }))
+        escritor.cerrar(catalogo)
+
+    def _podar(self) -> None:
+        """Borra las hojas cacheadas menos usadas por encima de max_archivos."""
+        archivos = []
+        for raiz, _, nombres in os.walk(self.directorio):
+            for nombre in nombres:
+                if nombre.endswith(".pdf"):
+                    ruta = os.path.join(raiz, nombre)
+                    try:
+                        archivos.append((os.path.getmtime(ruta), ruta))
+                    except OSError:
+                        pass
+        archivos.sort()
+        for _, ruta in archivos[:max(0, len(archivos) - self.max_archivos)]:
+            try:
+                os.unlink(ruta)
+            except OSError:
+                pass
+
+
+# Instancia global del generador
+generador_lotes = GeneradorLotes(
+    almacen_pdf,
+    os.path.join(config.PDF_ALMACEN_DIR, "lotes"),
+    max_archivos=config.PDF_LOTES_CACHE_MAX
+)
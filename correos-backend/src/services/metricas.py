@@ -0,0 +1,396 @@
+"""
+Métricas en memoria con exportación en formato de texto de Prometheus.
+
+Registrar un valor cuesta un lock por métrica y una suma (~1µs), así se puede
+instrumentar el camino caliente. Con varios workers (uvicorn --workers N) cada
+proceso vuelca periódicamente sus valores a un archivo en un directorio
+compartido (`configurar_multiproceso`) y /metrics, atienda el worker que
+atienda, suma los de todos: contadores e histogramas de todos los procesos
+del mismo arranque, medidores solo de los procesos vivos. Los contadores de
+los workers muertos se consolidan en un solo archivo (metricas-muertos.json)
+y sus archivos se borran, para que el directorio no crezca con cada reinicio.
+"""
+import bisect
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos (un solo worker)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Contadores e histogramas sumados de los workers muertos del arranque
+_ARCHIVO_MUERTOS = "metricas-muertos.json"
+
+# Buckets por defecto para latencias, en segundos
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Buckets para tamaños en bytes (1KB a 10MB)
+BUCKETS_BYTES = (1024, 4096, 16384, 65536, 131072, 262144, 524288, 1048576, 2097152, 5242880, 10485760)
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatear_labels(nombres: Sequence[str], valores: Sequence[str], extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _formatear_valor(valor: float) -> str:
+    if math.isinf(valor):
+        return "+Inf" if valor > 0 else "-Inf"
+    if float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, labels: Sequence[str] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._valores: Dict[Tuple[str, ...], Any] = {}
+
+    def _clave(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def instantanea(self) -> dict:
+        """Copia serializable (JSON) de la definición y los valores."""
+        with self._lock:
+            valores = [[list(clave), valor] for clave, valor in self._valores.items()]
+        return {
+            "tipo": self.tipo,
+            "ayuda": self.ayuda,
+            "labels": list(self.labels),
+            "valores": valores,
+        }
+
+
+class Contador(_Metrica):
+    """Valor que solo crece (requests, errores, rechazos...)."""
+
+    tipo = "counter"
+
+    def inc(self, cantidad: float = 1.0, **labels) -> None:
+        clave = self._clave(labels)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0.0) + cantidad
+
+    def valor(self, **labels) -> float:
+        return self._valores.get(self._clave(labels), 0.0)
+
+
+class Medidor(_Metrica):
+    """Valor que sube y baja (en curso, en cola...)."""
+
+    tipo = "gauge"
+
+    def set(self, valor: float, **labels) -> None:
+        with self._lock:
+            self._valores[self._clave(labels)] = float(valor)
+
+    def inc(self, cantidad: float = 1.0, **labels) -> None:
+        clave = self._clave(labels)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0.0) + cantidad
+
+    def dec(self, cantidad: float = 1.0, **labels) -> None:
+        self.inc(-cantidad, **labels)
+
+    def valor(self, **labels) -> float:
+        return self._valores.get(self._clave(labels), 0.0)
+
+
+class Histograma(_Metrica):
+    """Distribución de valores en buckets (latencias, tamaños)."""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, labels=(), buckets: Sequence[float] = BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, labels)
+        # Valores por clave: [conteo por bucket (no acumulado)..., +Inf, suma, total]
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, valor: float, **labels) -> None:
+        clave = self._clave(labels)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            datos = self._valores.get(clave)
+            if datos is None:
+                datos = self._valores[clave] = [0.0] * (len(self.buckets) + 3)
+            datos[indice] += 1
+            datos[-2] += valor
+            datos[-1] += 1
+
+    def instantanea(self) -> dict:
+        with self._lock:
+            valores = [[list(clave), list(datos)] for clave, datos in self._valores.items()]
+        return {
+            "tipo": self.tipo,
+            "ayuda": self.ayuda,
+            "labels": list(self.labels),
+            "buckets": list(self.buckets),
+            "valores": valores,
+        }
+
+
+def _render_metrica(nombre: str, datos: dict) -> List[str]:
+    lineas = [f"# HELP {nombre} {datos['ayuda']}", f"# TYPE {nombre} {datos['tipo']}"]
+    labels = datos["labels"]
+    for clave, valor in datos["valores"]:
+        if datos["tipo"] != "histogram":
+            lineas.append(f"{nombre}{_formatear_labels(labels, clave)} {_formatear_valor(valor)}")
+            continue
+        acumulado = 0.0
+        for limite, conteo in zip(list(datos["buckets"]) + [math.inf], valor):
+            acumulado += conteo
+            le = f'le="{_formatear_valor(limite)}"'
+            lineas.append(f"{nombre}_bucket{_formatear_labels(labels, clave, le)} {_formatear_valor(acumulado)}")
+        lineas.append(f"{nombre}_sum{_formatear_labels(labels, clave)} {_formatear_valor(valor[-2])}")
+        lineas.append(f"{nombre}_count{_formatear_labels(labels, clave)} {_formatear_valor(valor[-1])}")
+    return lineas
+
+
+def _fusionar(destino: Dict[str, dict], origen: Dict[str, dict], incluir_medidores: bool) -> None:
+    """Suma las métricas de `origen` en `destino` (mismo formato que instantanea)."""
+    for nombre, datos in origen.items():
+        if datos["tipo"] == "gauge" and not incluir_medidores:
+            continue
+        actual = destino.get(nombre)
+        if actual is None:
+            actual = destino[nombre] = {**datos, "valores": []}
+            actual["_indice"] = {}
+        elif actual["tipo"] != datos["tipo"] or actual.get("buckets") != datos.get("buckets"):
+            logger.warning("Métrica %s con definición distinta entre procesos; se ignora una", nombre)
+            continue
+        indice = actual["_indice"]
+        for clave, valor in datos["valores"]:
+            llave = tuple(clave)
+            if llave not in indice:
+                indice[llave] = len(actual["valores"])
+                actual["valores"].append([clave, valor if not isinstance(valor, list) else list(valor)])
+            elif isinstance(valor, list):
+                existente = actual["valores"][indice[llave]][1]
+                for i, v in enumerate(valor):
+                    existente[i] += v
+            else:
+                actual["valores"][indice[llave]][1] += valor
+
+
+def _sin_indices(metricas: Dict[str, dict]) -> Dict[str, dict]:
+    """Quita el índice auxiliar de _fusionar para poder serializar."""
+    return {nombre: {k: v for k, v in datos.items() if k != "_indice"} for nombre, datos in metricas.items()}
+
+
+def _leer_json(ruta: str) -> Optional[dict]:
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _proceso_vivo(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Registro:
+    """Conjunto de métricas del proceso. Registrar dos veces el mismo nombre devuelve la existente."""
+
+    def __init__(self):
+        self._metricas: Dict[str, _Metrica] = {}
+        self._lock = threading.Lock()
+        self._directorio: Optional[str] = None
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def _registrar(self, clase, nombre, ayuda, labels, **kwargs):
+        with self._lock:
+            existente = self._metricas.get(nombre)
+            if existente is not None:
+                if not isinstance(existente, clase):
+                    raise ValueError(f"La métrica {nombre} ya existe con otro tipo")
+                return existente
+            metrica = clase(nombre, ayuda, labels, **kwargs)
+            self._metricas[nombre] = metrica
+            return metrica
+
+    def contador(self, nombre: str, ayuda: str, labels: Sequence[str] = ()) -> Contador:
+        return self._registrar(Contador, nombre, ayuda, labels)
+
+    def medidor(self, nombre: str, ayuda: str, labels: Sequence[str] = ()) -> Medidor:
+        return self._registrar(Medidor, nombre, ayuda, labels)
+
+    def histograma(
+        self,
+        nombre: str,
+        ayuda: str,
+        labels: Sequence[str] = (),
+        buckets: Optional[Sequence[float]] = None,
+    ) -> Histograma:
+        return self._registrar(Histograma, nombre, ayuda, labels, buckets=buckets or BUCKETS_LATENCIA)
+
+    def instantanea(self) -> Dict[str, dict]:
+        with self._lock:
+            metricas = list(self._metricas.values())
+        return {m.nombre: m.instantanea() for m in metricas}
+
+    # --- Multiproceso ---------------------------------------------------
+
+    def _archivo_propio(self) -> str:
+        return os.path.join(self._directorio, f"metricas-{os.getpid()}.json")
+
+    def _escribir(self, ruta: str, datos: dict) -> None:
+        """Reemplaza `ruta` de forma atómica: quien lee nunca ve un archivo a medias."""
+        contenido = json.dumps(datos).encode("utf-8")
+        fd, tmp = tempfile.mkstemp(dir=self._directorio, prefix=".tmp-metricas-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(contenido)
+            os.replace(tmp, ruta)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def volcar(self) -> None:
+        """Escribe los valores de este proceso en el directorio compartido."""
+        if not self._directorio:
+            return
+        self._escribir(self._archivo_propio(), {
+            "pid": os.getpid(),
+            # Los workers de un mismo arranque comparten el proceso padre
+            "ppid": os.getppid(),
+            "metricas": self.instantanea(),
+        })
+
+    def configurar_multiproceso(self, directorio: str, intervalo: float = 5.0) -> None:
+        """
+        Activa la agregación entre workers: vuelca los valores de este proceso
+        cada `intervalo` segundos (y en cada render) a `directorio`.
+        """
+        os.makedirs(directorio, exist_ok=True)
+        self._directorio = directorio
+        self.volcar()
+        if self._hilo is None:
+            def _bucle():
+                while not self._detener.wait(intervalo):
+                    try:
+                        self.volcar()
+                    except Exception as e:
+                        logger.warning("⚠️  No se pudieron volcar las métricas: %s", e)
+
+            self._hilo = threading.Thread(target=_bucle, name="metricas-volcado", daemon=True)
+            self._hilo.start()
+        logger.info("📈 Métricas multiproceso en %s (volcado cada %ss)", directorio, intervalo)
+
+    def detener_multiproceso(self) -> None:
+        self._detener.set()
+        if self._directorio:
+            try:
+                self.volcar()
+            except Exception:
+                pass
+
+    @contextmanager
+    def _bloqueo(self) -> Iterator[None]:
+        """
+        Lock entre workers para consolidar y leer: sin él, un worker podría
+        sumar el archivo de un muerto y también el consolidado que ya lo incluye.
+        """
+        with open(os.path.join(self._directorio, ".metricas.lock"), "a") as archivo:
+            if fcntl is not None:
+                fcntl.flock(archivo.fileno(), fcntl.LOCK_EX)
+            yield
+
+    def _consolidar_muertos(self, ppid: int) -> None:
+        """
+        Suma los contadores e histogramas de los workers muertos de este
+        arranque en metricas-muertos.json y borra sus archivos (y los de
+        arranques anteriores). El consolidado guarda los pid que ya sumó: si
+        el proceso se cae entre escribirlo y borrar, no se suman dos veces.
+        """
+        ruta = os.path.join(self._directorio, _ARCHIVO_MUERTOS)
+        muertos = _leer_json(ruta)
+        if muertos is None or muertos.get("ppid") != ppid:
+            muertos = {"ppid": ppid, "pids": [], "metricas": {}}
+        nuevos: List[dict] = []
+        obsoletos: List[str] = []
+        for archivo in os.listdir(self._directorio):
+            if not (archivo.startswith("metricas-") and archivo.endswith(".json")) or archivo == _ARCHIVO_MUERTOS:
+                continue
+            datos = _leer_json(os.path.join(self._directorio, archivo))
+            if datos is None or _proceso_vivo(datos["pid"]):
+                continue
+            if datos.get("ppid") == ppid and datos["pid"] not in muertos["pids"]:
+                nuevos.append(datos)
+            obsoletos.append(archivo)
+
+        if nuevos:
+            consolidado: Dict[str, dict] = {}
+            _fusionar(consolidado, muertos["metricas"], incluir_medidores=False)
+            for datos in nuevos:
+                _fusionar(consolidado, datos["metricas"], incluir_medidores=False)
+            muertos["metricas"] = _sin_indices(consolidado)
+            muertos["pids"].extend(datos["pid"] for datos in nuevos)
+            self._escribir(ruta, muertos)
+            logger.info("📈 Métricas de %d workers muertos consolidadas", len(nuevos))
+        for archivo in obsoletos:
+            try:
+                os.unlink(os.path.join(self._directorio, archivo))
+            except FileNotFoundError:
+                pass
+
+    def _instantanea_agregada(self) -> Dict[str, dict]:
+        self.volcar()
+        ppid = os.getppid()
+        agregado: Dict[str, dict] = {}
+        with self._bloqueo():
+            self._consolidar_muertos(ppid)
+            for archivo in sorted(os.listdir(self._directorio)):
+                if not (archivo.startswith("metricas-") and archivo.endswith(".json")):
+                    continue
+                datos = _leer_json(os.path.join(self._directorio, archivo))
+                # Archivos de un arranque anterior del servidor no cuentan
+                if datos is None or datos.get("ppid") != ppid:
+                    continue
+                # El consolidado de los muertos no tiene pid ni medidores
+                vivo = "pid" in datos and _proceso_vivo(datos["pid"])
+                _fusionar(agregado, datos["metricas"], incluir_medidores=vivo)
+        return agregado
+
+    def render(self) -> str:
+        """Exporta todas las métricas (de todos los workers si hay multiproceso)."""
+        if self._directorio:
+            metricas = self._instantanea_agregada()
+        else:
+            metricas = self.instantanea()
+        lineas = []
+        for nombre, datos in metricas.items():
+            lineas.extend(_render_metrica(nombre, datos))
+        return "\n".join(lineas) + "\n"
+
+
+# Registro global del proceso
+registro = Registro()
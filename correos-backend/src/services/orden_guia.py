@@ -0,0 +1,102 @@
+"""
+Solicitud de guía a partir de una orden de Shopify.
+
+Hace en el servidor lo que antes armaba la UI con varias llamadas al
+catálogo: toma `shipping_address` de la orden, resuelve el código postal de
+destino contra CatalogoService, completa el remitente desde Config y
+devuelve una SolicitudGuia lista para GuiaService + EnvioService.
+"""
+from typing import List, Optional
+
+from src.config import config
+from src.models.envio import (
+    AjustesGuiaOrden,
+    DatosDestinatario,
+    DatosRemitente,
+    SolicitudGuia,
+)
+from src.services.validacion_envio import normalizar_telefono, resolver_codigo_postal
+
+
+class OrdenNoEnviableError(Exception):
+    """La orden no tiene datos suficientes para generar la guía."""
+
+    def __init__(self, errores: List[str]):
+        self.errores = errores
+        super().__init__("; ".join(errores))
+
+
+def _nombre(direccion: dict, cliente: dict) -> str:
+    for origen in (direccion, cliente):
+        nombre = " ".join(
+            p for p in (origen.get("first_name"), origen.get("last_name")) if p
+        ).strip()
+        if nombre:
+            return nombre
+    return (direccion.get("name") or "").strip()
+
+
+def construir_solicitud(orden: dict, ajustes: Optional[AjustesGuiaOrden] = None) -> SolicitudGuia:
+    """
+    Arma la SolicitudGuia de una orden.
+
+    Args:
+        orden: Orden con el formato de Shopify
+        ajustes: Correcciones del operador (código postal, señas, peso...)
+
+    Raises:
+        OrdenNoEnviableError: Con todos los datos faltantes o inválidos
+    """
+    ajustes = ajustes or AjustesGuiaOrden()
+    direccion = orden.get("shipping_address") or {}
+    cliente = orden.get("customer") or {}
+    errores = []
+
+    codigo = ajustes.codigo_postal or direccion.get("zip")
+    ubicacion = resolver_codigo_postal(codigo)
+    if ubicacion is None:
+        errores.append(
+            f"El código postal {codigo!r} no corresponde a un distrito del catálogo"
+            if codigo else "La orden no tiene código postal de destino"
+        )
+
+    nombre = _nombre(direccion, cliente)
+    if not nombre:
+        errores.append("La orden no tiene nombre de destinatario")
+
+    senas = ajustes.direccion or ", ".join(
+        p.strip() for p in (direccion.get("address1"), direccion.get("address2")) if p and p.strip()
+    )
+    if not senas:
+        errores.append("La orden no tiene dirección de entrega")
+
+    telefono = normalizar_telefono(ajustes.telefono or direccion.get("phone") or cliente.get("phone"))
+    if not telefono:
+        errores.append("La orden no tiene teléfono de destinatario")
+
+    if errores:
+        raise OrdenNoEnviableError(errores)
+
+    peso = ajustes.peso
+    if peso is None:
+        peso = float(orden.get("total_weight") or 0) or config.ORDENES_PESO_GRAMOS
+
+    return SolicitudGuia(
+        remitente=DatosRemitente(
+            nombre=config.REMITENTE_NOMBRE,
+            direccion=config.REMITENTE_DIRECCION,
+            telefono=normalizar_telefono(config.REMITENTE_TELEFONO)[:15],
+            codigo_postal=config.REMITENTE_CODIGO_POSTAL,
+        ),
+        destinatario=DatosDestinatario(
+            nombre=nombre[:200],
+            direccion=f"{senas}, {ubicacion.distrito}, {ubicacion.canton}, {ubicacion.provincia}"[:500],
+            telefono=telefono[:15],
+            codigo_postal=ubicacion.codigo_postal,
+            codigo_postal_zip=ubicacion.codigo_postal,
+        ),
+        peso=peso,
+        monto_flete=ajustes.monto_flete,
+        observaciones=ajustes.observaciones or f"Orden {orden.get('name') or orden.get('id')}",
+        orden_id=str(orden["id"]),
+    )
@@ -0,0 +1,355 @@
+"""
+Repositorio de órdenes de Shopify.
+
+Las órdenes se copian de una fuente compatible con Shopify a una tabla SQLite
+(la misma base que el registro de órdenes procesadas, Config.ORDENES_DB_PATH)
+y se consultan desde ahí:
+
+- Sincronización incremental: cada pasada pide a la fuente solo las órdenes
+  con (updated_at, id) posterior al cursor guardado, como
+  `GET /orders.json?updated_at_min=...&order=updated_at asc`. El cursor vive
+  en la base, así un reinicio no vuelve a copiar todo.
+- Búsqueda por id (clave primaria) o por nombre "#1024" (índice).
+- Listado paginado por cursor (id descendente), con filtros por
+  financial_status y "sin guía", y el estado en Correos de cada orden en la
+  misma consulta (LEFT JOIN con ordenes_procesadas).
+
+FuenteLocal reemplaza a la API de Shopify en desarrollo: lee un JSON con el
+formato de `/orders.json` (Config.ORDENES_FUENTE_PATH).
+"""
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from src.config import config
+from src.services.metricas import registro
+from src.services.ordenes_procesadas import (
+    ESTADO_GUIA_CREADA,
+    abrir_base,
+    clave_orden,
+    registro_ordenes,
+)
+
+logger = logging.getLogger(__name__)
+
+# Órdenes por página al sincronizar (máximo de la API de Shopify)
+PAGINA_SINCRONIZACION = 250
+LIMITE_LISTADO_MAXIMO = 250
+
+_sincronizadas = registro.contador(
+    "ordenes_sincronizadas_total", "Órdenes copiadas desde la fuente"
+)
+
+_ESQUEMA = (
+    "CREATE TABLE IF NOT EXISTS ordenes ("
+    "id INTEGER PRIMARY KEY, nombre TEXT NOT NULL, clave TEXT NOT NULL, "
+    "financial_status TEXT, actualizada_en REAL NOT NULL, datos TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_ordenes_nombre ON ordenes (nombre)",
+    "CREATE INDEX IF NOT EXISTS ix_ordenes_financial_status ON ordenes (financial_status, id)",
+    "CREATE TABLE IF NOT EXISTS ordenes_cursor ("
+    "fuente TEXT PRIMARY KEY, actualizada_en REAL NOT NULL, orden_id INTEGER NOT NULL)",
+)
+
+# Cursor de sincronización: (updated_at en epoch, id)
+Cursor = Tuple[float, int]
+
+
+def _epoch(valor: Optional[str]) -> float:
+    if not valor:
+        return 0.0
+    return datetime.fromisoformat(valor.replace("Z", "+00:00")).timestamp()
+
+
+def cursor_de(orden: dict) -> Cursor:
+    """Posición de una orden en el orden de sincronización."""
+    return _epoch(orden.get("updated_at") or orden.get("created_at")), int(orden["id"])
+
+
+class FuenteLocal:
+    """
+    Órdenes desde un JSON con el formato de `/orders.json` de Shopify
+    ({"orders": [...]}). Solo se vuelve a leer si cambió el mtime.
+
+    Args:
+        path: Archivo JSON (Config.ORDENES_FUENTE_PATH)
+    """
+
+    nombre = "local"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime_ns: Optional[int] = None
+        self._cursores: List[Cursor] = []
+        self._ordenes: List[dict] = []
+
+    def _cargar(self) -> None:
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._cursores, self._ordenes, self._mtime_ns = [], [], None
+            return
+        if mtime_ns == self._mtime_ns:
+            return
+        with open(self.path, encoding="utf-8") as f:
+            datos = json.load(f)
+        ordenes = datos["orders"] if isinstance(datos, dict) else datos
+        pares = sorted(((cursor_de(o), o) for o in ordenes), key=lambda par: par[0])
+        self._cursores = [c for c, _ in pares]
+        self._ordenes = [o for _, o in pares]
+        self._mtime_ns = mtime_ns
+
+    def pagina(self, desde: Optional[Cursor], limite: int) -> List[dict]:
+        """Órdenes posteriores a `desde` en orden de (updated_at, id)."""
+        with self._lock:
+            self._cargar()
+            inicio = bisect.bisect_right(self._cursores, desde) if desde else 0
+            return self._ordenes[inicio:inicio + limite]
+
+
+class RepositorioOrdenes:
+    """
+    Args:
+        path: Archivo SQLite (compartido con el registro de órdenes procesadas)
+        fuente: Origen de las órdenes (FuenteLocal o compatible)
+    """
+
+    def __init__(self, path: str, fuente: FuenteLocal):
+        self.path = path
+        self.fuente = fuente
+        self._local = threading.local()
+        # Una sincronización a la vez por proceso; entre procesos el upsert
+        # es idempotente y el cursor nunca retrocede
+        self._sync_lock = threading.Lock()
+        self._sync_hilo: Optional[threading.Thread] = None
+        self._sync_stop = threading.Event()
+
+    def _conexion(self) -> sqlite3.Connection:
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = abrir_base(self.path, _ESQUEMA)
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return conexion
+
+    # ------------------------------------------------------------------
+    # Sincronización
+    # ------------------------------------------------------------------
+
+    def sincronizar(self) -> int:
+        """
+        Copia las órdenes nuevas o modificadas desde el último cursor.
+
+        Returns:
+            Cantidad de órdenes copiadas
+        """
+        with self._sync_lock:
+            conexion = self._conexion()
+            fila = conexion.execute(
+                "SELECT actualizada_en, orden_id FROM ordenes_cursor WHERE fuente = ?",
+                (self.fuente.nombre,),
+            ).fetchone()
+            cursor: Optional[Cursor] = tuple(fila) if fila else None
+            total = 0
+            while True:
+                pagina = self.fuente.pagina(cursor, PAGINA_SINCRONIZACION)
+                if not pagina:
+                    break
+                cursor = self._guardar_pagina(conexion, pagina)
+                total += len(pagina)
+                if len(pagina) < PAGINA_SINCRONIZACION:
+                    break
+        if total:
+            _sincronizadas.inc(total)
+            logger.info("🔄 %d órdenes sincronizadas desde %s", total, self.fuente.nombre)
+        return total
+
+    @staticmethod
+    def _upsert(conexion: sqlite3.Connection, pagina: List[dict]) -> None:
+        filas = []
+        for orden in pagina:
+            actualizada_en, orden_id = cursor_de(orden)
+            filas.append((
+                orden_id,
+                orden.get("name") or f"#{orden_id}",
+                clave_orden(orden_id),
+                orden.get("financial_status"),
+                actualizada_en,
+                json.dumps(orden, ensure_ascii=False, separators=(",", ":")),
+            ))
+        # Una versión más vieja de la orden no pisa a una más nueva
+        conexion.executemany(
+            "INSERT INTO ordenes (id, nombre, clave, financial_status, actualizada_en, datos) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+            "nombre = excluded.nombre, financial_status = excluded.financial_status, "
+            "actualizada_en = excluded.actualizada_en, datos = excluded.datos "
+            "WHERE excluded.actualizada_en >= ordenes.actualizada_en",
+            filas,
+        )
+
+    def _guardar_pagina(self, conexion: sqlite3.Connection, pagina: List[dict]) -> Cursor:
+        ultimo = cursor_de(pagina[-1])
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            self._upsert(conexion, pagina)
+            conexion.execute(
+                "INSERT INTO ordenes_cursor (fuente, actualizada_en, orden_id) VALUES (?, ?, ?) "
+                "ON CONFLICT (fuente) DO UPDATE SET "
+                "actualizada_en = excluded.actualizada_en, orden_id = excluded.orden_id "
+                "WHERE (excluded.actualizada_en, excluded.orden_id) > "
+                "(ordenes_cursor.actualizada_en, ordenes_cursor.orden_id)",
+                (self.fuente.nombre, *ultimo),
+            )
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+        return ultimo
+
+    def guardar(self, orden: dict) -> None:
+        """
+        Guarda una orden recibida por otra vía (p.ej. un webhook), sin mover
+        el cursor de sincronización.
+        """
+        conexion = self._conexion()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            self._upsert(conexion, [orden])
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+
+    def iniciar_sincronizacion(self, intervalo: Optional[float] = None) -> None:
+        """
+        Inicia un hilo que sincroniza ya y luego cada `intervalo` segundos.
+        Con intervalo <= 0 solo se sincroniza una vez.
+        """
+        if intervalo is None:
+            intervalo = config.ORDENES_SYNC_SEGUNDOS
+        if self._sync_hilo is not None:
+            return
+
+        self._sync_stop.clear()
+        self._sync_hilo = threading.Thread(
+            target=self._sincronizar_periodicamente,
+            args=(intervalo,),
+            name="ordenes-sync",
+            daemon=True,
+        )
+        self._sync_hilo.start()
+
+    def detener_sincronizacion(self) -> None:
+        """Detiene el hilo de sincronización (si está activo)."""
+        if self._sync_hilo is None:
+            return
+        self._sync_stop.set()
+        self._sync_hilo.join(timeout=5)
+        self._sync_hilo = None
+
+    def _sincronizar_periodicamente(self, intervalo: float) -> None:
+        while True:
+            try:
+                self.sincronizar()
+            except Exception as e:
+                logger.error("❌ Error sincronizando órdenes: %s", e, exc_info=True)
+            if intervalo <= 0 or self._sync_stop.wait(intervalo):
+                return
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _con_estado(datos: str, estado: Optional[str], numero_envio: Optional[str]) -> dict:
+        orden = json.loads(datos)
+        orden["correos_status"] = estado
+        orden["correos_tracking"] = numero_envio
+        return orden
+
+    def buscar(self, valor) -> Optional[dict]:
+        """
+        Orden por id (1024, TM-1024, GID) o por nombre (#1024 o 1024), con
+        su estado en Correos; None si no está.
+        """
+        valor = str(valor).strip()
+        clave = clave_orden(valor)
+        conexion = self._conexion()
+        fila = None
+        if clave.startswith("TM-") and clave[3:].isdigit():
+            fila = conexion.execute(
+                "SELECT datos, clave FROM ordenes WHERE id = ?", (int(clave[3:]),)
+            ).fetchone()
+        if fila is None:
+            nombre = valor if valor.startswith("#") else f"#{valor}"
+            fila = conexion.execute(
+                "SELECT datos, clave FROM ordenes WHERE nombre = ? LIMIT 1", (nombre,)
+            ).fetchone()
+        if fila is None:
+            return None
+        # Incluye los cambios de estado que todavía no se escribieron
+        procesada = registro_ordenes.buscar(fila[1])
+        return self._con_estado(
+            fila[0],
+            procesada.estado if procesada else None,
+            procesada.numero_envio if procesada else None,
+        )
+
+    def listar(
+        self,
+        limite: int = 50,
+        cursor: Optional[str] = None,
+        financial_status: Optional[str] = None,
+        sin_guia: bool = False,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        Página de órdenes, de la más nueva a la más vieja.
+
+        El estado en Correos sale del mismo SELECT; un cambio de estado se ve
+        aquí cuando el registro lo escribe (ORDENES_LOTE_ESPERA_MS).
+
+        Args:
+            limite: Órdenes por página (hasta LIMITE_LISTADO_MAXIMO)
+            cursor: `siguiente_cursor` de la página anterior
+            financial_status: Solo órdenes con ese estado de pago
+            sin_guia: Solo órdenes sin guía creada
+
+        Returns:
+            (órdenes, cursor de la página siguiente o None)
+
+        Raises:
+            ValueError: Si el cursor no es válido
+        """
+        limite = max(1, min(limite, LIMITE_LISTADO_MAXIMO))
+        condiciones, parametros = [], []
+        if cursor:
+            condiciones.append("o.id < ?")
+            parametros.append(int(cursor))
+        if financial_status:
+            condiciones.append("o.financial_status = ?")
+            parametros.append(financial_status)
+        if sin_guia:
+            condiciones.append("(p.estado IS NULL OR p.estado <> ?)")
+            parametros.append(ESTADO_GUIA_CREADA)
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        filas = self._conexion().execute(
+            "SELECT o.id, o.datos, p.estado, p.numero_envio FROM ordenes o "
+            "LEFT JOIN ordenes_procesadas p ON p.clave = o.clave "
+            f"{where} ORDER BY o.id DESC LIMIT ?",
+            (*parametros, limite + 1),
+        ).fetchall()
+
+        siguiente = str(filas[limite - 1][0]) if len(filas) > limite else None
+        return [self._con_estado(datos, estado, numero) for _, datos, estado, numero in filas[:limite]], siguiente
+
+
+# Instancia global del repositorio
+repositorio_ordenes = RepositorioOrdenes(
+    config.ORDENES_DB_PATH,
+    FuenteLocal(config.ORDENES_FUENTE_PATH),
+)
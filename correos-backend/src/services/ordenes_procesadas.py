@@ -0,0 +1,374 @@
+"""
+Registro de órdenes procesadas (orden de Shopify -> guía de Correos).
+
+Reemplaza a processed_orders.json: un JSON reescrito por cada orden serializa
+a todos los escritores y cada escritura cuesta más a medida que crece el
+historial. Aquí las órdenes viven en una tabla SQLite (WAL) en
+Config.ORDENES_DB_PATH:
+
+- Lectura por clave: búsqueda en el índice de la clave primaria (tabla
+  WITHOUT ROWID), igual de rápida con cientos de miles de órdenes; en WAL los
+  lectores no esperan a los escritores.
+- Escritura fuera del request: `registrar()` deja la fila en memoria (este
+  proceso la ve de inmediato) y un hilo la escribe junto con las demás en una
+  sola transacción, cada ORDENES_LOTE_MAXIMO filas o ORDENES_LOTE_ESPERA_MS.
+  Dos cambios de la misma orden dentro de la ventana se escriben una vez.
+- Índices también por número de envío y por fecha de procesamiento.
+
+Las claves se normalizan a "TM-<id>", como las consulta la UI (clave_orden).
+"""
+import atexit
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+from src.config import config
+from src.services.metricas import registro
+
+logger = logging.getLogger(__name__)
+
+ESTADO_PROCESANDO = "PROCESSING"
+ESTADO_GUIA_CREADA = "GUIDE_CREATED"
+# ccrRegistroEnvio sin respuesta con el número ya consumido: el envío pudo
+# quedar registrado en Correos y la orden no se vuelve a reclamar sola
+ESTADO_INCIERTO = "UNCERTAIN"
+
+_GID_ORDEN = re.compile(r"^gid://shopify/Order/(\d+)$")
+
+_filas = registro.contador(
+    "ordenes_registro_filas_total", "Filas escritas en el registro de órdenes", ["operacion"]
+)
+_duracion_lote = registro.histograma(
+    "ordenes_registro_lote_duracion_segundos", "Duración de cada transacción de escritura en lote"
+)
+
+ESQUEMA = (
+    "CREATE TABLE IF NOT EXISTS ordenes_procesadas ("
+    "clave TEXT PRIMARY KEY, numero_envio TEXT, estado TEXT NOT NULL, "
+    "tarifa REAL, pdf_sha256 TEXT, procesada_en REAL NOT NULL) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS ix_ordenes_numero_envio ON ordenes_procesadas (numero_envio)",
+    "CREATE INDEX IF NOT EXISTS ix_ordenes_procesada_en ON ordenes_procesadas (procesada_en)",
+)
+_COLUMNAS = "clave, numero_envio, estado, tarifa, pdf_sha256, procesada_en"
+
+
+class OrdenProcesada(NamedTuple):
+    clave: str
+    numero_envio: Optional[str]
+    estado: str
+    tarifa: Optional[float]
+    pdf_sha256: Optional[str]
+    procesada_en: float
+
+
+def clave_orden(valor) -> str:
+    """
+    Clave de una orden: "TM-<id>".
+
+    Acepta el id numérico, el GID de Shopify (gid://shopify/Order/<id>) o la
+    clave ya normalizada.
+    """
+    valor = str(valor).strip()
+    m = _GID_ORDEN.match(valor)
+    if m:
+        return f"TM-{m.group(1)}"
+    if valor.isdigit():
+        return f"TM-{valor}"
+    return valor
+
+
+class OrdenOcupadaError(Exception):
+    """La orden ya tiene guía (o una de registro incierto) o otro proceso la está generando."""
+
+    def __init__(self, fila: OrdenProcesada):
+        self.fila = fila
+        super().__init__(describir_ocupada(fila))
+
+
+def describir_ocupada(fila: OrdenProcesada) -> str:
+    """Motivo por el que no se puede generar la guía de una orden ocupada."""
+    if fila.estado == ESTADO_GUIA_CREADA:
+        return "La orden ya tiene guía"
+    if fila.estado == ESTADO_INCIERTO:
+        return f"El envío {fila.numero_envio} pudo quedar registrado en Correos; verifíquelo antes de regenerar"
+    return "La guía de la orden se está generando"
+
+
+def abrir_base(path: str, *esquemas) -> sqlite3.Connection:
+    """
+    Conexión a la base de órdenes (WAL) con las tablas de `esquemas` creadas.
+    Cada hilo abre la suya: sqlite3 no comparte conexiones entre hilos.
+    """
+    directorio = os.path.dirname(path)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    conexion = sqlite3.connect(path, timeout=5, isolation_level=None)
+    conexion.execute("PRAGMA journal_mode=WAL")
+    conexion.execute("PRAGMA synchronous=NORMAL")
+    for esquema in (ESQUEMA,) + esquemas:
+        for sentencia in esquema:
+            conexion.execute(sentencia)
+    return conexion
+
+
+def guia_creada_o_en_curso(fila: Optional[OrdenProcesada], vigencia: float) -> bool:
+    """
+    True si la orden ya tiene guía (o una de registro incierto), o si se está
+    generando (PROCESSING de hace menos de `vigencia` segundos; uno más viejo
+    quedó de un proceso caído).
+    """
+    if fila is None:
+        return False
+    if fila.estado == ESTADO_PROCESANDO:
+        return time.time() - fila.procesada_en < vigencia
+    return fila.estado in (ESTADO_GUIA_CREADA, ESTADO_INCIERTO)
+
+
+class RegistroOrdenes:
+    """
+    Args:
+        path: Archivo SQLite (Config.ORDENES_DB_PATH)
+        lote_maximo: Filas por transacción
+        espera: Segundos que se acumulan filas antes de escribir
+    """
+
+    def __init__(self, path: str, lote_maximo: int = 500, espera: float = 0.05):
+        self.path = path
+        self.lote_maximo = max(1, lote_maximo)
+        self.espera = max(0.0, espera)
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        # clave -> fila a escribir (None = borrar)
+        self._pendientes: Dict[str, Optional[OrdenProcesada]] = {}
+        # Lote en curso: sigue visible para las lecturas hasta el COMMIT
+        self._en_escritura: Dict[str, Optional[OrdenProcesada]] = {}
+        self._hilo: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._detenido = False
+        atexit.register(self.cerrar)
+
+    def _conexion(self) -> sqlite3.Connection:
+        conexion = getattr(self._local, "conexion", None)
+        # Una conexión heredada por fork no se usa en el hijo
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = abrir_base(self.path)
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return conexion
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    def _asegurar_hilo(self) -> None:
+        # Con preload de gunicorn el módulo se importa antes del fork: el
+        # hilo se arranca en cada worker, al primer uso
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pendientes, self._en_escritura = {}, {}
+            self._hilo = None
+            self._detenido = False
+        if self._hilo is None:
+            self._hilo = threading.Thread(
+                target=self._bucle, name="registro-ordenes", daemon=True
+            )
+            self._hilo.start()
+
+    def _encolar(self, clave: str, fila: Optional[OrdenProcesada]) -> None:
+        with self._cond:
+            self._asegurar_hilo()
+            self._pendientes[clave] = fila
+            self._cond.notify()
+
+    def registrar(
+        self,
+        orden,
+        estado: str,
+        numero_envio: Optional[str] = None,
+        tarifa: Optional[float] = None,
+        pdf_sha256: Optional[str] = None,
+    ) -> OrdenProcesada:
+        """
+        Registra (o actualiza) una orden. No bloquea: la fila se escribe en
+        el próximo lote.
+        """
+        fila = OrdenProcesada(
+            clave_orden(orden), numero_envio, estado,
+            float(tarifa) if tarifa is not None else None, pdf_sha256, time.time()
+        )
+        self.guardar(fila)
+        return fila
+
+    def guardar(self, fila: OrdenProcesada) -> None:
+        """Escribe `fila` tal cual (p.ej. para restaurar un estado anterior)."""
+        self._encolar(fila.clave, fila)
+
+    def borrar(self, orden) -> None:
+        """Quita una orden (p.ej. si la generación de la guía falló)."""
+        self._encolar(clave_orden(orden), None)
+
+    def reclamar(
+        self, orden, vigencia: float, regenerar: bool = False, incierta: bool = False
+    ) -> Optional[OrdenProcesada]:
+        """
+        Marca la orden PROCESSING antes de pedir la guía, de forma atómica
+        entre hilos y workers (escritura directa, no por lote): de dos
+        reclamos simultáneos solo uno gana.
+
+        Se reclama si la orden no tiene fila, si su PROCESSING tiene más de
+        `vigencia` segundos (proceso caído), con `regenerar` si ya tiene guía
+        y con `incierta` si quedó UNCERTAIN (ya se verificó en Correos que
+        ese envío no está registrado).
+
+        Returns:
+            La fila anterior (para restaurarla si la generación falla)
+
+        Raises:
+            OrdenOcupadaError: Si otro la está generando, ya tiene guía o su
+                registro quedó incierto
+        """
+        clave = clave_orden(orden)
+        with self._cond:
+            en_memoria = self._pid == os.getpid() and (
+                clave in self._pendientes or clave in self._en_escritura
+            )
+        # Un cambio aún en memoria pisaría el reclamo al escribirse
+        if en_memoria:
+            self.vaciar()
+
+        ahora = time.time()
+        conexion = self._conexion()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            fila = conexion.execute(
+                f"SELECT {_COLUMNAS} FROM ordenes_procesadas WHERE clave = ?", (clave,)
+            ).fetchone()
+            reclamada = conexion.execute(
+                f"INSERT INTO ordenes_procesadas ({_COLUMNAS}) VALUES (?, NULL, ?, NULL, NULL, ?) "
+                "ON CONFLICT (clave) DO UPDATE SET estado = excluded.estado, procesada_en = excluded.procesada_en "
+                "WHERE NOT (ordenes_procesadas.estado = ? AND ordenes_procesadas.procesada_en > ?) "
+                "AND (? OR ordenes_procesadas.estado != ?) "
+                "AND (? OR ordenes_procesadas.estado != ?) "
+                "RETURNING clave",
+                (clave, ESTADO_PROCESANDO, ahora, ESTADO_PROCESANDO, ahora - vigencia,
+                 regenerar, ESTADO_GUIA_CREADA, incierta, ESTADO_INCIERTO),
+            ).fetchall() != []
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+        anterior = OrdenProcesada(*fila) if fila else None
+        if not reclamada:
+            raise OrdenOcupadaError(anterior)
+        _filas.inc(operacion="reclamar")
+        return anterior
+
+    def _bucle(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pendientes and not self._detenido:
+                    self._cond.wait()
+                if not self._pendientes:
+                    return
+                # Juntar más filas durante la ventana (o hasta llenar el lote)
+                limite = time.monotonic() + self.espera
+                while len(self._pendientes) < self.lote_maximo and not self._detenido:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._cond.wait(restante)
+                self._en_escritura, self._pendientes = self._pendientes, {}
+            try:
+                self._escribir(self._en_escritura)
+            except Exception as e:
+                logger.error("❌ No se pudo escribir el registro de órdenes: %s", e, exc_info=True)
+                # Reintentar en el próximo lote sin pisar cambios más nuevos
+                with self._cond:
+                    self._pendientes = {**self._en_escritura, **self._pendientes}
+                time.sleep(1)
+            finally:
+                with self._cond:
+                    self._en_escritura = {}
+
+    def _escribir(self, lote: Dict[str, Optional[OrdenProcesada]]) -> None:
+        guardar = [fila for fila in lote.values() if fila is not None]
+        borrar = [(clave,) for clave, fila in lote.items() if fila is None]
+        inicio = time.perf_counter()
+        conexion = self._conexion()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            if guardar:
+                conexion.executemany(
+                    f"INSERT OR REPLACE INTO ordenes_procesadas ({_COLUMNAS}) VALUES (?, ?, ?, ?, ?, ?)",
+                    guardar,
+                )
+            if borrar:
+                conexion.executemany("DELETE FROM ordenes_procesadas WHERE clave = ?", borrar)
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+        _duracion_lote.observe(time.perf_counter() - inicio)
+        _filas.inc(len(guardar), operacion="guardar")
+        _filas.inc(len(borrar), operacion="borrar")
+
+    def vaciar(self, timeout: float = 5.0) -> bool:
+        """Espera a que las filas pendientes queden escritas."""
+        limite = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify()
+        while time.monotonic() < limite:
+            with self._cond:
+                if not self._pendientes and not self._en_escritura:
+                    return True
+            time.sleep(0.005)
+        return False
+
+    def cerrar(self) -> None:
+        """Escribe lo pendiente y detiene el hilo."""
+        with self._cond:
+            hilo = self._hilo if self._pid == os.getpid() else None
+            self._detenido = True
+            self._cond.notify()
+        if hilo is not None:
+            hilo.join(timeout=5)
+        with self._cond:
+            self._hilo = None
+            self._detenido = False
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+
+    def buscar(self, orden) -> Optional[OrdenProcesada]:
+        """Estado de una orden, o None si no fue procesada."""
+        clave = clave_orden(orden)
+        with self._cond:
+            if self._pid == os.getpid():
+                for cambios in (self._pendientes, self._en_escritura):
+                    if clave in cambios:
+                        return cambios[clave]
+        fila = self._conexion().execute(
+            f"SELECT {_COLUMNAS} FROM ordenes_procesadas WHERE clave = ?", (clave,)
+        ).fetchone()
+        return OrdenProcesada(*fila) if fila else None
+
+    def buscar_por_numero(self, numero_envio: str) -> Optional[OrdenProcesada]:
+        """Orden a la que pertenece un número de envío, o None."""
+        fila = self._conexion().execute(
+            f"SELECT {_COLUMNAS} FROM ordenes_procesadas WHERE numero_envio = ? LIMIT 1",
+            (numero_envio,),
+        ).fetchone()
+        return OrdenProcesada(*fila) if fila else None
+
+
+# Instancia global del registro
+registro_ordenes = RegistroOrdenes(
+    config.ORDENES_DB_PATH,
+    lote_maximo=config.ORDENES_LOTE_MAXIMO,
+    espera=config.ORDENES_LOTE_ESPERA_MS / 1000.0,
+)
@@ -0,0 +1,251 @@
+"""
+Perfilado por muestreo de requests individuales (opt-in).
+
+Un hilo muestreador lee periódicamente la pila de los hilos que trabajan en
+la request perfilada (sys._current_frames) y cuenta las pilas. Al terminar
+la request se escriben dos archivos en PERFIL_DIR:
+
+- `<id>.folded`: collapsed stacks ("a;b;c 12"), para flamegraph.pl / speedscope
+- `<id>.speedscope.json`: para abrir en https://www.speedscope.app
+
+Solo se conservan los últimos PERFIL_MAX_ARCHIVOS perfiles. Sin perfiles
+activos el hilo muestreador no corre y el costo es nulo.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from src.services.metricas import registro
+
+logger = logging.getLogger(__name__)
+
+_perfil_actual: ContextVar[Optional["Perfil"]] = ContextVar("perfil_actual", default=None)
+
+_perfiles = registro.contador(
+    "perfiles_generados_total", "Perfiles de requests escritos a disco", ["motivo"]
+)
+
+_Marco = Tuple[str, str, int]
+
+
+class Perfil:
+    """Muestras de pila de una request."""
+
+    def __init__(self, identificador: str, ruta: str, motivo: str):
+        self.id = identificador
+        self.ruta = ruta
+        self.motivo = motivo
+        self.inicio = time.monotonic()
+        self.fin: Optional[float] = None
+        self.hilos: Set[int] = set()
+        self.muestras: Counter = Counter()
+        self.lock = threading.Lock()
+
+
+def _pila(frame, nombre_hilo: str) -> Tuple[_Marco, ...]:
+    marcos: List[_Marco] = []
+    while frame is not None:
+        codigo = frame.f_code
+        marcos.append((codigo.co_name, codigo.co_filename, codigo.co_firstlineno))
+        frame = frame.f_back
+    marcos.append((nombre_hilo, "", 0))
+    marcos.reverse()
+    return tuple(marcos)
+
+
+def _nombre_marco(marco: _Marco) -> str:
+    nombre, archivo, linea = marco
+    if not archivo:
+        return nombre
+    return f"{nombre} ({os.path.basename(archivo)}:{linea})"
+
+
+class Perfilador:
+    """
+    Args:
+        directorio: Dónde escribir los perfiles
+        intervalo: Segundos entre muestras
+        max_perfiles: Perfiles a conservar (los más viejos se borran)
+    """
+
+    def __init__(self, directorio: str, intervalo: float = 0.005, max_perfiles: int = 50):
+        self.directorio = directorio
+        self.intervalo = intervalo
+        self.max_perfiles = max_perfiles
+        self._activos: Set[Perfil] = set()
+        self._lock = threading.Lock()
+        self._hay_activos = threading.Condition(self._lock)
+        self._hilo: Optional[threading.Thread] = None
+
+    # --- Muestreo --------------------------------------------------------
+
+    def _bucle(self) -> None:
+        nombres: Dict[int, str] = {}
+        while True:
+            with self._lock:
+                while not self._activos:
+                    self._hay_activos.wait()
+                activos = list(self._activos)
+            frames = sys._current_frames()
+            for perfil in activos:
+                with perfil.lock:
+                    hilos = list(perfil.hilos)
+                for tid in hilos:
+                    frame = frames.get(tid)
+                    if frame is None:
+                        continue
+                    nombre = nombres.get(tid)
+                    if nombre is None:
+                        nombre = nombres[tid] = next(
+                            (t.name for t in threading.enumerate() if t.ident == tid), str(tid)
+                        )
+                    pila = _pila(frame, nombre)
+                    with perfil.lock:
+                        perfil.muestras[pila] += 1
+            del frames
+            time.sleep(self.intervalo)
+
+    def _asegurar_hilo(self) -> None:
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="perfilador", daemon=True)
+            self._hilo.start()
+
+    # --- API -------------------------------------------------------------
+
+    def iniciar(self, identificador: str, ruta: str, motivo: str) -> Perfil:
+        perfil = Perfil(identificador, ruta, motivo)
+        with self._lock:
+            self._asegurar_hilo()
+            self._activos.add(perfil)
+            self._hay_activos.notify()
+        return perfil
+
+    @contextmanager
+    def perfilar(self, perfil: Perfil) -> Iterator[None]:
+        """Activa el perfil en el contexto y muestrea el hilo actual durante el bloque."""
+        token = _perfil_actual.set(perfil)
+        try:
+            with registrar_hilo():
+                yield
+        finally:
+            _perfil_actual.reset(token)
+
+    def finalizar(self, perfil: Perfil) -> Optional[str]:
+        """Detiene el muestreo del perfil y lo escribe. Devuelve la ruta base."""
+        with self._lock:
+            self._activos.discard(perfil)
+        perfil.fin = time.monotonic()
+        try:
+            base = self._escribir(perfil)
+        except OSError as e:
+            logger.warning("⚠️  No se pudo escribir el perfil %s: %s", perfil.id, e)
+            return None
+        _perfiles.inc(motivo=perfil.motivo)
+        self._podar()
+        return base
+
+    # --- Archivos --------------------------------------------------------
+
+    def _escribir(self, perfil: Perfil) -> str:
+        os.makedirs(self.directorio, exist_ok=True)
+        with perfil.lock:
+            muestras = list(perfil.muestras.items())
+        base = os.path.join(self.directorio, perfil.id)
+
+        lineas = [
+            ";".join(_nombre_marco(m) for m in pila) + f" {cantidad}"
+            for pila, cantidad in sorted(muestras, key=lambda x: -x[1])
+        ]
+        with open(base + ".folded", "w", encoding="utf-8") as f:
+            f.write("\n".join(lineas) + ("\n" if lineas else ""))
+
+        indices: Dict[_Marco, int] = {}
+        marcos = []
+        samples = []
+        weights = []
+        for pila, cantidad in muestras:
+            fila = []
+            for marco in pila:
+                indice = indices.get(marco)
+                if indice is None:
+                    indice = indices[marco] = len(marcos)
+                    nombre, archivo, linea = marco
+                    marcos.append({"name": nombre, "file": archivo, "line": linea} if archivo else {"name": nombre})
+                fila.append(indice)
+            samples.append(fila)
+            weights.append(cantidad * self.intervalo)
+        duracion = (perfil.fin or time.monotonic()) - perfil.inicio
+        documento = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{perfil.ruta} {perfil.id}",
+            "exporter": "correos-backend",
+            "shared": {"frames": marcos},
+            "profiles": [{
+                "type": "sampled",
+                "name": perfil.ruta,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": duracion,
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+        with open(base + ".speedscope.json", "w", encoding="utf-8") as f:
+            json.dump(documento, f)
+        logger.info(
+            "🔬 Perfil %s (%s, %.0fms, %d muestras) en %s",
+            perfil.id, perfil.ruta, duracion * 1000, sum(c for _, c in muestras), base,
+        )
+        return base
+
+    def _podar(self) -> None:
+        """Borra los perfiles más viejos por encima de max_perfiles."""
+        try:
+            archivos = [a for a in os.listdir(self.directorio) if a.endswith(".folded")]
+        except OSError:
+            return
+        archivos.sort(key=lambda a: os.path.getmtime(os.path.join(self.directorio, a)))
+        for archivo in archivos[:max(0, len(archivos) - self.max_perfiles)]:
+            base = os.path.join(self.directorio, archivo[: -len(".folded")])
+            for sufijo in (".folded", ".speedscope.json"):
+                try:
+                    os.unlink(base + sufijo)
+                except OSError:
+                    pass
+
+
+def nuevo_id_perfil(ruta: str, request_id: Optional[str]) -> str:
+    # Va en nombres de archivo y en el header X-Perfil: el request id lo
+    # elige el cliente (X-Request-ID), se limpia igual que la ruta
+    ruta_segura = re.sub(r"[^A-Za-z0-9]+", "_", ruta).strip("_") or "raiz"
+    id_seguro = re.sub(r"[^A-Za-z0-9]+", "_", request_id or "").strip("_") or str(os.getpid())
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{ruta_segura}-{id_seguro}"
+
+
+@contextmanager
+def registrar_hilo() -> Iterator[None]:
+    """
+    Si la request en curso se está perfilando, muestrea el hilo actual
+    durante el bloque (p.ej. el hilo del ejecutor SOAP que la atiende).
+    """
+    perfil = _perfil_actual.get()
+    if perfil is None:
+        yield
+        return
+    tid = threading.get_ident()
+    with perfil.lock:
+        perfil.hilos.add(tid)
+    try:
+        yield
+    finally:
+        with perfil.lock:
+            perfil.hilos.discard(tid)
@@ -0,0 +1,183 @@
+"""
+Planificador de llamadas a Correos por carriles de prioridad.
+
+Todas las llamadas SOAP comparten un presupuesto de concurrencia hacia
+Correos. Cada llamada pertenece a un carril (interactivo, masivo, fondo) y
+cuando hay espera, los lugares libres se reparten por peso entre los carriles
+con llamadas pendientes (fair queuing ponderado por tiempo virtual): un lote
+masivo no puede dejar sin turno a las requests interactivas de la UI.
+
+El carril se toma del contexto (`usar_carril`), así no hay que pasarlo por
+todos los servicios.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, Optional
+
+from src.config import config
+from src.services.metricas import registro
+
+CARRIL_INTERACTIVO = "interactivo"
+CARRIL_MASIVO = "masivo"
+CARRIL_FONDO = "fondo"
+CARRILES = (CARRIL_INTERACTIVO, CARRIL_MASIVO, CARRIL_FONDO)
+
+_carril_actual: ContextVar[str] = ContextVar("carril_actual", default=CARRIL_INTERACTIVO)
+
+_espera = registro.histograma(
+    "soap_carril_espera_segundos", "Espera por un lugar de concurrencia hacia Correos", ["carril"]
+)
+_latencia = registro.histograma(
+    "soap_carril_latencia_segundos", "Latencia total de llamadas SOAP (espera + ejecución)", ["carril"]
+)
+_en_espera = registro.medidor(
+    "soap_carril_en_espera", "Llamadas SOAP esperando turno", ["carril"]
+)
+_activas = registro.medidor(
+    "soap_carril_activas", "Llamadas SOAP en curso hacia Correos", ["carril"]
+)
+
+
+class TurnoNoDisponibleError(Exception):
+    """No se obtuvo turno hacia Correos dentro del tiempo indicado."""
+
+
+def carril_actual() -> str:
+    """Carril de la tarea/hilo actual (interactivo por defecto)."""
+    return _carril_actual.get()
+
+
+@contextmanager
+def usar_carril(carril: str) -> Iterator[None]:
+    """Ejecuta el bloque con las llamadas SOAP asignadas a `carril`."""
+    if carril not in CARRILES:
+        raise ValueError(f"Carril inválido: {carril}. Debe ser: {', '.join(CARRILES)}")
+    token = _carril_actual.set(carril)
+    try:
+        yield
+    finally:
+        _carril_actual.reset(token)
+
+
+class _Carril:
+    def __init__(self, nombre: str, peso: float):
+        self.nombre = nombre
+        self.peso = peso
+        self.tiempo_virtual = 0.0
+        self.cola: Deque[threading.Event] = deque()
+        self.activas = 0
+
+
+class Planificador:
+    """Reparte `concurrencia` lugares hacia Correos entre carriles ponderados."""
+
+    def __init__(self, concurrencia: int, pesos: Dict[str, float]):
+        self.concurrencia = max(1, concurrencia)
+        self._carriles = {
+            nombre: _Carril(nombre, max(0.001, float(pesos.get(nombre, 1.0))))
+            for nombre in CARRILES
+        }
+        self._lock = threading.Lock()
+        self._en_uso = 0
+        self._tiempo_virtual = 0.0
+
+    def _avanzar(self, carril: _Carril) -> None:
+        # Un carril que estuvo inactivo no acumula crédito
+        inicio = max(carril.tiempo_virtual, self._tiempo_virtual)
+        self._tiempo_virtual = inicio
+        carril.tiempo_virtual = inicio + 1.0 / carril.peso
+        carril.activas += 1
+        self._en_uso += 1
+        _activas.set(carril.activas, carril=carril.nombre)
+
+    def _despachar(self) -> None:
+        """Concede lugares libres al carril con menor tiempo virtual."""
+        while self._en_uso < self.concurrencia:
+            pendientes = [c for c in self._carriles.values() if c.cola]
+            if not pendientes:
+                return
+            carril = min(
+                pendientes,
+                key=lambda c: max(c.tiempo_virtual, self._tiempo_virtual),
+            )
+            evento = carril.cola.popleft()
+            _en_espera.set(len(carril.cola), carril=carril.nombre)
+            self._avanzar(carril)
+            evento.set()
+
+    def _adquirir(self, carril: _Carril, timeout: Optional[float]) -> None:
+        with self._lock:
+            hay_espera = any(c.cola for c in self._carriles.values())
+            if self._en_uso < self.concurrencia and not hay_espera:
+                self._avanzar(carril)
+                return
+            evento = threading.Event()
+            carril.cola.append(evento)
+            _en_espera.set(len(carril.cola), carril=carril.nombre)
+
+        if evento.wait(timeout):
+            return
+
+        with self._lock:
+            if evento.is_set():
+                # Se concedió justo al vencer el timeout
+                return
+            carril.cola.remove(evento)
+            _en_espera.set(len(carril.cola), carril=carril.nombre)
+        raise TurnoNoDisponibleError(
+            f"Sin turno hacia Correos en {timeout:.2f}s (carril {carril.nombre})"
+        )
+
+    def _liberar(self, carril: _Carril) -> None:
+        with self._lock:
+            carril.activas -= 1
+            self._en_uso -= 1
+            _activas.set(carril.activas, carril=carril.nombre)
+            self._despachar()
+
+    @contextmanager
+    def turno(self, carril: Optional[str] = None, timeout: Optional[float] = None) -> Iterator[None]:
+        """
+        Bloquea hasta obtener un lugar de concurrencia hacia Correos.
+
+        Args:
+            carril: Carril de la llamada (por defecto, el del contexto)
+            timeout: Espera máxima en segundos (None = sin límite)
+
+        Raises:
+            TurnoNoDisponibleError: Si vence el timeout sin obtener turno
+        """
+        c = self._carriles[carril or carril_actual()]
+        inicio = time.monotonic()
+        self._adquirir(c, timeout)
+        _espera.observe(time.monotonic() - inicio, carril=c.nombre)
+        try:
+            yield
+        finally:
+            self._liberar(c)
+            _latencia.observe(time.monotonic() - inicio, carril=c.nombre)
+
+    def estado(self) -> dict:
+        with self._lock:
+            return {
+                "concurrencia": self.concurrencia,
+                "en_uso": self._en_uso,
+                "carriles": {
+                    c.nombre: {
+                        "peso": c.peso,
+                        "activas": c.activas,
+                        "en_espera": len(c.cola),
+                    }
+                    for c in self._carriles.values()
+                },
+            }
+
+
+# Instancia global del planificador
+planificador = Planificador(
+    concurrencia=config.SOAP_CONCURRENCIA_MAXIMA,
+    pesos=config.SOAP_PESOS_CARRILES,
+)
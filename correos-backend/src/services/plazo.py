@@ -0,0 +1,92 @@
+"""
+Plazo (deadline) de punta a punta de una request.
+
+El endpoint fija un plazo total y cada etapa (cola del ejecutor, token,
+turno/rate limit, llamada SOAP) usa solo lo que queda de él. El plazo viaja
+en el contexto (ContextVar), que el ejecutor SOAP copia al hilo, así no hay
+que pasarlo por parámetro a GuiaService, EnvioService, AuthService ni SoapClient.
+
+Sin plazo en el contexto (scripts, jobs) cada etapa usa su timeout propio.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+# Instante (time.monotonic) en que vence la request en curso
+_vence_en: ContextVar[Optional[float]] = ContextVar("plazo_vence_en", default=None)
+
+
+class PlazoVencidoError(Exception):
+    """La request agotó su plazo; no tiene sentido seguir trabajando en ella."""
+
+    def __init__(self, etapa: str):
+        self.etapa = etapa
+        super().__init__(f"Plazo de la request agotado ({etapa})")
+
+
+@contextmanager
+def usar_plazo(segundos: Optional[float]) -> Iterator[None]:
+    """Ejecuta el bloque con un plazo de `segundos` (None = sin plazo)."""
+    vence_en = None if segundos is None else time.monotonic() + segundos
+    # Un plazo interno nunca extiende el de la request que lo contiene
+    actual = _vence_en.get()
+    if actual is not None and (vence_en is None or actual < vence_en):
+        vence_en = actual
+    token = _vence_en.set(vence_en)
+    try:
+        yield
+    finally:
+        _vence_en.reset(token)
+
+
+@contextmanager
+def usar_plazo_propio(segundos: Optional[float]) -> Iterator[None]:
+    """
+    Como usar_plazo, pero reemplaza el plazo del contexto en lugar de
+    acotarse a él: para trabajo compartido que debe terminar aunque venza la
+    request que lo lanzó (p.ej. una consulta que queda en cache).
+    """
+    token = _vence_en.set(None if segundos is None else time.monotonic() + segundos)
+    try:
+        yield
+    finally:
+        _vence_en.reset(token)
+
+
+def restante() -> Optional[float]:
+    """Segundos que le quedan a la request (None = sin plazo)."""
+    vence_en = _vence_en.get()
+    if vence_en is None:
+        return None
+    return vence_en - time.monotonic()
+
+
+def verificar(etapa: str) -> None:
+    """
+    Raises:
+        PlazoVencidoError: Si el plazo ya venció antes de empezar `etapa`
+    """
+    quedan = restante()
+    if quedan is not None and quedan <= 0:
+        raise PlazoVencidoError(etapa)
+
+
+def vencido() -> bool:
+    quedan = restante()
+    return quedan is not None and quedan <= 0
+
+
+def timeout_para(etapa: str, maximo: Optional[float]) -> Optional[float]:
+    """
+    Timeout para una etapa: el menor entre su máximo propio y lo que queda.
+
+    Raises:
+        PlazoVencidoError: Si ya no queda tiempo
+    """
+    quedan = restante()
+    if quedan is None:
+        return maximo
+    if quedan <= 0:
+        raise PlazoVencidoError(etapa)
+    return quedan if maximo is None else min(maximo, quedan)
@@ -0,0 +1,340 @@
+"""
+Limitador de tasa (token bucket) para llamadas a Correos.
+
+TokenBucket es local al proceso. LimitadorOperaciones lleva un bucket por
+operación SOAP cuyo estado vive en un backend compartido (SQLite en el host,
+o Redis), así todos los workers juntos respetan la cuota de Correos.
+"""
+import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _consumir(tokens: float, actualizado: float, ahora: float,
+              tasa: float, capacidad: float, pedidos: float) -> Tuple[float, float]:
+    """
+    Recarga y consume un bucket.
+
+    Returns:
+        (tokens restantes, segundos de espera; 0 si se consumió)
+    """
+    tokens = min(capacidad, tokens + max(0.0, ahora - actualizado) * tasa)
+    if tokens >= pedidos:
+        return tokens - pedidos, 0.0
+    return tokens, (pedidos - tokens) / tasa
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe.
+
+    Se recargan `tasa` tokens por segundo hasta un máximo de `capacidad`
+    (ráfaga). Cada llamada consume un token.
+    """
+
+    def __init__(self, tasa: float, capacidad: Optional[float] = None):
+        if tasa <= 0:
+            raise ValueError("La tasa debe ser mayor a 0")
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad if capacidad is not None else max(1.0, tasa))
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def intentar(self, tokens: float = 1.0) -> float:
+        """
+        Intenta consumir tokens sin bloquear.
+
+        Returns:
+            0 si se consumieron; si no, segundos a esperar para que alcancen
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens, espera = _consumir(
+                self._tokens, self._ultimo, ahora, self.tasa, self.capacidad, tokens
+            )
+            self._ultimo = ahora
+            return espera
+
+    def adquirir(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """
+        Consume tokens, esperando lo necesario.
+
+        Args:
+            tokens: Tokens a consumir
+            timeout: Espera máxima en segundos (None = sin límite)
+
+        Returns:
+            True si se consumieron, False si se agotó el timeout
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            espera = self.intentar(tokens)
+            if espera == 0:
+                return True
+            if limite is not None:
+                restante = limite - time.monotonic()
+                if restante <= 0 or espera > restante:
+                    return False
+            time.sleep(espera)
+
+
+class LimiteExcedidoError(Exception):
+    """No hay tokens para la operación dentro de la espera permitida."""
+
+    def __init__(self, operacion: str, retry_after: float):
+        self.operacion = operacion
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(
+            f"Límite de tasa hacia Correos excedido en {operacion}. "
+            f"Reintente en {self.retry_after}s"
+        )
+
+
+class BackendMemoria:
+    """Buckets en memoria: compartidos entre hilos, no entre procesos."""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def consumir(self, clave: str, tasa: float, capacidad: float, pedidos: float,
+                 espera_bloqueo: Optional[float] = None) -> float:
+        with self._lock:
+            ahora = time.monotonic()
+            tokens, actualizado = self._buckets.get(clave, (capacidad, ahora))
+            tokens, espera = _consumir(tokens, actualizado, ahora, tasa, capacidad, pedidos)
+            self._buckets[clave] = (tokens, ahora)
+            return espera
+
+
+class BackendSQLite:
+    """
+    Buckets en un archivo SQLite: compartidos por todos los procesos del host.
+
+    Cada consumo es una transacción BEGIN IMMEDIATE (lectura + escritura bajo
+    el lock de escritura del archivo), así dos workers nunca gastan el mismo
+    token. Usa el reloj de pared porque monotonic no es comparable entre procesos.
+
+    Args:
+        path: Archivo SQLite
+        espera_bloqueo: Segundos máximos esperando el lock de escritura
+    """
+
+    def __init__(self, path: str, espera_bloqueo: float = 5.0):
+        self.path = path
+        self.espera_bloqueo = espera_bloqueo
+        self._local = threading.local()
+
+    def _conexion(self) -> sqlite3.Connection:
+        conexion = getattr(self._local, "conexion", None)
+        # Una conexión heredada por fork no se usa en el hijo
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = sqlite3.connect(self.path, timeout=self.espera_bloqueo, isolation_level=None)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets ("
+                "clave TEXT PRIMARY KEY, tokens REAL NOT NULL, actualizado REAL NOT NULL)"
+            )
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return conexion
+
+    def consumir(self, clave: str, tasa: float, capacidad: float, pedidos: float,
+                 espera_bloqueo: Optional[float] = None) -> float:
+        """
+        Raises:
+            sqlite3.OperationalError: Si el lock no se libera en `espera_bloqueo`
+                segundos (None = self.espera_bloqueo)
+        """
+        conexion = self._conexion()
+        espera = self.espera_bloqueo if espera_bloqueo is None else min(self.espera_bloqueo, espera_bloqueo)
+        conexion.execute(f"PRAGMA busy_timeout = {max(0, int(espera * 1000))}")
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            ahora = time.time()
+            fila = conexion.execute(
+                "SELECT tokens, actualizado FROM token_buckets WHERE clave = ?", (clave,)
+            ).fetchone()
+            tokens, actualizado = fila if fila else (capacidad, ahora)
+            tokens, espera = _consumir(tokens, actualizado, ahora, tasa, capacidad, pedidos)
+            conexion.execute(
+                "INSERT OR REPLACE INTO token_buckets (clave, tokens, actualizado) VALUES (?, ?, ?)",
+                (clave, tokens, ahora),
+            )
+            conexion.execute("COMMIT")
+            return espera
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+
+
+_SCRIPT_REDIS = """
+local tasa = tonumber(ARGV[1])
+local capacidad = tonumber(ARGV[2])
+local pedidos = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local ahora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local datos = redis.call('HMGET', KEYS[1], 'tokens', 'actualizado')
+local tokens = tonumber(datos[1]) or capacidad
+local actualizado = tonumber(datos[2]) or ahora
+tokens = math.min(capacidad, tokens + math.max(0, ahora - actualizado) * tasa)
+local espera = 0
+if tokens >= pedidos then
+    tokens = tokens - pedidos
+else
+    espera = (pedidos - tokens) / tasa
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'actualizado', ahora)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacidad / tasa) + 60)
+return tostring(espera)
+"""
+
+
+class BackendRedis:
+    """
+    Buckets en Redis (o compatible): compartidos entre hosts.
+    El consumo es un script Lua atómico con el reloj del servidor Redis.
+    Requiere el paquete opcional `redis`.
+    """
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError(
+                "El backend 'redis' requiere el paquete redis. Instálelo con: pip install redis"
+            )
+        self._cliente = redis.Redis.from_url(url)
+        self._script = self._cliente.register_script(_SCRIPT_REDIS)
+
+    def consumir(self, clave: str, tasa: float, capacidad: float, pedidos: float,
+                 espera_bloqueo: Optional[float] = None) -> float:
+        return float(self._script(keys=[clave], args=[tasa, capacidad, pedidos]))
+
+
+class LimitadorOperaciones:
+    """
+    Token bucket por operación sobre un backend (memoria, SQLite o Redis).
+
+    Cada operación tiene su propia tasa (`tasas`, o `tasa_defecto`) y una
+    ráfaga de `rafaga_segundos` segundos de tokens.
+    """
+
+    def __init__(
+        self,
+        backend,
+        tasa_defecto: float,
+        tasas: Optional[Dict[str, float]] = None,
+        rafaga_segundos: float = 1.0,
+        prefijo: str = "correos",
+    ):
+        if tasa_defecto <= 0:
+            raise ValueError("La tasa debe ser mayor a 0")
+        self.backend = backend
+        self.tasa_defecto = float(tasa_defecto)
+        self.tasas = {k: float(v) for k, v in (tasas or {}).items() if v > 0}
+        self.rafaga_segundos = rafaga_segundos
+        self.prefijo = prefijo
+
+    def _parametros(self, operacion: str) -> Tuple[float, float]:
+        tasa = self.tasas.get(operacion, self.tasa_defecto)
+        return tasa, max(1.0, tasa * self.rafaga_segundos)
+
+    def intentar(self, operacion: str, tokens: float = 1.0, espera_bloqueo: Optional[float] = None) -> float:
+        """
+        Intenta consumir sin esperar tokens (sí el lock del backend, hasta
+        `espera_bloqueo` segundos).
+
+        Returns:
+            0 si se consumieron; si no, segundos a esperar para que alcancen
+        """
+        tasa, capacidad = self._parametros(operacion)
+        return self.backend.consumir(
+            f"{self.prefijo}:{operacion}", tasa, capacidad, tokens, espera_bloqueo=espera_bloqueo
+        )
+
+    def adquirir(
+        self,
+        operacion: str,
+        espera_maxima: Optional[float] = None,
+        tokens: float = 1.0,
+        plazo_bloqueo: Optional[float] = None,
+    ) -> float:
+        """
+        Consume tokens de la operación, esperando como máximo `espera_maxima`.
+
+        Args:
+            operacion: Nombre de la operación (p.ej. "ccrGenerarGuia")
+            espera_maxima: Segundos a esperar (0 = fail-fast, None = sin límite)
+            tokens: Tokens a consumir
+            plazo_bloqueo: Segundos en total para esperar el lock del backend
+                (el plazo de la request; None = la espera propia del backend)
+
+        Returns:
+            Segundos esperados
+
+        Raises:
+            LimiteExcedidoError: Si no alcanzan los tokens dentro de la espera,
+                o el backend sigue bloqueado al vencer `plazo_bloqueo`
+        """
+        inicio = time.monotonic()
+        limite = None if espera_maxima is None else inicio + espera_maxima
+        limite_bloqueo = None if plazo_bloqueo is None else inicio + plazo_bloqueo
+        while True:
+            espera_bloqueo = None if limite_bloqueo is None else max(0.0, limite_bloqueo - time.monotonic())
+            try:
+                espera = self.intentar(operacion, tokens, espera_bloqueo=espera_bloqueo)
+            except sqlite3.OperationalError as e:
+                # Otro worker retiene el lock del archivo (o no se puede usar)
+                logger.warning("Backend del rate limit no disponible para %s: %s", operacion, e)
+                raise LimiteExcedidoError(operacion, 1) from e
+            if espera == 0:
+                return time.monotonic() - inicio
+            if limite is not None:
+                restante = limite - time.monotonic()
+                if espera > restante:
+                    raise LimiteExcedidoError(operacion, espera)
+            # Otros procesos compiten por los mismos tokens: se reintenta
+            # al vencer la espera estimada (con un poco de jitter)
+            time.sleep(espera * (1.0 + random.random() * 0.1))
+
+
+def crear_limitador(
+    backend: str,
+    tasa_defecto: float,
+    tasas: Optional[Dict[str, float]] = None,
+    rafaga_segundos: float = 1.0,
+    sqlite_path: str = "",
+    redis_url: str = "",
+    prefijo: str = "correos",
+) -> Optional[LimitadorOperaciones]:
+    """
+    Crea el limitador según el nombre de backend.
+
+    Args:
+        backend: "memoria", "sqlite", "redis" o "" (sin límite)
+
+    Returns:
+        El limitador, o None si está desactivado
+    """
+    backend = (backend or "").strip().lower()
+    if not backend or backend == "ninguno":
+        return None
+    if backend == "memoria":
+        almacen = BackendMemoria()
+    elif backend == "sqlite":
+        almacen = BackendSQLite(sqlite_path)
+    elif backend == "redis":
+        almacen = BackendRedis(redis_url)
+    else:
+        raise ValueError(f"Backend de rate limit desconocido: {backend}. Use memoria, sqlite o redis")
+    return LimitadorOperaciones(almacen, tasa_defecto, tasas, rafaga_segundos, prefijo)
@@ -2,15 +2,88 @@
 Cliente SOAP base para comunicación con Correos de Costa Rica.
 """
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Dict, Optional
+import requests
 from lxml import etree
 from zeep import Client, Settings
 from zeep.exceptions import Fault, TransportError
 from zeep.plugins import HistoryPlugin
+from zeep.transports import Transport
 from src.config import config
 from src.services.auth_service import auth_service
+from src.services import plazo
+from src.services.hedging import Hedger
+from src.services.metricas import registro
+from src.services.plazo import PlazoVencidoError
+from src.services.planificador import TurnoNoDisponibleError, planificador
+from src.services.rate_limiter import LimiteExcedidoError, crear_limitador
 
 logger = logging.getLogger(__name__)
 
+_espera_rate_limit = registro.histograma(
+    "soap_rate_limit_espera_segundos", "Espera por un token del rate limit hacia Correos", ["operacion"]
+)
+_rechazos_rate_limit = registro.contador(
+    "soap_rate_limit_rechazos_total", "Llamadas rechazadas por el rate limit hacia Correos", ["operacion"]
+)
+
+_duracion_llamada = registro.histograma(
+    "soap_llamada_duracion_segundos", "Duración de las llamadas SOAP a Correos (con turno asignado)", ["operacion"]
+)
+_llamadas = registro.contador(
+    "soap_llamadas_total", "Llamadas SOAP a Correos por resultado y CodRespuesta",
+    ["operacion", "resultado", "cod_respuesta"]
+)
+
+
+class ConexionSoapError(Exception):
+    """
+    La llamada a Correos no tuvo respuesta (timeout o error de conexión/HTTP):
+    no se sabe si Correos la procesó.
+    """
+
+
+# Headers HTTP de la llamada en curso (por hilo/tarea, no compartidos)
+_headers_llamada: ContextVar[Optional[Dict[str, str]]] = ContextVar("headers_llamada", default=None)
+
+
+def _extract_code_message(res):
+    """
+    Algunos métodos de Correos responden con CodRespuesta/MensajeRespuesta
+    (sin SOAP Fault). Extraemos esos campos para manejar token inválido.
+    """
+    try:
+        if hasattr(res, "CodRespuesta"):
+            code = getattr(res, "CodRespuesta", None)
+            msg = getattr(res, "MensajeRespuesta", "") or ""
+            return (str(code) if code is not None else None, str(msg))
+        if isinstance(res, dict):
+            code = res.get("CodRespuesta")
+            msg = res.get("MensajeRespuesta", "") or ""
+            return (str(code) if code is not None else None, str(msg))
+    except Exception:
+        pass
+    return (None, "")
+
+
+class TransporteCorreos(Transport):
+    """
+    Transport de Zeep que agrega los headers HTTP de la llamada en curso
+    y usa como timeout lo que queda del plazo de la request.
+    Evita modificar session.headers/operation_timeout, compartidos entre hilos.
+    """
+
+    def post(self, address, message, headers):
+        extra = _headers_llamada.get()
+        if extra:
+            headers = {**headers, **extra}
+        timeout = plazo.timeout_para("llamada SOAP", config.SOAP_TIMEOUT_SEGUNDOS)
+        return self.session.post(address, data=message, headers=headers, timeout=timeout)
+
 
 class SoapClient:
     """
@@ -20,6 +93,7 @@ class SoapClient:
     
     def __init__(self):
         self._client: Client = None
+        self._client_lock = threading.Lock()
         self._wsdl_url: str = f"{config.SOAP_URL}?wsdl"
         self._history = HistoryPlugin()
         self._settings = Settings(
@@ -27,34 +101,183 @@ class SoapClient:
             xml_huge_tree=True,
             raw_response=False
         )
+        # Cuota hacia Correos compartida con los demás workers (None = sin límite)
+        self._limitador = crear_limitador(
+            backend=config.SOAP_RATE_LIMIT_BACKEND,
+            tasa_defecto=config.SOAP_RATE_LIMIT_TASA,
+            tasas=config.SOAP_RATE_LIMIT_TASAS,
+            rafaga_segundos=config.SOAP_RATE_LIMIT_RAFAGA_SEGUNDOS,
+            sqlite_path=config.SOAP_RATE_LIMIT_SQLITE_PATH,
+            redis_url=config.SOAP_RATE_LIMIT_REDIS_URL,
+            prefijo=f"correos:{config.USERNAME}",
+        )
+        # Segundo intento para operaciones idempotentes lentas (opt-in)
+        self._hedger = Hedger(
+            operaciones=config.SOAP_HEDGING_OPERACIONES,
+            percentil=config.SOAP_HEDGING_PERCENTIL,
+            retardo_inicial=config.SOAP_HEDGING_RETARDO_INICIAL_SEGUNDOS,
+            retardo_minimo=config.SOAP_HEDGING_RETARDO_MINIMO_SEGUNDOS,
+            tasa_maxima=config.SOAP_HEDGING_TASA_MAXIMA,
+        )
     
     def _get_client(self) -> Client:
         """Obtiene o crea el cliente SOAP"""
         if self._client is None:
-            try:
-                logger.info(f"Creando cliente SOAP con WSDL: {self._wsdl_url}")
-                self._client = Client(
-                    wsdl=self._wsdl_url,
-                    settings=self._settings,
-                    plugins=[self._history],
-                )
-                logger.info("Cliente SOAP creado exitosamente")
-            except Exception as e:
-                logger.error(f"Error al crear cliente SOAP: {e}")
-                raise Exception(f"Error al inicializar cliente SOAP: {str(e)}")
+            with self._client_lock:
+                if self._client is None:
+                    try:
+                        logger.info("Creando cliente SOAP con WSDL: %s", self._wsdl_url)
+                        self._client = Client(
+                            wsdl=self._wsdl_url,
+                            settings=self._settings,
+                            plugins=[self._history],
+                            transport=TransporteCorreos(),
+                        )
+                        logger.info("Cliente SOAP creado exitosamente")
+                    except Exception as e:
+                        logger.error("Error al crear cliente SOAP: %s", e)
+                        raise Exception(f"Error al inicializar cliente SOAP: {str(e)}")
         
         return self._client
     
+    def abrir_conexiones(self, cantidad: int) -> None:
+        """
+        Deja `cantidad` conexiones TLS abiertas en el pool del transporte, así
+        las primeras llamadas no pagan el handshake. No consume cuota del rate
+        limit: es un HEAD al endpoint, cualquier status HTTP sirve.
+        """
+        sesion = self._get_client().transport.session
+        
+        def _abrir(_):
+            # Leer la respuesta (vacía) devuelve la conexión al pool
+            sesion.head(config.SOAP_URL, timeout=config.SOAP_TIMEOUT_SEGUNDOS).content
+        
+        with ThreadPoolExecutor(max_workers=cantidad) as pool:
+            list(pool.map(_abrir, range(cantidad)))
+    
     def call_method(
         self,
         method_name: str,
         *args,
         retry_on_token_error: bool = True,
+        espera_rate_limit: Optional[float] = None,
         **kwargs
     ):
         """
         Llama a un método del Web Service SOAP.
         
+        Primero consume un token del rate limit compartido de la operación y
+        luego espera turno en el planificador según el carril del contexto
+        (ver planificador.usar_carril). Ninguna de las esperas ni la llamada
+        HTTP supera lo que queda del plazo de la request (ver plazo.py).
+        
+        Las operaciones en SOAP_HEDGING_OPERACIONES pueden llevar un segundo
+        intento si el primero tarda (ver hedging.py); el hedge solo sale si
+        hay cuota inmediata en el rate limit.
+        
+        Args:
+            method_name: Nombre del método a llamar
+            *args: Argumentos posicionales
+            retry_on_token_error: Si True, reintenta con nuevo token si hay error 20
+            espera_rate_limit: Segundos máximos esperando cuota (0 = fail-fast;
+                None = SOAP_RATE_LIMIT_ESPERA_SEGUNDOS)
+            **kwargs: Argumentos con nombre
+            
+        Returns:
+            Resultado de la llamada SOAP
+            
+        Raises:
+            LimiteExcedidoError: Si no hay cuota para la operación a tiempo
+            PlazoVencidoError: Si se agota el plazo de la request
+            ConexionSoapError: Si Correos no respondió (timeout o error de
+                conexión): la llamada pudo haberse procesado
+            Exception: Si falla la llamada
+        """
+        if self._hedger.habilitado(method_name):
+            return self._hedger.ejecutar(
+                method_name,
+                lambda es_hedge: self._llamar_con_cuota(
+                    method_name,
+                    args,
+                    kwargs,
+                    retry_on_token_error,
+                    0 if es_hedge else espera_rate_limit,
+                ),
+            )
+        return self._llamar_con_cuota(
+            method_name, args, kwargs, retry_on_token_error, espera_rate_limit
+        )
+    
+    def _tomar_cuota(self, method_name: str, espera_rate_limit: Optional[float]) -> None:
+        """
+        Consume un token del rate limit de la operación (uno por llamada que
+        sale hacia Correos, reintentos incluidos).
+
+        Raises:
+            LimiteExcedidoError: Si no hay cuota dentro de la espera
+        """
+        if self._limitador is None:
+            return
+        if espera_rate_limit is None:
+            espera_rate_limit = config.SOAP_RATE_LIMIT_ESPERA_SEGUNDOS
+        espera_rate_limit = plazo.timeout_para(method_name, espera_rate_limit)
+        try:
+            # El lock del backend compartido tampoco se espera más que el plazo
+            esperado = self._limitador.adquirir(
+                method_name, espera_maxima=espera_rate_limit, plazo_bloqueo=plazo.restante()
+            )
+        except LimiteExcedidoError:
+            _rechazos_rate_limit.inc(operacion=method_name)
+            logger.warning("Rate limit hacia Correos excedido en %s", method_name)
+            raise
+        _espera_rate_limit.observe(esperado, operacion=method_name)
+
+    def _llamar_con_cuota(
+        self,
+        method_name: str,
+        args: tuple,
+        kwargs: dict,
+        retry_on_token_error: bool,
+        espera_rate_limit: Optional[float],
+    ):
+        """Un intento: cuota del rate limit, turno del planificador y llamada."""
+        plazo.verificar(method_name)
+        self._tomar_cuota(method_name, espera_rate_limit)
+        
+        try:
+            with planificador.turno(timeout=plazo.timeout_para(method_name, None)):
+                inicio = time.perf_counter()
+                resultado = "error"
+                codigo = ""
+                try:
+                    respuesta = self._call_method(
+                        method_name,
+                        *args,
+                        retry_on_token_error=retry_on_token_error,
+                        **kwargs
+                    )
+                    codigo = _extract_code_message(respuesta)[0] or ""
+                    resultado = "ok"
+                    return respuesta
+                except PlazoVencidoError:
+                    resultado = "plazo"
+                    raise
+                finally:
+                    _duracion_llamada.observe(time.perf_counter() - inicio, operacion=method_name)
+                    _llamadas.inc(operacion=method_name, resultado=resultado, cod_respuesta=codigo)
+        except TurnoNoDisponibleError:
+            raise PlazoVencidoError(f"turno para {method_name}")
+    
+    def _call_method(
+        self,
+        method_name: str,
+        *args,
+        retry_on_token_error: bool = True,
+        **kwargs
+    ):
+        """
+        Llama a un método del Web Service SOAP (ya con turno asignado).
+        
         Args:
             method_name: Nombre del método a llamar
             *args: Argumentos posicionales
@@ -92,7 +315,7 @@ class SoapClient:
                 if op and getattr(op, "input", None) and hasattr(op.input, "signature"):
                     operation_signature = op.input.signature() or ""
         except Exception as e:
-            logger.debug(f"No se pudo obtener firma WSDL para {method_name}: {e}")
+            logger.debug("No se pudo obtener firma WSDL para %s: %s", method_name, e)
 
         def _build_token_header(token_value: str):
             # Correos (WCF) suele matchear headers por (nombre + namespace).
@@ -125,50 +348,20 @@ class SoapClient:
 
             # Caso común: pToken va en SOAP headers
             # Además, algunos despliegues validan token por headers HTTP.
-            session = getattr(getattr(client, "transport", None), "session", None)
-            old_auth = None
-            old_ptoken = None
+            # Se envían solo en esta llamada (ver TransporteCorreos).
+            reset = _headers_llamada.set({
+                "Authorization": f"Bearer {token_value}",
+                "pToken": str(token_value),
+            })
             try:
-                if session is not None:
-                    old_auth = session.headers.get("Authorization")
-                    old_ptoken = session.headers.get("pToken")
-                    session.headers["Authorization"] = f"Bearer {token_value}"
-                    session.headers["pToken"] = str(token_value)
                 return method(*args, **kwargs, _soapheaders=_build_token_header(token_value))
             finally:
-                # Restaurar headers para no "ensuciar" otras llamadas
-                if session is not None:
-                    if old_auth is None:
-                        session.headers.pop("Authorization", None)
-                    else:
-                        session.headers["Authorization"] = old_auth
-                    if old_ptoken is None:
-                        session.headers.pop("pToken", None)
-                    else:
-                        session.headers["pToken"] = old_ptoken
+                _headers_llamada.reset(reset)
 
-        def _extract_code_message(res):
-            """
-            Algunos métodos de Correos responden con CodRespuesta/MensajeRespuesta
-            (sin SOAP Fault). Extraemos esos campos para manejar token inválido.
-            """
-            try:
-                if hasattr(res, "CodRespuesta"):
-                    code = getattr(res, "CodRespuesta", None)
-                    msg = getattr(res, "MensajeRespuesta", "") or ""
-                    return (str(code) if code is not None else None, str(msg))
-                if isinstance(res, dict):
-                    code = res.get("CodRespuesta")
-                    msg = res.get("MensajeRespuesta", "") or ""
-                    return (str(code) if code is not None else None, str(msg))
-            except Exception:
-                pass
-            return (None, "")
-        
         try:
-            logger.info(f"Llamando método SOAP: {method_name}")
+            logger.debug("Llamando método SOAP: %s", method_name)
             if operation_signature:
-                logger.debug(f"Firma WSDL {method_name}: {operation_signature}")
+                logger.debug("Firma WSDL %s: %s", method_name, operation_signature)
 
             result = _invoke_with_token(token)
 
@@ -183,15 +376,17 @@ class SoapClient:
                 token = auth_service.get_token(force_refresh=True)
                 if isinstance(token, str) and token.lower().startswith("bearer "):
                     token = token[7:].strip()
+                # El reintento es otra llamada a Correos: consume su propio token
+                self._tomar_cuota(method_name, None)
                 result = _invoke_with_token(token)
-            logger.info(f"Método {method_name} ejecutado exitosamente")
+            logger.debug("Método %s ejecutado exitosamente", method_name)
             return result
             
         except Fault as e:
             error_code = getattr(e, 'code', None)
             error_message = str(e)
             
-            logger.error(f"Error SOAP Fault en {method_name}: {e}")
+            logger.error("Error SOAP Fault en %s: %s", method_name, e)
             
             # Si es error de token (código 20) y se permite reintento
             if retry_on_token_error and (
@@ -202,24 +397,41 @@ class SoapClient:
                 logger.warning("Error de token detectado, renovando e reintentando...")
                 auth_service.invalidate_token()
                 token = auth_service.get_token(force_refresh=True)
+                self._tomar_cuota(method_name, None)
                 
                 # Reintentar una vez
                 try:
                     result = _invoke_with_token(token)
-                    logger.info(f"Método {method_name} ejecutado exitosamente tras renovar token")
+                    logger.info("Método %s ejecutado exitosamente tras renovar token", method_name)
                     return result
+                except (requests.exceptions.Timeout, requests.exceptions.ConnectionError, TransportError) as retry_error:
+                    logger.error("Error de conexión en reintento de %s: %s", method_name, retry_error)
+                    if plazo.vencido():
+                        raise PlazoVencidoError(method_name)
+                    raise ConexionSoapError(
+                        f"Error de conexión en {method_name} tras renovar token: {str(retry_error)}"
+                    )
                 except Exception as retry_error:
-                    logger.error(f"Error en reintento de {method_name}: {retry_error}")
+                    logger.error("Error en reintento de %s: %s", method_name, retry_error)
                     raise Exception(f"Error en método {method_name} tras renovar token: {str(retry_error)}")
             
             raise Exception(f"Error SOAP en {method_name}: {error_message}")
             
-        except TransportError as e:
-            logger.error(f"Error de transporte en {method_name}: {e}")
-            raise Exception(f"Error de conexión en {method_name}: {str(e)}")
+        except (PlazoVencidoError, LimiteExcedidoError):
+            raise
+            
+        except requests.exceptions.Timeout as e:
+            logger.error("Timeout en %s: %s", method_name, e)
+            if plazo.vencido():
+                raise PlazoVencidoError(method_name)
+            raise ConexionSoapError(f"Timeout en {method_name}: {str(e)}")
+            
+        except (TransportError, requests.exceptions.ConnectionError) as e:
+            logger.error("Error de transporte en %s: %s", method_name, e)
+            raise ConexionSoapError(f"Error de conexión en {method_name}: {str(e)}")
             
         except Exception as e:
-            logger.error(f"Error inesperado en {method_name}: {e}")
+            logger.error("Error inesperado en %s: %s", method_name, e)
             raise Exception(f"Error al ejecutar {method_name}: {str(e)}")
     
     def get_service_info(self):
@@ -256,7 +468,7 @@ class SoapClient:
 
             return {"sent": sent, "received": received}
         except Exception as e:
-            logger.debug(f"No se pudo obtener exchange SOAP: {e}")
+            logger.debug("No se pudo obtener exchange SOAP: %s", e)
             return {"sent": None, "received": None}
 
 
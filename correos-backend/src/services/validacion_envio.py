@@ -0,0 +1,143 @@
+"""
+Validación local de una SolicitudGuia antes de llamar a Correos.
+
+ccrGenerarGuia consume un número de guía en cada llamada, y
+ccrRegistroEnvio rechaza con código 17 los datos que no cumplen sus
+restricciones: un código postal que no es un distrito del catálogo o un
+teléfono con prefijo o separadores termina en una guía quemada y dos
+round-trips perdidos. Aquí se revisa todo contra el catálogo en memoria y
+se devuelven todos los errores juntos, sin tocar la red.
+"""
+import logging
+import re
+from typing import List, NamedTuple, Optional
+
+from src.models.envio import SolicitudGuia
+from src.services.catalogo_service import catalogo_service
+from src.services.metricas import registro
+
+logger = logging.getLogger(__name__)
+
+# Teléfono de Costa Rica: 8 dígitos, fijo (2), móvil (5-8) o 4xxx
+_TELEFONO_CR = re.compile(r"^[24-8]\d{7}$")
+
+_rechazadas = registro.contador(
+    "envio_validacion_rechazadas_total", "Solicitudes de guía rechazadas antes de llamar a Correos"
+)
+_errores = registro.contador(
+    "envio_validacion_errores_total", "Errores de validación local por campo", ["campo"]
+)
+
+
+class Ubicacion(NamedTuple):
+    codigo_postal: str
+    provincia: str
+    canton: str
+    distrito: str
+
+
+def _buscar_nombre(items: List[dict], codigo: str) -> Optional[str]:
+    for item in items:
+        if item.get("codigo") == codigo:
+            return item.get("nombre")
+    return None
+
+
+def resolver_codigo_postal(codigo: Optional[str]) -> Optional[Ubicacion]:
+    """
+    Provincia, cantón y distrito de un código postal de Costa Rica (PCCDD),
+    o None si no corresponde a un distrito del catálogo.
+    """
+    digitos = "".join(ch for ch in str(codigo or "") if ch.isdigit())
+    if len(digitos) != 5:
+        return None
+    p, cc, dd = digitos[0], digitos[1:3], digitos[3:5]
+    provincia = _buscar_nombre(catalogo_service.get_provincias(), p)
+    canton = _buscar_nombre(catalogo_service.get_cantones(p), cc) if provincia else None
+    distrito = _buscar_nombre(catalogo_service.get_distritos(p, cc), dd) if canton else None
+    if distrito is None:
+        return None
+    return Ubicacion(digitos, provincia, canton, distrito)
+
+
+def normalizar_telefono(valor: Optional[str]) -> str:
+    """
+    +506 8888-8888 -> 88888888 (como lo espera Correos en DEST_TELEFONO).
+    Para armar solicitudes desde datos externos (órdenes de Shopify); la
+    validación no la aplica.
+    """
+    digitos = re.sub(r"\D", "", valor or "")
+    if len(digitos) > 8 and digitos.startswith("506"):
+        digitos = digitos[3:]
+    return digitos
+
+
+class EnvioInvalidoError(Exception):
+    """La solicitud no cumple las restricciones de Correos; no se llamó al servicio."""
+
+    def __init__(self, errores: List[str]):
+        self.errores = errores
+        super().__init__("Error de validación: " + "; ".join(errores))
+
+
+def _validar_telefono(campo: str, valor: str, errores: List[tuple]) -> None:
+    # Se envía tal cual: con prefijo o separadores Correos lo rechaza
+    if not _TELEFONO_CR.match(valor or ""):
+        errores.append((campo, f"El teléfono {valor!r} no es un número de Costa Rica de 8 dígitos sin prefijo ni separadores"))
+
+
+def _validar_codigo_postal(campo: str, valor: Optional[str], errores: List[tuple]) -> Optional[str]:
+    ubicacion = resolver_codigo_postal(valor)
+    if ubicacion is None:
+        errores.append((campo, f"El código postal {valor!r} no corresponde a un distrito del catálogo"))
+        return None
+    return ubicacion.codigo_postal
+
+
+def validar_solicitud(solicitud: SolicitudGuia) -> List[str]:
+    """
+    Errores de la solicitud ("campo: mensaje"), o lista vacía si se puede
+    enviar a Correos. Cada solicitud con errores cuenta como rechazada.
+    """
+    errores = []
+    remitente = solicitud.remitente
+    destinatario = solicitud.destinatario
+
+    for campo, valor in (
+        ("remitente.nombre", remitente.nombre),
+        ("remitente.direccion", remitente.direccion),
+        ("destinatario.nombre", destinatario.nombre),
+        ("destinatario.direccion", destinatario.direccion),
+    ):
+        if not (valor or "").strip():
+            errores.append((campo, "Es obligatorio"))
+
+    _validar_codigo_postal("remitente.codigo_postal", remitente.codigo_postal, errores)
+    # El distrito va en DEST_ZIP; codigo_postal es DEST_APARTADO (texto libre)
+    # y solo se usa como ZIP, truncado como en envio_service, si no hay otro
+    if destinatario.codigo_postal_zip:
+        _validar_codigo_postal("destinatario.codigo_postal_zip", destinatario.codigo_postal_zip, errores)
+    else:
+        _validar_codigo_postal("destinatario.codigo_postal", (destinatario.codigo_postal or "")[:8], errores)
+
+    _validar_telefono("destinatario.telefono", destinatario.telefono, errores)
+    # El remitente de las órdenes puede no tener teléfono (REMITENTE_TELEFONO)
+    if (remitente.telefono or "").strip():
+        _validar_telefono("remitente.telefono", remitente.telefono, errores)
+
+    if errores:
+        _rechazadas.inc()
+        for campo, _ in errores:
+            _errores.inc(campo=campo)
+    return [f"{campo}: {mensaje}" for campo, mensaje in errores]
+
+
+def verificar_solicitud(solicitud: SolicitudGuia) -> None:
+    """
+    Raises:
+        EnvioInvalidoError: Con todos los errores de la solicitud
+    """
+    errores = validar_solicitud(solicitud)
+    if errores:
+        logger.warning("⚠️ Solicitud de guía rechazada antes de Correos: %s", "; ".join(errores))
+        raise EnvioInvalidoError(errores)
@@ -0,0 +1,35 @@
+"""
+Configuración común de los tests: las bases SQLite y el almacén de PDFs van
+a un directorio temporal, antes de importar src (Config lee el entorno al
+importarse y los servicios globales toman de ahí sus rutas).
+"""
+import os
+import sys
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="correos-tests-")
+os.environ["ORDENES_DB_PATH"] = os.path.join(_TMP, "ordenes.sqlite3")
+os.environ["PDF_ALMACEN_DIR"] = os.path.join(_TMP, "pdf")
+os.environ["ARRANQUE_CALENTAR"] = "false"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import itertools  # noqa: E402
+
+import pytest  # noqa: E402
+
+_ids = itertools.count(1000)
+
+
+@pytest.fixture
+def orden_id() -> int:
+    """Un id de orden distinto por test (las bases se comparten en la sesión)."""
+    return next(_ids)
+
+
+@pytest.fixture(scope="session")
+def catalogo():
+    from src.services.catalogo_service import catalogo_service
+
+    catalogo_service.cargar_catalogo()
+    return catalogo_service
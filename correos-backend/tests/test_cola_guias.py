@@ -0,0 +1,141 @@
+import threading
+
+import pytest
+
+from src.models.envio import RespuestaGuia
+from src.services.cola_guias import (
+    EN_CURSO, HECHA, OMITIDA, PENDIENTE, RECHAZADA, REVISION, ColaGuias
+)
+from src.services.envio_service import RegistroInciertoError
+from src.services.ordenes_procesadas import ESTADO_GUIA_CREADA, ESTADO_INCIERTO, registro_ordenes
+from src.services.plazo import PlazoVencidoError
+
+
+def _orden(orden_id: int) -> dict:
+    return {
+        "id": orden_id,
+        "name": f"#{orden_id}",
+        "financial_status": "paid",
+        "shipping_address": {
+            "name": "Ana Pérez",
+            "address1": "Del parque 100 m norte",
+            "zip": "10101",
+            "phone": "8888-8888",
+        },
+        "line_items": [{"grams": 500, "quantity": 1}],
+    }
+
+
+@pytest.fixture
+def cola(tmp_path):
+    return ColaGuias(str(tmp_path / "cola.sqlite3"), concurrencia=1, intervalo=0, reintento=60)
+
+
+def _estado(cola, trabajo_id):
+    return cola._conexion().execute(
+        "SELECT estado, intentos, numero_envio FROM cola_guias WHERE id = ?", (trabajo_id,)
+    ).fetchone()
+
+
+def test_encolar_mismo_webhook_una_sola_vez(cola, orden_id):
+    assert cola.encolar(_orden(orden_id), webhook_id="wh-1") is True
+    assert cola.encolar(_orden(orden_id), webhook_id="wh-1") is False
+    assert cola.resumen() == {PENDIENTE: 1}
+
+
+def test_encolar_orden_ya_en_cola(cola, orden_id):
+    assert cola.encolar(_orden(orden_id), webhook_id="wh-1") is True
+    # Otro webhook de la misma orden mientras sigue pendiente
+    assert cola.encolar(_orden(orden_id), webhook_id="wh-2") is False
+    assert cola.resumen() == {PENDIENTE: 1}
+
+
+def test_encolar_de_nuevo_tras_terminar(cola, orden_id):
+    cola.encolar(_orden(orden_id), webhook_id="wh-1")
+    trabajo_id, _, _ = cola._tomar()
+    cola._terminar(trabajo_id, HECHA)
+    assert cola.encolar(_orden(orden_id), webhook_id="wh-2") is True
+
+
+def test_tomar_reclama_cada_trabajo_una_vez(cola, orden_id):
+    for i in range(20):
+        cola.encolar(_orden(orden_id + i * 100000))
+
+    tomados = []
+    barrera = threading.Barrier(4)
+
+    def consumir():
+        barrera.wait()
+        while True:
+            trabajo = cola._tomar()
+            if trabajo is None:
+                return
+            tomados.append(trabajo[0])
+
+    hilos = [threading.Thread(target=consumir) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert sorted(tomados) == sorted(set(tomados))
+    assert len(tomados) == 20
+    assert cola.resumen() == {EN_CURSO: 20}
+
+
+def _procesar_con(cola, efecto):
+    def procesar(solicitud, regenerar):
+        assert regenerar is False
+        if isinstance(efecto, Exception):
+            raise efecto
+        return efecto
+
+    cola._procesar = procesar
+    trabajo = cola._tomar()
+    cola._ejecutar(*trabajo)
+    return _estado(cola, trabajo[0])
+
+
+def test_generar_guia(cola, orden_id, catalogo):
+    cola.encolar(_orden(orden_id))
+    respuesta = RespuestaGuia(exito=True, numero_envio="CR1", pdf_base64=None)
+    assert _procesar_con(cola, respuesta) == (HECHA, 0, "CR1")
+
+
+def test_omite_orden_con_guia(cola, orden_id, catalogo):
+    registro_ordenes.registrar(orden_id, ESTADO_GUIA_CREADA, numero_envio="CR2")
+    cola.encolar(_orden(orden_id))
+    assert _procesar_con(cola, AssertionError("no debe generar")) == (OMITIDA, 0, "CR2")
+
+
+def test_rechaza_orden_sin_direccion(cola, orden_id, catalogo):
+    orden = _orden(orden_id)
+    del orden["shipping_address"]
+    cola.encolar(orden)
+    estado, intentos, _ = _procesar_con(cola, AssertionError("no debe generar"))
+    assert (estado, intentos) == (RECHAZADA, 0)
+
+
+def test_reintenta_error_antes_del_registro(cola, orden_id, catalogo):
+    cola.encolar(_orden(orden_id))
+    assert _procesar_con(cola, PlazoVencidoError("ccrGenerarGuia")) == (PENDIENTE, 1, None)
+    # Con espera: no se vuelve a tomar enseguida
+    assert cola._tomar() is None
+
+
+def test_registro_incierto_queda_en_revision(cola, orden_id, catalogo):
+    cola.encolar(_orden(orden_id))
+    error = RegistroInciertoError("CR3", PlazoVencidoError("ccrRegistroEnvio"))
+    assert _procesar_con(cola, error) == (REVISION, 0, "CR3")
+
+
+def test_reintenta_rechazo_del_registro(cola, orden_id, catalogo):
+    cola.encolar(_orden(orden_id))
+    error = Exception("Error de validación de datos: DEST_ZIP")
+    assert _procesar_con(cola, error) == (PENDIENTE, 1, None)
+
+
+def test_orden_incierta_queda_en_revision(cola, orden_id, catalogo):
+    registro_ordenes.registrar(orden_id, ESTADO_INCIERTO, numero_envio="CR4")
+    cola.encolar(_orden(orden_id))
+    assert _procesar_con(cola, AssertionError("no debe generar")) == (REVISION, 0, "CR4")
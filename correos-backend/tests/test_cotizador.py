@@ -0,0 +1,99 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.services import cotizador as modulo
+from src.services import plazo
+from src.services.cotizador import Cotizador
+
+
+@pytest.fixture
+def correos(monkeypatch):
+    """ccrTarifa falso: cuenta las consultas y anota el plazo con que corren."""
+    estado = {"consultas": [], "plazos": [], "liberar": threading.Event()}
+    estado["liberar"].set()
+
+    def consultar_tarifa(origen, destino, peso):
+        estado["consultas"].append((origen, destino, peso))
+        estado["plazos"].append(plazo.restante())
+        estado["liberar"].wait(5)
+        if destino == "20102":
+            return None
+        return {"monto_tarifa": 2000, "impuesto": 260, "descuento": 0, "monto_total": 2260}
+
+    monkeypatch.setattr(modulo.envio_service, "consultar_tarifa", consultar_tarifa)
+    return estado
+
+
+@pytest.fixture
+def cotizador(tmp_path, catalogo):
+    return Cotizador(
+        str(tmp_path / "tarifas.sqlite3"), tramos=[500, 1000], vigencia=3600,
+        capacidad=100, concurrencia=4, timeout=30,
+    )
+
+
+def test_una_consulta_por_ruta_y_tramo(cotizador, correos):
+    items = [("20101", 300), ("20101", 450), ("20101", 900), ("20102", 100), ("99999", 100)]
+    resultados = asyncio.run(cotizador.cotizar(items, "10101"))
+
+    # 300 g y 450 g caen en el mismo tramo
+    assert sorted(correos["consultas"]) == [
+        ("10101", "20101", 500), ("10101", "20101", 1000), ("10101", "20102", 500)
+    ]
+    assert [r.get("tramo") for r in resultados] == [500, 500, 1000, 500, None]
+    assert resultados[0]["monto_total"] == 2260 and resultados[0]["fuente"] == "correos"
+    assert resultados[3]["error"] == "Correos no tiene tarifa para este destino"
+    assert "catálogo" in resultados[4]["error"]
+
+    # Segundo pedido: de memoria, sin llamar a Correos
+    resultados = asyncio.run(cotizador.cotizar([("20101", 300)], "10101"))
+    assert resultados[0]["fuente"] == "memoria"
+    assert len(correos["consultas"]) == 3
+
+
+def test_tarifas_compartidas_por_la_base(cotizador, correos):
+    asyncio.run(cotizador.cotizar([("20101", 300)], "10101"))
+    # Otro worker (u otro arranque) con la misma base
+    otro = Cotizador(cotizador.path, tramos=[500, 1000], vigencia=3600, capacidad=100, concurrencia=4, timeout=30)
+    resultados = asyncio.run(otro.cotizar([("20101", 300)], "10101"))
+    assert resultados[0]["fuente"] == "base"
+    assert len(correos["consultas"]) == 1
+
+
+def test_pedidos_simultaneos_esperan_la_misma_consulta(cotizador, correos):
+    async def dos_pedidos():
+        return await asyncio.gather(
+            cotizador.cotizar([("20101", 300)], "10101"),
+            cotizador.cotizar([("20101", 400)], "10101"),
+        )
+
+    primero, segundo = asyncio.run(dos_pedidos())
+    assert primero[0]["monto_total"] == segundo[0]["monto_total"] == 2260
+    assert len(correos["consultas"]) == 1
+
+
+def test_plazo_vencido_responde_y_la_consulta_sigue(cotizador, correos):
+    correos["liberar"].clear()
+
+    async def pedido_con_plazo():
+        with plazo.usar_plazo(0.05):
+            resultados = await cotizador.cotizar([("20101", 300)], "10101")
+        correos["liberar"].set()
+        # La consulta no se cancela: termina y queda en cache
+        await asyncio.gather(*cotizador._en_vuelo.values())
+        return resultados
+
+    resultados = asyncio.run(pedido_con_plazo())
+    assert resultados[0]["error"] == "Tarifa no disponible, intente nuevamente"
+    # Corrió con el timeout propio, no con lo que quedaba del pedido
+    assert correos["plazos"][0] > 1
+    assert asyncio.run(cotizador.cotizar([("20101", 300)], "10101"))[0]["fuente"] == "memoria"
+
+
+def test_origen_fuera_del_catalogo(cotizador, correos):
+    with pytest.raises(ValueError):
+        asyncio.run(cotizador.cotizar([("20101", 300)], "99999"))
+    with pytest.raises(ValueError):
+        cotizador.iniciar_precalculo("99999")
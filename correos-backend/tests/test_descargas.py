@@ -0,0 +1,86 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from src.api.descargas import _parse_rango, respuesta_archivo
+
+CONTENIDO = bytes(range(100))
+ETAG = '"abc"'
+
+
+@pytest.mark.parametrize("valor, esperado", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    # El fin se recorta al tamaño del archivo
+    ("bytes=95-500", (95, 99)),
+    # Sufijo: los últimos N bytes
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    # Varios rangos, sin unidad o mal formados: se ignora el header
+    ("bytes=0-1,5-6", None),
+    ("items=0-9", None),
+    ("bytes=-", None),
+])
+def test_parse_rango(valor, esperado):
+    assert _parse_rango(valor, len(CONTENIDO)) == esperado
+
+
+@pytest.mark.parametrize("valor", ["bytes=100-", "bytes=200-300", "bytes=9-5", "bytes=-0"])
+def test_parse_rango_fuera_del_archivo(valor):
+    with pytest.raises(ValueError):
+        _parse_rango(valor, len(CONTENIDO))
+
+
+@pytest.fixture
+def cliente(tmp_path):
+    ruta = tmp_path / "guia.pdf"
+    ruta.write_bytes(CONTENIDO)
+    app = FastAPI()
+
+    @app.get("/archivo")
+    async def archivo(request: Request):
+        return respuesta_archivo(request, str(ruta), etag=ETAG, media_type="application/pdf")
+
+    return TestClient(app)
+
+
+def test_archivo_completo(cliente):
+    r = cliente.get("/archivo")
+    assert r.status_code == 200
+    assert r.content == CONTENIDO
+    assert r.headers["etag"] == ETAG
+    assert r.headers["accept-ranges"] == "bytes"
+
+
+def test_if_none_match(cliente):
+    assert cliente.get("/archivo", headers={"If-None-Match": ETAG}).status_code == 304
+    assert cliente.get("/archivo", headers={"If-None-Match": f'"otro", W/{ETAG}'}).status_code == 304
+    assert cliente.get("/archivo", headers={"If-None-Match": '"otro"'}).status_code == 200
+
+
+def test_rango(cliente):
+    r = cliente.get("/archivo", headers={"Range": "bytes=10-19"})
+    assert r.status_code == 206
+    assert r.content == CONTENIDO[10:20]
+    assert r.headers["content-range"] == "bytes 10-19/100"
+
+
+def test_rango_sufijo(cliente):
+    r = cliente.get("/archivo", headers={"Range": "bytes=-5"})
+    assert r.status_code == 206
+    assert r.content == CONTENIDO[-5:]
+
+
+def test_rango_fuera_del_archivo(cliente):
+    r = cliente.get("/archivo", headers={"Range": "bytes=100-"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == "bytes */100"
+
+
+def test_if_range(cliente):
+    r = cliente.get("/archivo", headers={"Range": "bytes=0-9", "If-Range": ETAG})
+    assert r.status_code == 206
+    # Otra versión del archivo: se manda completo
+    r = cliente.get("/archivo", headers={"Range": "bytes=0-9", "If-Range": '"viejo"'})
+    assert r.status_code == 200
+    assert r.content == CONTENIDO
@@ -0,0 +1,33 @@
+import pytest
+
+from src.services.etiquetas import _CODE128, _modulos_code128, barras_code128
+
+
+def _simbolos(barras):
+    """Decodifica las barras de vuelta a los códigos Code 128."""
+    anchos = []
+    for i, (inicio, ancho) in enumerate(barras):
+        if i:
+            anterior_inicio, anterior_ancho = barras[i - 1]
+            anchos.append(inicio - anterior_inicio - anterior_ancho)
+        anchos.append(ancho)
+    patrones = ["".join(map(str, anchos[i:i + 6])) for i in range(0, len(anchos) - 7, 6)]
+    patrones.append("".join(map(str, anchos[-7:])))
+    return [_CODE128.index(p) for p in patrones]
+
+
+def test_code128_checksum():
+    # Inicio B (104) + P J J 1 2 3 C ponderados por posición:
+    # 104 + 48*1 + 42*2 + 42*3 + 17*4 + 18*5 + 19*6 + 35*7 = 879; 879 % 103 = 55
+    assert _simbolos(barras_code128("PJJ123C")) == [104, 48, 42, 42, 17, 18, 19, 35, 55, 106]
+
+
+def test_code128_ancho_en_modulos():
+    barras = barras_code128("PY064089266CR")
+    inicio, ancho = barras[-1]
+    assert inicio + ancho == _modulos_code128("PY064089266CR")
+
+
+def test_code128_caracter_no_soportado():
+    with pytest.raises(ValueError):
+        barras_code128("Ñ")
@@ -0,0 +1,46 @@
+import threading
+import time
+
+import pytest
+
+from src.services.hedging import Hedger
+from src.services.plazo import PlazoVencidoError, usar_plazo
+
+
+def test_ignora_operaciones_no_idempotentes(caplog):
+    hedger = Hedger(["ccrTarifa", "ccrGenerarGuia", "ccrRegistroEnvio"])
+    assert hedger.habilitado("ccrTarifa")
+    assert not hedger.habilitado("ccrGenerarGuia")
+    assert not hedger.habilitado("ccrRegistroEnvio")
+    assert "ccrGenerarGuia, ccrRegistroEnvio" in caplog.text
+
+
+def test_hedge_gana_si_el_primero_tarda():
+    hedger = Hedger(["ccrTarifa"], retardo_inicial=0.02)
+    liberar = threading.Event()
+
+    def intento(es_hedge):
+        if not es_hedge:
+            liberar.wait(5)
+        return "hedge" if es_hedge else "primero"
+
+    try:
+        assert hedger.ejecutar("ccrTarifa", intento) == "hedge"
+    finally:
+        liberar.set()
+        hedger.cerrar()
+
+
+def test_plazo_acota_el_retardo():
+    hedger = Hedger(["ccrTarifa"], retardo_inicial=5)
+    liberar = threading.Event()
+
+    inicio = time.monotonic()
+    try:
+        with usar_plazo(0.05):
+            with pytest.raises(PlazoVencidoError):
+                hedger.ejecutar("ccrTarifa", lambda es_hedge: liberar.wait(5))
+    finally:
+        liberar.set()
+        hedger.cerrar()
+    assert time.monotonic() - inicio < 1
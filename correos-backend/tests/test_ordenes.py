@@ -0,0 +1,49 @@
+import pytest
+
+from src.services.ordenes import repositorio_ordenes
+from src.services.ordenes_procesadas import ESTADO_GUIA_CREADA, registro_ordenes
+
+
+@pytest.fixture
+def ordenes(orden_id):
+    """Cinco órdenes con un financial_status propio del test (la base es compartida)."""
+    estado = f"test-{orden_id}"
+    ids = [orden_id * 10 + i for i in range(5)]
+    for i in ids:
+        repositorio_ordenes.guardar({
+            "id": i,
+            "name": f"#{i}",
+            "financial_status": estado,
+            "updated_at": "2026-01-01T00:00:00Z",
+        })
+    return estado, ids
+
+
+def test_listar_por_cursor(ordenes):
+    estado, ids = ordenes
+    vistos, cursor, paginas = [], None, 0
+    while True:
+        pagina, cursor = repositorio_ordenes.listar(limite=2, cursor=cursor, financial_status=estado)
+        vistos.extend(o["id"] for o in pagina)
+        paginas += 1
+        if cursor is None:
+            break
+
+    # De la más nueva a la más vieja, sin repetidas ni salteadas
+    assert vistos == sorted(ids, reverse=True)
+    assert paginas == 3
+
+
+def test_listar_pagina_exacta_sin_cursor_siguiente(ordenes):
+    estado, ids = ordenes
+    pagina, cursor = repositorio_ordenes.listar(limite=5, financial_status=estado)
+    assert len(pagina) == 5
+    assert cursor is None
+
+
+def test_listar_sin_guia(ordenes):
+    estado, ids = ordenes
+    registro_ordenes.registrar(ids[0], ESTADO_GUIA_CREADA, numero_envio="CR9")
+    registro_ordenes.vaciar()
+    pagina, _ = repositorio_ordenes.listar(limite=10, financial_status=estado, sin_guia=True)
+    assert [o["id"] for o in pagina] == sorted(ids[1:], reverse=True)
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from src.services.ordenes_procesadas import (
+    ESTADO_GUIA_CREADA,
+    ESTADO_PROCESANDO,
+    OrdenOcupadaError,
+    registro_ordenes,
+)
+
+
+def test_reclamar_orden_nueva_y_luego_ocupada(orden_id):
+    assert registro_ordenes.reclamar(orden_id, vigencia=60) is None
+    assert registro_ordenes.buscar(orden_id).estado == ESTADO_PROCESANDO
+
+    with pytest.raises(OrdenOcupadaError) as error:
+        registro_ordenes.reclamar(orden_id, vigencia=60, regenerar=True)
+    assert error.value.fila.estado == ESTADO_PROCESANDO
+
+
+def test_reclamar_procesando_vencido(orden_id):
+    registro_ordenes.reclamar(orden_id, vigencia=60)
+    time.sleep(0.01)
+    # Un PROCESSING más viejo que la vigencia es de una request caída
+    anterior = registro_ordenes.reclamar(orden_id, vigencia=0.001)
+    assert anterior.estado == ESTADO_PROCESANDO
+
+
+def test_reclamar_con_guia_solo_si_se_regenera(orden_id):
+    registro_ordenes.registrar(orden_id, ESTADO_GUIA_CREADA, numero_envio="CR123")
+    registro_ordenes.vaciar()
+
+    with pytest.raises(OrdenOcupadaError) as error:
+        registro_ordenes.reclamar(orden_id, vigencia=60)
+    assert error.value.fila.numero_envio == "CR123"
+
+    anterior = registro_ordenes.reclamar(orden_id, vigencia=60, regenerar=True)
+    assert anterior.estado == ESTADO_GUIA_CREADA
+    assert registro_ordenes.buscar(orden_id).estado == ESTADO_PROCESANDO
+
+
+def test_reclamar_concurrente_gana_uno(orden_id):
+    barrera = threading.Barrier(8)
+    resultados = []
+
+    def reclamar():
+        barrera.wait()
+        try:
+            registro_ordenes.reclamar(orden_id, vigencia=60)
+            resultados.append("ok")
+        except OrdenOcupadaError:
+            resultados.append("ocupada")
+
+    hilos = [threading.Thread(target=reclamar) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert sorted(resultados) == ["ocupada"] * 7 + ["ok"]
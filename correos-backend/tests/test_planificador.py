@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from src.services.planificador import (
+    CARRIL_FONDO, CARRIL_INTERACTIVO, Planificador, TurnoNoDisponibleError
+)
+
+
+def _esperar_cola(planificador, esperados):
+    limite = time.monotonic() + 5
+    while time.monotonic() < limite:
+        carriles = planificador.estado()["carriles"]
+        if all(carriles[c]["en_espera"] == n for c, n in esperados.items()):
+            return
+        time.sleep(0.005)
+    raise AssertionError(f"La cola no llegó a {esperados}: {planificador.estado()}")
+
+
+def test_reparto_ponderado_entre_carriles():
+    planificador = Planificador(concurrencia=1, pesos={CARRIL_INTERACTIVO: 2, CARRIL_FONDO: 1})
+    orden = []
+
+    def llamar(carril):
+        with planificador.turno(carril):
+            orden.append(carril[0].upper())
+
+    hilos = []
+    with planificador.turno(CARRIL_FONDO):
+        for carril in [CARRIL_FONDO] * 4 + [CARRIL_INTERACTIVO] * 4:
+            hilo = threading.Thread(target=llamar, args=(carril,))
+            hilo.start()
+            hilos.append(hilo)
+        _esperar_cola(planificador, {CARRIL_FONDO: 4, CARRIL_INTERACTIVO: 4})
+    for hilo in hilos:
+        hilo.join()
+
+    # Con peso 2:1 el interactivo recibe dos turnos por cada uno del fondo,
+    # y el fondo no se queda sin turno mientras haya interactivas
+    assert "".join(orden) == "IIIFIFFF"
+
+
+def test_turno_con_timeout():
+    planificador = Planificador(concurrencia=1, pesos={})
+    with planificador.turno(CARRIL_FONDO):
+        with pytest.raises(TurnoNoDisponibleError):
+            with planificador.turno(CARRIL_INTERACTIVO, timeout=0.05):
+                pass
+    assert planificador.estado()["en_uso"] == 0
+    assert planificador.estado()["carriles"][CARRIL_INTERACTIVO]["en_espera"] == 0
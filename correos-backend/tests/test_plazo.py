@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from src.services import plazo
+from src.services.ejecutor_soap import EjecutorSoap
+from src.services.plazo import PlazoVencidoError, usar_plazo, usar_plazo_propio
+from src.services.soap_client import TransporteCorreos
+
+
+def test_sin_plazo():
+    assert plazo.restante() is None
+    assert plazo.timeout_para("etapa", 5) == 5
+    plazo.verificar("etapa")
+
+
+def test_plazo_interno_no_extiende_el_externo():
+    with usar_plazo(0.5):
+        with usar_plazo(60):
+            assert plazo.restante() <= 0.5
+        with usar_plazo(0.1):
+            assert plazo.restante() <= 0.1
+    assert plazo.restante() is None
+
+
+def test_plazo_propio_reemplaza_al_de_la_request():
+    with usar_plazo(0.01):
+        with usar_plazo_propio(60):
+            assert plazo.restante() > 1
+        assert plazo.restante() <= 0.01
+
+
+def test_timeout_para_usa_lo_que_queda():
+    with usar_plazo(0.5):
+        assert plazo.timeout_para("etapa", 10) <= 0.5
+        assert plazo.timeout_para("etapa", 0.1) == 0.1
+    with usar_plazo(0.001):
+        time.sleep(0.01)
+        assert plazo.vencido()
+        with pytest.raises(PlazoVencidoError) as error:
+            plazo.timeout_para("token", 10)
+        assert error.value.etapa == "token"
+
+
+def test_el_plazo_viaja_al_hilo_del_ejecutor():
+    ejecutor = EjecutorSoap(max_workers=1, max_cola=1)
+
+    async def correr():
+        with usar_plazo(0.5):
+            return await ejecutor.ejecutar(plazo.restante)
+
+    try:
+        assert 0 < asyncio.run(correr()) <= 0.5
+    finally:
+        ejecutor.cerrar()
+
+
+def test_vencido_en_la_cola_del_ejecutor_no_corre():
+    ejecutor = EjecutorSoap(max_workers=1, max_cola=1)
+    corridas = []
+
+    async def correr():
+        with usar_plazo(0.001):
+            time.sleep(0.01)
+            return await ejecutor.ejecutar(corridas.append, 1)
+
+    try:
+        with pytest.raises(PlazoVencidoError):
+            asyncio.run(correr())
+    finally:
+        ejecutor.cerrar()
+    assert corridas == []
+
+
+def test_la_llamada_soap_usa_lo_que_queda(monkeypatch):
+    transporte = TransporteCorreos()
+    timeouts = []
+    monkeypatch.setattr(transporte.session, "post", lambda *a, timeout, **k: timeouts.append(timeout))
+    with usar_plazo(0.5):
+        transporte.post("http://correos", b"", {})
+    assert 0 < timeouts[0] <= 0.5
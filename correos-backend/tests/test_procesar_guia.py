@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.api import endpoints
+from src.models.envio import SolicitudGuia
+from src.services.envio_service import RegistroInciertoError
+from src.services.ordenes_procesadas import (
+    ESTADO_GUIA_CREADA, ESTADO_INCIERTO, OrdenOcupadaError, registro_ordenes
+)
+from src.services.planificador import CARRIL_INTERACTIVO
+from src.services.plazo import PlazoVencidoError
+from src.services.soap_client import ConexionSoapError
+
+
+def _solicitud(orden_id) -> SolicitudGuia:
+    return SolicitudGuia.model_validate({
+        "remitente": {"nombre": "Tienda", "direccion": "Bodega", "telefono": "22222222", "codigo_postal": "10101"},
+        "destinatario": {"nombre": "Ana", "direccion": "Casa 5", "telefono": "88888888", "codigo_postal": "20101"},
+        "peso": 500,
+        "monto_flete": 0,
+        "orden_id": str(orden_id),
+    })
+
+
+@pytest.fixture
+def correos(monkeypatch, catalogo):
+    """Correos falso: ccrGenerarGuia responde CR1, ccrRegistroEnvio lo que diga el test."""
+    estado = {"guia": lambda: {"numero_envio": "CR1"}, "registro": None}
+
+    def registrar_envio(numero_guia, solicitud):
+        if isinstance(estado["registro"], BaseException):
+            raise estado["registro"]
+        return {"codigo_respuesta": "00", "mensaje_respuesta": "", "pdf": None,
+                "pdf_sha256": None, "tarifa": None}
+
+    monkeypatch.setattr(endpoints.guia_service, "generar_numero_guia", lambda: estado["guia"]())
+    monkeypatch.setattr(endpoints.envio_service, "registrar_envio", registrar_envio)
+    return estado
+
+
+def test_guia_creada(correos, orden_id):
+    respuesta = endpoints._procesar_guia(_solicitud(orden_id))
+    assert respuesta.numero_envio == "CR1"
+    fila = registro_ordenes.buscar(orden_id)
+    assert (fila.estado, fila.numero_envio) == (ESTADO_GUIA_CREADA, "CR1")
+
+
+def test_rechazo_de_correos_libera_la_orden(correos, orden_id):
+    correos["registro"] = Exception("Error de validación de datos: DEST_ZIP")
+    with pytest.raises(Exception, match="validación") as error:
+        endpoints._procesar_guia(_solicitud(orden_id))
+    assert not isinstance(error.value, RegistroInciertoError)
+    assert registro_ordenes.buscar(orden_id) is None
+
+
+def test_rechazo_de_correos_es_400(correos, orden_id):
+    correos["registro"] = Exception("Error de validación de datos: DEST_ZIP")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(endpoints._ejecutar_guia(_solicitud(orden_id), CARRIL_INTERACTIVO, 5, False))
+    assert error.value.status_code == 400
+
+
+def test_fallo_antes_del_numero_libera_la_orden(correos, orden_id):
+    def sin_respuesta():
+        raise ConexionSoapError("Timeout en ccrGenerarGuia")
+
+    correos["guia"] = sin_respuesta
+    with pytest.raises(ConexionSoapError):
+        endpoints._procesar_guia(_solicitud(orden_id))
+    assert registro_ordenes.buscar(orden_id) is None
+
+
+@pytest.mark.parametrize("causa", [
+    ConexionSoapError("Timeout en ccrRegistroEnvio"),
+    PlazoVencidoError("ccrRegistroEnvio"),
+])
+def test_registro_sin_respuesta_queda_incierto(correos, orden_id, causa):
+    correos["registro"] = causa
+    with pytest.raises(RegistroInciertoError) as error:
+        endpoints._procesar_guia(_solicitud(orden_id))
+    assert error.value.numero_envio == "CR1"
+
+    fila = registro_ordenes.buscar(orden_id)
+    assert (fila.estado, fila.numero_envio) == (ESTADO_INCIERTO, "CR1")
+
+    # Ni regenerar la reclama: podría duplicar el envío
+    correos["registro"] = None
+    with pytest.raises(OrdenOcupadaError):
+        endpoints._procesar_guia(_solicitud(orden_id), regenerar=True)
+
+    # Verificado en Correos que no quedó registrado
+    assert endpoints._procesar_guia(_solicitud(orden_id), incierta=True).numero_envio == "CR1"
+    assert registro_ordenes.buscar(orden_id).estado == ESTADO_GUIA_CREADA
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+from src.services.rate_limiter import (
+    BackendMemoria, BackendSQLite, LimiteExcedidoError, LimitadorOperaciones, TokenBucket
+)
+
+
+def test_token_bucket_rafaga_y_espera():
+    bucket = TokenBucket(tasa=10, capacidad=3)
+    assert [bucket.intentar() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Sin tokens: ~1/tasa hasta el siguiente
+    assert bucket.intentar() == pytest.approx(0.1, abs=0.02)
+
+
+def test_token_bucket_tasa_invalida():
+    with pytest.raises(ValueError):
+        TokenBucket(tasa=0)
+
+
+@pytest.fixture(params=["memoria", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memoria":
+        return BackendMemoria()
+    return BackendSQLite(str(tmp_path / "rate.sqlite3"))
+
+
+def test_limitador_por_operacion(backend):
+    limitador = LimitadorOperaciones(backend, tasa_defecto=1, tasas={"ccrTarifa": 100}, rafaga_segundos=2)
+    limitador.adquirir("ccrGenerarGuia", espera_maxima=0)
+    limitador.adquirir("ccrGenerarGuia", espera_maxima=0)
+    with pytest.raises(LimiteExcedidoError) as error:
+        limitador.adquirir("ccrGenerarGuia", espera_maxima=0)
+    assert error.value.operacion == "ccrGenerarGuia"
+    assert error.value.retry_after >= 1
+    # Cada operación tiene su propio bucket
+    limitador.adquirir("ccrTarifa", espera_maxima=0)
+
+
+def test_backend_bloqueado_respeta_el_plazo(tmp_path):
+    path = str(tmp_path / "rate.sqlite3")
+    limitador = LimitadorOperaciones(BackendSQLite(path), tasa_defecto=100)
+    limitador.adquirir("ccrTarifa", espera_maxima=0)
+
+    # Otro worker retiene el lock de escritura del archivo
+    otro = sqlite3.connect(path, isolation_level=None)
+    otro.execute("BEGIN IMMEDIATE")
+    try:
+        inicio = time.monotonic()
+        with pytest.raises(LimiteExcedidoError) as error:
+            limitador.adquirir("ccrTarifa", espera_maxima=1, plazo_bloqueo=0.05)
+        assert time.monotonic() - inicio < 1
+        assert error.value.operacion == "ccrTarifa"
+    finally:
+        otro.execute("ROLLBACK")
+    limitador.adquirir("ccrTarifa", espera_maxima=0, plazo_bloqueo=0.05)
+
+
+def test_backend_sqlite_no_reusa_la_conexion_tras_fork(tmp_path, monkeypatch):
+    backend = BackendSQLite(str(tmp_path / "rate.sqlite3"))
+    conexion = backend._conexion()
+    assert backend._conexion() is conexion
+    # Como un worker forkeado desde el master de gunicorn
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+    assert backend._conexion() is not conexion
@@ -0,0 +1,65 @@
+import pytest
+
+from src.models.envio import SolicitudGuia
+from src.services.validacion_envio import (
+    EnvioInvalidoError, normalizar_telefono, validar_solicitud, verificar_solicitud
+)
+
+
+def _solicitud(**destinatario) -> SolicitudGuia:
+    return SolicitudGuia.model_validate({
+        "remitente": {"nombre": "Tienda", "direccion": "Bodega", "telefono": "22222222", "codigo_postal": "10101"},
+        "destinatario": {"nombre": "Ana", "direccion": "Casa 5", "telefono": "88888888",
+                         "codigo_postal": "20101", **destinatario},
+        "peso": 500,
+        "monto_flete": 0,
+    })
+
+
+def test_solicitud_valida(catalogo):
+    assert validar_solicitud(_solicitud()) == []
+    verificar_solicitud(_solicitud())
+
+
+@pytest.mark.parametrize("telefono", ["8888-8888", "+506 88888888", "38888888", "8888888"])
+def test_telefono_invalido_se_reporta(catalogo, telefono):
+    solicitud = _solicitud(telefono=telefono)
+    errores = validar_solicitud(solicitud)
+    assert len(errores) == 1 and errores[0].startswith("destinatario.telefono:")
+    # Se reporta, no se corrige: lo que se valida es lo que se envía
+    assert solicitud.destinatario.telefono == telefono
+
+
+def test_distrito_por_zip(catalogo):
+    # El apartado (DEST_APARTADO) es texto libre cuando hay ZIP
+    assert validar_solicitud(_solicitud(codigo_postal="Apdo 123", codigo_postal_zip="20101")) == []
+    errores = validar_solicitud(_solicitud(codigo_postal_zip="19999"))
+    assert errores == ["destinatario.codigo_postal_zip: El código postal '19999' no corresponde a un distrito del catálogo"]
+
+
+def test_todos_los_errores_juntos(catalogo):
+    with pytest.raises(EnvioInvalidoError) as error:
+        verificar_solicitud(_solicitud(nombre=" ", codigo_postal="99999", telefono="1"))
+    campos = [e.split(":")[0] for e in error.value.errores]
+    assert campos == ["destinatario.nombre", "destinatario.codigo_postal", "destinatario.telefono"]
+
+
+@pytest.mark.parametrize("valor, esperado", [
+    ("+506 8888-8888", "88888888"),
+    ("(506) 2222 2222", "22222222"),
+    ("88888888", "88888888"),
+    (None, ""),
+])
+def test_normalizar_telefono(valor, esperado):
+    assert normalizar_telefono(valor) == esperado
+
+
+def test_orden_de_shopify_se_normaliza(catalogo):
+    from src.services.orden_guia import construir_solicitud
+
+    solicitud = construir_solicitud({
+        "id": 1, "name": "#1",
+        "shipping_address": {"name": "Ana", "address1": "Casa 5", "zip": "20101", "phone": "+506 8888-8888"},
+    })
+    assert solicitud.destinatario.telefono == "88888888"
+    assert validar_solicitud(solicitud) == []